@@ -9,21 +9,47 @@ import importlib.util
 import subprocess
 import sys
 from dotenv import load_dotenv
-from llama_api_client import LlamaAPIClient
-from llama_api_client.types import SystemMessageParam, UserMessageParam
 from tools.ssh_tool import execute_remote_command, PersistentSSHSession, system_detection, stress_test_checks
+from tools.session_log import get_event_log
+from tools.metrics import LLM_TTFT, LLM_LATENCY, LLM_TOKENS_PER_SEC, LLM_ERRORS, TOOL_DURATION
+from tools.tracing import tracer, traced
 import shutil
-from rich.console import Console
 
 
-console = Console()
 load_dotenv()
 
+# The Llama client (and httpx/pydantic under it) and rich are only imported on first use, so
+# importing this module from the web server or the tests stays cheap.
+# Message params are TypedDicts, i.e. plain dicts at runtime.
+SystemMessageParam = dict
+UserMessageParam = dict
+_llama = None
+
+
+def get_llama():
+    global _llama
+    if _llama is None:
+        from llama_api_client import LlamaAPIClient
+        _llama = LlamaAPIClient(api_key=os.getenv("LLAMA_API_KEY"))
+    return _llama
+
+
+class _LazyConsole:
+    """Stands in for rich.console.Console until the first print/input."""
+    _console = None
+
+    def __getattr__(self, name):
+        if _LazyConsole._console is None:
+            from rich.console import Console
+            _LazyConsole._console = Console()
+        return getattr(_LazyConsole._console, name)
+
+
+console = _LazyConsole()
+
 # Store fed .txt files in session
 fed_txt_files = {}
 
-llama = LlamaAPIClient(api_key=os.getenv("LLAMA_API_KEY"))
-
 # User preferences (can be extended)
 user_prefs = {
     'verbosity': 'normal',  # options: 'normal', 'verbose', 'minimal'
@@ -31,8 +57,6 @@ user_prefs = {
     'confirm_dangerous': True,
 }
 
-llama = LlamaAPIClient(api_key=os.getenv("LLAMA_API_KEY"))
-
 # --- Utility Functions ---
 def file_exists(path):
     return os.path.isfile(path)
@@ -44,6 +68,7 @@ def is_dangerous_command(cmd):
     dangerous = ['rm ', 'dd ', 'mkfs', 'shutdown', 'reboot', 'init 0', 'halt', 'poweroff']
     return any(d in cmd for d in dangerous)
 
+@traced('agent.sanitize_output')
 def sanitize_output(output):
     # Redact common sensitive patterns
     output = re.sub(r'(\d{1,3}\.){3}\d{1,3}', '[REDACTED_IP]', output)
@@ -98,12 +123,14 @@ def run_tool_safely(tool_name, tool_args, timeout=10):
     if module_path and os.path.exists(module_path):
         try:
             # Run python -c to import the module and call the tool function
+            escaped_path = module_path.replace('\\', '\\\\')
             runner = [sys.executable, "-c",
                       ("import json, sys, importlib.util; "
-                       f"spec=importlib.util.spec_from_file_location('m','{module_path.replace('\\','\\\\')}'); "
+                       f"spec=importlib.util.spec_from_file_location('m','{escaped_path}'); "
                        "m=importlib.util.module_from_spec(spec); spec.loader.exec_module(m); "
                        "res = m." + func_key + "(sys.argv[1] if len(sys.argv)>1 else '') ; print(res)")]
-            proc = subprocess.run(runner + [tool_args], capture_output=True, text=True, timeout=timeout)
+            with TOOL_DURATION.labels(tool=tool_name, mode='subprocess').time():
+                proc = subprocess.run(runner + [tool_args], capture_output=True, text=True, timeout=timeout)
             if proc.returncode == 0:
                 return proc.stdout.strip() or proc.stderr.strip()
             return proc.stdout.strip() or proc.stderr.strip() or f"[ERROR] Non-zero exit: {proc.returncode}"
@@ -116,7 +143,8 @@ def run_tool_safely(tool_name, tool_args, timeout=10):
     # Fallback: call in-process if available
     if func_key in tool_funcs:
         try:
-            return tool_funcs[func_key](tool_args)
+            with TOOL_DURATION.labels(tool=tool_name, mode='inprocess').time():
+                return tool_funcs[func_key](tool_args)
         except Exception as e:
             return f"[ERROR] Tool '{tool_name}' failed in-process: {e}"
     return f"[ERROR] Tool '{tool_name}' not found"
@@ -140,6 +168,24 @@ def execute_remote_command_with_handling(cmd):
         return output + '\n[ERROR] File or command not found.'
     return output
 
+def execute_read_only_command(cmd):
+    """Speculative variant of execute_remote_command_with_handling: no preview and no sudo retry.
+    A permission error raises instead, so the approved run takes the normal path."""
+    res = execute_remote_command(cmd)
+    output = sanitize_output(str(res.get('output') if isinstance(res, dict) else res))
+    if check_permission_error(output):
+        raise PermissionError(output)
+    if check_file_not_found(output):
+        return output + '\n[ERROR] File or command not found.'
+    return output
+
+def log_event(event_type, **fields):
+    """Record a structured session event (outputs/events); logging failures never interrupt the agent."""
+    try:
+        return get_event_log().append(event_type, source='cli', **fields)
+    except Exception:
+        return None
+
 def extract_text_from_chunk(chunk) -> str:
     """
     Helper function to safely extract text from a response chunk.
@@ -150,19 +196,59 @@ def extract_text_from_chunk(chunk) -> str:
             return delta.text
     return ""
 
-def get_command_from_llama(instruction: str) -> str:
-    response = llama.chat.completions.create(
-        model="Llama-4-Maverick-17B-128E-Instruct-FP8",
-        messages=[
-            SystemMessageParam(role="system", content="You are a command interpreter assistant. Convert user tasks into Kali Linux shell commands. Respond with *only* the command. No explanation or formatting."),
-            UserMessageParam(role="user", content=instruction),
-        ],
-        stream=True
-    )
+def stream_completion(messages, model="Llama-4-Maverick-17B-128E-Instruct-FP8", operation="chat") -> str:
+    """
+    Stream a chat completion and return the concatenated text.
+    Records time-to-first-token, total latency, streaming rate and errors per model/operation.
+    """
+    start = time.perf_counter()
+    first = None
+    chunks = 0
     content = ""
-    for chunk in response:
-        # Use helper function to extract text
-        content += extract_text_from_chunk(chunk)
+    with tracer.span('llm.stream', model=model, operation=operation) as span:
+        try:
+            response = get_llama().chat.completions.create(model=model, messages=messages, stream=True)
+            for chunk in response:
+                text = extract_text_from_chunk(chunk)
+                if not text:
+                    continue
+                if first is None:
+                    first = time.perf_counter()
+                    LLM_TTFT.labels(model=model, operation=operation).observe(first - start)
+                chunks += 1
+                content += text
+                if span:
+                    span.event('llm.chunk', n=chunks, chars=len(text))
+        except Exception:
+            LLM_ERRORS.labels(model=model, operation=operation).inc()
+            raise
+        if span:
+            span.set(chunks=chunks, chars=len(content))
+    end = time.perf_counter()
+    LLM_LATENCY.labels(model=model, operation=operation).observe(end - start)
+    if first is not None and end > first:
+        LLM_TOKENS_PER_SEC.labels(model=model, operation=operation).observe(chunks / (end - first))
+    return content
+
+def device_facts_context(device=None) -> str:
+    """Cached facts about the target device for system prompts ('' when none were collected yet)."""
+    from tools.ssh_tool import SSH_HOST
+    from tools.facts import facts_cache
+    device = device or SSH_HOST
+    if not device:
+        return ""
+    try:
+        summary = facts_cache.summary(device)
+    except Exception:
+        return ""
+    return f" Target device facts: {summary}" if summary else ""
+
+@traced('agent.get_command_from_llama')
+def get_command_from_llama(instruction: str) -> str:
+    content = stream_completion([
+        SystemMessageParam(role="system", content="You are a command interpreter assistant. Convert user tasks into Kali Linux shell commands. Respond with *only* the command. No explanation or formatting." + device_facts_context()),
+        UserMessageParam(role="user", content=instruction),
+    ], operation="command")
     return content.strip()
 
 
@@ -179,14 +265,7 @@ def summarize_and_respond(user_prompt: str, context_text: str = "") -> str:
     ))
     user_msg = UserMessageParam(role="user", content=(f"Context:\n{context_text}\n\nUser prompt: {user_prompt}\n\nPlease summarize what was done and then answer the prompt."))
     try:
-        resp = llama.chat.completions.create(
-            model="Llama-4-Scout-17B-16E-Instruct-FP8",
-            messages=[system, user_msg],
-            stream=True
-        )
-        out = ""
-        for chunk in resp:
-            out += extract_text_from_chunk(chunk)
+        out = stream_completion([system, user_msg], model="Llama-4-Scout-17B-16E-Instruct-FP8", operation="summarize")
         return out.strip()
     except Exception as e:
         return f"[LLM ERROR] {e}"
@@ -205,14 +284,7 @@ def plan_course(conversation_text: str) -> str:
     ))
     user_msg = UserMessageParam(role="user", content=(f"Conversation:\n{conversation_text}\n\nPlease return a JSON array of 5 steps."))
     try:
-        resp = llama.chat.completions.create(
-            model="Llama-4-Maverick-17B-128E-Instruct-FP8",
-            messages=[system, user_msg],
-            stream=True
-        )
-        out = ""
-        for chunk in resp:
-            out += extract_text_from_chunk(chunk)
+        out = stream_completion([system, user_msg], operation="plan_course")
         return out.strip()
     except Exception as e:
         return f"[LLM ERROR] {e}"
@@ -222,6 +294,7 @@ def aggregate_agents(actions: list, user_prompt: str = "") -> str:
     """
     Aggregate a list of agent actions (strings) and produce a single coherent response that
     summarizes what the agents did and answers the user's prompt in the context of those actions.
+    Workflows (tools/workflow.py) call it as their final reduce step, one line per step result.
     """
     system = SystemMessageParam(role="system", content=(
         "You are the coordinator agent. Given a list of actions from different sub-agents, "
@@ -233,14 +306,7 @@ def aggregate_agents(actions: list, user_prompt: str = "") -> str:
     user_content = f"Actions:\n{actions_text}\n\nUser follow-up: {user_prompt}\n\nPlease produce: 1) A 3-5 line summary of actions, 2) A concise answer to the follow-up, and 3) Next steps (bullet list)."
     user_msg = UserMessageParam(role="user", content=user_content)
     try:
-        resp = llama.chat.completions.create(
-            model="Llama-4-Scout-17B-16E-Instruct-FP8",
-            messages=[system, user_msg],
-            stream=True
-        )
-        out = ""
-        for chunk in resp:
-            out += extract_text_from_chunk(chunk)
+        out = stream_completion([system, user_msg], model="Llama-4-Scout-17B-16E-Instruct-FP8", operation="aggregate")
         return out.strip()
     except Exception as e:
         return f"[LLM ERROR] {e}"
@@ -303,31 +369,52 @@ def ingest_context_folder():
 ## Removed connect_vpn_on_kali and execute_interactive_command (Kali/bug bounty specific)
 
 def load_persistent_memory(memory_path="persistent_memory.json"):
-    if os.path.exists(memory_path):
-        try:
-            with open(memory_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            # Convert dicts to SystemMessageParam/UserMessageParam objects
-            history = []
-            for msg in data:
-                if msg.get("role") == "system":
-                    history.append(SystemMessageParam(**msg))
-                else:
-                    history.append(UserMessageParam(**msg))
-            return history
-        except Exception as e:
-            print(f"Failed to load persistent memory: {e}")
+    """Load chat history from storage; a legacy JSON memory file is imported on first use."""
+    try:
+        from tools.storage import get_storage, import_memory_json
+        storage = get_storage()
+        import_memory_json(storage, memory_path)
+        # Convert dicts to SystemMessageParam/UserMessageParam objects
+        history = []
+        for msg in storage.load_memory():
+            if msg.get("role") == "system":
+                history.append(SystemMessageParam(**msg))
+            else:
+                history.append(UserMessageParam(**msg))
+        return history
+    except Exception as e:
+        print(f"Failed to load persistent memory: {e}")
     return []
 
 def save_persistent_memory(chat_history, memory_path="persistent_memory.json"):
+    """Persist chat history to storage; only messages added since the last save are written."""
     try:
+        from tools.storage import get_storage
         # Convert message objects to dicts
-        data = [msg.__dict__ for msg in chat_history]
-        with open(memory_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        data = [dict(msg) if isinstance(msg, dict) else msg.__dict__ for msg in chat_history]
+        get_storage().save_memory(data)
     except Exception as e:
         print(f"Failed to save persistent memory: {e}")
 
+def save_session_markdown(file_index, md_pairs):
+    """Write outputs/session_N.md and record its prompt/response pairs in the history database."""
+    fname = f"session_{file_index}.md"
+    md_filename = os.path.join("outputs", fname)
+    with open(md_filename, "w", encoding="utf-8") as f:
+        for idx, (prompt, response) in enumerate(md_pairs, 1):
+            f.write(f"### Prompt {idx}:\n{prompt}\n\n### Response {idx}:\n{response}\n\n")
+    try:
+        from tools.storage import get_storage
+        storage = get_storage()
+        mtime = os.path.getmtime(md_filename)
+        with storage.transaction():
+            # A restarted CLI numbers its files from 1 again, so the rows for an overwritten file are replaced
+            storage.replace_history(fname, f'cli:{fname}', 'pair',
+                                    [(str(prompt).strip(), str(response).strip()) for prompt, response in md_pairs], ts=mtime)
+            storage.set_meta(f'imported:{fname}', mtime)
+    except Exception as e:
+        print(f"Failed to record session history: {e}")
+
 def main():
     console.print("[bold magenta]Llamatrama Agent Online. Type 'exit' to quit.[/bold magenta]")
     context, tool_functions, tool_module_paths = ingest_context_folder()
@@ -379,6 +466,7 @@ def main():
         user_input = console.input("[cyan]You:[/cyan] ")
         if user_input.lower() in ["exit", "quit"]:
             break
+        log_event('prompt', text=user_input)
 
 
 
@@ -412,17 +500,10 @@ def main():
                 "Here are the available tools:\n" + tool_list
             )
             try:
-                response = llama.chat.completions.create(
-                    model="Llama-4-Maverick-17B-128E-Instruct-FP8",
-                    messages=[
-                        SystemMessageParam(role="system", content=system_instruction),
-                        UserMessageParam(role="user", content=smart_prompt),
-                    ],
-                    stream=True
-                )
-                model_reply = ""
-                for chunk in response:
-                    model_reply += extract_text_from_chunk(chunk)
+                model_reply = stream_completion([
+                    SystemMessageParam(role="system", content=system_instruction),
+                    UserMessageParam(role="user", content=smart_prompt),
+                ], operation="tool_planner")
                 model_reply = model_reply.strip()
                 console.print(f"[green]Llama tool planner:[/green] {model_reply}")
                 # Parse and execute tool calls in the reply
@@ -433,10 +514,12 @@ def main():
                 for tool_name, tool_args in matches:
                     func_key = f"tool_{tool_name}"
                     if func_key in tool_functions:
+                        t0 = time.time()
                         try:
                             result = run_tool_safely(tool_name, tool_args.strip(), timeout=10)
                         except Exception as e:
                             result = f"[ERROR] Tool '{tool_name}' failed: {e}"
+                        log_event('tool_result', tool=tool_name, args=tool_args.strip(), output=str(result), duration_ms=int((time.time() - t0) * 1000))
                         console.print(f"[green]Tool {tool_name} output:[/green]\n{result}")
                         md_pairs.append((user_input, str(result)))
                         pair_count += 1
@@ -444,10 +527,7 @@ def main():
                         console.print(f"[red]No tool named '{tool_name}' found in plugins folder.[/red]")
                 # Write to markdown every 5 pairs
                 if pair_count >= 5:
-                    md_filename = os.path.join("outputs", f"session_{file_index}.md")
-                    with open(md_filename, "w", encoding="utf-8") as f:
-                        for idx, (prompt, response) in enumerate(md_pairs, 1):
-                            f.write(f"### Prompt {idx}:\n{prompt}\n\n### Response {idx}:\n{response}\n\n")
+                    save_session_markdown(file_index, md_pairs)
                     file_index += 1
                     pair_count = 0
                     md_pairs = []
@@ -461,17 +541,16 @@ def main():
             from tools.ssh_tool import PersistentSSHSession, pi_diagnostics
             session = PersistentSSHSession()
             console.print("[blue]Running full Pi diagnostics...[/blue]")
+            t0 = time.time()
             results = pi_diagnostics(session)
             session.close()
+            log_event('tool_result', tool='diagnostics', output=json.dumps(results), duration_ms=int((time.time() - t0) * 1000))
             for k, v in results.items():
                 console.print(f"[bold green]{k}:[/bold green]\n{v}\n")
             md_pairs.append((user_input, str(results)))
             pair_count += 1
             if pair_count == 5:
-                md_filename = os.path.join("outputs", f"session_{file_index}.md")
-                with open(md_filename, "w", encoding="utf-8") as f:
-                    for idx, (prompt, response) in enumerate(md_pairs, 1):
-                        f.write(f"### Prompt {idx}:\n{prompt}\n\n### Response {idx}:\n{response}\n\n")
+                save_session_markdown(file_index, md_pairs)
                 file_index += 1
                 pair_count = 0
                 md_pairs = []
@@ -486,21 +565,20 @@ def main():
             # Try to find the tool function (by convention: tool_TOOLNAME)
             func_key = f"tool_{tool_name}"
             if func_key in tool_functions:
+                t0 = time.time()
                 try:
                     # Run tool via safe runner (subprocess with timeout or fallback)
                     result = run_tool_safely(tool_name, tool_args, timeout=10)
                 except Exception as e:
                     result = f"[ERROR] Tool '{tool_name}' failed: {e}"
+                log_event('tool_result', tool=tool_name, args=tool_args, output=str(result), duration_ms=int((time.time() - t0) * 1000))
                 console.print(f"[green]Tool {tool_name} output:[/green]\n{result}")
                 # Optionally, add to markdown pairs
                 md_pairs.append((user_input, str(result)))
                 pair_count += 1
                 # Write to markdown every 5 pairs
                 if pair_count == 5:
-                    md_filename = os.path.join("outputs", f"session_{file_index}.md")
-                    with open(md_filename, "w", encoding="utf-8") as f:
-                        for idx, (prompt, response) in enumerate(md_pairs, 1):
-                            f.write(f"### Prompt {idx}:\n{prompt}\n\n### Response {idx}:\n{response}\n\n")
+                    save_session_markdown(file_index, md_pairs)
                     file_index += 1
                     pair_count = 0
                     md_pairs = []
@@ -511,9 +589,8 @@ def main():
 
         chat_history.append(UserMessageParam(role="user", content=user_input))
 
-        response = llama.chat.completions.create(
-            model="Llama-4-Maverick-17B-128E-Instruct-FP8",
-            messages=chat_history + [
+        llm_start = time.time()
+        message = stream_completion(chat_history + [
                 SystemMessageParam(
                     role="system",
                     content=(
@@ -524,14 +601,9 @@ def main():
                         "Remember: you are connected to a real remote Raspberry Pi via SSH, and your actions will affect the actual device."
                     )
                 ),
-            ],
-            stream=True
-        )
-        message = ""
-        for chunk in response:
-            # Use helper function to extract text
-            message += extract_text_from_chunk(chunk)
+            ], operation="chat")
         message = message.strip()
+        log_event('response', text=message, duration_ms=int((time.time() - llm_start) * 1000))
         chat_history.append(SystemMessageParam(role="system", content=message))
         console.print(f"[green]Llamatrama:[/green] {message}")
 
@@ -544,10 +616,12 @@ def main():
             for tool_name, tool_args in matches:
                 func_key = f"tool_{tool_name}"
                 if func_key in tool_functions:
+                    t0 = time.time()
                     try:
                         result = run_tool_safely(tool_name, tool_args.strip(), timeout=10)
                     except Exception as e:
                         result = f"[ERROR] Tool '{tool_name}' failed: {e}"
+                    log_event('tool_result', tool=tool_name, args=tool_args.strip(), output=str(result), duration_ms=int((time.time() - t0) * 1000))
                     console.print(f"[green]Autoplay Tool {tool_name} output:[/green]\n{result}")
                     # Add tool output to markdown pairs and chat history so the model can see it
                     md_pairs.append((f"#${tool_name}", str(result)))
@@ -557,15 +631,7 @@ def main():
                     console.print(f"[red]No tool named '{tool_name}' found in plugins folder.[/red]")
             # Request a follow-up response from the model after tool outputs are available
             try:
-                follow = llama.chat.completions.create(
-                    model="Llama-4-Maverick-17B-128E-Instruct-FP8",
-                    messages=chat_history,
-                    stream=True
-                )
-                follow_reply = ""
-                for chunk in follow:
-                    follow_reply += extract_text_from_chunk(chunk)
-                follow_reply = follow_reply.strip()
+                follow_reply = stream_completion(chat_history, operation="tool_followup").strip()
                 chat_history.append(SystemMessageParam(role="system", content=follow_reply))
                 console.print(f"[green]Llamatrama (after tools):[/green] {follow_reply}")
                 md_pairs.append(("[tool-followup]", follow_reply))
@@ -590,10 +656,15 @@ def main():
         if "[RUN]" in message:
             try:
                 cmd_request = message.split("[RUN]", 1)[1].strip()
+                t0 = time.time()
                 shell_cmd = get_command_from_llama(cmd_request)
+                log_event('planned_command', request=cmd_request, command=shell_cmd, duration_ms=int((time.time() - t0) * 1000))
                 console.print(f"[yellow]Running command:[/yellow] {shell_cmd}")
+                t0 = time.time()
                 res = execute_remote_command(shell_cmd)
                 output = res.get('output') if isinstance(res, dict) else res
+                log_event('ssh_output', command=shell_cmd, output=str(output), status=res.get('status') if isinstance(res, dict) else None,
+                          duration_ms=int((time.time() - t0) * 1000))
                 console.print(f"[bright_cyan]SSH Output:[/bright_cyan] {output}")
                 # Optionally, add SSH output to markdown
                 md_pairs[-1] = (user_input, f"{message}\n\n**SSH Output:**\n```\n{output}\n```")
@@ -602,10 +673,7 @@ def main():
 
         # Write to markdown every 5 pairs
         if pair_count == 5:
-            md_filename = os.path.join("outputs", f"session_{file_index}.md")
-            with open(md_filename, "w", encoding="utf-8") as f:
-                for idx, (prompt, response) in enumerate(md_pairs, 1):
-                    f.write(f"### Prompt {idx}:\n{prompt}\n\n### Response {idx}:\n{response}\n\n")
+            save_session_markdown(file_index, md_pairs)
             file_index += 1
             pair_count = 0
             md_pairs = []
@@ -0,0 +1,90 @@
+"""
+Import-time benchmark with a regression budget.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for each entry in
+import_budget.json, sums the self-times it reports and fails when a module goes over its
+budget or pulls in a module listed under "forbid" (heavy dependencies that must stay lazy).
+
+    python scripts/import_bench.py              # check every budget entry
+    python scripts/import_bench.py agent --top 15
+    python scripts/import_bench.py --scale 4    # slower hardware (e.g. a Pi Zero)
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+PKG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_budget.json')
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def parse_importtime(stderr):
+    """Parse -X importtime output into [(module, self_us, cumulative_us, depth)] in import order."""
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), (len(m.group(3)) - 1) // 2))
+    return rows
+
+
+def measure(module, python=sys.executable, runs=3):
+    """Best-of-`runs` import of `module` in a fresh interpreter. Returns (total_ms, rows) or raises RuntimeError."""
+    best = None
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([PKG_DIR, os.environ.get('PYTHONPATH', '')]))
+    for _ in range(max(1, runs)):
+        proc = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'],
+                              capture_output=True, text=True, cwd=PKG_DIR, env=env)
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f'exit {proc.returncode}'
+            raise RuntimeError(f'import {module} failed: {error}')
+        rows = parse_importtime(proc.stderr)
+        total = sum(r[1] for r in rows) / 1000.0
+        if best is None or total < best[0]:
+            best = (total, rows)
+    return best
+
+
+def check(module, spec, scale=1.0, top=0):
+    """Return a list of budget violations for one module (empty when within budget)."""
+    total_ms, rows = measure(module)
+    imported = {r[0] for r in rows}
+    problems = []
+    limit = spec.get('max_ms', float('inf')) * scale
+    if total_ms > limit:
+        problems.append(f'{module}: {total_ms:.1f} ms > budget {limit:.1f} ms')
+    for name in spec.get('forbid', []):
+        if name in imported:
+            problems.append(f'{module}: imports {name} eagerly')
+    print(f'{module}: {total_ms:.1f} ms ({len(rows)} modules, budget {limit:.0f} ms)')
+    if top:
+        for name, _, cumulative, depth in sorted(rows, key=lambda r: -r[2])[:top]:
+            print(f'    {cumulative / 1000.0:8.1f} ms  {"  " * depth}{name}')
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', help='modules to check (default: every entry in import_budget.json)')
+    parser.add_argument('--scale', type=float, default=float(os.getenv('IMPORT_BUDGET_SCALE', '1')),
+                        help='multiply every max_ms budget (slow hardware)')
+    parser.add_argument('--top', type=int, default=0, help='show the N slowest imports (cumulative)')
+    args = parser.parse_args(argv)
+    with open(BUDGET_FILE, 'r', encoding='utf-8') as fh:
+        budgets = json.load(fh)
+    problems = []
+    for module in args.modules or list(budgets):
+        try:
+            problems.extend(check(module, budgets.get(module, {}), args.scale, args.top))
+        except RuntimeError as e:
+            problems.append(str(e))
+    for p in problems:
+        print('FAIL', p)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+Admission control for expensive endpoints (LLM streams, SSH sessions).
+
+Every request passes two gates before it runs:
+- token buckets per user and per device (shared across workers through tools.shared_state),
+  which bound the sustained request rate;
+- a concurrency limiter per pool ('llm' for the worker, 'ssh:<device>' per device) with a
+  bounded FIFO wait queue, which bounds parallel LLM streams and SSH sessions so a small
+  Pi's sshd (MaxStartups) is never flooded.
+
+A request that cannot be admitted fails fast with AdmissionRejected(reason, retry_after);
+the web layer turns that into 429 + Retry-After.
+
+    async with admission.admit('ssh', user='alice', device='100.64.0.2'):
+        ...
+"""
+import asyncio
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from tools.metrics import counter, gauge
+
+
+def _env(name, default):
+    return float(os.getenv(name, default))
+
+
+# Per-kind policy; rates are tokens/second, bursts are bucket capacities.
+# Concurrency limits apply per worker process.
+POLICIES = {
+    'llm': {
+        'user_rate': _env('ADMIT_LLM_USER_RATE', 0.5), 'user_burst': _env('ADMIT_LLM_USER_BURST', 5),
+        'concurrency': int(_env('ADMIT_LLM_CONCURRENCY', 4)),
+        'max_queue': int(_env('ADMIT_LLM_QUEUE', 8)), 'max_wait': _env('ADMIT_LLM_WAIT', 30),
+    },
+    'ssh': {
+        'user_rate': _env('ADMIT_SSH_USER_RATE', 1.0), 'user_burst': _env('ADMIT_SSH_USER_BURST', 10),
+        'device_rate': _env('ADMIT_SSH_DEVICE_RATE', 1.0), 'device_burst': _env('ADMIT_SSH_DEVICE_BURST', 5),
+        'concurrency': int(_env('ADMIT_SSH_DEVICE_CONCURRENCY', 2)),
+        'max_queue': int(_env('ADMIT_SSH_QUEUE', 4)), 'max_wait': _env('ADMIT_SSH_WAIT', 20),
+    },
+    # Exec channels on a pooled connection (/ws/mux streams): the socket is rate-checked once as 'ssh',
+    # each stream only needs a per-device slot, sized for sshd's default MaxSessions (10)
+    'exec': {
+        'device_rate': _env('ADMIT_EXEC_DEVICE_RATE', 5.0), 'device_burst': _env('ADMIT_EXEC_DEVICE_BURST', 40),
+        'concurrency': int(_env('ADMIT_EXEC_DEVICE_CONCURRENCY', 8)),
+        'max_queue': int(_env('ADMIT_EXEC_QUEUE', 64)), 'max_wait': _env('ADMIT_EXEC_WAIT', 30),
+    },
+}
+
+ADMISSIONS = counter('admission_decisions_total', 'Admission decisions by kind and result', ['kind', 'result'])
+QUEUED = gauge('admission_queue_depth', 'Requests waiting for a concurrency slot', ['pool'])
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class Slot:
+    """A held concurrency slot. release() is idempotent, so a long-lived stream can hand it back early."""
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._start = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._limiter.release(time.monotonic() - self._start)
+
+
+class LocalBuckets:
+    """In-process token buckets, used when the shared store is unavailable (same interface as SharedState.take_token)."""
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take_token(self, key, rate, capacity, cost=1.0):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / rate if rate > 0 else float('inf')
+
+
+class ConcurrencyLimiter:
+    """
+    At most `limit` concurrent holders; up to `max_queue` callers wait in FIFO order for at most
+    `max_wait` seconds. A released slot is handed directly to the oldest waiter.
+    """
+    def __init__(self, name, limit, max_queue, max_wait):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters = deque()
+        self._avg_hold = 1.0
+
+    @property
+    def queued(self):
+        return sum(1 for w in self._waiters if not w.done())
+
+    def retry_after(self):
+        """Rough time until a new caller could get a slot: queue ahead of it times the average hold time."""
+        return self._avg_hold * (self.queued + 1) / self.limit
+
+    async def acquire(self):
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return
+        if self.queued >= self.max_queue:
+            raise AdmissionRejected('queue_full', self.retry_after())
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        QUEUED.labels(pool=self.name).inc()
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived as we timed out; pass it on
+                self.release()
+            raise AdmissionRejected('timeout', self.retry_after())
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            QUEUED.labels(pool=self.name).dec()
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(waiter)
+
+    def release(self, held=None):
+        if held is not None:
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # slot transferred; active count unchanged
+                return
+        self.active = max(0, self.active - 1)
+
+
+class AdmissionController:
+    """
+    buckets: object with take_token(key, rate, capacity) -> (allowed, retry_after); defaults to
+    the shared SQLite state so limits hold across workers, falling back to in-process buckets.
+    """
+    def __init__(self, policies=None, buckets=None):
+        self.policies = policies or POLICIES
+        self._buckets = buckets
+        self._local = LocalBuckets()
+        self._limiters = {}
+
+    def _take(self, key, rate, capacity):
+        if self._buckets is None:
+            try:
+                from tools.shared_state import get_shared_state
+                self._buckets = get_shared_state()
+            except Exception:
+                self._buckets = self._local
+        try:
+            return self._buckets.take_token(key, rate, capacity)
+        except Exception:
+            return self._local.take_token(key, rate, capacity)
+
+    def limiter(self, kind, device=None):
+        policy = self.policies[kind]
+        name = f"{kind}:{device}" if device else kind
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            limiter = self._limiters[name] = ConcurrencyLimiter(name, policy['concurrency'], policy['max_queue'], policy['max_wait'])
+        return limiter
+
+    def check_rate(self, kind, user=None, device=None):
+        """Consume one token from the user's and the device's bucket, or raise AdmissionRejected."""
+        policy = self.policies[kind]
+        checks = []
+        if user and policy.get('user_rate'):
+            checks.append((f"{kind}:user:{user}", policy['user_rate'], policy['user_burst']))
+        if device and policy.get('device_rate'):
+            checks.append((f"{kind}:device:{device}", policy['device_rate'], policy['device_burst']))
+        for key, rate, burst in checks:
+            allowed, retry_after = self._take(key, rate, burst)
+            if not allowed:
+                raise AdmissionRejected('rate_limited', retry_after)
+
+    async def acquire(self, kind, user=None, device=None):
+        """Rate-check, then take a concurrency slot ('llm' per worker, 'ssh'/'exec' per device). Returns a Slot."""
+        try:
+            self.check_rate(kind, user=user, device=device)
+            limiter = self.limiter(kind, device if kind in ('ssh', 'exec') else None)
+            await limiter.acquire()
+        except AdmissionRejected as e:
+            ADMISSIONS.labels(kind=kind, result=e.reason).inc()
+            raise
+        ADMISSIONS.labels(kind=kind, result='admitted').inc()
+        return Slot(limiter)
+
+    @contextlib.asynccontextmanager
+    async def admit(self, kind, user=None, device=None):
+        """acquire() for the duration of the block."""
+        slot = await self.acquire(kind, user=user, device=device)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def status(self):
+        return {name: {'active': l.active, 'queued': l.queued, 'limit': l.limit, 'max_queue': l.max_queue}
+                for name, l in self._limiters.items()}
+
+
+# Process-wide controller used by the web server
+admission = AdmissionController()
@@ -0,0 +1,402 @@
+"""
+Camera snapshots and MJPEG streaming straight from the device's camera tool over SSH.
+
+A snapshot runs rpicam-still / libcamera-still / raspistill with `-o -`, so the JPEG
+arrives on the exec channel and never touches a file on either side. Continuous mode runs
+rpicam-vid / libcamera-vid (or raspivid) with the MJPEG codec. The output is one long run
+of back-to-back JPEGs, which JpegSplitter cuts into frames by walking the JPEG markers.
+
+One capture per device fans out to every viewer. A viewer always gets the newest frame
+when it is ready for another, so a slow client skips frames instead of queueing them, and
+it never slows the capture or other viewers. While a stream is running, snapshots reuse
+its latest frame. The camera can only be opened by one process at a time.
+
+SyntheticChannel stands in for a real channel. It produces small valid grayscale JPEGs at a
+fixed rate, for tests and for dashboard work without a Pi (CAMERA_SYNTHETIC=1).
+
+    jpeg = snapshot(lambda cmd: ssh_pool.open_exec(host, user, cmd, password=pw))
+    viewer = cameras.subscribe('100.64.0.2', open_channel, fps=10)
+    frame = await viewer.next()      # (seq, jpeg bytes, ts)
+    viewer.close()
+"""
+import asyncio
+import struct
+import threading
+import time
+
+SOI, EOI = b'\xff\xd8', b'\xff\xd9'
+# Markers without a length field: SOI, EOI, TEM, RST0-7
+_STANDALONE = {0xD8, 0xD9, 0x01, *range(0xD0, 0xD8)}
+MAX_FRAME = 8 * 1024 * 1024
+
+
+def _first_tool(candidates):
+    """sh snippet exec-ing the first available (tool, args) pair, stderr silenced so it cannot corrupt the stream."""
+    branches = [f"if command -v {tool} >/dev/null 2>&1; then exec {tool} {args} 2>/dev/null; fi" for tool, args in candidates]
+    return '; '.join(branches + ["echo 'no camera tool found (rpicam-apps, libcamera-apps or raspistill)' >&2; exit 127"])
+
+
+def snapshot_command(width=1280, height=720, quality=85):
+    size = f"--width {int(width)} --height {int(height)}"
+    modern = f"-n -t 1 --immediate {size} -q {int(quality)} -e jpg -o -"
+    return _first_tool([('rpicam-still', modern), ('libcamera-still', modern),
+                        ('raspistill', f"-n -t 1 -w {int(width)} -h {int(height)} -q {int(quality)} -o -")])
+
+
+def stream_command(width=640, height=480, fps=10, quality=70):
+    size = f"--width {int(width)} --height {int(height)}"
+    modern = f"-n -t 0 --codec mjpeg {size} --framerate {fps:g} -q {int(quality)} -o -"
+    return _first_tool([('rpicam-vid', modern), ('libcamera-vid', modern),
+                        ('raspivid', f"-n -t 0 -cd MJPEG -w {int(width)} -h {int(height)} -fps {int(max(1, fps))} -o -")])
+
+
+class JpegSplitter:
+    """
+    Incremental splitter for concatenated JPEGs. Header segments are skipped by their length
+    fields (so an EXIF thumbnail cannot end a frame early); after SOS the entropy-coded data is
+    scanned for the first marker that is neither stuffing (FF00) nor a restart marker.
+    """
+    def __init__(self, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+        self.skipped = 0
+        self._buffer = bytearray()
+        self._pos = None      # parse position inside the current frame
+        self._entropy = False
+
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        while True:
+            frame = self._next()
+            if frame is None:
+                break
+            frames.append(frame)
+        if len(self._buffer) > self.max_frame:
+            # Garbage or a frame far too large: resynchronise on the next SOI
+            self.skipped += len(self._buffer)
+            self._buffer.clear()
+            self._pos = None
+        return frames
+
+    def _next(self):
+        buf = self._buffer
+        if self._pos is None:
+            start = buf.find(SOI)
+            if start < 0:
+                keep = 1 if buf.endswith(b'\xff') else 0
+                self.skipped += len(buf) - keep
+                del buf[:len(buf) - keep]
+                return None
+            if start:
+                self.skipped += start
+                del buf[:start]
+            self._pos, self._entropy = 2, False
+        while True:
+            if self._entropy:
+                i = self._pos
+                while True:
+                    i = buf.find(b'\xff', i)
+                    if i < 0 or i + 1 >= len(buf):
+                        self._pos = max(self._pos, len(buf) - 1)
+                        return None
+                    marker = buf[i + 1]
+                    if marker == 0x00 or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+                        i += 1 if marker == 0xFF else 2
+                        continue
+                    break
+                self._pos, self._entropy = i, False
+                continue
+            if self._pos + 2 > len(buf):
+                return None
+            if buf[self._pos] != 0xFF:
+                # Not a marker where one must be: drop this SOI and look for the next one
+                del buf[:2]
+                self.skipped += 2
+                self._pos = None
+                return self._next()
+            marker = buf[self._pos + 1]
+            if marker == 0xD9:
+                end = self._pos + 2
+                frame = bytes(buf[:end])
+                del buf[:end]
+                self._pos = None
+                return frame
+            if marker in _STANDALONE or marker == 0xFF:
+                self._pos += 1 if marker == 0xFF else 2
+                continue
+            if self._pos + 4 > len(buf):
+                return None
+            length = struct.unpack_from('>H', buf, self._pos + 2)[0]
+            if self._pos + 2 + length > len(buf):
+                return None
+            self._pos += 2 + length
+            if marker == 0xDA:
+                self._entropy = True
+
+
+def read_jpeg(channel, timeout=20.0, max_bytes=MAX_FRAME):
+    """Read one complete JPEG from a channel running a snapshot command."""
+    channel.settimeout(timeout)
+    chunks, size = [], 0
+    while True:
+        data = channel.recv(65536)
+        if not data:
+            break
+        chunks.append(data)
+        size += len(data)
+        if size > max_bytes:
+            raise ValueError("snapshot larger than the frame limit")
+    data = b''.join(chunks)
+    frames = JpegSplitter(max_frame=max_bytes + 1).feed(data)
+    if not frames:
+        message = data[:200].decode(errors='replace').strip() if data and not data.startswith(SOI) else 'no image data'
+        raise RuntimeError(f"camera returned no JPEG: {message}")
+    return frames[0]
+
+
+def snapshot(open_channel, width=1280, height=720, quality=85, timeout=20.0):
+    """open_channel(command) -> channel. Returns the JPEG bytes."""
+    channel = open_channel(snapshot_command(width, height, quality))
+    try:
+        return read_jpeg(channel, timeout)
+    finally:
+        try:
+            channel.close()
+        except Exception:
+            pass
+
+
+# --- Synthetic source ---
+def _bits_to_bytes(bits):
+    bits += '1' * (-len(bits) % 8)  # pad with ones, as the standard requires
+    out = bytearray()
+    for i in range(0, len(bits), 8):
+        byte = int(bits[i:i + 8], 2)
+        out.append(byte)
+        if byte == 0xFF:
+            out.append(0x00)
+    return bytes(out)
+
+
+def synthetic_jpeg(width=64, height=48, level=150, comment=''):
+    """
+    A valid baseline grayscale JPEG of one flat gray level (144..159), built without an imaging
+    library: tiny hand-made Huffman tables, DC only. width and height are rounded up to 8.
+    """
+    width, height = max(8, -(-width // 8) * 8), max(8, -(-height // 8) * 8)
+    level = min(159, max(144, int(level)))
+
+    def segment(marker, payload):
+        return b'\xff' + bytes([marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+    # DC codes: '0' -> category 0 (no change), '10' -> category 8; AC codes: '0' -> end of block
+    dht = (b'\x00' + bytes([1, 1] + [0] * 14) + b'\x00\x08' +
+           b'\x10' + bytes([1] + [0] * 15) + b'\x00')
+    blocks = (width // 8) * (height // 8)
+    bits = '10' + format(8 * (level - 128), '08b') + '0' + '00' * (blocks - 1)
+    return (SOI + segment(0xFE, comment.encode()) +
+            segment(0xDB, b'\x00' + b'\x01' * 64) +
+            segment(0xC0, struct.pack('>BHHB', 8, height, width, 1) + b'\x01\x11\x00') +
+            segment(0xC4, dht) +
+            segment(0xDA, b'\x01\x01\x00\x00\x3f\x00') +
+            _bits_to_bytes(bits) + EOI)
+
+
+class SyntheticChannel:
+    """
+    Channel-like MJPEG source: recv() returns a stream of synthetic frames at `fps`, cut into
+    arbitrary chunk sizes the way a network read would. frames=None runs until closed.
+    """
+    def __init__(self, fps=10.0, width=64, height=48, frames=None, chunk=1000):
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.frames = frames
+        self.chunk = chunk
+        self.sent = 0
+        self._pending = b''
+        self._closed = threading.Event()
+        self._next_at = time.monotonic()
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, n):
+        if not self._pending:
+            if self._closed.is_set() or (self.frames is not None and self.sent >= self.frames):
+                return b''
+            delay = self._next_at - time.monotonic()
+            if delay > 0 and self._closed.wait(delay):
+                return b''
+            self._next_at = max(self._next_at + 1.0 / self.fps, time.monotonic() - 1.0)
+            self._pending = synthetic_jpeg(self.width, self.height, 144 + self.sent % 16, f'frame {self.sent}')
+            self.sent += 1
+        data, self._pending = self._pending[:min(n, self.chunk)], self._pending[min(n, self.chunk):]
+        return data
+
+    def close(self):
+        self._closed.set()
+
+
+# --- Fan-out ---
+class Viewer:
+    """Waits for frames newer than the last one it returned; anything in between is skipped (counted in dropped)."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.seen = 0
+        self.dropped = 0
+        self.delivered = 0
+
+    def notify(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    async def next(self, timeout=None):
+        """(seq, jpeg, ts) of the newest frame; raises ConnectionError once the capture has ended."""
+        while True:
+            latest = self.stream.latest
+            if latest is not None and latest[0] > self.seen:
+                self.dropped += latest[0] - self.seen - 1 if self.seen else 0
+                self.seen = latest[0]
+                self.delivered += 1
+                return latest
+            if not self.stream.alive:
+                raise ConnectionError(self.stream.error or 'camera stream ended')
+            self.event.clear()
+            if timeout is None:
+                await self.event.wait()
+            else:
+                await asyncio.wait_for(self.event.wait(), timeout)
+
+    def close(self):
+        self.stream.hub.unsubscribe(self)
+
+
+class CameraStream:
+    """One capture channel for a device; the reader thread keeps only the latest frame."""
+    def __init__(self, hub, device, open_channel, width=640, height=480, fps=10, quality=70):
+        self.hub = hub
+        self.device = device
+        self.open_channel = open_channel
+        self.settings = {'width': int(width), 'height': int(height), 'fps': float(fps), 'quality': int(quality)}
+        self.viewers = set()
+        self.latest = None
+        self.frames = 0
+        self.bytes = 0
+        self.error = None
+        self.started = time.time()
+        self._channel = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f'camera-{device}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+        channel = self._channel
+        if channel is not None:
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+    def publish(self, jpeg):
+        self.frames += 1
+        self.bytes += len(jpeg)
+        self.latest = (self.frames, jpeg, time.time())
+        with self._lock:
+            viewers = list(self.viewers)
+        for viewer in viewers:
+            viewer.notify()
+
+    def _run(self):
+        splitter = JpegSplitter()
+        try:
+            channel = self._channel = self.open_channel(stream_command(**self.settings))
+            if self._stop.is_set():
+                channel.close()
+                return
+            channel.settimeout(15)
+            while not self._stop.is_set():
+                data = channel.recv(65536)
+                if not data:
+                    if not self.frames:
+                        self.error = 'camera produced no frames'
+                    break
+                for jpeg in splitter.feed(data):
+                    self.publish(jpeg)
+        except Exception as e:
+            if not self._stop.is_set():
+                self.error = str(e) or type(e).__name__
+        finally:
+            self.stop()
+            with self._lock:
+                viewers = list(self.viewers)
+            for viewer in viewers:
+                viewer.notify()
+
+    def status(self):
+        elapsed = max(1e-9, time.time() - self.started)
+        return {'device': self.device, 'alive': self.alive, 'viewers': len(self.viewers), 'frames': self.frames,
+                'fps': round(self.frames / elapsed, 1), 'bytes': self.bytes, 'error': self.error, **self.settings,
+                'dropped': sum(v.dropped for v in list(self.viewers))}
+
+
+class CameraHub:
+    """One CameraStream per device shared by its viewers; the capture stops with its last viewer."""
+    def __init__(self):
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, device, open_channel, width=640, height=480, fps=10, quality=70):
+        """Join the device's running capture (its settings win) or start one. Must be called on the event loop."""
+        device = str(device)
+        with self._lock:
+            stream = self._streams.get(device)
+            if stream is None or not stream.alive:
+                stream = self._streams[device] = CameraStream(self, device, open_channel, width, height, fps, quality).start()
+            viewer = Viewer(stream)
+            with stream._lock:
+                stream.viewers.add(viewer)
+        return viewer
+
+    def unsubscribe(self, viewer):
+        stream = viewer.stream
+        with stream._lock:
+            stream.viewers.discard(viewer)
+            idle = not stream.viewers
+        if idle:
+            stream.stop()
+            with self._lock:
+                if self._streams.get(stream.device) is stream:
+                    del self._streams[stream.device]
+
+    def latest(self, device, max_age=2.0):
+        """JPEG from a running capture if it is recent enough, else None."""
+        stream = self._streams.get(str(device))
+        latest = stream.latest if stream is not None and stream.alive else None
+        return latest[1] if latest and time.time() - latest[2] <= max_age else None
+
+    def stop_all(self):
+        with self._lock:
+            streams = list(self._streams.values())
+            self._streams.clear()
+        for stream in streams:
+            stream.stop()
+
+    def status(self):
+        with self._lock:
+            return [s.status() for s in self._streams.values()]
+
+
+# Process-wide hub used by the web server
+cameras = CameraHub()
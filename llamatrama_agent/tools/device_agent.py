@@ -0,0 +1,269 @@
+"""
+Client side of the optional resident device agent (tools/device_agent_runtime.py).
+
+The agent replaces "type into a pty shell, wait for the timeout, scrape the text" with
+native calls: exec, stat, list, read, write, metrics, gpio_read and gpio_write. They are
+multiplexed by request id over one SSH exec channel (or a tailnet TCP socket), so several
+calls can be in flight at once and each returns as soon as it is done.
+
+Deployment is explicit: run install_command() on the device once, for example via
+POST /devices/{device}/agent/install. Afterwards PersistentSSHSession.send_command uses the
+agent whenever it is installed, and falls back to the shell when it is not. DEVICE_AGENT=off
+disables it.
+
+    client = attach(lambda cmd: ssh_pool.open_exec(host, user, cmd))   # None when not installed
+    client.exec('uptime')['stdout']
+    client.write_file('/tmp/x', b'data'); client.read_file('/tmp/x')
+"""
+import base64
+import hashlib
+import itertools
+import json
+import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from tools.device_agent_runtime import MAGIC, MAX_READ, FrameReader, available_codecs, frame, make_codec
+
+RUNTIME_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_agent_runtime.py')
+
+
+class AgentUnavailable(RuntimeError):
+    """No agent answered on the transport, or the connection to it was lost."""
+
+
+class AgentError(RuntimeError):
+    """The agent ran the call and it failed (the message is the remote exception)."""
+
+
+def agent_enabled():
+    return os.getenv('DEVICE_AGENT', 'auto').lower() not in ('off', '0', 'false', 'no')
+
+
+def runtime_source():
+    with open(RUNTIME_PATH, 'rb') as f:
+        return f.read()
+
+
+def agent_version():
+    """Content hash of the runtime; a changed runtime is deployed side by side under a new name."""
+    return hashlib.sha256(runtime_source()).hexdigest()[:12]
+
+
+def agent_path():
+    return f'"$HOME/.llamatrama/agent-{agent_version()}.py"'
+
+
+def install_command():
+    payload = base64.b64encode(runtime_source()).decode()
+    path = agent_path()
+    return (f'mkdir -p "$HOME/.llamatrama" && printf %s {payload} | base64 -d > {path}.tmp && '
+            f'mv {path}.tmp {path} && echo installed {agent_version()}')
+
+
+def probe_command():
+    """Prints 'present'/'absent', the python3 version and whether msgpack is importable."""
+    return (f'if [ -f {agent_path()} ]; then echo present; else echo absent; fi; '
+            'python3 -c "import sys; print(sys.version.split()[0])" 2>/dev/null || echo no-python; '
+            'python3 -c "import msgpack" 2>/dev/null && echo msgpack || true')
+
+
+def launch_command():
+    return (f'f={agent_path()}; if [ -f "$f" ] && command -v python3 >/dev/null 2>&1; '
+            'then exec python3 -u "$f" --stdio 2>/dev/null; else echo NOAGENT; fi')
+
+
+def parse_probe(output):
+    lines = [line.strip() for line in str(output).splitlines() if line.strip()]
+    return {'installed': 'present' in lines, 'version': agent_version(),
+            'python': next((line for line in lines if line[:1].isdigit()), None),
+            'msgpack': 'msgpack' in lines}
+
+
+class AgentClient:
+    """
+    Request/response client over any transport with recv/sendall/close/settimeout (paramiko channel,
+    socket). The handshake runs in the constructor; a reader thread then resolves futures by id.
+    """
+    def __init__(self, transport, token=None, codecs=None, timeout=5.0):
+        self.transport = transport
+        self._reader = FrameReader()
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self.closed = False
+        self.error = None
+        transport.settimeout(timeout)
+        try:
+            magic = self._read_exact(len(MAGIC))
+        except OSError as e:
+            raise AgentUnavailable(f"no agent on this transport: {e}")
+        if magic != MAGIC:
+            raise AgentUnavailable("no agent on this transport")
+        hello = {'codecs': codecs or available_codecs()}
+        if token:
+            hello['token'] = token
+        transport.sendall(frame(json.dumps(hello).encode()))
+        reply = json.loads(self._read_body())
+        if 'error' in reply:
+            raise AgentUnavailable(f"agent refused the connection: {reply['error']}")
+        self.codec = make_codec(reply.get('codec'))
+        self.methods = reply.get('methods') or []
+        self.remote_pid = reply.get('pid')
+        transport.settimeout(None)
+        self._thread = threading.Thread(target=self._run, name='device-agent', daemon=True)
+        self._thread.start()
+
+    def _read_exact(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.transport.recv(n - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def _read_body(self):
+        while True:
+            data = self.transport.recv(65536)
+            if not data:
+                raise AgentUnavailable("agent closed the connection during the handshake")
+            bodies = self._reader.feed(data)
+            if bodies:
+                if len(bodies) > 1:
+                    raise AgentUnavailable("unexpected frames during the handshake")
+                return bodies[0]
+
+    @property
+    def alive(self):
+        return not self.closed and self._thread.is_alive()
+
+    def _run(self):
+        try:
+            while True:
+                data = self.transport.recv(65536)
+                if not data:
+                    break
+                for body in self._reader.feed(data):
+                    response = self.codec.decode(body)
+                    with self._lock:
+                        future = self._pending.pop(response.get('i'), None)
+                    if future is None:
+                        continue
+                    if 'e' in response:
+                        future.set_exception(AgentError(response['e']))
+                    else:
+                        future.set_result(response.get('r'))
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+        finally:
+            self.closed = True
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(AgentUnavailable(self.error or 'agent connection closed'))
+
+    def submit(self, method, **params):
+        """Send a request without waiting; returns a Future for its result."""
+        if self.closed:
+            raise AgentUnavailable(self.error or 'agent connection closed')
+        future = Future()
+        rid = next(self._ids)
+        with self._lock:
+            self._pending[rid] = future
+        try:
+            with self._send_lock:
+                self.transport.sendall(frame(self.codec.encode({'i': rid, 'm': method, 'p': params})))
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(rid, None)
+            raise AgentUnavailable(f"sending to agent failed: {e}")
+        return future
+
+    def call(self, method, timeout=30.0, **params):
+        try:
+            return self.submit(method, **params).result(timeout)
+        except FutureTimeout:
+            raise TimeoutError(f"agent call {method} timed out after {timeout}s")
+
+    # --- Native calls ---
+    def ping(self):
+        return self.call('ping', timeout=5)
+
+    def exec(self, cmd, timeout=60, cwd=None, input=None, kill_after=None):
+        """{code, stdout, stderr, cwd, timed_out, running, killed, elapsed}. After timeout seconds the output so
+        far is returned and the command keeps running (running=True); kill_after, when set, kills it instead."""
+        params = {'cmd': cmd, 'timeout': timeout, 'cwd': cwd, 'input': input}
+        if kill_after is not None:
+            params['kill_after'] = kill_after
+        future = self.submit('exec', **params)
+        try:
+            return future.result(min(timeout, kill_after or timeout) + 5)
+        except FutureTimeout:
+            raise TimeoutError(f"agent exec timed out after {timeout}s")
+
+    def stat(self, path):
+        return self.call('stat', path=path)
+
+    def listdir(self, path='.'):
+        return self.call('list', path=path)
+
+    def read_file(self, path, chunk=MAX_READ):
+        """Whole file as bytes, fetched in chunks."""
+        parts, offset = [], 0
+        while True:
+            result = self.call('read', path=path, offset=offset, length=chunk)
+            parts.append(result['data'])
+            offset += len(result['data'])
+            if result['eof'] or not result['data']:
+                return b''.join(parts)
+
+    def write_file(self, path, data, append=False, mode=None):
+        if isinstance(data, str):
+            data = data.encode()
+        return self.call('write', path=path, data=data, append=append, mode=mode)
+
+    def metrics(self):
+        return self.call('metrics')
+
+    def gpio_read(self, pin):
+        return self.call('gpio_read', pin=int(pin))
+
+    def gpio_write(self, pin, value):
+        return self.call('gpio_write', pin=int(pin), value=int(bool(value)))
+
+    def close(self):
+        self.closed = True
+        try:
+            self.transport.close()
+        except Exception:
+            pass
+
+
+def attach(open_channel, timeout=5.0):
+    """Start the installed agent on a new channel (open_channel(command) -> channel); None when absent."""
+    try:
+        channel = open_channel(launch_command())
+    except Exception:
+        return None
+    try:
+        return AgentClient(channel, timeout=timeout)
+    except (AgentUnavailable, OSError, ValueError):
+        try:
+            channel.close()
+        except Exception:
+            pass
+        return None
+
+
+def connect_tcp(host, port, token, timeout=5.0):
+    """Reach an agent started with --listen over the tailnet."""
+    import socket
+    sock = socket.create_connection((host, int(port)), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        return AgentClient(sock, token=token, timeout=timeout)
+    except Exception:
+        sock.close()
+        raise
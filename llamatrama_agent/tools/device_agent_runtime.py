@@ -0,0 +1,402 @@
+"""
+Resident device agent: the program that runs ON the device (python3 stdlib; msgpack is used
+when it is installed there). tools/device_agent.py deploys it as
+~/.llamatrama/agent-<version>.py and talks to it.
+
+    python3 agent.py --stdio                                   # over an SSH exec channel
+    python3 agent.py --listen 100.64.0.2:7071 --token-file T   # over the tailnet
+
+Wire format: the agent writes MAGIC once, then both sides exchange frames of a 4-byte
+big-endian length followed by the body. The first frame each way is a JSON hello. The
+client lists the codecs it speaks (plus the token, over TCP), and the agent answers with
+the codec it picked. After that, requests are {i: id, m: method, p: params} and responses
+are {i: id, r: result} or {i: id, e: error}. Requests run concurrently on a thread pool,
+so responses may come back in any order.
+
+This module must stay importable on its own (no tools.* imports); the server side reuses
+its codec and framing.
+"""
+import argparse
+import base64
+import hmac
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MAGIC = b'LTA1'
+PROTOCOL = 1
+MAX_FRAME = 64 * 1024 * 1024
+MAX_READ = 16 * 1024 * 1024
+_LEN = struct.Struct('>I')
+_CWD_MARK = '\x1e'
+
+
+# --- Codecs and framing ---
+class JsonCodec:
+    """JSON with bytes carried as {"$b": base64}."""
+    name = 'json'
+
+    def encode(self, obj):
+        return json.dumps(obj, default=self._default, separators=(',', ':')).encode()
+
+    def decode(self, data):
+        return json.loads(data, object_hook=self._hook)
+
+    @staticmethod
+    def _default(value):
+        if isinstance(value, (bytes, bytearray)):
+            return {'$b': base64.b64encode(bytes(value)).decode()}
+        raise TypeError(f"cannot encode {type(value).__name__}")
+
+    @staticmethod
+    def _hook(obj):
+        return base64.b64decode(obj['$b']) if len(obj) == 1 and '$b' in obj else obj
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+def available_codecs():
+    return (['msgpack'] if msgpack is not None else []) + ['json']
+
+
+def make_codec(name):
+    return MsgpackCodec() if name == 'msgpack' and msgpack is not None else JsonCodec()
+
+
+def frame(body):
+    return _LEN.pack(len(body)) + body
+
+
+class FrameReader:
+    """Incremental decoder for length-prefixed frames."""
+    def __init__(self, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        bodies = []
+        while len(self._buffer) >= _LEN.size:
+            (length,) = _LEN.unpack_from(self._buffer)
+            if length > self.max_frame:
+                raise ValueError(f"frame of {length} bytes exceeds the limit")
+            if len(self._buffer) < _LEN.size + length:
+                break
+            bodies.append(bytes(self._buffer[_LEN.size:_LEN.size + length]))
+            del self._buffer[:_LEN.size + length]
+        return bodies
+
+
+# --- Operations ---
+def op_ping():
+    return {'protocol': PROTOCOL, 'pid': os.getpid(), 'time': time.time(), 'python': sys.version.split()[0]}
+
+
+def op_exec(cmd, timeout=60, cwd=None, input=None, kill_after=None):
+    """Run cmd with /bin/sh in cwd. Returns code, stdout, stderr and the working directory it ended in.
+    timeout is a read timeout, as on the interactive shell: when it passes, the output so far comes back
+    with timed_out and running set, and the command keeps going. kill_after (seconds) is the optional hard limit."""
+    script = f'{cmd}\n__rc=$?\nprintf "{_CWD_MARK}%s" "$(pwd)"\nexit $__rc'
+    if not cwd or not os.path.isdir(os.path.expanduser(cwd)):
+        cwd = os.path.expanduser('~')
+    start = time.monotonic()
+    proc = subprocess.Popen(['/bin/sh', '-c', script], cwd=os.path.expanduser(cwd),
+                            stdin=subprocess.PIPE if input else subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    lock = threading.Lock()
+    out, err, keep = [], [], [True]
+
+    def drain(stream, sink):
+        # Keeps reading after we return, so a command left running never blocks on a full pipe
+        for block in iter(lambda: stream.read1(65536), b''):
+            with lock:
+                if keep[0]:
+                    sink.append(block)
+        stream.close()
+
+    def feed():
+        try:
+            proc.stdin.write(input)
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    readers = [threading.Thread(target=drain, args=(proc.stdout, out), daemon=True),
+               threading.Thread(target=drain, args=(proc.stderr, err), daemon=True)]
+    for thread in readers + ([threading.Thread(target=feed, daemon=True)] if input else []):
+        thread.start()
+    limit = timeout if kill_after is None else min(timeout, kill_after)
+    running = killed = False
+    try:
+        proc.wait(limit)
+    except subprocess.TimeoutExpired:
+        if kill_after is not None and kill_after <= timeout:
+            proc.kill()
+            proc.wait()
+            killed = True
+        else:
+            running = True
+    for thread in readers:
+        thread.join(0.5 if running else max(0.5, limit - (time.monotonic() - start)))
+    with lock:
+        keep[0] = False
+        stdout, stderr = b''.join(out).decode(errors='replace'), b''.join(err).decode(errors='replace')
+    if running:
+        def reap():
+            try:
+                proc.wait(None if kill_after is None else max(0, kill_after - (time.monotonic() - start)))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        threading.Thread(target=reap, daemon=True).start()
+    new_cwd = cwd
+    if _CWD_MARK in stdout:
+        stdout, new_cwd = stdout.rsplit(_CWD_MARK, 1)
+    finished = not (running or killed)
+    return {'code': proc.returncode if finished else None, 'stdout': stdout, 'stderr': stderr, 'cwd': new_cwd,
+            'timed_out': not finished, 'running': running, 'killed': killed, 'pid': proc.pid,
+            'elapsed': round(time.monotonic() - start, 4)}
+
+
+def _stat_dict(st):
+    import stat as stat_mod
+    kind = ('dir' if stat_mod.S_ISDIR(st.st_mode) else 'file' if stat_mod.S_ISREG(st.st_mode)
+            else 'link' if stat_mod.S_ISLNK(st.st_mode) else 'other')
+    return {'type': kind, 'size': st.st_size, 'mode': st.st_mode & 0o7777, 'mtime': st.st_mtime,
+            'uid': st.st_uid, 'gid': st.st_gid}
+
+
+def op_stat(path):
+    return _stat_dict(os.lstat(os.path.expanduser(path)))
+
+
+def op_list(path='.'):
+    entries = []
+    with os.scandir(os.path.expanduser(path)) as it:
+        for entry in it:
+            try:
+                entries.append({'name': entry.name, **_stat_dict(entry.stat(follow_symlinks=False))})
+            except OSError:
+                entries.append({'name': entry.name, 'type': 'unknown'})
+    return sorted(entries, key=lambda e: e['name'])
+
+
+def op_read(path, offset=0, length=None):
+    length = MAX_READ if length is None else min(int(length), MAX_READ)
+    with open(os.path.expanduser(path), 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        data = f.read(length)
+    return {'data': data, 'size': size, 'eof': offset + len(data) >= size}
+
+
+def op_write(path, data, append=False, mode=None):
+    """Replace (atomically, via a temp file) or append to a file."""
+    path = os.path.expanduser(path)
+    if append:
+        with open(path, 'ab') as f:
+            f.write(data)
+    else:
+        tmp = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        if mode is None and os.path.exists(path):
+            mode = os.stat(path).st_mode & 0o7777
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    return {'written': len(data)}
+
+
+def op_metrics():
+    out = {'cpus': os.cpu_count()}
+    with open('/proc/loadavg') as f:
+        out['load'] = [float(v) for v in f.read().split()[:3]]
+    with open('/proc/uptime') as f:
+        out['uptime'] = float(f.read().split()[0])
+    mem = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('MemTotal', 'MemAvailable', 'SwapTotal', 'SwapFree'):
+                mem[key] = int(rest.split()[0]) * 1024
+    out['memory'] = mem
+    vfs = os.statvfs('/')
+    out['disk'] = {'total': vfs.f_blocks * vfs.f_frsize, 'free': vfs.f_bavail * vfs.f_frsize}
+    try:
+        with open('/sys/class/thermal/thermal_zone0/temp') as f:
+            out['temp_c'] = int(f.read()) / 1000.0
+    except (OSError, ValueError):
+        out['temp_c'] = None
+    return out
+
+
+def _gpio_base(root='/sys/class/gpio'):
+    try:
+        for name in sorted(os.listdir(root)):
+            if name.startswith('gpiochip'):
+                with open(f'{root}/{name}/label') as f:
+                    if f.read().startswith('pinctrl'):
+                        return int(name[8:])
+    except OSError:
+        pass
+    return 0
+
+
+def _gpio_dir(pin, direction=None):
+    number = _gpio_base() + int(pin)
+    path = f'/sys/class/gpio/gpio{number}'
+    if not os.path.exists(path):
+        with open('/sys/class/gpio/export', 'w') as f:
+            f.write(str(number))
+        for _ in range(50):
+            if os.access(path + '/value', os.R_OK):
+                break
+            time.sleep(0.01)
+    if direction:
+        with open(path + '/direction', 'w') as f:
+            f.write(direction)
+    return path
+
+
+def op_gpio_read(pin):
+    with open(_gpio_dir(pin) + '/value') as f:
+        return int(f.read().strip() or 0)
+
+
+def op_gpio_write(pin, value):
+    with open(_gpio_dir(pin, 'out') + '/value', 'w') as f:
+        f.write('1' if value else '0')
+    return int(bool(value))
+
+
+METHODS = {
+    'ping': op_ping, 'exec': op_exec, 'stat': op_stat, 'list': op_list, 'read': op_read, 'write': op_write,
+    'metrics': op_metrics, 'gpio_read': op_gpio_read, 'gpio_write': op_gpio_write,
+}
+
+
+# --- Server ---
+class Connection:
+    """One client: handshake, then requests dispatched to a thread pool; writes are serialised."""
+    def __init__(self, recv, send, token=None, workers=8):
+        self.recv = recv
+        self.send = send
+        self.token = token
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.codec = None
+        self._write_lock = threading.Lock()
+
+    def write(self, body):
+        with self._write_lock:
+            self.send(frame(body))
+
+    def _bodies(self):
+        reader = FrameReader()
+        while True:
+            data = self.recv(65536)
+            if not data:
+                return
+            yield from reader.feed(data)
+
+    def serve(self):
+        self.send(MAGIC)
+        bodies = self._bodies()
+        try:
+            hello = json.loads(next(bodies))
+        except (StopIteration, ValueError):
+            return
+        if self.token and not hmac.compare_digest(str(hello.get('token') or ''), self.token):
+            self.write(json.dumps({'error': 'unauthorized'}).encode())
+            return
+        offered = hello.get('codecs') or ['json']
+        name = next((c for c in offered if c in available_codecs()), 'json')
+        self.codec = make_codec(name)
+        self.write(json.dumps({'codec': name, 'protocol': PROTOCOL, 'methods': sorted(METHODS), 'pid': os.getpid()}).encode())
+        try:
+            for body in bodies:
+                self.pool.submit(self.handle, self.codec.decode(body))
+        finally:
+            self.pool.shutdown(wait=True)
+
+    def handle(self, request):
+        rid = request.get('i')
+        method = METHODS.get(request.get('m'))
+        if method is None:
+            response = {'i': rid, 'e': f"unknown method {request.get('m')}"}
+        else:
+            try:
+                response = {'i': rid, 'r': method(**(request.get('p') or {}))}
+            except Exception as e:
+                response = {'i': rid, 'e': f"{type(e).__name__}: {e}"}
+        try:
+            self.write(self.codec.encode(response))
+        except (OSError, ValueError):
+            pass
+
+
+def _stdio():
+    out = sys.stdout.buffer
+
+    def send(data):
+        out.write(data)
+        out.flush()
+
+    Connection(lambda n: os.read(0, n), send).serve()
+
+
+def _listen(address, token):
+    host, _, port = address.rpartition(':')
+    server = socket.create_server((host or '0.0.0.0', int(port)), reuse_port=False)
+    while True:
+        sock, _ = server.accept()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = Connection(sock.recv, sock.sendall, token=token)
+
+        def run(sock=sock, conn=conn):
+            try:
+                conn.serve()
+            except OSError:
+                pass
+            finally:
+                sock.close()
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='llamatrama resident device agent')
+    parser.add_argument('--stdio', action='store_true', help='serve one client on stdin/stdout')
+    parser.add_argument('--listen', help='HOST:PORT to accept clients on (e.g. the tailnet address)')
+    parser.add_argument('--token-file', help='shared secret required from TCP clients')
+    args = parser.parse_args(argv)
+    if args.listen:
+        if not args.token_file:
+            parser.error('--listen requires --token-file')
+        with open(os.path.expanduser(args.token_file)) as f:
+            _listen(args.listen, f.read().strip())
+    else:
+        _stdio()
+
+
+if __name__ == '__main__':
+    main()
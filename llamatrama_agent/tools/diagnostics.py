@@ -0,0 +1,296 @@
+"""
+Typed diagnostics: parsers for df/free/uptime/vcgencmd/ps output, and columnar fleet aggregation.
+
+The parsers turn the raw text `pi_diagnostics` collects into records with numbers in base
+units (bytes, percent, seconds, °C). Lines they do not recognise (echoed commands, shell
+prompts) are skipped, so output from an interactive shell parses as well as exec output.
+
+FleetFrame holds one column per metric across many devices and answers percentiles, top-N
+and threshold alerts over hundreds of devices in a few milliseconds. It uses NumPy when
+installed and falls back to plain Python otherwise.
+
+    frame = FleetFrame({'pi-1': parse_vitals(out1), 'pi-2': parse_vitals(out2)})
+    frame.summary(thresholds={'temp_c': 75})
+"""
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+_UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4, 'P': 1024 ** 5}
+_SIZE = re.compile(r'^(\d+(?:[.,]\d+)?)([KMGTP]?)(?:i?B?)?$', re.IGNORECASE)
+
+
+def parse_size(text):
+    """'3.7Gi', '29G', '512M', '0B', '1024' -> bytes (powers of 1024, as df -h and free -h use). None if unparsable."""
+    m = _SIZE.match(text.strip()) if text else None
+    if not m:
+        return None
+    return int(round(float(m.group(1).replace(',', '.')) * _UNITS[m.group(2).upper()]))
+
+
+def _percent(text):
+    try:
+        return float(text.rstrip('%').replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def parse_df(text):
+    """df -h / df -P -> [{filesystem, mount, size_bytes, used_bytes, available_bytes, use_percent}]."""
+    disks = []
+    for line in (text or '').splitlines():
+        fields = line.split()
+        if len(fields) < 6 or not fields[-1].startswith('/') or not fields[-2].endswith('%'):
+            continue
+        size, used, avail = (parse_size(f) for f in fields[-5:-2])
+        if size is None:
+            continue
+        disks.append({'filesystem': ' '.join(fields[:-5]), 'mount': fields[-1], 'size_bytes': size,
+                      'used_bytes': used, 'available_bytes': avail, 'use_percent': _percent(fields[-2])})
+    return disks
+
+
+def parse_free(text):
+    """free -h -> {'mem': {total, used, free, shared, buff_cache, available}, 'swap': {...}} in bytes, plus used percents."""
+    columns = ['total', 'used', 'free', 'shared', 'buff_cache', 'available']
+    result = {}
+    for line in (text or '').splitlines():
+        fields = line.split()
+        if fields and fields[0] == 'total':
+            columns = [f.replace('/', '_').lower() for f in fields]
+        elif fields and fields[0] in ('Mem:', 'Swap:'):
+            row = {}
+            for name, value in zip(columns, fields[1:]):
+                row[name] = parse_size(value)
+            result[fields[0][:-1].lower()] = row
+    mem = result.get('mem')
+    if mem and mem.get('total'):
+        in_use = mem['total'] - mem['available'] if mem.get('available') is not None else mem.get('used')
+        if in_use is not None:
+            result['mem_used_percent'] = round(100.0 * in_use / mem['total'], 2)
+    swap = result.get('swap')
+    if swap and swap.get('total'):
+        result['swap_used_percent'] = round(100.0 * (swap.get('used') or 0) / swap['total'], 2)
+    return result
+
+
+_UPTIME = re.compile(r'\bup\s+(.*?),\s+(?:(\d+)\s+users?,\s+)?load averages?:\s*(.*)$')
+
+
+def parse_uptime(text):
+    """uptime -> {uptime_seconds, users, load_1, load_5, load_15}; {} if not found."""
+    for line in (text or '').splitlines():
+        m = _UPTIME.search(line)
+        if not m:
+            continue
+        duration, users, loads = m.groups()
+        seconds = 0
+        days = re.search(r'(\d+)\s+days?', duration)
+        if days:
+            seconds += int(days.group(1)) * 86400
+        clock = re.search(r'(\d+):(\d+)', duration)
+        if clock:
+            seconds += int(clock.group(1)) * 3600 + int(clock.group(2)) * 60
+        minutes = re.search(r'(\d+)\s+min', duration)
+        if minutes:
+            seconds += int(minutes.group(1)) * 60
+        values = [float(v.replace(',', '.')) for v in re.findall(r'\d+[.,]\d+', loads)[:3]]
+        record = {'uptime_seconds': seconds, 'users': int(users) if users else None}
+        record.update(zip(('load_1', 'load_5', 'load_15'), values))
+        return record
+    return {}
+
+
+def parse_temp(text):
+    """vcgencmd measure_temp ("temp=48.3'C") or a thermal_zone reading (48312) -> {'temp_c': float}."""
+    m = re.search(r"temp=(-?\d+(?:\.\d+)?)", text or '')
+    if m:
+        return {'temp_c': float(m.group(1))}
+    m = re.search(r'^\s*(-?\d{4,6})\s*$', text or '', re.MULTILINE)
+    if m:
+        return {'temp_c': int(m.group(1)) / 1000.0}
+    return {}
+
+
+def parse_ps(text):
+    """ps aux -> [{user, pid, cpu_percent, mem_percent, rss_bytes, command}] (RSS is reported in KiB)."""
+    processes = []
+    for line in (text or '').splitlines():
+        fields = line.split(None, 10)
+        if len(fields) < 11 or not fields[1].isdigit():
+            continue
+        cpu, mem = _percent(fields[2]), _percent(fields[3])
+        if cpu is None or mem is None or not fields[5].isdigit():
+            continue
+        processes.append({'user': fields[0], 'pid': int(fields[1]), 'cpu_percent': cpu, 'mem_percent': mem,
+                          'rss_bytes': int(fields[5]) * 1024, 'command': fields[10].strip()})
+    return processes
+
+
+def parse_diagnostics(results):
+    """Typed view of pi_diagnostics() output (keys that have a parser; the raw dict is left untouched)."""
+    record = {}
+    if 'disk_usage' in results:
+        record['disks'] = parse_df(results['disk_usage'])
+    if 'memory_usage' in results:
+        record['memory'] = parse_free(results['memory_usage'])
+    if 'uptime' in results:
+        record.update(parse_uptime(results['uptime']))
+    if 'cpu_temp' in results:
+        record.update(parse_temp(results['cpu_temp']))
+    if 'list_processes' in results:
+        record['processes'] = parse_ps(results['list_processes'])
+    return record
+
+
+# --- Fleet-wide collection ---
+_SEPARATOR = '@@VITALS'
+VITALS_COMMAND = '; '.join(f"{cmd}; echo {_SEPARATOR}" for cmd in (
+    'df -h -x tmpfs -x devtmpfs', 'free -h', 'uptime', 'vcgencmd measure_temp 2>/dev/null || cat /sys/class/thermal/thermal_zone0/temp',
+    'ps aux --sort=-%cpu | head -11'))
+
+
+def parse_vitals(output):
+    """Parse the output of VITALS_COMMAND into one device record."""
+    parts = (output or '').split(_SEPARATOR)
+    parts += [''] * (5 - len(parts))
+    return parse_diagnostics({'disk_usage': parts[0], 'memory_usage': parts[1], 'uptime': parts[2],
+                              'cpu_temp': parts[3], 'list_processes': parts[4]})
+
+
+def collect_fleet(hosts, run, concurrency=32):
+    """run(host, command) -> output for every host in parallel. Returns {host: record}; failures become {'error': ...}."""
+    def one(host):
+        try:
+            return host, parse_vitals(run(host, VITALS_COMMAND))
+        except Exception as e:
+            return host, {'error': str(e) or type(e).__name__}
+    hosts = list(dict.fromkeys(hosts))
+    if not hosts:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(hosts)))) as pool:
+        return dict(pool.map(one, hosts))
+
+
+# --- Columnar aggregation ---
+def _root_disk_percent(record):
+    disks = record.get('disks') or []
+    root = next((d for d in disks if d['mount'] == '/'), None)
+    values = [d['use_percent'] for d in ([root] if root else disks) if d.get('use_percent') is not None]
+    return max(values) if values else None
+
+
+# Metric -> extractor from a device record
+METRICS = {
+    'temp_c': lambda r: r.get('temp_c'),
+    'load_1': lambda r: r.get('load_1'),
+    'load_5': lambda r: r.get('load_5'),
+    'load_15': lambda r: r.get('load_15'),
+    'mem_used_percent': lambda r: (r.get('memory') or {}).get('mem_used_percent'),
+    'swap_used_percent': lambda r: (r.get('memory') or {}).get('swap_used_percent'),
+    'disk_used_percent': _root_disk_percent,
+    'top_process_cpu': lambda r: max((p['cpu_percent'] for p in r.get('processes') or []), default=None),
+    'uptime_seconds': lambda r: r.get('uptime_seconds'),
+}
+
+DEFAULT_THRESHOLDS = {'temp_c': 75.0, 'mem_used_percent': 90.0, 'disk_used_percent': 90.0, 'load_5': 4.0}
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _percentile(sorted_values, q):
+    """Linear interpolation between closest ranks (NumPy's default method)."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+class FleetFrame:
+    """
+    One float column per metric (NaN where a device did not report it), one row per device.
+    use_numpy: None = use NumPy if importable; False forces the pure-Python path.
+    """
+    def __init__(self, records, metrics=None, use_numpy=None):
+        self.metrics = metrics or METRICS
+        self.np = _numpy() if use_numpy is not False else None
+        self.devices = [d for d, r in records.items() if isinstance(r, dict) and 'error' not in r]
+        self.errors = {d: r.get('error') for d, r in records.items() if not isinstance(r, dict) or 'error' in r}
+        self.columns = {}
+        for name, extract in self.metrics.items():
+            values = []
+            for device in self.devices:
+                try:
+                    value = extract(records[device])
+                except Exception:
+                    value = None
+                values.append(float(value) if value is not None else math.nan)
+            self.columns[name] = self.np.array(values, dtype=float) if self.np else values
+
+    def __len__(self):
+        return len(self.devices)
+
+    def _present(self, metric):
+        column = self.columns[metric]
+        if self.np:
+            return column[~self.np.isnan(column)]
+        return [v for v in column if not math.isnan(v)]
+
+    def stats(self, metric, percentiles=(50, 90, 99)):
+        """{count, min, mean, max, p50, p90, p99} over devices that reported the metric."""
+        values = self._present(metric)
+        if len(values) == 0:
+            return {'count': 0}
+        if self.np:
+            qs = self.np.percentile(values, percentiles)
+            out = {'count': int(values.size), 'min': float(values.min()), 'mean': float(values.mean()), 'max': float(values.max())}
+        else:
+            ordered = sorted(values)
+            qs = [_percentile(ordered, q) for q in percentiles]
+            out = {'count': len(values), 'min': ordered[0], 'mean': sum(values) / len(values), 'max': ordered[-1]}
+        out.update({f"p{q}": round(float(v), 3) for q, v in zip(percentiles, qs)})
+        out['mean'] = round(out['mean'], 3)
+        return out
+
+    def top(self, metric, n=10):
+        """The n devices with the highest values: [(device, value)], highest first."""
+        column = self.columns[metric]
+        if self.np:
+            order = self.np.argsort(-self.np.nan_to_num(column, nan=-self.np.inf), kind='stable')[:n]
+            return [(self.devices[i], float(column[i])) for i in order if not self.np.isnan(column[i])]
+        ranked = sorted((i for i, v in enumerate(column) if not math.isnan(v)), key=lambda i: -column[i])
+        return [(self.devices[i], column[i]) for i in ranked[:n]]
+
+    def alerts(self, thresholds=None):
+        """[{device, metric, value, threshold}] for every value at or above its threshold, worst first per metric."""
+        found = []
+        for metric, limit in (thresholds or DEFAULT_THRESHOLDS).items():
+            if metric not in self.columns:
+                continue
+            column = self.columns[metric]
+            if self.np:
+                hits = self.np.nonzero(column >= limit)[0]
+                hits = hits[self.np.argsort(-column[hits], kind='stable')]
+            else:
+                hits = sorted((i for i, v in enumerate(column) if v >= limit), key=lambda i: -column[i])
+            found.extend({'device': self.devices[i], 'metric': metric, 'value': float(column[i]), 'threshold': limit}
+                         for i in hits)
+        return found
+
+    def summary(self, thresholds=None, top_n=5):
+        return {
+            'devices': len(self.devices),
+            'unreachable': self.errors,
+            'metrics': {name: self.stats(name) for name in self.columns},
+            'hottest': self.top('temp_c', top_n),
+            'busiest': self.top('load_5', top_n),
+            'alerts': self.alerts(thresholds),
+            'backend': 'numpy' if self.np else 'python',
+        }
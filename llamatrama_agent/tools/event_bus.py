@@ -0,0 +1,161 @@
+"""
+In-process event bus with a Server-Sent Events encoder.
+
+Publishers (endpoints, background watchers, worker threads) call bus.publish(topic, data).
+Each subscriber gets its own bounded asyncio.Queue; slow subscribers lose their oldest
+events instead of blocking publishers. A short replay buffer lets a reconnecting
+EventSource resume from its Last-Event-ID.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class Subscription:
+    def __init__(self, bus, topics=None, maxsize=256):
+        self.bus = bus
+        self.topics = set(topics) if topics else None
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.loop = asyncio.get_running_loop()
+        self.dropped = 0
+
+    def wants(self, event):
+        return self.topics is None or event['topic'] in self.topics
+
+    def offer(self, event):
+        """Enqueue without blocking; on overflow drop the oldest queued event."""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        if timeout is None:
+            return await self.queue.get()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """
+    Topic-based publish/subscribe. publish() is safe to call from any thread;
+    delivery always happens on the subscriber's event loop.
+    """
+    def __init__(self, replay=500):
+        self._subs = set()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._history = deque(maxlen=replay)
+        self.forwarders = []
+
+    def subscribe(self, topics=None, last_event_id=None, maxsize=256):
+        sub = Subscription(self, topics, maxsize=maxsize)
+        with self._lock:
+            self._subs.add(sub)
+            backlog = [e for e in self._history if last_event_id is not None and e['id'] > last_event_id]
+        for event in backlog:
+            if sub.wants(event):
+                sub.offer(event)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subs)
+
+    def add_forwarder(self, fn):
+        """Register fn(topic, data), called for every locally originated event (e.g. to fan out to other workers)."""
+        self.forwarders.append(fn)
+
+    def publish(self, topic, data, forward=True):
+        with self._lock:
+            self._seq += 1
+            event = {'id': self._seq, 'topic': topic, 'ts': time.time(), 'data': data}
+            self._history.append(event)
+            subs = list(self._subs)
+        for sub in subs:
+            if not sub.wants(event):
+                continue
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is sub.loop:
+                sub.offer(event)
+            elif not sub.loop.is_closed():
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+        if forward:
+            for fn in self.forwarders:
+                try:
+                    fn(topic, data)
+                except Exception:
+                    pass
+        return event['id']
+
+
+def format_sse(event):
+    """Encode an event dict as an SSE message (id/event/data lines)."""
+    payload = json.dumps({'ts': event['ts'], 'data': event['data']}, ensure_ascii=False, default=str)
+    lines = [f"id: {event['id']}", f"event: {event['topic']}"]
+    lines.extend(f"data: {line}" for line in payload.splitlines() or [''])
+    return "\n".join(lines) + "\n\n"
+
+
+class FileTailer:
+    """
+    Tracks byte offsets of files in a directory and returns only newly appended text,
+    so watchers can publish deltas instead of re-reading whole files.
+    """
+    def __init__(self, directory, suffix='.md'):
+        self.directory = directory
+        self.suffix = suffix
+        self.offsets = {}
+
+    def prime(self):
+        """Record current sizes so only future appends are reported."""
+        for path in self._files():
+            try:
+                self.offsets[path] = os.path.getsize(path)
+            except OSError:
+                pass
+
+    def _files(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, f) for f in sorted(os.listdir(self.directory)) if f.endswith(self.suffix)]
+
+    def poll(self):
+        """Return [(filename, appended_text)] for files that grew (or are new) since the last poll."""
+        changes = []
+        for path in self._files():
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            offset = self.offsets.get(path, 0)
+            if size < offset:
+                # File was rewritten (session_N.md is written whole); start over
+                offset = 0
+            if size == offset:
+                continue
+            with open(path, 'rb') as fh:
+                fh.seek(offset)
+                text = fh.read(size - offset).decode('utf-8', errors='ignore')
+            self.offsets[path] = size
+            changes.append((os.path.basename(path), text))
+        return changes
+
+
+# Process-wide bus used by the web server
+bus = EventBus()
@@ -0,0 +1,243 @@
+"""
+Per-device facts cache with hash-based incremental collection.
+
+Facts are grouped in sections (os, kernel, cpu, memory, disks, interfaces, services,
+tailscale). A refresh sends one script that gathers every section on the device and hashes
+it there; sections whose hash matches the one we already hold come back as a single
+"same" line, and only changed sections cross the link (base64-encoded). Values that change
+on every read (disk usage) live in VOLATILE sections, which are always sent and kept out of
+the hashed ones. Parsed facts
+live in the device_facts table, so every worker and the CLI share them.
+
+    facts_cache.refresh('100.64.0.2', lambda script: session.send_command(script, timeout=15))
+    facts_cache.summary('100.64.0.2')   # compact text for LLM prompts
+"""
+import base64
+import re
+
+# Section -> shell snippet run on the device. Kept free of single quotes (the script
+# quotes them) and of volatile values (clock speed, free memory, lifetimes) so hashes
+# only change when the fact does.
+SECTIONS = {
+    'os': 'cat /etc/os-release',
+    'kernel': 'uname -nsrm',
+    'cpu': 'lscpu | grep -v -i mhz',
+    'memory': 'grep -e ^MemTotal: -e ^SwapTotal: /proc/meminfo',
+    'disks': 'df -P -m -x tmpfs -x devtmpfs -x overlay | tr -s " " | cut -d" " -f1,2,6',  # filesystem, size, mount
+    'interfaces': 'ip -br addr',
+    'services': 'systemctl list-units --type=service --state=running --no-pager --no-legend --plain',
+    'tailscale': 'tailscale ip && tailscale version',
+    'disk_usage': 'df -P -m -x tmpfs -x devtmpfs -x overlay',
+}
+# Sections that change on every refresh: always transferred, never compared by hash
+VOLATILE = {'disk_usage'}
+
+_HASH_LEN = 16
+_LINE = re.compile(r'@@FACT (\w+) ([0-9a-f]{%d}) (same|changed)\r?\n?([A-Za-z0-9+/=]*)' % _HASH_LEN)
+
+
+def build_script(known=None, sections=None):
+    """One-line POSIX sh script reporting each section's hash, with a body only where it differs from known."""
+    known = known or {}
+    parts = [
+        '_f() { out=$(sh -c "$3" 2>/dev/null); '
+        f'h=$(printf %s "$out" | sha256sum | cut -c1-{_HASH_LEN}); '
+        'if [ "$h" = "$2" ]; then printf "@@%s %s %s same\\n" FACT "$1" "$h"; '
+        'else printf "@@%s %s %s changed\\n" FACT "$1" "$h"; printf %s "$out" | base64 | tr -d "\\n"; echo; fi; }'
+    ]
+    for name in sections or SECTIONS:
+        cmd = SECTIONS[name]
+        if "'" in cmd:
+            raise ValueError(f"fact command for {name} must not contain single quotes")
+        digest = '-' if name in VOLATILE else known.get(name) or '-'
+        parts.append(f"_f {name} '{digest}' '{cmd}'")
+    return '; '.join(parts)
+
+
+def parse_output(text):
+    """{section: (hash, raw_text or None)} from the script's output; None means unchanged."""
+    found = {}
+    for m in _LINE.finditer(text or ''):
+        name, digest, state, body = m.groups()
+        if name not in SECTIONS:
+            continue
+        raw = None
+        if state == 'changed':
+            raw = base64.b64decode(body).decode('utf-8', errors='replace') if body else ''
+        found[name] = (digest, raw)
+    return found
+
+
+# --- Section parsers: raw command output -> structured facts ---
+def _key_values(text, sep):
+    out = {}
+    for line in text.splitlines():
+        if sep in line:
+            key, value = line.split(sep, 1)
+            out[key.strip()] = value.strip().strip('"')
+    return out
+
+
+def parse_kernel(text):
+    fields = text.split()
+    keys = ('system', 'hostname', 'release', 'machine')
+    return dict(zip(keys, fields)) if len(fields) >= 4 else {'raw': text.strip()}
+
+
+def parse_memory(text):
+    values = {}
+    for key, value in _key_values(text, ':').items():
+        number = value.split()[0] if value else ''
+        if number.isdigit():
+            values[key.lower().replace('total', '_total_kb')] = int(number)
+    return values
+
+
+def parse_disks(text):
+    disks = []
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) >= 3 and fields[1].isdigit():
+            disks.append({'filesystem': fields[0], 'size_mb': int(fields[1]), 'mount': fields[2]})
+    return disks
+
+
+def parse_disk_usage(text):
+    usage = {}
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) >= 6 and fields[2].isdigit():
+            usage[fields[5]] = {'used_mb': int(fields[2]), 'available_mb': int(fields[3]), 'use_percent': fields[4]}
+    return usage
+
+
+def parse_interfaces(text):
+    interfaces = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 2:
+            interfaces.append({'name': fields[0], 'state': fields[1], 'addresses': fields[2:]})
+    return interfaces
+
+
+def parse_services(text):
+    return sorted(line.split()[0] for line in text.splitlines() if line.strip() and line.split()[0].endswith('.service'))
+
+
+def parse_tailscale(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    ips = [line for line in lines if re.fullmatch(r'\d{1,3}(\.\d{1,3}){3}|[0-9a-fA-F:]*:[0-9a-fA-F:]*', line)]
+    version = next((line for line in lines if line not in ips), None)
+    return {'ips': ips, 'version': version, 'installed': bool(ips or version)}
+
+
+PARSERS = {
+    'os': lambda text: _key_values(text, '='),
+    'kernel': parse_kernel,
+    'cpu': lambda text: _key_values(text, ':'),
+    'memory': parse_memory,
+    'disks': parse_disks,
+    'interfaces': parse_interfaces,
+    'services': parse_services,
+    'tailscale': parse_tailscale,
+    'disk_usage': parse_disk_usage,
+}
+
+
+class FactsCache:
+    """
+    Facts per device, persisted in storage (tools.storage.Storage by default). Reads always go
+    to storage (one indexed query), so every worker and the CLI see the latest collection.
+    refresh(device, run) runs the collection script through run(script) -> output text.
+    """
+    def __init__(self, storage=None):
+        self._storage = storage
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            from tools.storage import get_storage
+            self._storage = get_storage()
+        return self._storage
+
+    def get(self, device):
+        """{section: facts} as last collected (empty when the device was never collected)."""
+        return {name: entry['data'] for name, entry in self.storage.get_facts(str(device)).items()}
+
+    def entries(self, device):
+        """Like get(), with hash, collected_at and checked_at per section."""
+        return self.storage.get_facts(str(device))
+
+    def refresh(self, device, run, sections=None, force=False):
+        """
+        Collect facts incrementally. Returns {'facts', 'changed', 'unchanged', 'volatile', 'bytes'};
+        VOLATILE sections are re-read every time and listed under 'volatile' only.
+        force=True ignores the known hashes and re-transfers every section.
+        """
+        device = str(device)
+        entries = self.storage.get_facts(device)
+        known = {} if force else {name: e['hash'] for name, e in entries.items()}
+        output = run(build_script(known, sections))
+        found = parse_output(str(output))
+        if not found:
+            raise RuntimeError(f"facts collection on {device} returned no sections")
+        changed, unchanged, volatile = {}, [], []
+        for name, (digest, raw) in found.items():
+            if raw is None:
+                if name in entries:
+                    unchanged.append(name)
+                continue
+            try:
+                data = PARSERS[name](raw or '')
+            except Exception:
+                data = {'raw': raw}
+            changed[name] = (digest, data)
+            if name in VOLATILE:
+                volatile.append(name)
+        self.storage.save_facts(device, changed, unchanged)
+        return {'facts': self.get(device), 'changed': sorted(set(changed) - VOLATILE), 'unchanged': sorted(unchanged),
+                'volatile': sorted(volatile), 'bytes': len(str(output))}
+
+    def summary(self, device, max_services=15):
+        """Compact one-paragraph description of a device for LLM prompts; '' when nothing is cached."""
+        facts = self.get(device)
+        if not facts:
+            return ''
+        parts = []
+        os_facts = facts.get('os') or {}
+        if os_facts.get('PRETTY_NAME'):
+            parts.append(f"OS {os_facts['PRETTY_NAME']}")
+        kernel = facts.get('kernel') or {}
+        if kernel.get('release'):
+            parts.append(f"kernel {kernel.get('system', 'Linux')} {kernel['release']} {kernel.get('machine', '')}".strip())
+        if kernel.get('hostname'):
+            parts.append(f"hostname {kernel['hostname']}")
+        cpu = facts.get('cpu') or {}
+        if cpu.get('Model name') or cpu.get('CPU(s)'):
+            parts.append(f"CPU {cpu.get('Model name', '?')} x{cpu.get('CPU(s)', '?')}")
+        memory = facts.get('memory') or {}
+        if memory.get('mem_total_kb'):
+            parts.append(f"RAM {memory['mem_total_kb'] / 1048576:.1f} GiB")
+        disks = facts.get('disks') or []
+        usage = facts.get('disk_usage') or {}
+        if disks:
+            parts.append('disks ' + ', '.join(
+                f"{d['mount']} {d['size_mb'] / 1024:.1f} GiB" + (f" ({usage[d['mount']]['use_percent']} used)" if d['mount'] in usage else '')
+                for d in disks[:4]))
+        interfaces = [i for i in facts.get('interfaces') or [] if i.get('addresses') and i['name'] != 'lo']
+        if interfaces:
+            parts.append('interfaces ' + ', '.join(f"{i['name']} {' '.join(i['addresses'][:1])}" for i in interfaces[:4]))
+        tailscale = facts.get('tailscale') or {}
+        if tailscale.get('installed'):
+            parts.append(f"tailscale {' '.join(tailscale.get('ips')[:1]) or 'no ip'} ({tailscale.get('version') or 'unknown version'})")
+        services = facts.get('services') or []
+        if services:
+            names = [s[:-len('.service')] for s in services[:max_services]]
+            more = f" (+{len(services) - max_services} more)" if len(services) > max_services else ''
+            parts.append('running services ' + ', '.join(names) + more)
+        return f"{device}: " + '; '.join(parts)
+
+
+# Process-wide cache (storage is opened on first use)
+facts_cache = FactsCache()
+
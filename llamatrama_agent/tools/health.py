@@ -0,0 +1,227 @@
+"""
+Per-host health tracking with a circuit breaker.
+
+Every SSH connect attempt reports its outcome here: TCP connect latency feeds an EWMA, and
+network failures (refused, unreachable, timeout) count toward opening the host's circuit.
+
+- closed: calls go through.
+- open: calls fail immediately with HostUnavailable instead of waiting out the
+  connect timeout. A background prober checks TCP 22 with a short timeout and moves the
+  circuit to half-open once the port answers. Reopening backs off exponentially.
+- half_open: one trial connection is let through; success closes the circuit, failure
+  re-opens it.
+
+Authentication errors never trip the circuit: the host is reachable, the credentials are wrong.
+"""
+import socket
+import threading
+import time
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class HostUnavailable(RuntimeError):
+    def __init__(self, host, retry_after, last_error=None, failures=0):
+        self.host = host
+        self.retry_after = max(1, int(retry_after))
+        self.last_error = last_error
+        detail = f": {last_error}" if last_error else ''
+        super().__init__(f"{host} is unreachable (circuit open after {failures} failures, "
+                         f"next check in {self.retry_after}s){detail}")
+
+
+class HostHealth:
+    def __init__(self, host):
+        self.host = host
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.successes = 0
+        self.ewma_latency = None
+        self.last_error = None
+        self.last_change = time.time()
+        self.next_probe = 0.0
+        self.trips = 0
+        self.trial_started = None
+
+    def as_dict(self):
+        return {
+            'host': self.host, 'state': self.state,
+            'consecutive_failures': self.consecutive_failures, 'failures': self.failures, 'successes': self.successes,
+            'ewma_latency_ms': round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            'last_error': self.last_error, 'since': self.last_change,
+            'next_probe_in': max(0.0, round(self.next_probe - time.time(), 1)) if self.state == OPEN else None,
+        }
+
+
+def tcp_probe(host, port=22, timeout=2.0):
+    """Return the TCP connect time to host:port in seconds; raises OSError when unreachable."""
+    start = time.perf_counter()
+    with socket.create_connection((host, port), timeout=timeout):
+        return time.perf_counter() - start
+
+
+class HealthTracker:
+    """
+    failure_threshold: consecutive network failures that open a circuit.
+    reset_timeout: seconds before the first probe of an open circuit; doubles per re-open up to max_reset.
+    alpha: EWMA weight of the newest latency sample.
+    probe: fn(host) -> latency, raising on failure; None disables background probing (an open
+    circuit then goes half-open by itself once reset_timeout has passed).
+    on_change: fn(host_dict) called on every state transition.
+    """
+    def __init__(self, failure_threshold=3, reset_timeout=15.0, max_reset=300.0, alpha=0.3,
+                 trial_timeout=30.0, probe=tcp_probe, probe_interval=1.0, on_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset = max_reset
+        self.alpha = alpha
+        self.trial_timeout = trial_timeout
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.on_change = on_change
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._prober = None
+
+    def _get(self, host):
+        h = self._hosts.get(host)
+        if h is None:
+            h = self._hosts[host] = HostHealth(host)
+        return h
+
+    def _set_state(self, h, state):
+        if h.state == state:
+            return None
+        h.state = state
+        h.last_change = time.time()
+        return h.as_dict()
+
+    def _notify(self, change):
+        if change and self.on_change:
+            try:
+                self.on_change(change)
+            except Exception:
+                pass
+
+    def _open(self, h, now):
+        h.next_probe = now + min(self.max_reset, self.reset_timeout * (2 ** h.trips))
+        h.trips += 1
+        h.trial_started = None
+        return self._set_state(h, OPEN)
+
+    # --- Gate ---
+    def check(self, host):
+        """Raise HostUnavailable if calls to host should fail fast right now (read-only)."""
+        host = str(host)
+        with self._lock:
+            h = self._hosts.get(host)
+            if h is None or h.state == CLOSED:
+                return
+            now = time.time()
+            if h.state == OPEN and (self.probe is not None or now < h.next_probe):
+                raise HostUnavailable(host, h.next_probe - now, h.last_error, h.consecutive_failures)
+            if h.state == HALF_OPEN and h.trial_started and now - h.trial_started < self.trial_timeout:
+                raise HostUnavailable(host, 1, h.last_error, h.consecutive_failures)
+
+    def before_connect(self, host):
+        """check(), and claim the single trial connection when the circuit is half-open."""
+        self.check(host)
+        host = str(host)
+        change = None
+        with self._lock:
+            h = self._hosts.get(host)
+            if h is not None and h.state != CLOSED:
+                change = self._set_state(h, HALF_OPEN)
+                h.trial_started = time.time()
+        self._notify(change)
+
+    # --- Outcomes ---
+    def record_success(self, host, latency=None):
+        host = str(host)
+        with self._lock:
+            h = self._get(host)
+            h.successes += 1
+            h.consecutive_failures = 0
+            h.trips = 0
+            h.trial_started = None
+            if latency is not None:
+                h.ewma_latency = latency if h.ewma_latency is None else self.alpha * latency + (1 - self.alpha) * h.ewma_latency
+            change = self._set_state(h, CLOSED)
+        self._notify(change)
+
+    def record_failure(self, host, error=None):
+        host = str(host)
+        now = time.time()
+        with self._lock:
+            h = self._get(host)
+            h.failures += 1
+            h.consecutive_failures += 1
+            h.last_error = str(error) if error is not None else None
+            change = None
+            if h.state == HALF_OPEN or (h.state == CLOSED and h.consecutive_failures >= self.failure_threshold):
+                change = self._open(h, now)
+        self._notify(change)
+        if change:
+            self._ensure_prober()
+
+    # --- Background probing ---
+    def probe_due(self):
+        """Probe every open circuit whose backoff has elapsed; returns the hosts moved to half-open."""
+        now = time.time()
+        with self._lock:
+            due = [h.host for h in self._hosts.values() if h.state == OPEN and now >= h.next_probe]
+        recovered = []
+        for host in due:
+            try:
+                latency = self.probe(host)
+            except Exception as e:
+                with self._lock:
+                    h = self._get(host)
+                    h.last_error = str(e)
+                    h.next_probe = time.time() + min(self.max_reset, self.reset_timeout * (2 ** h.trips))
+                    h.trips += 1
+                continue
+            with self._lock:
+                h = self._get(host)
+                if h.state != OPEN:
+                    continue
+                if latency is not None:
+                    h.ewma_latency = latency if h.ewma_latency is None else self.alpha * latency + (1 - self.alpha) * h.ewma_latency
+                h.trial_started = None
+                change = self._set_state(h, HALF_OPEN)
+            self._notify(change)
+            recovered.append(host)
+        return recovered
+
+    def _ensure_prober(self):
+        if self.probe is None:
+            return
+        with self._lock:
+            if self._prober and self._prober.is_alive():
+                return
+            self._prober = threading.Thread(target=self._probe_loop, name='health-prober', daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            self.probe_due()
+            with self._lock:
+                if not any(h.state == OPEN for h in self._hosts.values()):
+                    self._prober = None
+                    return
+
+    # --- Reporting ---
+    def state(self, host):
+        with self._lock:
+            h = self._hosts.get(str(host))
+            return h.state if h else CLOSED
+
+    def snapshot(self):
+        with self._lock:
+            return [h.as_dict() for h in sorted(self._hosts.values(), key=lambda h: h.host)]
+
+
+# Process-wide tracker shared by ssh_tool, ssh_pool and the web server
+health = HealthTracker()
@@ -0,0 +1,462 @@
+"""
+Multi-device log tail: follow journald (or a log file) on several devices and merge the
+streams into one feed ordered by timestamp.
+
+Each (device, command) pair gets one reader thread on a pooled SSH channel, shared by every
+feed that needs it. The reader runs `journalctl -f -o json` (or `tail -F`). It first prints
+the device clock, so timestamps can be shifted onto the server clock (`aligned`). That way
+one device's skewed clock does not reorder the merged feed.
+
+Filtering happens in one of two places. With where='device', units and priority become
+journalctl arguments and the regex becomes `--grep`, so filtered lines never cross the
+link. With where='server', the device sends everything and each feed filters on its own;
+readers are then shared more widely.
+
+A LogFeed merges its devices with LogMerger, a heap that releases a record once every
+source has moved past it, or after `hold` seconds at most. Readers stop reading their
+channel while every feed they serve is saturated. SSH flow control then pushes back on the
+device instead of memory growing on the server. A feed that falls behind others drops its
+oldest lines and reports how many. Each reader keeps a bounded replay buffer, so a late
+joiner starts with recent history.
+
+    feed = log_tail.open(['100.64.0.2', '100.64.0.3'], open_channel, LogFilter(units=['nginx'], priority='warning'))
+    batch = await feed.next_batch(timeout=15)   # {'records': [...], 'dropped': 0}
+    feed.close()
+"""
+import asyncio
+import heapq
+import json
+import os
+import re
+import shlex
+import threading
+import time
+from collections import deque
+
+PRIORITIES = ('emerg', 'alert', 'crit', 'err', 'warning', 'notice', 'info', 'debug')
+
+_UNIT = re.compile(r'^[\w@:.\-]+$')
+_CLOCK = re.compile(r'^@@CLOCK (\d+(?:\.\d+)?)')
+
+
+def parse_priority(value):
+    """0-7 or a syslog level name (err, warning, ...) -> int; None passes through."""
+    if value is None or value == '':
+        return None
+    text = str(value).strip().lower()
+    if text.isdigit() and int(text) < len(PRIORITIES):
+        return int(text)
+    aliases = {'error': 'err', 'warn': 'warning', 'critical': 'crit', 'emergency': 'emerg'}
+    text = aliases.get(text, text)
+    if text in PRIORITIES:
+        return PRIORITIES.index(text)
+    raise ValueError(f"unknown priority: {value}")
+
+
+class LogFilter:
+    """units (list), priority (at least this severe) and a regex on the message."""
+    def __init__(self, units=None, priority=None, pattern=None):
+        self.units = [u for u in (units or []) if u]
+        for unit in self.units:
+            if not _UNIT.match(unit):
+                raise ValueError(f"invalid unit name: {unit}")
+        self.priority = parse_priority(priority)
+        self.pattern = pattern or None
+        try:
+            self._regex = re.compile(pattern) if pattern else None
+        except re.error as e:
+            raise ValueError(f"invalid regex: {e}")
+
+    def journal_args(self):
+        """journalctl arguments applying this filter on the device."""
+        args = []
+        for unit in self.units:
+            args += ['-u', unit]
+        if self.priority is not None:
+            args += ['-p', str(self.priority)]
+        if self.pattern:
+            args += ['--grep', self.pattern]
+        return args
+
+    def match(self, record):
+        if self.units:
+            unit = record.get('unit') or ''
+            if unit not in self.units and unit.rsplit('.', 1)[0] not in self.units:
+                return False
+        if self.priority is not None and record.get('priority') is not None and record['priority'] > self.priority:
+            return False
+        return self._regex is None or bool(self._regex.search(record.get('message') or ''))
+
+    def key(self):
+        return (tuple(self.units), self.priority, self.pattern)
+
+
+def journal_command(log_filter=None, lines=50, cursor=None):
+    """Follow the journal as JSON; resumes after `cursor` when reconnecting."""
+    args = ['journalctl', '-f', '-o', 'json', '--no-pager']
+    args += ['--after-cursor', cursor] if cursor else ['-n', str(int(lines))]
+    if log_filter:
+        args += log_filter.journal_args()
+    return _with_clock(' '.join(shlex.quote(a) for a in args))
+
+
+def file_command(path, lines=50, pattern=None):
+    """Follow a log file (absolute path), optionally grepping on the device."""
+    if not path or not os.path.isabs(path) or '..' in path.split('/'):
+        raise ValueError("log file path must be absolute")
+    cmd = f"tail -n {int(lines)} -F {shlex.quote(path)}"
+    if pattern:
+        cmd += f" | grep --line-buffered -E {shlex.quote(pattern)}"
+    return _with_clock(cmd)
+
+
+def _with_clock(cmd):
+    # Device clock first, so the reader can measure skew against the server clock
+    return f"echo @@CLOCK $(date +%s.%N); {cmd}"
+
+
+def parse_journal(line):
+    """One `journalctl -o json` line -> record dict, or None for anything else."""
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(entry, dict):
+        return None
+    message = entry.get('MESSAGE')
+    if isinstance(message, list):  # journald sends non-UTF-8 messages as byte arrays
+        message = bytes(b & 0xFF for b in message if isinstance(b, int)).decode('utf-8', errors='replace')
+    try:
+        ts = int(entry.get('__REALTIME_TIMESTAMP')) / 1e6
+    except (TypeError, ValueError):
+        ts = time.time()
+    try:
+        priority = int(entry.get('PRIORITY'))
+    except (TypeError, ValueError):
+        priority = None
+    return {'ts': ts, 'unit': entry.get('_SYSTEMD_UNIT') or entry.get('SYSLOG_IDENTIFIER'), 'priority': priority,
+            'message': message if message is not None else '', 'host': entry.get('_HOSTNAME'),
+            'cursor': entry.get('__CURSOR')}
+
+
+class LogMerger:
+    """
+    Bounded heap merge over several sources by aligned timestamp. A record is released once every
+    source has been seen past it (the watermark), after `hold` seconds, or when more than
+    max_pending records are waiting. Records arriving behind what was already released are
+    still delivered, marked late.
+    """
+    def __init__(self, sources=(), hold=2.0, max_pending=5000):
+        self.hold = hold
+        self.max_pending = max_pending
+        self._heap = []
+        self._seq = 0
+        self._seen = {source: None for source in sources}
+        self.released = None
+        self.late = 0
+        self.forced = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, record):
+        source = record['source']
+        ts = record['aligned']
+        heapq.heappush(self._heap, (ts, self._seq, record))
+        self._seq += 1
+        seen = self._seen.get(source)
+        self._seen[source] = ts if seen is None else max(seen, ts)
+
+    def watermark(self):
+        seen = self._seen.values()
+        return None if not self._seen or None in seen else min(seen)
+
+    def pop_ready(self, now=None, limit=None):
+        now = time.time() if now is None else now
+        watermark = self.watermark()
+        out = []
+        while self._heap and (limit is None or len(out) < limit):
+            ts = self._heap[0][0]
+            overflow = len(self._heap) > self.max_pending
+            if not (overflow or ts <= now - self.hold or (watermark is not None and ts <= watermark)):
+                break
+            _, _, record = heapq.heappop(self._heap)
+            if overflow:
+                self.forced += 1
+            if self.released is not None and ts < self.released:
+                record = {**record, 'late': True}
+                self.late += 1
+            else:
+                self.released = ts
+            out.append(record)
+        return out
+
+
+class LogFeed:
+    """One viewer's merged, filtered view of several readers. ingest() runs on reader threads."""
+    def __init__(self, hub, readers, log_filter, hold=2.0, max_buffer=2000):
+        self.hub = hub
+        self.readers = readers
+        self.filter = log_filter or LogFilter()
+        self.max_buffer = max_buffer
+        self.merger = LogMerger([r.device for r in readers], hold=hold, max_pending=max_buffer)
+        self.dropped = 0
+        self.delivered = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._backlog = {}  # device -> (history, last seq) when this feed joined its reader
+
+    @property
+    def saturated(self):
+        return len(self.merger) >= self.max_buffer * 0.8
+
+    def attach(self, reader):
+        """Join reader; its history so far becomes this feed's replay and is never delivered live."""
+        with reader._lock:
+            reader.feeds.add(self)
+            self._backlog[reader.device] = (list(reader._history), reader.seq)
+
+    def ingest(self, record):
+        backlog = self._backlog.get(record['device'])
+        if backlog is not None and record['seq'] <= backlog[1]:
+            return  # already part of the replay
+        if not self.filter.match(record):
+            return
+        with self._lock:
+            self.merger.push(record)
+            if len(self.merger) > self.max_buffer:
+                # Too far behind: the oldest lines are dropped
+                self.dropped += len(self.merger.pop_ready(limit=len(self.merger) - self.max_buffer))
+
+    def replay(self, limit):
+        """Records the readers had buffered when this feed joined, filtered and merged."""
+        records = [r for history, _ in self._backlog.values() for r in history if self.filter.match(r)]
+        records.sort(key=lambda r: r['aligned'])
+        return records[-limit:] if limit else []
+
+    def take(self, now=None, limit=500):
+        with self._lock:
+            records = self.merger.pop_ready(now, limit=limit)
+            dropped, self.dropped = self.dropped, 0
+        if records:
+            self.delivered += len(records)
+            for reader in self.readers:
+                reader.wake()
+        return records, dropped
+
+    async def next_batch(self, timeout=15.0, poll=0.2, limit=500):
+        """Wait up to timeout for merged records: {'records': [...], 'dropped': n} (both may be empty)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            records, dropped = self.take(limit=limit)
+            if records or dropped or time.monotonic() >= deadline:
+                return {'records': records, 'dropped': dropped}
+            await asyncio.sleep(poll)
+
+    def status(self):
+        return {'devices': [r.device for r in self.readers], 'filter': list(self.filter.key()), 'pending': len(self.merger),
+                'delivered': self.delivered, 'late': self.merger.late, 'forced': self.merger.forced}
+
+    def close(self):
+        self.hub.close(self)
+
+
+class LogReader:
+    """Reader thread for one (device, command): parses lines, keeps a replay buffer and fans out to feeds."""
+    def __init__(self, device, source, make_command, open_channel, replay=500):
+        self.device = device
+        self.source = source
+        self.make_command = make_command
+        self.open_channel = open_channel
+        self.key = (device, make_command(None, False))
+        self.feeds = set()
+        self.offset = 0.0
+        self.lines = 0
+        self.seq = 0
+        self.error = None
+        self.connected = False
+        self._history = deque(maxlen=replay)
+        self._cursor = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._space = threading.Event()
+        self._channel = None
+        self._thread = threading.Thread(target=self._run, name=f'logs-{device}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._space.set()
+        channel = self._channel
+        if channel is not None:
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+    def wake(self):
+        self._space.set()
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def history(self):
+        with self._lock:
+            return list(self._history)
+
+    def handle_line(self, line, now=None):
+        """Parse one output line and deliver it; returns the record (None for markers and junk)."""
+        now = time.time() if now is None else now
+        clock = _CLOCK.match(line)
+        if clock:
+            self.offset = now - float(clock.group(1))
+            return None
+        if self.source == 'journal':
+            record = parse_journal(line)
+            if record is None:
+                return None
+            self._cursor = record.pop('cursor', None) or self._cursor
+        else:
+            if not line.strip():
+                return None
+            record = {'ts': now - self.offset, 'unit': os.path.basename(self.source), 'priority': None,
+                      'message': line, 'host': None}
+        record.update(device=self.device, source=self.device, aligned=record['ts'] + self.offset)
+        self.lines += 1
+        with self._lock:
+            self.seq += 1
+            record['seq'] = self.seq
+            self._history.append(record)
+            feeds = list(self.feeds)
+        for feed in feeds:
+            feed.ingest(record)
+        return record
+
+    def _wait_for_space(self):
+        # Every consumer is behind: stop reading so the SSH window fills and the device blocks
+        while not self._stop.is_set():
+            with self._lock:
+                feeds = list(self.feeds)
+            if not feeds or not all(f.saturated for f in feeds):
+                return
+            self._space.clear()
+            self._space.wait(0.5)
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                self._stream()
+                failures = 0
+            except Exception as e:
+                self.error = str(e) or type(e).__name__
+                failures += 1
+            self.connected = False
+            if self._stop.wait(min(60.0, 2.0 ** min(failures, 6))):
+                break
+
+    def _stream(self):
+        import socket
+        from tools.health import health
+        health.check(self.device)
+        # Reconnects resume after the last journal cursor (files: without re-sending the backlog)
+        channel = self._channel = self.open_channel(self.make_command(self._cursor, self.lines > 0))
+        buffer = ''
+        try:
+            channel.settimeout(30)
+            self.connected = True
+            self.error = None
+            while not self._stop.is_set():
+                self._wait_for_space()
+                try:
+                    data = channel.recv(16384)
+                except socket.timeout:
+                    continue  # a quiet log is not a dead channel
+                if not data:
+                    raise ConnectionError('log channel closed')
+                *lines, buffer = (buffer + data.decode(errors='replace')).split('\n')
+                for line in lines:
+                    self.handle_line(line.rstrip('\r'))
+        finally:
+            self._channel = None
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+    def status(self):
+        return {'device': self.device, 'source': self.source, 'connected': self.connected, 'alive': self.alive,
+                'feeds': len(self.feeds), 'lines': self.lines, 'clock_offset': round(self.offset, 3), 'error': self.error}
+
+
+class LogTailHub:
+    """Shares readers between feeds; a reader stops when its last feed closes."""
+    def __init__(self, replay=500, start_readers=True):
+        self.replay = replay
+        self.start_readers = start_readers
+        self._readers = {}
+        self._lock = threading.Lock()
+
+    def open(self, devices, open_channel, log_filter=None, source='journal', where='device', lines=50,
+             hold=2.0, max_buffer=2000):
+        """
+        Start (or join) readers for each device and return a LogFeed over them.
+        open_channel(device, command) -> channel. source is 'journal' or an absolute file path.
+        where='device' pushes the filter into the command; 'server' filters here only.
+        """
+        log_filter = log_filter or LogFilter()
+        if where not in ('device', 'server'):
+            raise ValueError("where must be 'device' or 'server'")
+        device_filter = log_filter if where == 'device' else None
+        if source == 'journal':
+            def make_command(cursor, resume):
+                return journal_command(device_filter, lines=lines, cursor=cursor)
+        else:
+            file_command(source)  # validates the path
+            pattern = device_filter.pattern if device_filter else None
+
+            def make_command(cursor, resume):
+                return file_command(source, lines=0 if resume else lines, pattern=pattern)
+        readers = []
+        with self._lock:
+            for device in dict.fromkeys(str(d) for d in devices):
+                key = (device, make_command(None, False))
+                reader = self._readers.get(key)
+                if reader is None or (self.start_readers and not reader.alive):
+                    reader = self._readers[key] = LogReader(device, source, make_command,
+                                                            lambda cmd, device=device: open_channel(device, cmd),
+                                                            replay=self.replay)
+                    if self.start_readers:
+                        reader.start()
+                readers.append(reader)
+        feed = LogFeed(self, readers, log_filter, hold=hold, max_buffer=max_buffer)
+        for reader in readers:
+            feed.attach(reader)
+        return feed
+
+    def close(self, feed):
+        if feed.closed:
+            return
+        feed.closed = True
+        with self._lock:
+            for reader in feed.readers:
+                with reader._lock:
+                    reader.feeds.discard(feed)
+                    idle = not reader.feeds
+                if idle:
+                    reader.stop()
+                    if self._readers.get(reader.key) is reader:
+                        del self._readers[reader.key]
+                else:
+                    reader.wake()
+
+    def status(self):
+        with self._lock:
+            return [r.status() for r in self._readers.values()]
+
+
+# Process-wide hub used by the web server
+log_tail = LogTailHub()
@@ -0,0 +1,225 @@
+"""
+Minimal Prometheus-style metrics (counters, gauges, histograms) with text exposition.
+
+No client library is required: metrics live in a process-wide registry and
+render() produces the text format served at /metrics. Each worker process exposes
+its own series.
+
+    from tools.metrics import histogram
+    SSH_CONNECT = histogram('ssh_connect_seconds', 'SSH connection phases', ['host', 'stage'])
+    SSH_CONNECT.labels(host='100.64.0.2', stage='tcp').observe(0.034)
+"""
+import contextlib
+import math
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _fmt(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def _label_str(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._children.items())
+        for key, child in items:
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = float(value)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self._default().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{self._label_str(key)} {_fmt(child.value)}"]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1.0):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def _new_child(self):
+        return _Histogram(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _render_child(self, key, child):
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f"{self.name}_bucket{self._label_str(key, ('le', _fmt(bound)))} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_str(key)} {_fmt(total)}")
+        lines.append(f"{self.name}_count{self._label_str(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"metric {metric.name} already registered as {existing.kind}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# --- Shared instruments used across the agent, SSH tools and web server ---
+HTTP_LATENCY = histogram('http_request_duration_seconds', 'HTTP request latency by route', ['method', 'route', 'status'])
+HTTP_IN_FLIGHT = gauge('http_requests_in_flight', 'HTTP requests currently being served')
+SSH_CONNECT = histogram('ssh_connect_seconds', 'SSH connection phases (tcp, auth, shell) per host', ['host', 'stage'])
+SSH_CONNECT_FAILURES = counter('ssh_connect_failures_total', 'Failed SSH connection attempts per host', ['host'])
+SSH_COMMAND = histogram('ssh_command_duration_seconds', 'Remote command duration per host', ['host'])
+SSH_COMMAND_BYTES = counter('ssh_command_output_bytes_total', 'Bytes of command output received per host', ['host'])
+LLM_TTFT = histogram('llm_time_to_first_token_seconds', 'Time until the first streamed text chunk', ['model', 'operation'])
+LLM_LATENCY = histogram('llm_request_duration_seconds', 'Total LLM streaming latency', ['model', 'operation'])
+LLM_TOKENS_PER_SEC = histogram('llm_tokens_per_second', 'Streamed text chunks per second (approximate tokens/s)', ['model', 'operation'],
+                               buckets=(1, 5, 10, 20, 40, 80, 160, 320))
+LLM_ERRORS = counter('llm_errors_total', 'LLM calls that raised', ['model', 'operation'])
+TOOL_DURATION = histogram('plugin_tool_duration_seconds', 'Plugin tool run time', ['tool', 'mode'])
+CACHE_REQUESTS = counter('cache_requests_total', 'Cache lookups by cache and result (hit/miss)', ['cache', 'result'])
@@ -0,0 +1,135 @@
+"""
+Concurrent SSH reachability prober and rolling latency table.
+
+probe_all() checks every device at once on the event loop: a TCP connect to port 22, then
+reading the SSH identification banner ("SSH-2.0-OpenSSH_9.2p1 ..."), optionally followed by a
+real login through the shared SSH pool. A round over 100 devices takes about one timeout.
+
+LatencyTable keeps the last `window` samples per host and ranks hosts live-and-fast first,
+for the device picker and for anything that has to choose where to run.
+"""
+import asyncio
+import statistics
+import time
+from collections import deque
+
+
+async def probe_host(host, port=22, timeout=2.0):
+    """TCP connect + banner read. Returns a result dict; never raises."""
+    result = {'host': host, 'ts': time.time(), 'reachable': False, 'tcp_ms': None, 'banner_ms': None, 'banner': None, 'error': None}
+    start = time.perf_counter()
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        connected = time.perf_counter()
+        result['tcp_ms'] = round((connected - start) * 1000, 2)
+        # The server speaks first; skip any pre-banner lines (RFC 4253 4.2)
+        deadline = connected + timeout
+        while True:
+            line = await asyncio.wait_for(reader.readline(), max(0.01, deadline - time.perf_counter()))
+            if not line:
+                raise ConnectionError('connection closed before SSH banner')
+            if line.startswith(b'SSH-'):
+                break
+        result['banner_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        result['banner'] = line.decode('ascii', errors='replace').strip()[:255]
+        result['reachable'] = True
+    except asyncio.TimeoutError:
+        result['error'] = f'timeout after {timeout}s'
+    except (OSError, ConnectionError) as e:
+        result['error'] = str(e) or type(e).__name__
+    finally:
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+    return result
+
+
+async def _auth_check(result, login, timeout):
+    """Attempt a real login via the shared SSH pool (reuses the transport for later commands)."""
+    from tools.ssh_pool import ssh_pool
+    user, password = login
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(asyncio.to_thread(ssh_pool.get_client, result['host'], user, password), timeout)
+        result['auth_ok'] = True
+        result['auth_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    except Exception as e:
+        result['auth_ok'] = False
+        result['auth_error'] = str(e) or type(e).__name__
+
+
+async def probe_all(hosts, port=22, timeout=2.0, concurrency=128, logins=None, auth_timeout=10.0):
+    """
+    Probe hosts concurrently (at most `concurrency` sockets at once).
+    logins: optional {host: (user, password)}; reachable hosts in it also get an auth check.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(host):
+        async with sem:
+            result = await probe_host(host, port=port, timeout=timeout)
+        if logins and result['reachable'] and host in logins:
+            await _auth_check(result, logins[host], auth_timeout)
+        return result
+
+    return await asyncio.gather(*(one(h) for h in dict.fromkeys(hosts)))
+
+
+class LatencyTable:
+    """Rolling per-host reachability and latency (banner time) over the last `window` probes."""
+    def __init__(self, window=20):
+        self.window = window
+        self._samples = {}
+        self._last = {}
+
+    def update(self, results):
+        for r in results:
+            samples = self._samples.setdefault(r['host'], deque(maxlen=self.window))
+            samples.append((r['ts'], r['reachable'], r.get('banner_ms')))
+            self._last[r['host']] = r
+
+    def row(self, host):
+        samples = self._samples.get(host)
+        if not samples:
+            return None
+        last = self._last[host]
+        latencies = [ms for _, ok, ms in samples if ok and ms is not None]
+        row = {
+            'host': host,
+            'reachable': last['reachable'],
+            'last_ms': last.get('banner_ms'),
+            'p50_ms': round(statistics.median(latencies), 2) if latencies else None,
+            'max_ms': max(latencies) if latencies else None,
+            'success_rate': round(sum(1 for _, ok, _ in samples if ok) / len(samples), 3),
+            'samples': len(samples),
+            'banner': last.get('banner'),
+            'error': last.get('error'),
+            'checked_at': last['ts'],
+        }
+        if 'auth_ok' in last:
+            row['auth_ok'] = last['auth_ok']
+        return row
+
+    def rows(self):
+        """All hosts, reachable first, then by median latency."""
+        rows = [self.row(h) for h in self._samples]
+        return sorted(rows, key=lambda r: (not r['reachable'], r['p50_ms'] if r['p50_ms'] is not None else float('inf'), r['host']))
+
+    def rank(self, hosts):
+        """Order candidate hosts for scheduling: live and fast first, never-probed next, down last."""
+        def key(host):
+            row = self.row(host)
+            if row is None:
+                return (1, float('inf'))
+            if not row['reachable']:
+                return (2, float('inf'))
+            return (0, row['p50_ms'] if row['p50_ms'] is not None else float('inf'))
+        return sorted(dict.fromkeys(hosts), key=key)
+
+
+# Process-wide table filled by the web server's background prober
+latency_table = LatencyTable()
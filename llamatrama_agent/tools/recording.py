@@ -0,0 +1,426 @@
+"""
+Seekable terminal session recordings (what operators ran and saw over /ws/ssh-exec).
+
+Each recording is three files under outputs/recordings/:
+
+- <id>.rec: a magic header, then zlib-compressed blocks, each prefixed with its compressed length.
+  A block holds frames (kind, milliseconds since the start, bytes): 'o' output, 'i' input,
+  'm' marker (JSON: gaps, exit). A block that opens with a 'k' keyframe frame carries the last
+  `keyframe_bytes` of output before it, enough to redraw the terminal without what came earlier;
+  one is written every `keyframe_seconds` or `keyframe_bytes` of output, whichever comes first.
+- <id>.idx: fixed-width (first ms, last ms, byte offset, keyframe flag) entries, one per block,
+  appended after the block itself. Readers ignore anything past the last entry, so a crash loses
+  at most the block being written.
+- <id>.json: metadata (user, device, command, start/end, sizes).
+
+Seeking to t is a binary search over the index, then decoding from the nearest keyframe block
+at or before t (a bounded amount of output, never the whole recording). The live stream only
+appends (monotonic time, kind, bytes) to a list; a single writer thread per store encodes,
+compresses and writes blocks every `block_seconds` or `block_bytes`. If the writer falls more
+than `max_pending` bytes behind, frames are dropped and a gap marker recorded instead of
+stalling the stream. Retention removes the oldest finished recordings beyond `max_bytes` or
+`max_age_days`.
+
+    store = get_recordings()
+    rec = store.open(user='alice', device='100.64.0.2', command='htop')
+    rec.output(chunk)
+    rec.close()
+    store.frames(rec.id, start_ms=90_000)   # keyframe at 90s, then the frames after it
+"""
+import bisect
+import json
+import logging
+import os
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'LTR1'
+_FRAME = struct.Struct('<cII')   # kind, ms since start, length
+_BLOCK = struct.Struct('<I')     # compressed length
+_IDX = struct.Struct('<IIQB')    # first ms, last ms, offset of the block in .rec, starts with a keyframe
+_ID = re.compile(r'^[0-9]{8}T[0-9]{12}-[0-9a-f]{6}$')
+KINDS = {b'o': 'o', b'i': 'i', b'm': 'm', b'k': 'k'}
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """Whether the process that opened a recording (host:pid) is still running on this host."""
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def encode_frames(frames):
+    return b''.join(_FRAME.pack(kind, ms, len(data)) + data for ms, kind, data in frames)
+
+
+def decode_frames(raw):
+    """[(ms, kind, bytes)] from a decompressed block."""
+    frames, pos = [], 0
+    while pos + _FRAME.size <= len(raw):
+        kind, ms, length = _FRAME.unpack_from(raw, pos)
+        pos += _FRAME.size
+        frames.append((ms, kind, raw[pos:pos + length]))
+        pos += length
+    return frames
+
+
+class Recording:
+    """One session being recorded; output()/input() are cheap appends safe to call from the event loop."""
+    def __init__(self, store, rec_id, meta):
+        self.store = store
+        self.id = rec_id
+        self.meta = meta
+        self._start = store.clock()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_bytes = 0
+        self._dropped = 0
+        self._block_started = None
+        self._tail = b''
+        self._since_key = None  # (ms of the last keyframe, output bytes since it)
+        self._offset = len(MAGIC)
+        self.closed = False
+        self._finished = False
+
+    def _append(self, kind, data):
+        if self.closed or not data:
+            return
+        if isinstance(data, str):
+            data = data.encode('utf-8', errors='replace')
+        ms = int((self.store.clock() - self._start) * 1000)
+        with self._lock:
+            if self._pending_bytes + len(data) > self.store.max_pending:
+                self._dropped += len(data)
+                return
+            if self._dropped:
+                self._pending.append((ms, b'm', json.dumps({'gap_bytes': self._dropped}).encode()))
+                self._dropped = 0
+            self._pending.append((ms, kind, data))
+            self._pending_bytes += len(data)
+            if self._block_started is None:
+                self._block_started = self.store.clock()
+        if self._pending_bytes >= self.store.block_bytes:
+            self.store.wake()
+
+    def output(self, data):
+        self._append(b'o', data)
+
+    def input(self, data):
+        self._append(b'i', data)
+
+    def marker(self, **fields):
+        self._append(b'm', json.dumps(fields, default=str))
+
+    def close(self, **fields):
+        """Stop recording; the writer thread flushes what is left and finalizes the metadata."""
+        if fields:
+            self.marker(**fields)
+        self.closed = True
+        self.store.wake()
+
+    # --- Writer side (store thread) ---
+    def _due(self, now):
+        with self._lock:
+            if not self._pending:
+                return self.closed and not self._finished
+            return (self.closed or self._pending_bytes >= self.store.block_bytes
+                    or now - self._block_started >= self.store.block_seconds)
+
+    def _flush(self):
+        """Called only with the store's flush lock held, so blocks and the index are appended in order."""
+        if self._finished:
+            return
+        with self._lock:
+            frames, self._pending = self._pending, []
+            self._pending_bytes = 0
+            self._block_started = None
+        if frames:
+            first = frames[0][0]
+            key = (self._since_key is None or first - self._since_key[0] >= self.store.keyframe_seconds * 1000
+                   or self._since_key[1] >= self.store.keyframe_bytes)
+            if key:
+                frames.insert(0, (first, b'k', self._tail))
+                self._since_key = (first, 0)
+            block = zlib.compress(encode_frames(frames), 6)
+            output = b''.join(data for _, kind, data in frames if kind == b'o')
+            self._tail = (self._tail + output)[-self.store.keyframe_bytes:]
+            self._since_key = (self._since_key[0], self._since_key[1] + len(output))
+            rec_path, idx_path = self.store.paths(self.id)[:2]
+            with open(rec_path, 'ab') as fh:
+                fh.write(_BLOCK.pack(len(block)) + block)
+            with open(idx_path, 'ab') as fh:
+                fh.write(_IDX.pack(first, frames[-1][0], self._offset, int(key)))
+            self._offset += _BLOCK.size + len(block)
+            self.meta['duration_ms'] = frames[-1][0]
+            self.meta['frames'] = self.meta.get('frames', 0) + len(frames) - int(key)
+            self.meta['raw_bytes'] = self.meta.get('raw_bytes', 0) + sum(len(f[2]) for f in frames[int(key):])
+            self.meta['stored_bytes'] = self._offset
+        if self.closed and not self._pending:
+            self.meta['ended'] = time.time()
+            self.store.write_meta(self.id, self.meta)
+            self._finished = True
+
+
+class RecordingStore:
+    """
+    directory: where recordings live. max_bytes / max_age_days: retention for finished ones.
+    block_seconds / block_bytes: how often the writer cuts a block.
+    keyframe_seconds / keyframe_bytes: how often a block starts with a keyframe, and its size.
+    """
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024, max_age_days=30, block_seconds=2.0,
+                 block_bytes=64 * 1024, keyframe_seconds=30.0, keyframe_bytes=16 * 1024, max_pending=8 * 1024 * 1024,
+                 clock=time.monotonic):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.block_seconds = block_seconds
+        self.block_bytes = block_bytes
+        self.keyframe_seconds = keyframe_seconds
+        self.keyframe_bytes = keyframe_bytes
+        self.max_pending = max_pending
+        self.clock = clock
+        self.blocks_decoded = 0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()  # one flusher at a time: the writer thread, shutdown or a caller
+        self._wake = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def paths(self, rec_id):
+        if not _ID.match(rec_id or ''):
+            raise ValueError('Invalid recording id')
+        base = os.path.join(self.directory, rec_id)
+        return base + '.rec', base + '.idx', base + '.json'
+
+    def write_meta(self, rec_id, meta):
+        path = self.paths(rec_id)[2]
+        tmp = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, path)
+
+    def _read_meta(self, rec_id):
+        with open(self.paths(rec_id)[2], encoding='utf-8') as fh:
+            return json.load(fh)
+
+    def _recover(self):
+        """Recordings left open by a crashed process are closed at their last complete block."""
+        for rec_id in self._ids():
+            try:
+                meta = self._read_meta(rec_id)
+            except (OSError, ValueError):
+                continue
+            if meta.get('ended') or _owner_alive(meta.get('owner')):
+                continue
+            index = self._index(rec_id)
+            meta.update(ended=os.path.getmtime(self.paths(rec_id)[2]), incomplete=True,
+                        duration_ms=index[-1][1] if index else 0)
+            self.write_meta(rec_id, meta)
+
+    # --- Recording ---
+    def open(self, **fields):
+        """Start a recording; fields (user, device, command...) go into its metadata."""
+        now = time.time()
+        rec_id = time.strftime('%Y%m%dT%H%M%S', time.gmtime(now)) + f"{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:6]}"
+        meta = {'id': rec_id, 'started': time.time(), 'ended': None, 'owner': OWNER, **fields}
+        rec_path = self.paths(rec_id)[0]
+        with open(rec_path, 'wb') as fh:
+            fh.write(MAGIC)
+        open(self.paths(rec_id)[1], 'wb').close()
+        self.write_meta(rec_id, meta)
+        rec = Recording(self, rec_id, meta)
+        with self._lock:
+            self._active[rec_id] = rec
+        self._ensure_writer()
+        return rec
+
+    def wake(self):
+        self._wake.set()
+
+    def _ensure_writer(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._writer, name='recording-writer', daemon=True)
+            self._thread.start()
+
+    def _writer(self):
+        while True:
+            self._wake.wait(min(0.5, self.block_seconds))
+            self._wake.clear()
+            try:
+                self.flush(only_due=True)
+            except Exception:
+                logger.exception("Recording writer failed")
+
+    def flush(self, only_due=False):
+        """Write pending frames (all of them, or only blocks that are due) and retire closed recordings."""
+        with self._flush_lock:
+            now = self.clock()
+            with self._lock:
+                active = list(self._active.values())
+            finished = False
+            for rec in active:
+                if only_due and not rec._due(now):
+                    continue
+                rec._flush()
+                if rec._finished:
+                    finished = True
+                    with self._lock:
+                        self._active.pop(rec.id, None)
+            if finished:
+                self.enforce_retention()
+
+    # --- Retention ---
+    def _ids(self):
+        return sorted(f[:-5] for f in os.listdir(self.directory) if f.endswith('.json') and _ID.match(f[:-5]))
+
+    def _size(self, rec_id):
+        return sum(os.path.getsize(p) for p in self.paths(rec_id) if os.path.exists(p))
+
+    def enforce_retention(self):
+        """Delete finished recordings older than max_age, then the oldest until under max_bytes. Returns ids removed."""
+        with self._flush_lock:
+            return self._enforce_retention()
+
+    def _enforce_retention(self):
+        with self._lock:
+            active = set(self._active)
+        ids = self._ids()
+        sizes = {r: self._size(r) for r in ids}
+        total = sum(sizes.values())
+        cutoff = time.time() - self.max_age
+        removed = []
+        for rec_id in ids:  # ids sort oldest first
+            if rec_id in active:
+                continue
+            try:
+                ended = self._read_meta(rec_id).get('ended')
+            except (OSError, ValueError):
+                ended = 0
+            if ended is None:  # still being recorded by another process
+                continue
+            if ended < cutoff or total > self.max_bytes:
+                for path in self.paths(rec_id):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total -= sizes[rec_id]
+                removed.append(rec_id)
+        return removed
+
+    # --- Playback ---
+    def list(self, limit=100, user=None, device=None):
+        """Newest-first metadata, optionally for one user or device."""
+        out = []
+        for rec_id in reversed(self._ids()):
+            try:
+                meta = self._read_meta(rec_id)
+            except (OSError, ValueError):
+                continue
+            if (user and meta.get('user') != user) or (device and meta.get('device') != device):
+                continue
+            meta['active'] = rec_id in self._active
+            out.append(meta)
+            if len(out) >= limit:
+                break
+        return out
+
+    def get(self, rec_id):
+        try:
+            meta = self._read_meta(rec_id)
+        except OSError:
+            return None
+        meta['active'] = rec_id in self._active
+        meta['blocks'] = len(self._index(rec_id))
+        return meta
+
+    def _index(self, rec_id):
+        with open(self.paths(rec_id)[1], 'rb') as fh:
+            data = fh.read()
+        usable = len(data) - len(data) % _IDX.size
+        return [_IDX.unpack_from(data, i) for i in range(0, usable, _IDX.size)]
+
+    def frames(self, rec_id, start_ms=0, end_ms=None, limit=None):
+        """
+        Yield (ms, kind, bytes) from start_ms on, oldest first, with a leading 'k' frame holding
+        the recent output needed to draw the terminal as it was at start_ms. Reading starts at
+        the last keyframe block at or before start_ms.
+        """
+        index = self._index(rec_id)
+        if not index:
+            return
+        # The last block that starts at or before start_ms (blocks are cut in time order), then back to a keyframe
+        pos = max(0, bisect.bisect_right([entry[0] for entry in index], start_ms) - 1)
+        while pos > 0 and not index[pos][3]:
+            pos -= 1
+        emitted = 0
+        context = None
+        with open(self.paths(rec_id)[0], 'rb') as fh:
+            for first_ms, last_ms, offset, _ in index[pos:]:
+                if end_ms is not None and first_ms >= end_ms:
+                    return
+                fh.seek(offset)
+                (length,) = _BLOCK.unpack(fh.read(_BLOCK.size))
+                self.blocks_decoded += 1
+                for ms, kind, data in decode_frames(zlib.decompress(fh.read(length))):
+                    if kind == b'k':
+                        if context is None or ms <= start_ms:
+                            context = data
+                        continue
+                    context = b'' if context is None else context
+                    if ms < start_ms:
+                        if kind == b'o':
+                            context = (context + data)[-self.keyframe_bytes:]
+                        continue
+                    if end_ms is not None and ms >= end_ms:
+                        return
+                    if emitted == 0:
+                        yield start_ms, 'k', context
+                    yield ms, KINDS[kind], data
+                    emitted += 1
+                    if limit and emitted >= limit:
+                        return
+        if emitted == 0 and context is not None:
+            yield start_ms, 'k', context
+
+    def asciicast(self, rec_id, start_ms=0, end_ms=None):
+        """asciinema v2 lines (header + [seconds, 'o'|'i', text] events) from start_ms, for standard players."""
+        meta = self._read_meta(rec_id)
+        yield json.dumps({'version': 2, 'width': meta.get('width', 120), 'height': meta.get('height', 40),
+                          'timestamp': int(meta['started'] + start_ms / 1000),
+                          'title': f"{meta.get('user', '')}@{meta.get('device', '')}: {meta.get('command', '')}"}) + '\n'
+        for ms, kind, data in self.frames(rec_id, start_ms, end_ms):
+            if kind in ('o', 'i', 'k') and data:
+                yield json.dumps([round((ms - start_ms) / 1000, 3), 'i' if kind == 'i' else 'o',
+                                  data.decode('utf-8', errors='replace')]) + '\n'
+
+
+_default_store = None
+
+
+def get_recordings(directory=None):
+    """Return the process-wide store under outputs/recordings (created on first use)."""
+    global _default_store
+    if _default_store is None:
+        directory = directory or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'outputs', 'recordings')
+        _default_store = RecordingStore(directory,
+                                        max_bytes=int(float(os.getenv('RECORDINGS_MAX_MB', '500')) * 1024 * 1024),
+                                        max_age_days=float(os.getenv('RECORDINGS_MAX_DAYS', '30')))
+    return _default_store
@@ -0,0 +1,177 @@
+"""
+Per-device cache for the results of idempotent read commands.
+
+`uname -a`, `tailscale ip` or `df -h` cost a full SSH round trip plus the read timeout every
+time the UI or the agent asks. Results are kept per (device, command) with a TTL picked by
+command class:
+
+- static: kernel, OS release, hostname, CPU, tailscale IP (hours)
+- slow: disks, interfaces, services, USB, cron (minutes)
+- volatile: memory, load, temperature, uptime, and any other read-only command (seconds)
+
+Only commands the speculative-execution policy proves read-only are cached; a compound
+`a && b` is cached with the shortest TTL of its parts. Any other command run on a device
+(it might mutate) drops that device's entries.
+
+Cached and fresh outputs are both CommandResult, a str with `cached`, `age` and `ttl_class`.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from tools.metrics import CACHE_REQUESTS
+from tools.speculative import is_read_only
+
+TTLS = {
+    'static': float(os.getenv('RESULT_CACHE_TTL_STATIC', 6 * 3600)),
+    'slow': float(os.getenv('RESULT_CACHE_TTL_SLOW', 300)),
+    'volatile': float(os.getenv('RESULT_CACHE_TTL_VOLATILE', 5)),
+}
+
+# Leading words -> class; the longest matching prefix wins
+CLASSES = {
+    ('uname',): 'static', ('lsb_release',): 'static', ('hostname',): 'static', ('lscpu',): 'static',
+    ('nproc',): 'static', ('whoami',): 'static', ('id',): 'static', ('tailscale', 'ip'): 'static',
+    ('tailscale', 'version'): 'static', ('cat', '/etc/os-release'): 'static', ('cat', '/proc/cpuinfo'): 'static',
+    ('cat', '/boot/config.txt'): 'static', ('vcgencmd', 'get_mem'): 'static',
+    ('df',): 'slow', ('lsblk',): 'slow', ('lsusb',): 'slow', ('ip',): 'slow', ('systemctl',): 'slow',
+    ('crontab',): 'slow', ('tailscale', 'status'): 'slow',
+    ('free',): 'volatile', ('uptime',): 'volatile', ('vcgencmd', 'measure_temp'): 'volatile',
+}
+_ORDER = ('static', 'slow', 'volatile')
+
+# execute_remote_command() appends this; it does not change what the command reads
+_FAIL_SUFFIX = " || echo '[ERROR] Command failed'"
+
+
+class CommandResult(str):
+    """Command output plus freshness: cached (served from cache), age (seconds), ttl_class."""
+    def __new__(cls, output, cached=False, age=0.0, ttl_class=None):
+        obj = super().__new__(cls, output)
+        obj.cached = cached
+        obj.age = age
+        obj.ttl_class = ttl_class
+        return obj
+
+    @property
+    def fresh(self):
+        return not self.cached
+
+
+def _parts(command):
+    if not command or not isinstance(command, str):
+        return None
+    if command.endswith(_FAIL_SUFFIX):
+        command = command[:-len(_FAIL_SUFFIX)]
+    parts = [part.strip() for part in command.split('&&')]
+    return parts if all(is_read_only(part) for part in parts) else None
+
+
+def is_mutating(command):
+    """Anything the read-only policy cannot vouch for might change the device."""
+    return _parts(command) is None
+
+
+def classify(command):
+    """TTL class for a cacheable command, or None when it must not be cached."""
+    parts = _parts(command)
+    if parts is None:
+        return None
+    worst = None
+    for part in parts:
+        words = tuple(part.split())
+        if words[0] == 'ls' and not any(w.startswith('/') for w in words[1:]):
+            return None  # lists the shell's working directory
+        cls = 'volatile'
+        for n in range(len(words), 0, -1):
+            if words[:n] in CLASSES:
+                cls = CLASSES[words[:n]]
+                break
+        if worst is None or _ORDER.index(cls) > _ORDER.index(worst):
+            worst = cls
+    return worst
+
+
+class ResultCache:
+    """
+    ttls: {class: seconds}. max_entries bounds the whole cache (least recently used goes first);
+    outputs over max_bytes are never stored.
+    """
+    def __init__(self, ttls=None, max_entries=1024, max_bytes=64 * 1024):
+        self.ttls = ttls or TTLS
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.on_invalidate = None  # fn(device); the web server uses it to tell the other workers
+
+    def generation(self, device):
+        """Bumped by every invalidation; pass it to put() so a read that raced a mutation is dropped."""
+        return self._generations.get(str(device), 0)
+
+    def get(self, device, command):
+        """Cached CommandResult for (device, command) if still within its TTL, else None."""
+        key = (str(device), command)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                output, stored, cls = entry
+                age = time.time() - stored
+                if age <= self.ttls[cls]:
+                    self._entries.move_to_end(key)
+                    CACHE_REQUESTS.labels(cache='result', result='hit').inc()
+                    return CommandResult(output, cached=True, age=round(age, 3), ttl_class=cls)
+                del self._entries[key]
+        CACHE_REQUESTS.labels(cache='result', result='miss').inc()
+        return None
+
+    def put(self, device, command, output, generation=None):
+        """Store output if the command is cacheable; returns it as a fresh CommandResult."""
+        cls = classify(command)
+        if cls is not None and len(output) <= self.max_bytes:
+            with self._lock:
+                if generation is not None and generation != self.generation(device):
+                    return CommandResult(output, ttl_class=cls)
+                self._entries[(str(device), command)] = (str(output), time.time(), cls)
+                self._entries.move_to_end((str(device), command))
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return CommandResult(output, ttl_class=cls)
+
+    def observe(self, device, command):
+        """Called before a command runs: one that might mutate makes the device's entries stale."""
+        if is_mutating(command):
+            self.invalidate(device)
+
+    def invalidate(self, device=None, notify=True):
+        """Drop device's entries (all devices when None); notify=False for invalidations received from elsewhere."""
+        with self._lock:
+            for key in [k for k in self._entries if device is None or k[0] == str(device)]:
+                del self._entries[key]
+            for d in ([str(device)] if device is not None else list(self._generations)):
+                self._generations[d] = self._generations.get(d, 0) + 1
+        if notify and self.on_invalidate is not None:
+            self.on_invalidate(None if device is None else str(device))
+
+    def fetch(self, device, command, run, use_cache=True):
+        """Serve (device, command) from cache, or run(command), cache and return it. use_cache=False always runs."""
+        if use_cache:
+            hit = self.get(device, command)
+            if hit is not None:
+                return hit
+        self.observe(device, command)
+        generation = self.generation(device)
+        return self.put(device, command, run(command), generation)
+
+    def stats(self):
+        with self._lock:
+            by_device = {}
+            for device, _ in self._entries:
+                by_device[device] = by_device.get(device, 0) + 1
+        return {'entries': sum(by_device.values()), 'devices': by_device, 'ttls': self.ttls}
+
+
+# Process-wide cache shared by every SSH session and the pool
+result_cache = ResultCache()
@@ -0,0 +1,402 @@
+"""
+Server-side recurring tasks across device groups: cron syntax, jitter, concurrency caps.
+
+`pi_schedule_task` appends to one device's crontab, so every device fires in the same minute
+and results stay on the device. Here schedules live in the schedules table and fire from the
+server:
+
+- cron: five fields (minute hour day-of-month month day-of-week) with lists, ranges, steps and
+  names, or @hourly/@daily/@weekly/@monthly/@yearly. Evaluated in server local time.
+- targets: '*' (every known device), 'tag:<name>' (Tailscale ACL tag), or a device IP/name.
+- jitter: each device starts up to `jitter` seconds after the due time, at an offset derived
+  from (schedule, due time, device), so the herd is spread differently on every run.
+- concurrency: at most `concurrency` devices of one run in flight; the Scheduler also caps
+  SSH calls across all schedules (max_concurrency).
+- a run that is still going when the next one is due records a 'skipped' run instead.
+- misfires (server down or busy past `misfire_grace`): misfire='skip' records one 'missed'
+  run covering every lost slot, misfire='run_once' runs once now.
+- every run lands in schedule_runs with per-device results; each schedule keeps its newest
+  `keep` runs and nothing older than the retention window.
+
+With several workers each due slot is claimed through shared state, so it runs once.
+
+    scheduler.configure(run=lambda device, cmd, timeout: ssh_pool.run(...), devices=fetch_devices)
+    scheduler.add({'name': 'disk', 'cron': '*/15 * * * *', 'command': 'df -h /', 'targets': ['tag:lab'], 'jitter': 60})
+    scheduler.start()
+"""
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# --- Cron expressions ---
+_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+_NAMES = {
+    'month': {m: i for i, m in enumerate(('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)},
+    'weekday': {d: i for i, d in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))},
+}
+_MACROS = {'@yearly': '0 0 1 1 *', '@annually': '0 0 1 1 *', '@monthly': '0 0 1 * *', '@weekly': '0 0 * * 0',
+           '@daily': '0 0 * * *', '@midnight': '0 0 * * *', '@hourly': '0 * * * *'}
+_HORIZON_DAYS = 366 * 5
+
+
+def _parse_field(text, name, low, high):
+    names = _NAMES.get(name, {})
+
+    def value(token):
+        token = token.lower()
+        if token in names:
+            return names[token]
+        if not token.isdigit() or not low <= int(token) <= high:
+            raise ValueError(f"cron {name}: {token!r} is not in {low}-{high}")
+        return int(token)
+
+    values = set()
+    for part in text.split(','):
+        base, _, step = part.partition('/')
+        if step and (not step.isdigit() or int(step) == 0):
+            raise ValueError(f"cron {name}: bad step {step!r}")
+        if base == '*':
+            start, end = low, high
+        elif '-' in base:
+            start, end = (value(t) for t in base.split('-', 1))
+            if start > end:
+                raise ValueError(f"cron {name}: range {base!r} is reversed")
+        else:
+            start = value(base)
+            end = high if step else start
+        values.update(range(start, end + 1, int(step or 1)))
+    return values
+
+
+class CronExpr:
+    """A parsed cron expression; next_after(ts) is the first matching minute after ts."""
+    def __init__(self, expr):
+        self.expr = expr.strip()
+        fields = _MACROS.get(self.expr.lower(), self.expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields, got {len(fields)}: {expr!r}")
+        parsed = [_parse_field(text, *spec) for text, spec in zip(fields, _FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = (sorted(v) for v in parsed)
+        self.weekdays = {d % 7 for d in weekdays}
+        # Vixie cron: when both day fields are restricted, either one matching is enough
+        self.day_restricted, self.weekday_restricted = not fields[2].startswith('*'), not fields[4].startswith('*')
+
+    def _day_matches(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, ts):
+        t = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end = t + timedelta(days=_HORIZON_DAYS)
+        while t < end:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+            else:
+                minute = next((m for m in self.minutes if m >= t.minute), None)
+                if minute is None:
+                    t = (t + timedelta(hours=1)).replace(minute=0)
+                    continue
+                return t.replace(minute=minute).timestamp()
+        raise ValueError(f"cron expression {self.expr!r} never fires")
+
+    def __repr__(self):
+        return f"CronExpr({self.expr!r})"
+
+
+# --- Schedule specs ---
+KINDS = ('command', 'diagnostics')
+MISFIRE = ('skip', 'run_once')
+DEFAULTS = {'kind': 'command', 'command': None, 'targets': ['*'], 'jitter': 0, 'concurrency': 8, 'timeout': 60,
+            'misfire': 'skip', 'misfire_grace': 60, 'keep': 200, 'enabled': True}
+MAX_OUTPUT = 4000
+
+
+def normalize_spec(spec, current=None):
+    """Validate a schedule spec (merged over `current` for updates); raises ValueError."""
+    merged = {**DEFAULTS, **(current or {}), **{k: v for k, v in spec.items() if v is not None}}
+    unknown = set(merged) - set(DEFAULTS) - {'name', 'cron'}
+    if unknown:
+        raise ValueError(f"unknown schedule fields: {', '.join(sorted(unknown))}")
+    if not str(merged.get('name') or '').strip():
+        raise ValueError("schedule needs a name")
+    CronExpr(str(merged.get('cron') or ''))
+    if merged['kind'] not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    if merged['kind'] == 'command' and not str(merged['command'] or '').strip():
+        raise ValueError("command schedules need a command")
+    if merged['misfire'] not in MISFIRE:
+        raise ValueError(f"misfire must be one of {', '.join(MISFIRE)}")
+    targets = merged['targets']
+    merged['targets'] = [targets] if isinstance(targets, str) else [str(t) for t in targets]
+    if not merged['targets']:
+        raise ValueError("schedule needs at least one target")
+    for key, low in (('jitter', 0), ('misfire_grace', 0), ('timeout', 1)):
+        merged[key] = max(low, float(merged[key]))
+    for key in ('concurrency', 'keep'):
+        merged[key] = max(1, int(merged[key]))
+    merged['name'] = str(merged['name']).strip()
+    merged['enabled'] = bool(merged['enabled'])
+    return merged
+
+
+def resolve_targets(targets, devices):
+    """Device IPs selected by targets ('*', 'tag:<name>', IP or name) out of fetch_devices-style dicts."""
+    known = [d for d in devices if isinstance(d, dict) and d.get('ip') and not str(d.get('name', '')).startswith('[')]
+    selected = []
+    for target in targets:
+        if target in ('*', 'all'):
+            selected += [d['ip'] for d in known]
+        elif target.startswith('tag:'):
+            selected += [d['ip'] for d in known if target in (d.get('tags') or ())]
+        else:
+            matches = [d['ip'] for d in known if target in (d['ip'], d.get('name'))]
+            selected += matches or [target]
+    return list(dict.fromkeys(selected))
+
+
+def jitter_offset(schedule_id, due, device, jitter):
+    """Stable per-(run, device) delay in [0, jitter): repeatable for a run, different between runs."""
+    if jitter <= 0:
+        return 0.0
+    digest = hashlib.sha256(f"{schedule_id}:{due:.0f}:{device}".encode()).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 * jitter
+
+
+def _run_status(devices, failed):
+    if not devices:
+        return 'failed'
+    return 'ok' if not failed else ('failed' if failed == devices else 'partial')
+
+
+# --- Scheduler ---
+class Scheduler:
+    """
+    Fires due schedules from a background thread. run(device, command, timeout) -> (code, output)
+    and devices() -> [device dicts] are supplied by the web server (configure()); claim(key, ttl)
+    -> bool arbitrates between workers and on_run(run) is told about every finished run.
+    """
+    def __init__(self, storage=None, run=None, devices=None, claim=None, on_run=None, max_concurrency=32,
+                 retention_days=30, clock=time.time):
+        self._storage = storage
+        self.max_concurrency = max_concurrency
+        self.retention = retention_days * 86400
+        self.clock = clock
+        self.configure(run, devices, claim, on_run)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='schedule')
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            from tools.storage import get_storage
+            self._storage = get_storage()
+        return self._storage
+
+    def configure(self, run=None, devices=None, claim=None, on_run=None):
+        self.run_command = run
+        self.devices = devices or (lambda: [])
+        self.claim = claim or (lambda key, ttl: True)
+        self.on_run = on_run
+
+    # --- Schedule management ---
+    def add(self, spec, username=None):
+        spec = normalize_spec(spec)
+        next_run = CronExpr(spec['cron']).next_after(self.clock())
+        schedule_id = self.storage.add_schedule(spec['name'], spec, spec['enabled'], next_run, created_by=username)
+        self._wake.set()
+        return self.get(schedule_id)
+
+    def update(self, schedule_id, changes):
+        current = self.storage.get_schedule(schedule_id)
+        if current is None:
+            return None
+        spec = normalize_spec(changes, current['spec'])
+        next_run = current['next_run']
+        if spec['cron'] != current['spec']['cron'] or (spec['enabled'] and not current['enabled']) or next_run is None:
+            next_run = CronExpr(spec['cron']).next_after(self.clock())
+        self.storage.update_schedule(schedule_id, spec['name'], spec, spec['enabled'], next_run)
+        self._wake.set()
+        return self.get(schedule_id)
+
+    def remove(self, schedule_id):
+        return self.storage.delete_schedule(schedule_id)
+
+    def get(self, schedule_id):
+        schedule = self.storage.get_schedule(schedule_id)
+        if schedule:
+            schedule['running'] = self._active_run(schedule) is not None
+        return schedule
+
+    def list(self):
+        schedules = self.storage.list_schedules()
+        for schedule in schedules:
+            schedule['running'] = self._active_run(schedule) is not None
+        return schedules
+
+    def history(self, schedule_id=None, status=None, since=None, until=None, limit=100):
+        return self.storage.list_schedule_runs(schedule_id, status, since, until, limit)
+
+    def _active_run(self, schedule):
+        """The schedule's unfinished run id; runs stuck longer than a run can take are marked abandoned."""
+        row = self.storage.active_schedule_run(schedule['id'])
+        if row is None:
+            return None
+        spec = schedule['spec']
+        limit = spec['jitter'] + spec['timeout'] * 4 + 300
+        if self.clock() - row[1] > max(limit, 3600):
+            self.storage.finish_schedule_run(row[0], 'abandoned')
+            return None
+        return row[0]
+
+    # --- Firing ---
+    def tick(self, now=None):
+        """Fire every enabled schedule that is due at `now`. Returns {schedule_id: future or status}."""
+        now = self.clock() if now is None else now
+        fired = {}
+        for schedule in self.storage.list_schedules():
+            if not schedule['enabled'] or schedule['next_run'] is None or schedule['next_run'] > now:
+                continue
+            fired[schedule['id']] = self._fire(schedule, now)
+        return fired
+
+    def _fire(self, schedule, now):
+        spec, due = schedule['spec'], schedule['next_run']
+        cron = CronExpr(spec['cron'])
+        self.storage.set_next_run(schedule['id'], cron.next_after(now))
+        if not self.claim(f"schedule:{schedule['id']}:{due:.0f}", max(3600.0, spec['timeout'] * 2)):
+            return 'claimed'
+        note = None
+        if now - due > spec['misfire_grace']:
+            missed, slot = 0, due
+            while slot <= now and missed < 10000:
+                missed, due, slot = missed + 1, slot, cron.next_after(slot)
+            note = {'missed': missed, 'late_seconds': round(now - schedule['next_run'], 1)}
+            if spec['misfire'] == 'skip':
+                self.storage.start_schedule_run(schedule['id'], schedule['next_run'], status='missed', detail=note)
+                return 'missed'
+        if self._active_run(schedule) is not None:
+            self.storage.start_schedule_run(schedule['id'], due, status='skipped', detail={'reason': 'previous run still running'})
+            return 'skipped'
+        return self._launch(schedule, due, note)
+
+    def run_now(self, schedule_id):
+        """Start a run immediately (outside the cron cadence). Returns a future, or 'skipped'/None."""
+        schedule = self.storage.get_schedule(schedule_id)
+        if schedule is None:
+            return None
+        if self._active_run(schedule) is not None:
+            return 'skipped'
+        return self._launch(schedule, self.clock(), {'manual': True})
+
+    def _launch(self, schedule, due, note=None):
+        run_id = self.storage.start_schedule_run(schedule['id'], due, detail=note)
+        return self._pool.submit(self._execute, schedule, run_id, due, note)
+
+    def _execute(self, schedule, run_id, due, note):
+        spec = schedule['spec']
+        started = self.clock()
+        detail = dict(note or {})
+        try:
+            hosts = resolve_targets(spec['targets'], self.devices())
+            offsets = {host: jitter_offset(schedule['id'], due, host, spec['jitter']) for host in hosts}
+            command = spec['command']
+            if spec['kind'] == 'diagnostics':
+                from tools.diagnostics import VITALS_COMMAND
+                command = VITALS_COMMAND
+
+            def one(host):
+                if self._stop.wait(max(0.0, started + offsets[host] - self.clock())):
+                    return host, {'error': 'scheduler stopped', 'delay': round(offsets[host], 2)}
+                return host, self._run_device(host, command, spec, offsets[host])
+
+            ordered = sorted(hosts, key=offsets.get)
+            results = {}
+            if ordered:
+                with ThreadPoolExecutor(max_workers=min(spec['concurrency'], len(ordered))) as pool:
+                    results = dict(pool.map(one, ordered))
+            failed = sum(1 for r in results.values() if 'error' in r or r.get('code') not in (0, None))
+            if spec['kind'] == 'diagnostics':
+                from tools.diagnostics import FleetFrame
+                records = {h: r['record'] for h, r in results.items() if 'record' in r}
+                detail['summary'] = FleetFrame(records).summary() if records else None
+            detail['results'] = results
+            status = _run_status(len(hosts), failed)
+            if not hosts:
+                detail['error'] = 'no devices matched the targets'
+        except Exception as e:
+            status, failed, hosts = 'failed', 0, []
+            detail['error'] = str(e) or type(e).__name__
+        self.storage.finish_schedule_run(run_id, status, len(hosts), failed, detail)
+        self.storage.prune_schedule_runs(schedule['id'], spec['keep'], self.clock() - self.retention)
+        summary = {'id': run_id, 'schedule_id': schedule['id'], 'name': schedule['name'], 'status': status,
+                   'due_at': due, 'devices': len(hosts), 'failed': failed, 'seconds': round(self.clock() - started, 3)}
+        if self.on_run:
+            try:
+                self.on_run(summary)
+            except Exception:
+                pass
+        return summary
+
+    def _run_device(self, host, command, spec, delay):
+        began = time.monotonic()
+        try:
+            with self._slots:
+                code, output = self.run_command(host, command, spec['timeout'])
+        except Exception as e:
+            return {'error': str(e) or type(e).__name__, 'delay': round(delay, 2)}
+        result = {'code': code, 'delay': round(delay, 2), 'ms': round((time.monotonic() - began) * 1000, 1)}
+        if spec['kind'] == 'diagnostics':
+            from tools.diagnostics import parse_vitals
+            result['record'] = parse_vitals(output)
+        else:
+            output = output or ''
+            result['output'] = output[-MAX_OUTPUT:]
+            result['truncated'] = len(output) > MAX_OUTPUT
+        return result
+
+    # --- Background loop ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            wait = 30.0
+            try:
+                self.tick()
+                upcoming = [s['next_run'] for s in self.storage.list_schedules() if s['enabled'] and s['next_run']]
+                if upcoming:
+                    wait = min(upcoming) - self.clock()
+            except Exception:
+                logger.exception("Scheduler tick failed")
+            # Re-read at least every 30s: other workers may add or edit schedules
+            self._wake.wait(max(0.5, min(wait, 30.0)))
+            self._wake.clear()
+
+
+scheduler = Scheduler()
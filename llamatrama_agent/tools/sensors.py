@@ -0,0 +1,382 @@
+"""
+High-rate GPIO/I2C sampling through a small resident sampler on the device.
+
+pi_gpio_read and friends cost one shell round trip per read. Here one exec channel runs
+SAMPLER (plain python3, stdlib only) on the device instead. It keeps the GPIO value files
+(sysfs) and /dev/i2c-N open, reads every channel `rate` times a second and sends binary
+batches back:
+
+    frame   = kind (1 byte) + length (uint32 LE) + payload
+    'H'       hello: JSON {channels, rate, gpio_base}
+    'S'       samples: count (uint16), channels (uint16), then count x (ts double + channels x float32)
+    'A'       ack for a write request: JSON {id, ok, error}
+    'E'       error: JSON {channel, error} (reported once per channel; the value reads NaN)
+
+Writes go the other way as JSON lines on stdin ({"id", "gpio": [[pin, value]], "i2c": [[bus, addr, reg, value]]}).
+The sampler applies them between two samples, so a batch of writes costs one message.
+
+On the server, samples land in the same array-backed RingBuffer the telemetry module uses,
+one column per channel.
+
+    sensors.start('100.64.0.2', open_channel, gpio=[17, 27], i2c=[(1, 0x48, 0x00, 2)], rate=200)
+    sensors.window('100.64.0.2', start=time.time() - 5)    # {'ts': [...], 'gpio17': [...], ...}
+    sensors.write('100.64.0.2', gpio=[(22, 1)])
+"""
+import itertools
+import json
+import math
+import shlex
+import struct
+import threading
+import time
+
+from tools.telemetry import RingBuffer
+
+MAX_RATE = 2000
+MAX_CHANNELS = 32
+MAX_POINTS = 2_000_000
+
+_HEADER = struct.Struct('<cI')
+_COUNTS = struct.Struct('<HH')
+
+# Runs on the device: python3 -u -c SAMPLER '<json config>'
+SAMPLER = r'''
+import fcntl, json, math, os, select, struct, sys, time
+cfg = json.loads(sys.argv[1])
+root = cfg.get('root', '')
+out = sys.stdout.buffer
+
+def frame(kind, payload):
+    out.write(kind + struct.pack('<I', len(payload)) + payload)
+    out.flush()
+
+def gpio_base():
+    top = root + '/sys/class/gpio'
+    try:
+        for name in sorted(os.listdir(top)):
+            if name.startswith('gpiochip'):
+                with open(top + '/' + name + '/label') as f:
+                    if f.read().startswith('pinctrl'):
+                        return int(name[8:])
+    except OSError:
+        pass
+    return 0
+
+BASE = gpio_base()
+fds = {}
+
+def gpio_fd(pin, write=False):
+    key = (pin, write)
+    if key not in fds:
+        path = root + '/sys/class/gpio/gpio%d' % (BASE + pin)
+        if not os.path.exists(path):
+            with open(root + '/sys/class/gpio/export', 'w') as f:
+                f.write(str(BASE + pin))
+            for _ in range(50):
+                if os.access(path + '/value', os.R_OK):
+                    break
+                time.sleep(0.01)
+        if write:
+            with open(path + '/direction', 'w') as f:
+                f.write('out')
+        fds[key] = os.open(path + '/value', os.O_RDWR if write else os.O_RDONLY)
+    return fds[key]
+
+def i2c_fd(bus, addr):
+    if bus not in fds:
+        fds[bus] = os.open(root + '/dev/i2c-%d' % bus, os.O_RDWR)
+    fcntl.ioctl(fds[bus], 0x0703, addr)
+    return fds[bus]
+
+def gpio_reader(pin):
+    return lambda: float(os.pread(gpio_fd(pin), 1, 0) == b'1')
+
+def i2c_reader(bus, addr, reg, width):
+    def read():
+        fd = i2c_fd(bus, addr)
+        os.write(fd, bytes([reg]))
+        return float(int.from_bytes(os.read(fd, width), 'big'))
+    return read
+
+def apply(request):
+    for pin, value in request.get('gpio', []):
+        os.pwrite(gpio_fd(pin, write=True), b'1' if value else b'0', 0)
+    for bus, addr, reg, value in request.get('i2c', []):
+        os.write(i2c_fd(bus, addr), bytes([reg, value & 0xFF]))
+
+readers = [gpio_reader(p) for p in cfg.get('gpio', [])] + [i2c_reader(*c) for c in cfg.get('i2c', [])]
+names = cfg['channels']
+row = struct.Struct('<d' + 'f' * len(readers))
+period = 1.0 / cfg['rate']
+size = max(1, cfg['batch'])
+failed = set()
+batch = []
+pending = b''  # stdin bytes not yet forming a whole request line
+frame(b'H', json.dumps({'channels': names, 'rate': cfg['rate'], 'gpio_base': BASE}).encode())
+due = time.monotonic()
+while True:
+    values = []
+    for i, read in enumerate(readers):
+        try:
+            values.append(read())
+        except OSError as e:
+            values.append(math.nan)
+            if i not in failed:
+                failed.add(i)
+                frame(b'E', json.dumps({'channel': names[i], 'error': str(e)}).encode())
+    batch.append(row.pack(time.time(), *values))
+    if len(batch) >= size:
+        frame(b'S', struct.pack('<HH', len(batch), len(readers)) + b''.join(batch))
+        batch = []
+    due += period
+    while True:
+        delay = due - time.monotonic()
+        if delay < -1.0:
+            due = time.monotonic()  # fell far behind: skip ahead rather than burst
+        ready = select.select([0], [], [], max(0.0, delay))[0]
+        if not ready:
+            break
+        # Raw reads into our own buffer: select() cannot see lines already buffered by sys.stdin
+        chunk = os.read(0, 4096)
+        if not chunk:
+            sys.exit(0)
+        pending += chunk
+        while b'\n' in pending:
+            line, pending = pending.split(b'\n', 1)
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            try:
+                apply(request)
+                frame(b'A', json.dumps({'id': request.get('id'), 'ok': True}).encode())
+            except (OSError, ValueError, TypeError) as e:
+                frame(b'A', json.dumps({'id': request.get('id'), 'ok': False, 'error': str(e)}).encode())
+'''
+
+
+def channel_names(gpio=(), i2c=()):
+    return [f'gpio{int(pin)}' for pin in gpio] + [f'i2c{bus}_0x{addr:02x}_0x{reg:02x}' for bus, addr, reg, _ in i2c]
+
+
+def normalize_i2c(i2c):
+    """[(bus, addr, reg[, width])] with ints validated; width defaults to 1 byte."""
+    out = []
+    for entry in i2c or ():
+        bus, addr, reg, *rest = entry
+        width = int(rest[0]) if rest else 1
+        bus, addr, reg = int(bus), int(addr), int(reg)
+        if not (0 <= bus < 32 and 0x03 <= addr <= 0x77 and 0 <= reg <= 0xFF and 1 <= width <= 4):
+            raise ValueError(f"invalid i2c channel: {entry}")
+        out.append((bus, addr, reg, width))
+    return out
+
+
+def sampler_command(gpio=(), i2c=(), rate=100, batch=None, root=None, python='python3'):
+    """Command starting the resident sampler; batch defaults to about 10 batches per second."""
+    gpio = [int(pin) for pin in gpio or ()]
+    if any(not 0 <= pin < 64 for pin in gpio):
+        raise ValueError("gpio pins must be between 0 and 63")
+    i2c = normalize_i2c(i2c)
+    if not gpio and not i2c:
+        raise ValueError("nothing to sample: give gpio pins and/or i2c registers")
+    if len(gpio) + len(i2c) > MAX_CHANNELS:
+        raise ValueError(f"at most {MAX_CHANNELS} channels")
+    rate = float(rate)
+    if not 0 < rate <= MAX_RATE:
+        raise ValueError(f"rate must be between 0 and {MAX_RATE} Hz")
+    config = {'gpio': gpio, 'i2c': i2c, 'rate': rate, 'batch': int(batch or max(1, rate // 10)),
+              'channels': channel_names(gpio, i2c)}
+    if root:
+        config['root'] = root
+    return f"{python} -u -c {shlex.quote(SAMPLER)} {shlex.quote(json.dumps(config))}"
+
+
+class FrameReader:
+    """Incremental decoder for the sampler's length-prefixed frames."""
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Consume bytes; returns the completed frames as [(kind, payload)]."""
+        self._buffer += data
+        frames = []
+        while len(self._buffer) >= _HEADER.size:
+            kind, length = _HEADER.unpack_from(self._buffer)
+            end = _HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            frames.append((kind.decode(), bytes(self._buffer[_HEADER.size:end])))
+            del self._buffer[:end]
+        return frames
+
+
+def decode_samples(payload):
+    """'S' payload -> [(ts, (value, ...))]."""
+    count, channels = _COUNTS.unpack_from(payload)
+    row = struct.Struct('<d' + 'f' * channels)
+    return [(values[0], values[1:]) for values in row.iter_unpack(payload[_COUNTS.size:_COUNTS.size + count * row.size])]
+
+
+class SensorSession:
+    """One sampler channel and its buffer. The reader thread ends when the channel closes (no reconnect)."""
+    def __init__(self, device, open_channel, gpio=(), i2c=(), rate=100, batch=None, seconds=600):
+        self.device = device
+        self.gpio = [int(pin) for pin in gpio or ()]
+        self.i2c = normalize_i2c(i2c)
+        self.rate = float(rate)
+        self.command = sampler_command(self.gpio, self.i2c, self.rate, batch)
+        self.channels = channel_names(self.gpio, self.i2c)
+        self.buffer = RingBuffer(int(min(MAX_POINTS, max(1000, self.rate * seconds))), self.channels)
+        self.open_channel = open_channel
+        self.samples = 0
+        self.batches = 0
+        self.bytes = 0
+        self.errors = {}
+        self.error = None
+        self.started = time.time()
+        self._ids = itertools.count(1)
+        self._acks = {}
+        self._lock = threading.Lock()
+        self._channel = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'sensors-{device}', daemon=True)
+
+    def start(self):
+        self._channel = self.open_channel(self.command)
+        self._thread.start()
+        return self
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+        channel = self._channel
+        if channel is not None:
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+    def handle(self, kind, payload):
+        if kind == 'S':
+            rows = decode_samples(payload)
+            with self._lock:
+                for ts, values in rows:
+                    self.buffer.append(ts, dict(zip(self.channels, values)))
+            self.samples += len(rows)
+            self.batches += 1
+        elif kind == 'A':
+            ack = json.loads(payload)
+            waiter = self._acks.get(ack.get('id'))
+            if waiter:
+                waiter[1] = ack
+                waiter[0].set()
+        elif kind == 'E':
+            info = json.loads(payload)
+            self.errors[info.get('channel')] = info.get('error')
+
+    def _run(self):
+        reader = FrameReader()
+        try:
+            while not self._stop.is_set():
+                data = self._channel.recv(65536)
+                if not data:
+                    break
+                self.bytes += len(data)
+                for kind, payload in reader.feed(data):
+                    self.handle(kind, payload)
+        except Exception as e:
+            if not self._stop.is_set():
+                self.error = str(e) or type(e).__name__
+        finally:
+            if self.error is None and not self._stop.is_set():
+                self.error = 'sampler exited'
+            for waiter in list(self._acks.values()):
+                waiter[0].set()
+
+    def write(self, gpio=(), i2c=(), timeout=5.0):
+        """Apply a batch of writes on the device between two samples; returns the sampler's ack."""
+        if not self.alive:
+            raise RuntimeError(self.error or 'sampler is not running')
+        request = {'id': next(self._ids), 'gpio': [[int(pin), 1 if value else 0] for pin, value in gpio or ()],
+                   'i2c': [[int(bus), int(addr), int(reg), int(value)] for bus, addr, reg, value in i2c or ()]}
+        waiter = self._acks[request['id']] = [threading.Event(), None]
+        try:
+            self._channel.sendall((json.dumps(request) + '\n').encode())
+            if not waiter[0].wait(timeout) or waiter[1] is None:
+                raise TimeoutError('no acknowledgement from sampler')
+            return waiter[1]
+        finally:
+            self._acks.pop(request['id'], None)
+
+    def window(self, start=None, end=None, channels=None, max_points=5000):
+        """Columnar samples between start and end, decimated to at most max_points rows."""
+        names = [c for c in channels if c in self.channels] if channels else self.channels
+        with self._lock:
+            rows = self.buffer.range(start, end, names)
+        stride = max(1, math.ceil(len(rows) / max_points)) if max_points else 1
+        rows = rows[::stride]
+        out = {'ts': [ts for ts, _ in rows], 'stride': stride}
+        for name in names:
+            out[name] = [values[name] for _, values in rows]
+        return out
+
+    def latest(self):
+        with self._lock:
+            last = self.buffer.latest()
+        return {'ts': last[0], **last[1]} if last else None
+
+    def status(self):
+        elapsed = max(1e-9, time.time() - self.started)
+        return {'device': self.device, 'alive': self.alive, 'channels': self.channels, 'rate': self.rate,
+                'samples': self.samples, 'batches': self.batches, 'bytes': self.bytes,
+                'effective_rate': round(self.samples / elapsed, 1), 'channel_errors': self.errors, 'error': self.error}
+
+
+class SensorHub:
+    """At most one sampler per device; starting again replaces it."""
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def start(self, device, open_channel, gpio=(), i2c=(), rate=100, batch=None, seconds=600):
+        """open_channel(command) -> channel with recv/sendall/close."""
+        session = SensorSession(str(device), open_channel, gpio, i2c, rate, batch, seconds)
+        self.stop(device)
+        session.start()
+        with self._lock:
+            self._sessions[str(device)] = session
+        return session
+
+    def get(self, device):
+        session = self._sessions.get(str(device))
+        if session is None:
+            raise KeyError(f"no sampler running on {device}")
+        return session
+
+    def stop(self, device):
+        with self._lock:
+            session = self._sessions.pop(str(device), None)
+        if session:
+            session.stop()
+        return session is not None
+
+    def stop_all(self):
+        for device in list(self._sessions):
+            self.stop(device)
+
+    def window(self, device, start=None, end=None, channels=None, max_points=5000):
+        return self.get(device).window(start, end, channels, max_points)
+
+    def write(self, device, gpio=(), i2c=(), timeout=5.0):
+        return self.get(device).write(gpio, i2c, timeout)
+
+    def status(self):
+        with self._lock:
+            return [s.status() for s in self._sessions.values()]
+
+
+# Process-wide hub used by the web server
+sensors = SensorHub()
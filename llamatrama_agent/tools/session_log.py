@@ -0,0 +1,271 @@
+"""
+Append-only structured session event log.
+
+Records are JSON lines in size-capped segments named after their first sequence number
+(outputs/events/00000000000000000001.jsonl). Every segment has a sibling .idx file of
+fixed-width (seq, byte offset) pairs, so reading "everything after cursor N" is a binary
+search plus one seek instead of a directory scan and a full-file read.
+
+Large command outputs are stored once under blobs/ and referenced by hash from the record.
+The markdown session files remain available as a derived view via export_markdown().
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+_IDX = struct.Struct('<QQ')  # seq, byte offset within the segment
+
+
+class SessionEventLog:
+    """
+    directory: where segments, indexes and blobs live.
+    max_segment_bytes: roll to a new segment once the current one reaches this size.
+    inline_limit: outputs longer than this are written to blobs/ and referenced.
+    """
+    def __init__(self, directory, max_segment_bytes=4 * 1024 * 1024, inline_limit=4096):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.inline_limit = inline_limit
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'blobs'), exist_ok=True)
+        self._segments = self._list_segments()
+        self._last_seq = self._recover()
+
+    # --- Segment bookkeeping ---
+    def _list_segments(self):
+        bases = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.jsonl'):
+                try:
+                    bases.append(int(fname[:-6]))
+                except ValueError:
+                    continue
+        return sorted(bases)
+
+    def _seg_path(self, base):
+        return os.path.join(self.directory, f"{base:020d}.jsonl")
+
+    def _idx_path(self, base):
+        return os.path.join(self.directory, f"{base:020d}.idx")
+
+    def _recover(self):
+        """Find the last committed seq; drop a torn trailing line or index entry after a crash."""
+        if not self._segments:
+            return 0
+        base = self._segments[-1]
+        seg, idx = self._seg_path(base), self._idx_path(base)
+        idx_size = os.path.getsize(idx) if os.path.exists(idx) else 0
+        idx_size -= idx_size % _IDX.size
+        entries = []
+        if idx_size:
+            with open(idx, 'rb') as fh:
+                data = fh.read(idx_size)
+            entries = [_IDX.unpack_from(data, i) for i in range(0, idx_size, _IDX.size)]
+        seg_size = os.path.getsize(seg)
+        # Keep only index entries whose line is fully present in the segment
+        while entries and entries[-1][1] >= seg_size:
+            entries.pop()
+        end = seg_size
+        if entries:
+            with open(seg, 'rb') as fh:
+                fh.seek(entries[-1][1])
+                line = fh.readline()
+            if line.endswith(b'\n'):
+                end = entries[-1][1] + len(line)
+            else:
+                end = entries[-1][1]
+                entries.pop()
+        else:
+            end = 0
+        if end != seg_size:
+            with open(seg, 'r+b') as fh:
+                fh.truncate(end)
+        with open(idx, 'wb') as fh:
+            for e in entries:
+                fh.write(_IDX.pack(*e))
+        if entries:
+            return entries[-1][0]
+        return base - 1
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Serialize appends across processes (several web workers + the CLI agent)."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _refresh_tail(self):
+        """Pick up segments and records appended by other processes since our last append."""
+        self._segments = self._list_segments()
+        if not self._segments:
+            return
+        idx = self._idx_path(self._segments[-1])
+        size = os.path.getsize(idx) if os.path.exists(idx) else 0
+        size -= size % _IDX.size
+        if size:
+            with open(idx, 'rb') as fh:
+                fh.seek(size - _IDX.size)
+                self._last_seq = max(self._last_seq, _IDX.unpack(fh.read(_IDX.size))[0])
+        else:
+            self._last_seq = max(self._last_seq, self._segments[-1] - 1)
+
+    def _read_index(self, base):
+        path = self._idx_path(base)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        usable = len(data) - len(data) % _IDX.size
+        return [_IDX.unpack_from(data, i) for i in range(0, usable, _IDX.size)]
+
+    # --- Writing ---
+    def store_blob(self, text):
+        """Store text content-addressed under blobs/ and return its reference."""
+        raw = text.encode('utf-8', errors='ignore')
+        ref = hashlib.sha256(raw).hexdigest()
+        path = os.path.join(self.directory, 'blobs', ref + '.txt')
+        if not os.path.exists(path):
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as fh:
+                fh.write(raw)
+            os.replace(tmp, path)
+        return ref
+
+    def read_blob(self, ref):
+        if not ref or not all(c in '0123456789abcdef' for c in ref):
+            raise ValueError('Invalid blob reference')
+        with open(os.path.join(self.directory, 'blobs', ref + '.txt'), 'r', encoding='utf-8', errors='ignore') as fh:
+            return fh.read()
+
+    def append(self, event_type, **fields):
+        """
+        Append one record and return its sequence number (the cursor).
+        An 'output' field longer than inline_limit is moved to a blob and replaced by
+        'output_ref' + 'output_bytes'.
+        """
+        output = fields.get('output')
+        if isinstance(output, str) and len(output) > self.inline_limit:
+            fields.pop('output')
+            fields['output_ref'] = self.store_blob(output)
+            fields['output_bytes'] = len(output)
+        with self._lock, self._file_lock():
+            self._refresh_tail()
+            seq = self._last_seq + 1
+            record = {'seq': seq, 'ts': round(time.time(), 3), 'type': event_type}
+            record.update(fields)
+            line = (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+            if not self._segments or os.path.getsize(self._seg_path(self._segments[-1])) >= self.max_segment_bytes:
+                self._segments.append(seq)
+            base = self._segments[-1]
+            seg = self._seg_path(base)
+            offset = os.path.getsize(seg) if os.path.exists(seg) else 0
+            with open(seg, 'ab') as fh:
+                fh.write(line)
+                fh.flush()
+            with open(self._idx_path(base), 'ab') as fh:
+                fh.write(_IDX.pack(seq, offset))
+            self._last_seq = seq
+        return record['seq']
+
+    # --- Reading ---
+    @property
+    def cursor(self):
+        """Sequence number of the newest record (0 when empty)."""
+        with self._lock:
+            self._refresh_tail()
+            return self._last_seq
+
+    def read(self, since=0, limit=100, types=None):
+        """
+        Return (records, next_cursor) for records with seq > since, oldest first.
+        Pass next_cursor back as `since` to fetch the following page.
+        """
+        limit = max(1, min(int(limit), 1000))
+        since = max(0, int(since))
+        with self._lock:
+            self._refresh_tail()
+            segments = list(self._segments)
+            last = self._last_seq
+        records = []
+        next_cursor = since
+        # Start at the last segment whose base <= since + 1
+        start = 0
+        for i, base in enumerate(segments):
+            if base <= since + 1:
+                start = i
+        for base in segments[start:]:
+            index = [e for e in self._read_index(base) if e[0] <= last]
+            lo, hi = 0, len(index)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if index[mid][0] <= since:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo >= len(index):
+                continue
+            with open(self._seg_path(base), 'rb') as fh:
+                fh.seek(index[lo][1])
+                for seq, _ in index[lo:]:
+                    line = fh.readline()
+                    if not line.endswith(b'\n'):
+                        break
+                    next_cursor = seq
+                    rec = json.loads(line)
+                    if types and rec.get('type') not in types:
+                        continue
+                    records.append(rec)
+                    if len(records) >= limit:
+                        return records, next_cursor
+        return records, next_cursor
+
+    async def tail(self, since=0, poll=1.0, limit=100):
+        """Async generator yielding new records as they are appended."""
+        cursor = since
+        while True:
+            records, cursor = await asyncio.to_thread(self.read, cursor, limit)
+            for rec in records:
+                yield rec
+            if not records:
+                await asyncio.sleep(poll)
+
+    def export_markdown(self, since=0, limit=100):
+        """Render records as the legacy prompt/response markdown layout."""
+        records, _ = self.read(since=since, limit=limit)
+        parts = []
+        for rec in records:
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(rec['ts']))
+            body = rec.get('text') or rec.get('command') or rec.get('output') or ''
+            if rec.get('output_ref'):
+                body = f"[output stored as blob {rec['output_ref']} ({rec.get('output_bytes')} bytes)]"
+            extra = f" ({rec['duration_ms']} ms)" if 'duration_ms' in rec else ''
+            parts.append(f"### {rec['type']} #{rec['seq']} [{when}]{extra}:\n{body}\n")
+        return "\n".join(parts)
+
+
+_default_log = None
+
+
+def get_event_log(directory=None):
+    """Return the process-wide log under outputs/events (created on first use)."""
+    global _default_log
+    if _default_log is None:
+        directory = directory or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'outputs', 'events')
+        _default_log = SessionEventLog(directory)
+    return _default_log
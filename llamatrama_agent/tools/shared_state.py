@@ -0,0 +1,248 @@
+"""
+Cross-process shared state on top of the SQLite store, so the dashboard can run under
+`uvicorn --workers N` (or several replicas on one host sharing the database file).
+
+- kv: small JSON values with optional TTL and compare-and-swap
+- registry: live workers and SSH sessions, kept fresh by heartbeats
+- token buckets: rate-limit counters updated atomically across workers
+- changes: an append-only notification table; ChangeWatcher polls PRAGMA data_version
+  (which only moves when another connection commits) and dispatches new rows to callbacks
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+from tools.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+ORIGIN = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SharedState:
+    def __init__(self, storage=None, origin=None, keep_changes=5000):
+        self.storage = storage or get_storage()
+        self.origin = origin or ORIGIN
+        self.keep_changes = keep_changes
+
+    def _conn(self):
+        return self.storage.connection()
+
+    # --- Key/value ---
+    def get(self, key, default=None):
+        row = self._conn().execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        self.storage.write("INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+                            "ON CONFLICT(key) DO UPDATE SET value=excluded.value, expires_at=excluded.expires_at",
+                            (key, json.dumps(value, default=str), expires))
+
+    def set_if_absent(self, key, value, ttl=None):
+        """Store value unless a live one exists; returns the value that ends up stored."""
+        with self.storage.transaction(immediate=True):
+            current = self.get(key)
+            if current is not None:
+                return current
+            self.set(key, value, ttl=ttl)
+            return value
+
+    def swap(self, key, value, ttl=None):
+        """Atomically replace a value and return the previous one (None if absent)."""
+        with self.storage.transaction(immediate=True):
+            previous = self.get(key)
+            self.set(key, value, ttl=ttl)
+            return previous
+
+    def delete(self, key):
+        self.storage.write("DELETE FROM kv WHERE key = ?", (key,))
+
+    # --- Registry (workers, SSH sessions) ---
+    def register(self, kind, name, data=None):
+        now = time.time()
+        self.storage.write(
+            "INSERT INTO registry (kind, name, pid, data, created_at, last_seen) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(kind, name) DO UPDATE SET pid=excluded.pid, data=excluded.data, last_seen=excluded.last_seen",
+            (kind, name, os.getpid(), json.dumps(data or {}, default=str), now, now))
+
+    def heartbeat(self, kind, name):
+        self.storage.write("UPDATE registry SET last_seen = ? WHERE kind = ? AND name = ?", (time.time(), kind, name))
+
+    def unregister(self, kind, name):
+        self.storage.write("DELETE FROM registry WHERE kind = ? AND name = ?", (kind, name))
+
+    def entries(self, kind, ttl=None):
+        """Live registry entries of a kind; entries not seen for `ttl` seconds are pruned."""
+        if ttl is not None:
+            self.storage.write("DELETE FROM registry WHERE kind = ? AND last_seen < ?", (kind, time.time() - ttl))
+        rows = self._conn().execute(
+            "SELECT name, pid, data, created_at, last_seen FROM registry WHERE kind = ? ORDER BY created_at", (kind,))
+        return [{'name': r[0], 'pid': r[1], 'data': json.loads(r[2] or '{}'), 'created_at': r[3], 'last_seen': r[4]} for r in rows]
+
+    # --- Rate limiting ---
+    def take_token(self, key, rate, capacity, cost=1.0):
+        """
+        Token bucket shared by every worker: refill at `rate` tokens/s up to `capacity`.
+        Returns (allowed, retry_after_seconds).
+        """
+        now = time.time()
+        with self.storage.transaction(immediate=True):
+            row = self._conn().execute("SELECT tokens, updated_at FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._conn().execute(
+                "INSERT INTO rate_limits (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens=excluded.tokens, updated_at=excluded.updated_at",
+                (key, tokens, now))
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / rate if rate > 0 else float('inf')
+
+    # --- Change notification ---
+    def notify(self, topic, payload=None):
+        return self.notify_many([(topic, payload)])
+
+    def notify_many(self, items):
+        """Insert [(topic, payload)] change rows in one transaction; returns the last change id."""
+        change_id = 0
+        with self.storage.transaction(immediate=True):
+            for topic, payload in items:
+                change_id = self.storage.write("INSERT INTO changes (ts, topic, origin, payload) VALUES (?, ?, ?, ?)",
+                                               (time.time(), topic, self.origin, json.dumps(payload, default=str))).lastrowid
+                if change_id % 500 == 0:
+                    self.storage.write("DELETE FROM changes WHERE id <= ?", (change_id - self.keep_changes,))
+        return change_id
+
+    def last_change_id(self):
+        row = self._conn().execute("SELECT MAX(id) FROM changes").fetchone()
+        return row[0] or 0
+
+    def changes_since(self, last_id, limit=500):
+        rows = self._conn().execute(
+            "SELECT id, ts, topic, origin, payload FROM changes WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit))
+        return [{'id': r[0], 'ts': r[1], 'topic': r[2], 'origin': r[3], 'payload': json.loads(r[4]) if r[4] else None} for r in rows]
+
+
+class ChangeWatcher:
+    """
+    Background thread delivering change rows written by *other* processes to callbacks.
+    callback(topic, payload, origin) runs on the watcher thread.
+    on_tick() runs every interval (used for worker heartbeats).
+    """
+    def __init__(self, state, callback, interval=0.5, on_tick=None):
+        self.state = state
+        self.callback = callback
+        self.interval = interval
+        self.on_tick = on_tick
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_id = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.last_id = self.state.last_change_id()
+        self._thread = threading.Thread(target=self._run, name='shared-state-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def poll_once(self):
+        delivered = 0
+        for change in self.state.changes_since(self.last_id):
+            self.last_id = change['id']
+            if change['origin'] == self.state.origin:
+                continue
+            try:
+                self.callback(change['topic'], change['payload'], change['origin'])
+                delivered += 1
+            except Exception:
+                pass
+        return delivered
+
+    def _run(self):
+        conn = self.state._conn()
+        version = None
+        while not self._stop.is_set():
+            try:
+                current = conn.execute("PRAGMA data_version").fetchone()[0]
+                if current != version:
+                    version = current
+                    self.poll_once()
+                if self.on_tick:
+                    self.on_tick()
+            except Exception:
+                pass
+            self._stop.wait(self.interval)
+
+
+class ChangeForwarder:
+    """
+    Queues locally published events and writes them to the changes table from a background
+    thread, batching whatever accumulated since the last write into one transaction. put() never
+    touches SQLite, so it is safe to call from the event loop.
+    """
+    def __init__(self, state, max_batch=200):
+        self.state = state
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self.batches = 0
+
+    def put(self, topic, payload=None):
+        self._queue.put((topic, payload))
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='shared-state-forwarder', daemon=True)
+            self._thread.start()
+
+    def _drain(self, block=True):
+        try:
+            items = [self._queue.get() if block else self._queue.get_nowait()]
+        except queue.Empty:
+            return False
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = items[-1] is None
+        items = [item for item in items if item is not None]
+        if items:
+            try:
+                self.state.notify_many(items)
+                self.batches += 1
+            except Exception:
+                logger.exception("Could not forward %d events", len(items))
+        return not stop
+
+    def _run(self):
+        while self._drain():
+            pass
+
+    def stop(self):
+        """Write what is queued, then end the thread."""
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(5)
+        while self._drain(block=False):
+            pass
+
+
+_default_state = None
+
+
+def get_shared_state():
+    global _default_state
+    if _default_state is None:
+        _default_state = SharedState()
+    return _default_state
@@ -0,0 +1,368 @@
+"""
+Speculative execution of read-only planned commands.
+
+/chat plans a command and /approve runs it once a human accepts. For commands the policy
+below proves read-only, the server starts the run in the background as soon as the plan
+exists and keeps the result keyed by (device, command), so approving it returns at once.
+
+The policy is an allow-list, not a deny-list: anything it does not understand is treated
+as mutating and never runs before approval. Shell metacharacters, sudo, redirections,
+command substitution and paths outside READ_PATHS all disqualify a command.
+
+    if speculative.start(device, cmd, run):     # after planning
+        ...
+    output = await speculative.take_async(device, cmd)   # in /approve; None on a miss
+"""
+import asyncio
+import os
+import posixpath
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.metrics import CACHE_REQUESTS, counter
+
+SPECULATIONS = counter('speculative_runs_total', 'Speculative command runs by outcome', ['result'])
+
+# Readable trees for cat/head/tail/ls/wc; override with a colon-separated SPECULATE_READ_PATHS
+READ_PATHS = tuple(p.rstrip('/') or '/' for p in os.getenv(
+    'SPECULATE_READ_PATHS', '/proc:/sys/class:/etc/os-release:/etc/hostname:/var/log:/home:/tmp:/boot/config.txt'
+).split(':') if p)
+
+# Readable but blocking (or consuming) on read
+_NEVER = ('/proc/kmsg', '/proc/sysrq-trigger')
+
+_META = set(';&|<>`$\\\n\r(){}*?[]~!#')
+
+
+def _flags(args):
+    return [a for a in args if a.startswith('-')]
+
+
+def _operands(args):
+    return [a for a in args if not a.startswith('-')]
+
+
+def path_allowed(path):
+    """True for absolute, normalised paths inside READ_PATHS."""
+    if not path.startswith('/') or '..' in path.split('/'):
+        return False
+    path = posixpath.normpath(path)
+    if path in _NEVER:
+        return False
+    return any(path == root or path.startswith(root.rstrip('/') + '/') for root in READ_PATHS)
+
+
+def _no_args(args):
+    return not args
+
+
+def _df(args):
+    return all(a.startswith('-') or path_allowed(a) for a in args)
+
+
+def _free(args):
+    # -s/-c would repeat forever or N times; everything else only changes units
+    long_ok = ('--bytes', '--kilo', '--mega', '--giga', '--human', '--si', '--lohi', '--total', '--wide')
+    return all(a in long_ok or (a.startswith('-') and not a.startswith('--') and set(a[1:]) <= set('bkmghltw'))
+               for a in args)
+
+
+def _uptime(args):
+    return all(a in ('-p', '--pretty', '-s', '--since') for a in args)
+
+
+def _hostname(args):
+    # Without a flag, `hostname NAME` sets the hostname
+    return all(a in ('-f', '-i', '-I', '-s', '-d', '--fqdn', '--short') for a in args)
+
+
+def _uname(args):
+    return all(a.startswith('-') for a in args)
+
+
+_FOLLOW = ('--follow', '-f', '-F', '--retry')
+
+
+def _follows(args):
+    """tail -f / -F / --follow (also inside a short-flag cluster like -fn)."""
+    return any(f in _FOLLOW or (not f.startswith('--') and set(f[1:]) & set('fF')) for f in _flags(args))
+
+
+def _files(follow=False):
+    def check(args):
+        if follow and _follows(args):
+            return False
+        # head/tail -n N: the count is an operand, not a path
+        paths = [p for p in _operands(args) if not p.isdigit()]
+        return bool(paths) and all(path_allowed(p) for p in paths)
+    return check
+
+
+def _ls(args):
+    return all(path_allowed(p) for p in _operands(args))
+
+
+def _systemctl(args):
+    ops = _operands(args)
+    if not ops or ops[0] not in ('status', 'is-active', 'is-enabled', 'is-failed', 'list-units', 'list-timers'):
+        return False
+    return all(f in ('--no-pager', '-l', '--full', '--all', '-a', '--failed', '--user') or f.startswith('--lines=') or f.startswith('-n')
+               for f in _flags(args))
+
+
+def _vcgencmd(args):
+    ops = _operands(args)
+    return len(ops) >= 1 and ops[0] in ('measure_temp', 'get_throttled', 'measure_volts', 'measure_clock', 'get_mem')
+
+
+# Output-format options only; -b/-batch, -force and -n/-netns would run or redirect other commands
+_IP_OPTIONS = ('-4', '-6', '-br', '-brief', '-j', '-json', '-s', '-stats', '-d', '-details', '-o', '-oneline',
+               '-c', '-color', '-p', '-pretty')
+
+
+def _ip(args):
+    if not all(f in _IP_OPTIONS for f in _flags(args)):
+        return False
+    ops = _operands(args)
+    if not ops or ops[0] not in ('a', 'addr', 'address', 'link', 'route', 'r', 'neigh'):
+        return False
+    return ops[1:] in ([], ['show'], ['list']) or (len(ops) >= 2 and ops[1] in ('show', 'list'))
+
+
+def _lsb_release(args):
+    return all(a.startswith('-') for a in args)
+
+
+def _tailscale(args):
+    # Flags are allow-listed: `status --web` would start a long-running web server
+    ops, flags = _operands(args), _flags(args)
+    if ops[:1] == ['ip']:
+        return len(ops) <= 2 and all(f in ('-4', '-6') for f in flags)  # `tailscale ip [peer]`
+    return (len(ops) == 1 and ops[0] in ('status', 'version', 'netcheck')
+            and all(f in ('--json', '--peers', '--self', '--active') for f in flags))
+
+
+def _crontab(args):
+    # `crontab FILE` and `crontab -r` replace or delete the table
+    return args == ['-l']
+
+
+def _any_args(args):
+    return True
+
+
+POLICY = {
+    'df': _df, 'free': _free, 'uptime': _uptime, 'hostname': _hostname, 'uname': _uname,
+    'whoami': _no_args, 'id': _no_args, 'lscpu': _no_args, 'lsusb': _no_args, 'lsblk': _uname, 'nproc': _no_args,
+    'ls': _ls, 'cat': _files(), 'head': _files(), 'wc': _files(),
+    'tail': _files(follow=True),
+    'systemctl': _systemctl, 'vcgencmd': _vcgencmd, 'ip': _ip,
+    'lsb_release': _lsb_release, 'tailscale': _tailscale, 'crontab': _crontab, 'ps': _any_args,
+}
+
+
+# Filters allowed after the first command of a pipeline: they read stdin only and write stdout only.
+# Each one lists the options it may take; anything else (unknown flags, file operands) is refused.
+def _filter(short='', valued='', long=(), long_valued=(), long_optional=(), numeric=False, pattern=False):
+    """short/valued: single-letter flags without/with a value; long*: --name options (optional = only as
+    --name=value); numeric: legacy `head -5`; pattern: grep's one pattern operand (unless -e was given)."""
+    def check(args):
+        operands, has_e, i = [], False, 0
+        while i < len(args):
+            arg = args[i]
+            i += 1
+            if arg.startswith('--'):
+                name, eq, _ = arg[2:].partition('=')
+                if name in long and not eq or name in long_optional:
+                    continue
+                if name not in long_valued:
+                    return False
+                if not eq:
+                    if i >= len(args):
+                        return False
+                    i += 1
+                continue
+            if arg.startswith('-') and len(arg) > 1:
+                if numeric and arg[1:].isdigit():
+                    continue
+                for pos, flag in enumerate(arg[1:], 1):
+                    if flag in valued:
+                        has_e = has_e or flag == 'e'
+                        if pos == len(arg) - 1:  # value is the next word
+                            if i >= len(args):
+                                return False
+                            i += 1
+                        break
+                    if flag not in short:
+                        return False
+                continue
+            operands.append(arg)
+        return len(operands) <= (1 if pattern and not has_e else 0)
+    return check
+
+
+_HEAD_TAIL = dict(short='qvz', valued='nc', long=('quiet', 'silent', 'verbose', 'zero-terminated'),
+                  long_valued=('lines', 'bytes'), numeric=True)
+FILTERS = {
+    'head': _filter(**_HEAD_TAIL),
+    'tail': _filter(**_HEAD_TAIL),  # no -f/-F/--follow/--pid: a watch must terminate
+    'wc': _filter(short='clmwL', long=('bytes', 'chars', 'lines', 'words', 'max-line-length')),
+    'sort': _filter(short='bdfghiMnrRsuVz', valued='kt',
+                    long=('ignore-leading-blanks', 'dictionary-order', 'ignore-case', 'general-numeric-sort',
+                          'human-numeric-sort', 'month-sort', 'numeric-sort', 'random-sort', 'reverse', 'stable',
+                          'unique', 'version-sort', 'zero-terminated'),
+                    long_valued=('key', 'field-separator')),
+    'uniq': _filter(short='cdDiuz', valued='fsw',
+                    long=('count', 'repeated', 'ignore-case', 'unique', 'zero-terminated'),
+                    long_valued=('skip-fields', 'skip-chars', 'check-chars')),
+    'grep': _filter(short='EFGPiyvwxcLloqsbhHnTZaUz', valued='emABC',
+                    long=('extended-regexp', 'fixed-strings', 'basic-regexp', 'perl-regexp', 'ignore-case',
+                          'no-ignore-case', 'invert-match', 'word-regexp', 'line-regexp', 'count', 'only-matching',
+                          'quiet', 'silent', 'no-messages', 'byte-offset', 'with-filename', 'no-filename',
+                          'line-number', 'initial-tab', 'null', 'text', 'binary', 'null-data',
+                          'files-with-matches', 'files-without-match', 'color', 'colour', 'line-buffered'),
+                    long_valued=('regexp', 'max-count', 'after-context', 'before-context', 'context', 'label'),
+                    long_optional=('color', 'colour'), pattern=True),
+}
+
+
+def is_read_only_pipeline(cmd):
+    """is_read_only(), also accepting `cmd | filter | ...` where every filter is a stdin-only FILTERS entry."""
+    if not cmd or not isinstance(cmd, str) or '||' in cmd or '|&' in cmd:
+        return False
+    first, *filters = cmd.split('|')
+    if not is_read_only(first.strip()):
+        return False
+    for segment in filters:
+        segment = segment.strip()
+        if not segment or any(c in _META for c in segment):
+            return False
+        try:
+            words = shlex.split(segment)
+        except ValueError:
+            return False
+        check = FILTERS.get(words[0]) if words else None
+        if not (check and check(words[1:])):
+            return False
+    return True
+
+
+def is_read_only(cmd):
+    """True only when every word of cmd is understood and the command cannot change device state."""
+    if not cmd or not isinstance(cmd, str) or any(c in _META for c in cmd):
+        return False
+    try:
+        words = shlex.split(cmd)
+    except ValueError:
+        return False
+    if not words or '=' in words[0]:
+        return False
+    check = POLICY.get(words[0])
+    return bool(check and check(words[1:]))
+
+
+class SpeculativeCache:
+    """
+    Background results keyed by (device, command).
+    ttl: seconds a finished result stays usable (outputs like uptime go stale).
+    workers: parallel speculative runs; kept small so speculation never crowds out real work.
+    """
+    def __init__(self, ttl=30.0, workers=2, max_entries=256, policy=is_read_only):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.policy = policy
+        self._workers = workers
+        self._executor = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='speculate')
+        return self._executor
+
+    def _prune(self, now):
+        for key, (future, started) in list(self._entries.items()):
+            if future.done() and now - started > self.ttl:
+                del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    def start(self, device, cmd, run):
+        """Run run(cmd) in the background if the policy proves cmd read-only. Returns True if a run is (already) in flight."""
+        if not self.policy(cmd):
+            SPECULATIONS.labels(result='refused').inc()
+            return False
+        key = (str(device), cmd)
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            if key in self._entries:
+                return True
+            self._entries[key] = (self._pool().submit(run, cmd), now)
+        SPECULATIONS.labels(result='started').inc()
+        return True
+
+    def _claim(self, device, cmd):
+        key = (str(device), cmd)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        future, started = entry
+        if future.done() and time.time() - started > self.ttl:
+            SPECULATIONS.labels(result='expired').inc()
+            return None
+        return future
+
+    def take(self, device, cmd, timeout=None):
+        """Consume the result for (device, cmd), waiting up to timeout for a run in flight. None on a miss or failure."""
+        future = self._claim(device, cmd)
+        if future is None:
+            return self._miss()
+        try:
+            output = future.result(timeout)
+        except Exception:
+            return self._failed()
+        return self._hit(output)
+
+    async def take_async(self, device, cmd, timeout=None):
+        """take() for the event loop: awaits a run in flight without blocking it."""
+        future = self._claim(device, cmd)
+        if future is None:
+            return self._miss()
+        try:
+            output = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except Exception:
+            return self._failed()
+        return self._hit(output)
+
+    def _hit(self, output):
+        CACHE_REQUESTS.labels(cache='speculative', result='hit').inc()
+        return output
+
+    def _miss(self):
+        CACHE_REQUESTS.labels(cache='speculative', result='miss').inc()
+        return None
+
+    def _failed(self):
+        SPECULATIONS.labels(result='failed').inc()
+        return self._miss()
+
+    def invalidate(self, device=None):
+        """Drop results for device (all devices when None), e.g. after a mutating command ran there."""
+        with self._lock:
+            for key in [k for k in self._entries if device is None or k[0] == str(device)]:
+                del self._entries[key]
+
+    def status(self):
+        now = time.time()
+        with self._lock:
+            return [{'device': d, 'command': c, 'done': f.done(), 'age': round(now - started, 1)}
+                    for (d, c), (f, started) in self._entries.items()]
+
+
+# Process-wide cache used by the web server
+speculative = SpeculativeCache(ttl=float(os.getenv('SPECULATE_TTL', 30)))
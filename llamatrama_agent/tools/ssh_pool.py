@@ -0,0 +1,191 @@
+"""
+Shared SSH transports keyed by (host, user).
+
+PersistentSSHSession opens a fresh connection and an interactive shell for every caller.
+The pool keeps one authenticated paramiko client per device and hands out lightweight
+exec channels on top of it, so many concurrent streams to the same Pi share a single
+TCP connection and a single SSH handshake.
+"""
+import os
+import socket
+import threading
+import time
+
+from tools.metrics import SSH_CONNECT, SSH_CONNECT_FAILURES, CACHE_REQUESTS
+from tools.health import health
+from tools.result_cache import result_cache
+
+
+def _default_connect(host, user, password=None, key_path=None, timeout=10):
+    """Open an authenticated paramiko SSHClient (key first, then password), like PersistentSSHSession."""
+    import paramiko
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+    def attempt(**auth):
+        health.before_connect(host)
+        t0 = time.perf_counter()
+        try:
+            sock = socket.create_connection((str(host), 22), timeout=timeout)
+        except OSError as e:
+            SSH_CONNECT_FAILURES.labels(host=str(host)).inc()
+            health.record_failure(host, e)
+            raise
+        t1 = time.perf_counter()
+        SSH_CONNECT.labels(host=str(host), stage='tcp').observe(t1 - t0)
+        health.record_success(host, t1 - t0)
+        try:
+            ssh.connect(str(host), username=str(user), sock=sock, timeout=timeout, **auth)
+        except Exception:
+            sock.close()
+            SSH_CONNECT_FAILURES.labels(host=str(host)).inc()
+            raise
+        SSH_CONNECT.labels(host=str(host), stage='auth').observe(time.perf_counter() - t1)
+
+    if key_path and os.path.exists(key_path):
+        try:
+            attempt(pkey=paramiko.RSAKey.from_private_key_file(key_path))
+            return ssh
+        except paramiko.AuthenticationException:
+            pass
+    if password:
+        try:
+            attempt(password=password)
+            return ssh
+        except paramiko.AuthenticationException as e:
+            ssh.close()
+            raise RuntimeError(f"Authentication failed: {e}") from e
+    ssh.close()
+    raise RuntimeError("Authentication failed: No valid SSH key or password, or credentials are incorrect.")
+
+
+class SSHTransportPool:
+    """
+    Keeps one live SSH client per (host, user) and opens exec channels on it.
+    Clients idle for longer than idle_timeout are closed by prune().
+    connect: factory(host, user, password, key_path, timeout) -> client; overridable for tests.
+    """
+    def __init__(self, idle_timeout=300, connect_timeout=10, connect=None):
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._connect = connect or _default_connect
+        self._clients = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def _key(self, host, user):
+        return (str(host), str(user or ''))
+
+    @staticmethod
+    def _alive(client):
+        transport = client.get_transport() if hasattr(client, 'get_transport') else None
+        return bool(transport and transport.is_active())
+
+    def get_client(self, host, user, password=None, key_path=None):
+        """Return a connected client for (host, user), reusing a live one when possible."""
+        key = self._key(host, user)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None and self._alive(client):
+                self._last_used[key] = time.time()
+                CACHE_REQUESTS.labels(cache='ssh_pool', result='hit').inc()
+                return client
+            CACHE_REQUESTS.labels(cache='ssh_pool', result='miss').inc()
+            if client is not None:
+                self._clients.pop(key, None)
+                try:
+                    client.close()
+                except Exception:
+                    pass
+        # Connect outside the lock so one slow host doesn't block every other device
+        client = self._connect(host, user, password=password,
+                               key_path=key_path or os.getenv("SSH_KEY_PATH", os.path.expanduser("~/.ssh/id_rsa")),
+                               timeout=self.connect_timeout)
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None and self._alive(existing):
+                # Another caller won the race; keep theirs
+                try:
+                    client.close()
+                except Exception:
+                    pass
+                client = existing
+            else:
+                self._clients[key] = client
+            self._last_used[key] = time.time()
+        return client
+
+    def open_exec(self, host, user, command, password=None, key_path=None, pty=False):
+        """Open a new channel on the pooled transport and start `command` on it."""
+        result_cache.observe(host, command)
+        client = self.get_client(host, user, password=password, key_path=key_path)
+        channel = client.get_transport().open_session()
+        if pty:
+            channel.get_pty()
+        channel.set_combine_stderr(True)
+        channel.exec_command(command)
+        return channel
+
+    def run(self, host, user, command, password=None, key_path=None, timeout=10):
+        """Run a command to completion on a pooled transport. Returns (exit_code, output)."""
+        channel = self.open_exec(host, user, command, password=password, key_path=key_path)
+        channel.settimeout(timeout)
+        chunks = []
+        try:
+            while True:
+                data = channel.recv(4096)
+                if not data:
+                    break
+                chunks.append(data)
+            code = channel.recv_exit_status()
+        finally:
+            channel.close()
+        return code, b"".join(chunks).decode(errors="ignore")
+
+    def discard(self, host, user):
+        """Drop (and close) the pooled client for a device, e.g. after a transport error."""
+        key = self._key(host, user)
+        with self._lock:
+            client = self._clients.pop(key, None)
+            self._last_used.pop(key, None)
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def prune(self):
+        """Close clients that are dead or have been idle longer than idle_timeout."""
+        now = time.time()
+        stale = []
+        with self._lock:
+            for key, client in list(self._clients.items()):
+                if not self._alive(client) or now - self._last_used.get(key, 0) > self.idle_timeout:
+                    stale.append(self._clients.pop(key))
+                    self._last_used.pop(key, None)
+        for client in stale:
+            try:
+                client.close()
+            except Exception:
+                pass
+        return len(stale)
+
+    def close_all(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._last_used.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def hosts(self):
+        with self._lock:
+            return [{'host': h, 'user': u, 'idle': round(time.time() - self._last_used.get((h, u), 0), 1)}
+                    for (h, u) in self._clients]
+
+
+# Process-wide pool shared by the web server and the agent
+ssh_pool = SSHTransportPool()
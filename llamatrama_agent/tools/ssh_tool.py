@@ -22,7 +22,7 @@ def tailscale_file_send(session, file_path, destination):
 def pi_diagnostics(session):
     """
     Run a suite of diagnostic commands to verify Pi connectivity and core features.
-    Returns a dict of results.
+    Returns a dict of raw results plus 'parsed', their typed form (see tools.diagnostics).
     """
     results = {}
     try:
@@ -39,13 +39,22 @@ def pi_diagnostics(session):
         results['list_cron'] = pi_list_cron(session)
     except Exception as e:
         results['error'] = str(e)
+    from tools.diagnostics import parse_diagnostics
+    results['parsed'] = parse_diagnostics(results)
     return results
 # --- Raspberry Pi Management Features ---
 
 def pi_system_info(session):
-    """Get detailed system information (CPU, memory, disk, OS, uptime)."""
-    cmd = "uname -a && lsb_release -a && uptime && free -h && df -h && vcgencmd measure_temp"
-    return session.send_command(cmd)
+    """Get detailed system information (CPU, memory, disk, OS, uptime).
+    Static facts are refreshed incrementally through the facts cache; only uptime, memory
+    and temperature are read live."""
+    from tools.facts import facts_cache
+    try:
+        facts_cache.refresh(session.host, lambda script: session.send_command(script, timeout=15, cache=False))
+        summary = facts_cache.summary(session.host)
+    except Exception as e:
+        summary = f"[facts unavailable: {e}]"
+    return summary + "\n" + session.send_command("uptime && free -h && vcgencmd measure_temp")
 
 def pi_update_upgrade(session):
     """Update and upgrade all packages on the Pi."""
@@ -105,7 +114,8 @@ def pi_take_photo(session, filename="image.jpg"):
     return session.send_command(f"raspistill -o {filename}")
 
 def pi_schedule_task(session, cron_line):
-    """Add a cron job (provide full cron line, e.g., '* * * * * command')."""
+    """Add a cron job on this device (full cron line, e.g., '* * * * * command').
+    Fleet-wide schedules with jitter and a central run history live in tools/scheduler.py."""
     return session.send_command(f'(crontab -l; echo "{cron_line}") | crontab -')
 
 def pi_list_cron(session):
@@ -213,11 +223,16 @@ def copy_file(session, src, dest):
     """Copy a file."""
     cmd = f"cp {src} {dest}"
     return session.send_command(cmd)
-import paramiko
 import os
+import re
+import socket
 import threading  # Removed, not used
 import time
 from dotenv import load_dotenv
+from tools.metrics import SSH_CONNECT, SSH_CONNECT_FAILURES, SSH_COMMAND, SSH_COMMAND_BYTES
+from tools.tracing import traced, current_span
+from tools.health import health, HostUnavailable
+from tools.result_cache import result_cache, CommandResult
 
 load_dotenv()
 
@@ -291,6 +306,7 @@ class PersistentSSHSession:
     Allows command chaining, stateful execution, and interactive prompt handling.
     """
     def __init__(self, host=None, user=None, password=None, key_path=None):
+        import paramiko  # imported on first session so importing this module stays cheap
         self.ssh = paramiko.SSHClient()
         self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         self.connected = False
@@ -299,14 +315,44 @@ class PersistentSSHSession:
         self.user = user or SSH_USER
         self.password = password or SSH_PASSWORD
         self.key_path = key_path or SSH_KEY_PATH
+        self._agent = None     # AgentClient, False once probed absent, None before probing
+        self._shell_state = False
+        self.cwd = None
         self._connect()
 
+    def _timed_connect(self, **auth):
+        """ssh.connect over our own socket so TCP connect and handshake+auth are timed separately."""
+        host = str(self.host)
+        health.before_connect(host)  # fails fast while the host's circuit is open
+        t0 = time.perf_counter()
+        try:
+            sock = socket.create_connection((host, 22), timeout=10)
+        except OSError as e:
+            SSH_CONNECT_FAILURES.labels(host=host).inc()
+            health.record_failure(host, e)
+            raise
+        t1 = time.perf_counter()
+        SSH_CONNECT.labels(host=host, stage='tcp').observe(t1 - t0)
+        health.record_success(host, t1 - t0)
+        try:
+            self.ssh.connect(host, username=str(self.user), sock=sock, timeout=10, **auth)
+        except Exception:
+            sock.close()
+            SSH_CONNECT_FAILURES.labels(host=host).inc()
+            raise
+        SSH_CONNECT.labels(host=host, stage='auth').observe(time.perf_counter() - t1)
+
+    @traced('ssh.connect')
     def _connect(self):
+        import paramiko
+        span = current_span()
+        if span:
+            span.set(host=str(self.host), user=str(self.user))
         try:
             if self.key_path and os.path.exists(self.key_path):
                 try:
                     key = paramiko.RSAKey.from_private_key_file(self.key_path)
-                    self.ssh.connect(str(self.host), username=str(self.user), pkey=key, timeout=10)
+                    self._timed_connect(pkey=key)
                     self.connected = True
                 except paramiko.PasswordRequiredException as e:
                     raise RuntimeError(f"SSH key requires a password: {e}") from e
@@ -318,7 +364,7 @@ class PersistentSSHSession:
                     raise RuntimeError(f"SSH key file not found: {e}") from e
             if not self.connected and self.password:
                 try:
-                    self.ssh.connect(str(self.host), username=str(self.user), password=self.password, timeout=10)
+                    self._timed_connect(password=self.password)
                     self.connected = True
                 except paramiko.AuthenticationException as e:
                     self.ssh.close()
@@ -329,9 +375,14 @@ class PersistentSSHSession:
             if not self.connected:
                 self.ssh.close()
                 raise RuntimeError("Authentication failed: No valid SSH key or password, or credentials are incorrect.")
+            t0 = time.perf_counter()
             self.shell = self.ssh.invoke_shell()
             time.sleep(1)  # Let shell initialize
             self._flush_shell()
+            SSH_CONNECT.labels(host=str(self.host), stage='shell').observe(time.perf_counter() - t0)
+        except HostUnavailable:
+            self.ssh.close()
+            raise
         except Exception as e:
             self.ssh.close()
             raise RuntimeError(f"SSH connection error: {e}")
@@ -342,22 +393,82 @@ class PersistentSSHSession:
             self.shell.recv(4096)
 
     def close(self):
+        if self._agent:
+            self._agent.close()
         if self.shell:
             self.shell.close()
         self.ssh.close()
 
-    def send_command(self, command, responses=None, timeout=10, expect_prompt=None):
+    def agent(self):
+        """The resident device agent on this connection (tools/device_agent.py), or None when it is not
+        installed, disabled (DEVICE_AGENT=off) or its channel died."""
+        from tools.device_agent import agent_enabled, attach
+        if self._agent is None and agent_enabled():
+            def open_channel(command):
+                channel = self.ssh.get_transport().open_session()
+                channel.exec_command(command)
+                return channel
+            self._agent = attach(open_channel) or False
+        if self._agent and not self._agent.alive:
+            self._agent = False
+        return self._agent or None
+
+    def _agent_command(self, agent, command, timeout, kill_after=None):
+        """Run through the agent: returns as soon as the command exits, or with the output so far after
+        timeout seconds while it keeps running (as the shell path does); cd carries over via self.cwd."""
+        result = agent.exec(command, timeout=timeout, cwd=self.cwd, kill_after=kill_after)
+        self.cwd = result.get('cwd') or self.cwd
+        output = result.get('stdout', '') + result.get('stderr', '')
+        if result.get('killed'):
+            output += f"\n[TIMEOUT] Command killed after {kill_after}s"
+        elif result.get('running'):
+            output += f"\n[TIMEOUT] Command still running after {timeout}s"
+        return output
+
+    @traced('ssh.send_command')
+    def send_command(self, command, responses=None, timeout=10, expect_prompt=None, cache=True, kill_after=None):
         """
         Send a command to the persistent shell, handle interactive prompts, and return output.
         responses: list of responses to send if prompt detected.
         expect_prompt: regex pattern to match prompt.
+        timeout: how long to read output; a command still running then keeps going.
+        kill_after: optional hard limit; the command is interrupted once it has run this long.
+        cache: serve idempotent reads from the per-device result cache; False always runs
+        (and refreshes the entry). The output is a CommandResult carrying `cached` and `age`.
         """
         if not self.shell:
             raise RuntimeError("SSH shell not initialized.")
-        self.shell.send(command + '\n')
+        host = str(self.host)
+        span = current_span()
+        if span:
+            span.set(host=host, command=command)
+        if cache and not responses:
+            hit = result_cache.get(host, command)
+            if hit is not None:
+                if span:
+                    span.set(cached=True, age=hit.age)
+                return hit
+        result_cache.observe(host, command)  # a possibly mutating command invalidates the device
+        generation = result_cache.generation(host)
+        if _SHELL_STATE.match(command):
+            self._shell_state = True  # exports/aliases live in the pty shell: keep using it from now on
+        # sudo and full-screen programs need the pty (password prompt, terminal): they stay on the shell
+        agent = None if responses or self._shell_state or _NEEDS_TTY.search(command) else self.agent()
         output = ""
         start_time = time.time()
-        while True:
+        perf_start = time.perf_counter()
+        if agent:
+            from tools.device_agent import AgentUnavailable
+            try:
+                output = self._agent_command(agent, command, timeout, kill_after)
+            except TimeoutError as e:
+                output = f"[TIMEOUT] {e}"
+            except AgentUnavailable:
+                self._agent = False  # channel lost: this and later commands use the shell
+                agent = None
+        if not agent:
+            self.shell.send(command + '\n')
+        while not agent:
             if self.shell and self.shell.recv_ready():
                 chunk = self.shell.recv(4096).decode(errors="ignore")
                 output += chunk
@@ -368,35 +479,55 @@ class PersistentSSHSession:
                         for resp in responses:
                             self.shell.send(resp + '\n')
                             time.sleep(0.5)
+            if kill_after is not None and time.time() - start_time > kill_after:
+                self.shell.send('\x03')  # Ctrl-C
+                output += f"\n[TIMEOUT] Command killed after {kill_after}s"
+                break
             if time.time() - start_time > timeout:
                 break
             time.sleep(0.2)
-        return output
-
-def execute_remote_command(command: str, responses=None, validate=True) -> dict:
+        SSH_COMMAND.labels(host=str(self.host)).observe(time.perf_counter() - perf_start)
+        SSH_COMMAND_BYTES.labels(host=str(self.host)).inc(len(output))
+        if responses or not output.strip() or any(kw in output for kw in ERROR_KEYWORDS):
+            return CommandResult(output)  # interactive, empty or failed: never cached
+        return result_cache.put(host, command, output, generation)
+
+# Commands whose effect lives in the interactive shell's state, which the agent cannot carry over
+_SHELL_STATE = re.compile(r'^\s*(export|source|\.|alias|unalias|unset|set|shopt|ulimit|umask)\s')
+# Commands that need a terminal (sudo's password prompt, full-screen programs), anywhere in a chain
+_NEEDS_TTY = re.compile(r'(?:^|[;&|(`]|\$\()\s*(?:sudo|su|passwd|top|htop|less|more|man|vi|vim|nano|watch|ssh)(?:\s|$)')
+
+ERROR_KEYWORDS = [
+    "Permission denied", "command not found", "not recognized", "No such file or directory",
+    "Failed", "E:", "error:", "ERROR:", "Operation not permitted", "Could not", "is not installed"
+]
+
+def execute_remote_command(command: str, responses=None, validate=True, use_cache=True) -> dict:
     """
     Execute a command with chaining, validation, and feedback loop.
-    Returns dict: {output, error, status, attempted_commands}
+    Returns dict: {output, error, status, attempted_commands, cached}
+    Idempotent reads are answered from the result cache without connecting; use_cache=False forces a run.
     """
+    # Command chaining logic
+    chained_cmd = (
+        f"{command} || echo '[ERROR] Command failed'"
+    )
+    if use_cache and not responses:
+        hit = result_cache.get(SSH_HOST, chained_cmd)
+        if hit is not None:
+            return {"output": hit, "error": "", "status": "success", "attempted_commands": [chained_cmd], "cached": True}
     session = PersistentSSHSession()
     attempted = []
     output = ""
     error = ""
     status = "success"
-    # Command chaining logic
-    chained_cmd = (
-        f"{command} || echo '[ERROR] Command failed'"
-    )
     attempted.append(chained_cmd)
     try:
-        result = session.send_command(chained_cmd, responses=responses)
+        result = session.send_command(chained_cmd, responses=responses, cache=False)
         output = result
         # Improved response validation
         if validate:
-            error_keywords = [
-                "Permission denied", "command not found", "not recognized", "No such file or directory",
-                "Failed", "E:", "error:", "ERROR:", "Operation not permitted", "Could not", "is not installed"
-            ]
+            error_keywords = ERROR_KEYWORDS
             if any(kw in output for kw in error_keywords):
                 error = next(kw for kw in error_keywords if kw in output)
                 status = "error"
@@ -422,18 +553,23 @@ def execute_remote_command(command: str, responses=None, validate=True) -> dict:
         "output": output,
         "error": error,
         "status": status,
-        "attempted_commands": attempted
+        "attempted_commands": attempted,
+        "cached": False
     }
 
 def system_detection() -> dict:
     """
     Run system detection commands and return baseline info for Raspberry Pi.
     """
+    from tools.facts import facts_cache
     session = PersistentSSHSession()
-    cmd = "uname -a && whoami && pwd && hostname && ip addr"
-    output = session.send_command(cmd)
-    session.close()
-    return {"system_info": output}
+    try:
+        result = facts_cache.refresh(session.host, lambda script: session.send_command(script, timeout=15, cache=False))
+        identity = session.send_command("whoami && pwd")
+    finally:
+        session.close()
+    return {"system_info": facts_cache.summary(session.host) + "\n" + identity,
+            "facts": result['facts'], "changed": result['changed']}
 
 def stress_test_checks() -> dict:
     """
@@ -0,0 +1,747 @@
+"""
+Embedded SQLite storage for users, device credentials, jobs, audit records, session
+history, scheduled tasks, workflow runs and the agent's persistent memory.
+
+The database runs in WAL mode so the web server, the CLI agent and background workers
+can read while one of them writes. Schema changes are applied as numbered migrations
+tracked in PRAGMA user_version. All queries are parameterized module-level constants;
+sqlite3 keeps their compiled statements in a per-connection cache, so hot lookups
+(user by name, jobs by device) are not re-parsed on every request.
+
+Import the legacy JSON/markdown files with:
+    python -m tools.storage import
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB_PATH = os.getenv(
+    "LLAMA_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'llamatrama.db'),
+)
+
+MIGRATIONS = [
+    # 1: initial schema
+    """
+    CREATE TABLE users (
+        username TEXT PRIMARY KEY,
+        full_name TEXT,
+        hashed_password TEXT NOT NULL,
+        disabled INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE device_creds (
+        device TEXT PRIMARY KEY,
+        ssh_user TEXT,
+        ssh_password TEXT,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        device TEXT,
+        username TEXT,
+        command TEXT,
+        status TEXT NOT NULL DEFAULT 'running',
+        output TEXT,
+        error TEXT,
+        started_at REAL NOT NULL,
+        finished_at REAL
+    );
+    CREATE INDEX idx_jobs_device_time ON jobs(device, started_at);
+    CREATE INDEX idx_jobs_user_time ON jobs(username, started_at);
+    CREATE INDEX idx_jobs_time ON jobs(started_at);
+    CREATE TABLE audit (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        username TEXT,
+        device TEXT,
+        action TEXT NOT NULL,
+        detail TEXT
+    );
+    CREATE INDEX idx_audit_user_time ON audit(username, ts);
+    CREATE INDEX idx_audit_device_time ON audit(device, ts);
+    CREATE INDEX idx_audit_time ON audit(ts);
+    CREATE TABLE history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        source TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        prompt TEXT,
+        response TEXT
+    );
+    CREATE INDEX idx_history_time ON history(ts);
+    CREATE INDEX idx_history_source_time ON history(source, ts);
+    CREATE TABLE memory (
+        position INTEGER PRIMARY KEY,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL
+    );
+    CREATE TABLE meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """,
+    # 2: cross-process shared state (see tools/shared_state.py)
+    """
+    CREATE TABLE kv (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        expires_at REAL
+    );
+    CREATE TABLE registry (
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        pid INTEGER,
+        data TEXT,
+        created_at REAL NOT NULL,
+        last_seen REAL NOT NULL,
+        PRIMARY KEY (kind, name)
+    );
+    CREATE TABLE rate_limits (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        topic TEXT NOT NULL,
+        origin TEXT NOT NULL,
+        payload TEXT
+    );
+    """,
+    # 3: per-device facts cache (see tools/facts.py)
+    """
+    CREATE TABLE device_facts (
+        device TEXT NOT NULL,
+        section TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        data TEXT,
+        collected_at REAL NOT NULL,
+        checked_at REAL NOT NULL,
+        PRIMARY KEY (device, section)
+    );
+    """,
+    # 4: recurring fleet tasks and their run history (see tools/scheduler.py)
+    """
+    CREATE TABLE schedules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        spec TEXT NOT NULL,
+        enabled INTEGER NOT NULL DEFAULT 1,
+        next_run REAL,
+        created_by TEXT,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE schedule_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        schedule_id INTEGER NOT NULL REFERENCES schedules(id) ON DELETE CASCADE,
+        status TEXT NOT NULL,
+        due_at REAL NOT NULL,
+        started_at REAL NOT NULL,
+        finished_at REAL,
+        devices INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        detail TEXT
+    );
+    CREATE INDEX idx_schedule_runs_schedule_time ON schedule_runs(schedule_id, started_at);
+    CREATE INDEX idx_schedule_runs_time ON schedule_runs(started_at);
+    """,
+    # 5: DAG workflow runs with per-step state, for resumption (see tools/workflow.py)
+    """
+    CREATE TABLE workflow_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        spec TEXT NOT NULL,
+        status TEXT NOT NULL,
+        created_by TEXT,
+        owner TEXT,
+        heartbeat REAL,
+        started_at REAL NOT NULL,
+        finished_at REAL,
+        result TEXT
+    );
+    CREATE INDEX idx_workflow_runs_time ON workflow_runs(started_at);
+    CREATE INDEX idx_workflow_runs_status ON workflow_runs(status, heartbeat);
+    CREATE TABLE workflow_steps (
+        run_id INTEGER NOT NULL REFERENCES workflow_runs(id) ON DELETE CASCADE,
+        step_id TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        started_at REAL,
+        finished_at REAL,
+        PRIMARY KEY (run_id, step_id)
+    );
+    """,
+    # 6: history rows remember the markdown file they were imported from, so a re-import replaces them
+    """
+    ALTER TABLE history ADD COLUMN import_path TEXT;
+    CREATE INDEX idx_history_import_path ON history(import_path);
+    UPDATE history SET import_path = substr(source, 5) WHERE source LIKE 'cli:%';
+    DELETE FROM history WHERE source = 'web' AND kind = 'aggregate' AND id NOT IN (
+        SELECT MIN(id) FROM history WHERE source = 'web' AND kind = 'aggregate'
+        GROUP BY trim(response, ' ' || char(9, 10, 13)));
+    """,
+]
+
+# --- Statements ---
+SQL_GET_USER = "SELECT username, full_name, hashed_password, disabled FROM users WHERE username = ?"
+SQL_LIST_USERS = "SELECT username, full_name, hashed_password, disabled FROM users ORDER BY username"
+SQL_UPSERT_USER = (
+    "INSERT INTO users (username, full_name, hashed_password, disabled, updated_at) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT(username) DO UPDATE SET full_name=excluded.full_name, hashed_password=excluded.hashed_password, "
+    "disabled=excluded.disabled, updated_at=excluded.updated_at"
+)
+SQL_DELETE_USER = "DELETE FROM users WHERE username = ?"
+SQL_SET_PASSWORD = "UPDATE users SET hashed_password = ?, updated_at = ? WHERE username = ?"
+SQL_GET_CREDS = "SELECT device, ssh_user, ssh_password FROM device_creds WHERE device = ?"
+SQL_LIST_CREDS = "SELECT device, ssh_user, ssh_password FROM device_creds ORDER BY device"
+SQL_UPSERT_CREDS = (
+    "INSERT INTO device_creds (device, ssh_user, ssh_password, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(device) DO UPDATE SET ssh_user=excluded.ssh_user, ssh_password=excluded.ssh_password, updated_at=excluded.updated_at"
+)
+SQL_START_JOB = "INSERT INTO jobs (kind, device, username, command, status, started_at) VALUES (?, ?, ?, ?, 'running', ?)"
+SQL_FINISH_JOB = "UPDATE jobs SET status = ?, output = ?, error = ?, finished_at = ? WHERE id = ?"
+SQL_GET_JOB = "SELECT * FROM jobs WHERE id = ?"
+SQL_INSERT_AUDIT = "INSERT INTO audit (ts, username, device, action, detail) VALUES (?, ?, ?, ?, ?)"
+SQL_INSERT_HISTORY = "INSERT INTO history (ts, source, kind, prompt, response, import_path) VALUES (?, ?, ?, ?, ?, ?)"
+SQL_DELETE_IMPORTED_HISTORY = "DELETE FROM history WHERE import_path = ?"
+SQL_LIVE_AGGREGATES = "SELECT response FROM history WHERE source = 'web' AND kind = 'aggregate' AND import_path IS NULL"
+SQL_COUNT_MEMORY = "SELECT COUNT(*) FROM memory"
+SQL_INSERT_MEMORY = "INSERT OR REPLACE INTO memory (position, role, content) VALUES (?, ?, ?)"
+SQL_LIST_MEMORY = "SELECT role, content FROM memory ORDER BY position"
+SQL_GET_META = "SELECT value FROM meta WHERE key = ?"
+SQL_SET_META = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value"
+SQL_GET_FACTS = "SELECT section, hash, data, collected_at, checked_at FROM device_facts WHERE device = ?"
+SQL_UPSERT_FACT = (
+    "INSERT INTO device_facts (device, section, hash, data, collected_at, checked_at) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(device, section) DO UPDATE SET hash=excluded.hash, data=excluded.data, "
+    "collected_at=excluded.collected_at, checked_at=excluded.checked_at"
+)
+SQL_TOUCH_FACT = "UPDATE device_facts SET checked_at = ? WHERE device = ? AND section = ?"
+SQL_LIST_FACT_DEVICES = "SELECT device, MAX(checked_at) FROM device_facts GROUP BY device ORDER BY device"
+SQL_INSERT_SCHEDULE = "INSERT INTO schedules (name, spec, enabled, next_run, created_by, updated_at) VALUES (?, ?, ?, ?, ?, ?)"
+SQL_UPDATE_SCHEDULE = "UPDATE schedules SET name = ?, spec = ?, enabled = ?, next_run = ?, updated_at = ? WHERE id = ?"
+SQL_SET_NEXT_RUN = "UPDATE schedules SET next_run = ? WHERE id = ?"
+SQL_GET_SCHEDULE = "SELECT id, name, spec, enabled, next_run, created_by, updated_at FROM schedules WHERE id = ?"
+SQL_LIST_SCHEDULES = "SELECT id, name, spec, enabled, next_run, created_by, updated_at FROM schedules ORDER BY id"
+SQL_DELETE_SCHEDULE = "DELETE FROM schedules WHERE id = ?"
+SQL_START_SCHEDULE_RUN = (
+    "INSERT INTO schedule_runs (schedule_id, status, due_at, started_at, finished_at, devices, failed, detail) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_FINISH_SCHEDULE_RUN = "UPDATE schedule_runs SET status = ?, finished_at = ?, devices = ?, failed = ?, detail = ? WHERE id = ?"
+SQL_GET_SCHEDULE_RUN = "SELECT * FROM schedule_runs WHERE id = ?"
+SQL_ACTIVE_SCHEDULE_RUN = (
+    "SELECT id, started_at FROM schedule_runs WHERE schedule_id = ? AND status = 'running' ORDER BY id DESC LIMIT 1"
+)
+SQL_INSERT_WORKFLOW_RUN = (
+    "INSERT INTO workflow_runs (name, spec, status, created_by, owner, heartbeat, started_at) VALUES (?, ?, 'running', ?, ?, ?, ?)"
+)
+SQL_INSERT_WORKFLOW_STEP = "INSERT INTO workflow_steps (run_id, step_id, status) VALUES (?, ?, 'pending')"
+SQL_UPDATE_WORKFLOW_STEP = (
+    "UPDATE workflow_steps SET status = ?, attempts = ?, result = ?, error = ?, started_at = ?, finished_at = ? "
+    "WHERE run_id = ? AND step_id = ?"
+)
+SQL_FINISH_WORKFLOW_RUN = "UPDATE workflow_runs SET status = ?, result = ?, finished_at = ?, owner = NULL WHERE id = ?"
+SQL_CLAIM_WORKFLOW_RUN = (
+    "UPDATE workflow_runs SET owner = ?, heartbeat = ? WHERE id = ? AND status = 'running' "
+    "AND (owner IS NULL OR owner = ? OR heartbeat < ?)"
+)
+SQL_HEARTBEAT_WORKFLOW_RUN = "UPDATE workflow_runs SET heartbeat = ? WHERE id = ? AND owner = ?"
+SQL_STALE_WORKFLOW_RUNS = "SELECT id FROM workflow_runs WHERE status = 'running' AND (owner IS NULL OR heartbeat < ?) ORDER BY id"
+SQL_GET_WORKFLOW_RUN = "SELECT * FROM workflow_runs WHERE id = ?"
+SQL_LIST_WORKFLOW_STEPS = (
+    "SELECT step_id, status, attempts, result, error, started_at, finished_at FROM workflow_steps WHERE run_id = ?"
+)
+SQL_PRUNE_SCHEDULE_RUNS = (
+    "DELETE FROM schedule_runs WHERE schedule_id = ? AND (started_at < ? OR id NOT IN "
+    "(SELECT id FROM schedule_runs WHERE schedule_id = ? ORDER BY id DESC LIMIT ?))"
+)
+
+
+def _user_row(row):
+    if row is None:
+        return None
+    return {'username': row[0], 'full_name': row[1], 'hashed_password': row[2], 'disabled': bool(row[3])}
+
+
+def _schedule_row(row):
+    if row is None:
+        return None
+    return {'id': row[0], 'name': row[1], 'spec': json.loads(row[2]), 'enabled': bool(row[3]), 'next_run': row[4],
+            'created_by': row[5], 'updated_at': row[6]}
+
+
+def _run_row(row):
+    row['detail'] = json.loads(row['detail']) if row.get('detail') else None
+    return row
+
+
+class Storage:
+    """
+    Thread-safe access to the SQLite database: every thread gets its own connection.
+    Write helpers commit immediately; use `with storage.transaction():` to group writes.
+    """
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_DB_PATH
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        self._migrate()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, cached_statements=256, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def transaction(self, immediate=False):
+        """Group writes; immediate=True takes the write lock up front (for read-modify-write)."""
+        return _Transaction(self.connection(), immediate=immediate)
+
+    def _migrate(self):
+        conn = self.connection()
+        with _Transaction(conn, immediate=True):
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in script.split(';'):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+
+    def schema_version(self):
+        return self.connection().execute("PRAGMA user_version").fetchone()[0]
+
+    def write(self, sql, params=()):
+        """Execute one write statement, committing it unless a transaction is already open."""
+        conn = self.connection()
+        if conn.in_transaction:
+            return conn.execute(sql, params)
+        with _Transaction(conn):
+            return conn.execute(sql, params)
+
+    # --- Users ---
+    def get_user(self, username):
+        return _user_row(self.connection().execute(SQL_GET_USER, (username,)).fetchone())
+
+    def list_users(self):
+        return [_user_row(r) for r in self.connection().execute(SQL_LIST_USERS)]
+
+    def upsert_user(self, user):
+        self.write(SQL_UPSERT_USER, (user['username'], user.get('full_name'), user.get('hashed_password', ''),
+                                      int(bool(user.get('disabled'))), time.time()))
+
+    def delete_user(self, username):
+        self.write(SQL_DELETE_USER, (username,))
+
+    def set_password(self, username, hashed_password):
+        return self.write(SQL_SET_PASSWORD, (hashed_password, time.time(), username)).rowcount > 0
+
+    # --- Device credentials ---
+    def get_device_creds(self, device):
+        row = self.connection().execute(SQL_GET_CREDS, (device,)).fetchone()
+        return {'ssh_user': row[1], 'ssh_password': row[2]} if row else None
+
+    def all_device_creds(self):
+        return {r[0]: {'ssh_user': r[1], 'ssh_password': r[2]} for r in self.connection().execute(SQL_LIST_CREDS)}
+
+    def save_device_creds(self, device, ssh_user, ssh_password=None):
+        self.write(SQL_UPSERT_CREDS, (device, ssh_user, ssh_password, time.time()))
+
+    # --- Jobs ---
+    def start_job(self, kind, command=None, device=None, username=None):
+        return self.write(SQL_START_JOB, (kind, device, username, command, time.time())).lastrowid
+
+    def finish_job(self, job_id, status='ok', output=None, error=None):
+        self.write(SQL_FINISH_JOB, (status, output, error, time.time(), job_id))
+
+    def get_job(self, job_id):
+        cur = self.connection().execute(SQL_GET_JOB, (job_id,))
+        row = cur.fetchone()
+        return dict(zip([c[0] for c in cur.description], row)) if row else None
+
+    def list_jobs(self, device=None, username=None, since=None, until=None, limit=100):
+        """Newest-first job history; filters map onto the device/user/time indexes."""
+        return self._select('jobs', 'started_at', {'device': device, 'username': username}, since, until, limit)
+
+    # --- Audit ---
+    def audit(self, action, username=None, device=None, detail=None):
+        if detail is not None and not isinstance(detail, str):
+            detail = json.dumps(detail, ensure_ascii=False, default=str)
+        return self.write(SQL_INSERT_AUDIT, (time.time(), username, device, action, detail)).lastrowid
+
+    def list_audit(self, username=None, device=None, since=None, until=None, limit=100):
+        return self._select('audit', 'ts', {'username': username, 'device': device}, since, until, limit)
+
+    # --- Session history ---
+    def add_history(self, source, kind, prompt=None, response=None, ts=None, import_path=None):
+        return self.write(SQL_INSERT_HISTORY, (ts or time.time(), source, kind, prompt, response, import_path)).lastrowid
+
+    def replace_history(self, import_path, source, kind, pairs, ts=None):
+        """Replace the rows recorded from import_path with (prompt, response) pairs."""
+        with self.transaction():
+            self.write(SQL_DELETE_IMPORTED_HISTORY, (import_path,))
+            for prompt, response in pairs:
+                self.add_history(source, kind, prompt=prompt, response=response, ts=ts, import_path=import_path)
+        return len(pairs)
+
+    def list_history(self, source=None, since=None, until=None, limit=100):
+        return self._select('history', 'ts', {'source': source}, since, until, limit)
+
+    def _select(self, table, time_col, equals, since, until, limit):
+        clauses, params = [], []
+        for col, val in equals.items():
+            if val is not None:
+                clauses.append(f"{col} = ?")
+                params.append(val)
+        if since is not None:
+            clauses.append(f"{time_col} >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"{time_col} < ?")
+            params.append(until)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        params.append(max(1, min(int(limit), 1000)))
+        cur = self.connection().execute(f"SELECT * FROM {table}{where} ORDER BY {time_col} DESC, id DESC LIMIT ?", params)
+        cols = [c[0] for c in cur.description]
+        return [dict(zip(cols, row)) for row in cur]
+
+    # --- Agent memory ---
+    def load_memory(self):
+        return [{'role': r[0], 'content': r[1]} for r in self.connection().execute(SQL_LIST_MEMORY)]
+
+    def save_memory(self, messages):
+        """Persist a chat history; only messages past the stored length are written."""
+        conn = self.connection()
+        with self.transaction():
+            stored = conn.execute(SQL_COUNT_MEMORY).fetchone()[0]
+            for position, msg in enumerate(messages[stored:], start=stored):
+                conn.execute(SQL_INSERT_MEMORY, (position, msg.get('role', 'user'), str(msg.get('content', ''))))
+
+    # --- Meta ---
+    def get_meta(self, key, default=None):
+        row = self.connection().execute(SQL_GET_META, (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.write(SQL_SET_META, (key, str(value)))
+
+    # --- Device facts ---
+    def get_facts(self, device):
+        """{section: {hash, data, collected_at, checked_at}} for one device; data is decoded JSON."""
+        return {r[0]: {'hash': r[1], 'data': json.loads(r[2]) if r[2] else None, 'collected_at': r[3], 'checked_at': r[4]}
+                for r in self.connection().execute(SQL_GET_FACTS, (device,))}
+
+    def save_facts(self, device, changed, unchanged=()):
+        """Store changed sections ({section: (hash, data)}) and mark unchanged ones as re-checked."""
+        now = time.time()
+        with self.transaction():
+            for section, (digest, data) in changed.items():
+                self.write(SQL_UPSERT_FACT, (device, section, digest, json.dumps(data, ensure_ascii=False), now, now))
+            for section in unchanged:
+                self.write(SQL_TOUCH_FACT, (now, device, section))
+
+    def list_fact_devices(self):
+        return [{'device': r[0], 'checked_at': r[1]} for r in self.connection().execute(SQL_LIST_FACT_DEVICES)]
+
+    # --- Schedules ---
+    def add_schedule(self, name, spec, enabled=True, next_run=None, created_by=None):
+        return self.write(SQL_INSERT_SCHEDULE, (name, json.dumps(spec), int(bool(enabled)), next_run, created_by,
+                                                time.time())).lastrowid
+
+    def update_schedule(self, schedule_id, name, spec, enabled, next_run):
+        return self.write(SQL_UPDATE_SCHEDULE, (name, json.dumps(spec), int(bool(enabled)), next_run, time.time(),
+                                                schedule_id)).rowcount > 0
+
+    def set_next_run(self, schedule_id, next_run):
+        self.write(SQL_SET_NEXT_RUN, (next_run, schedule_id))
+
+    def get_schedule(self, schedule_id):
+        return _schedule_row(self.connection().execute(SQL_GET_SCHEDULE, (schedule_id,)).fetchone())
+
+    def list_schedules(self):
+        return [_schedule_row(r) for r in self.connection().execute(SQL_LIST_SCHEDULES)]
+
+    def delete_schedule(self, schedule_id):
+        return self.write(SQL_DELETE_SCHEDULE, (schedule_id,)).rowcount > 0
+
+    def start_schedule_run(self, schedule_id, due_at, status='running', detail=None, devices=0, failed=0):
+        """Record a run; runs that never start (skipped, missed) pass their final status and are finished at once."""
+        now = time.time()
+        finished = None if status == 'running' else now
+        return self.write(SQL_START_SCHEDULE_RUN, (schedule_id, status, due_at, now, finished, devices, failed,
+                                                   json.dumps(detail, default=str) if detail is not None else None)).lastrowid
+
+    def finish_schedule_run(self, run_id, status, devices=0, failed=0, detail=None):
+        self.write(SQL_FINISH_SCHEDULE_RUN, (status, time.time(), devices, failed,
+                                             json.dumps(detail, default=str) if detail is not None else None, run_id))
+
+    def active_schedule_run(self, schedule_id):
+        """(run_id, started_at) of the schedule's unfinished run, or None."""
+        return self.connection().execute(SQL_ACTIVE_SCHEDULE_RUN, (schedule_id,)).fetchone()
+
+    def get_schedule_run(self, run_id):
+        cur = self.connection().execute(SQL_GET_SCHEDULE_RUN, (run_id,))
+        row = cur.fetchone()
+        return _run_row(dict(zip([c[0] for c in cur.description], row))) if row else None
+
+    def list_schedule_runs(self, schedule_id=None, status=None, since=None, until=None, limit=100):
+        """Newest-first run history; detail (per-device results) is decoded."""
+        rows = self._select('schedule_runs', 'started_at', {'schedule_id': schedule_id, 'status': status}, since, until, limit)
+        return [_run_row(r) for r in rows]
+
+    def prune_schedule_runs(self, schedule_id, keep, before):
+        """Keep the newest `keep` runs of a schedule and drop any that started before `before`."""
+        return self.write(SQL_PRUNE_SCHEDULE_RUNS, (schedule_id, before, schedule_id, max(1, int(keep)))).rowcount
+
+    # --- Workflows ---
+    def create_workflow_run(self, name, spec, step_ids, created_by=None, owner=None):
+        """Insert a run and its steps (all pending), owned (leased) by `owner`."""
+        now = time.time()
+        with self.transaction():
+            run_id = self.write(SQL_INSERT_WORKFLOW_RUN, (name, json.dumps(spec), created_by, owner, now, now)).lastrowid
+            for step_id in step_ids:
+                self.write(SQL_INSERT_WORKFLOW_STEP, (run_id, step_id))
+        return run_id
+
+    def update_workflow_step(self, run_id, step_id, status, attempts=0, result=None, error=None, started_at=None,
+                             finished_at=None):
+        self.write(SQL_UPDATE_WORKFLOW_STEP, (status, attempts, json.dumps(result, default=str) if result is not None else None,
+                                              error, started_at, finished_at, run_id, step_id))
+
+    def finish_workflow_run(self, run_id, status, result=None):
+        self.write(SQL_FINISH_WORKFLOW_RUN, (status, json.dumps(result, default=str) if result is not None else None,
+                                             time.time(), run_id))
+
+    def claim_workflow_run(self, run_id, owner, stale_before):
+        """Take the lease on a running workflow if it is free, ours, or its owner stopped heartbeating."""
+        return self.write(SQL_CLAIM_WORKFLOW_RUN, (owner, time.time(), run_id, owner, stale_before)).rowcount > 0
+
+    def heartbeat_workflow_run(self, run_id, owner):
+        return self.write(SQL_HEARTBEAT_WORKFLOW_RUN, (time.time(), run_id, owner)).rowcount > 0
+
+    def stale_workflow_runs(self, stale_before):
+        return [r[0] for r in self.connection().execute(SQL_STALE_WORKFLOW_RUNS, (stale_before,))]
+
+    def get_workflow_run(self, run_id):
+        """The run with decoded spec/result and {step_id: state} in 'steps', or None."""
+        conn = self.connection()
+        cur = conn.execute(SQL_GET_WORKFLOW_RUN, (run_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        run = dict(zip([c[0] for c in cur.description], row))
+        run['spec'] = json.loads(run['spec'])
+        run['result'] = json.loads(run['result']) if run['result'] else None
+        run['steps'] = {r[0]: {'status': r[1], 'attempts': r[2], 'result': json.loads(r[3]) if r[3] else None,
+                               'error': r[4], 'started_at': r[5], 'finished_at': r[6]}
+                        for r in conn.execute(SQL_LIST_WORKFLOW_STEPS, (run_id,))}
+        return run
+
+    def list_workflow_runs(self, status=None, since=None, until=None, limit=100):
+        """Newest-first runs without their specs or step states."""
+        rows = self._select('workflow_runs', 'started_at', {'status': status}, since, until, limit)
+        return [{k: v for k, v in r.items() if k not in ('spec', 'result')} for r in rows]
+
+
+class UserMapping:
+    """Dict-style view of the users table (username -> user dict) used as the web server's users_db."""
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get(self, username, default=None):
+        if not isinstance(username, str):
+            return default
+        user = self.storage.get_user(username)
+        return user if user is not None else default
+
+    def __getitem__(self, username):
+        user = self.get(username)
+        if user is None:
+            raise KeyError(username)
+        return user
+
+    def __setitem__(self, username, user):
+        self.storage.upsert_user(dict(user, username=username))
+
+    def __delitem__(self, username):
+        self.storage.delete_user(username)
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def __iter__(self):
+        return iter([u['username'] for u in self.storage.list_users()])
+
+    def __len__(self):
+        return len(self.storage.list_users())
+
+    def items(self):
+        return [(u['username'], u) for u in self.storage.list_users()]
+
+
+class _Transaction:
+    def __init__(self, conn, immediate=False):
+        self.conn = conn
+        self.immediate = immediate
+        self.nested = False
+
+    def __enter__(self):
+        if self.conn.in_transaction:
+            self.nested = True
+        else:
+            self.conn.execute("BEGIN IMMEDIATE" if self.immediate else "BEGIN")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.nested:
+            return False
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+# --- Legacy importer ---
+_PAIR_RE = re.compile(r"### Prompt \d+:\n(.*?)\n\n### Response \d+:\n(.*?)(?=\n\n### Prompt \d+:|\Z)", re.S)
+_AGG_RE = re.compile(r"### Aggregate \(([^)]*)\):\n(.*?)(?=\n\n### Aggregate \(|\Z)", re.S)
+
+
+def import_users_json(storage, path):
+    """Upsert users from users.json. Returns the number of users imported."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as fh:
+        users = json.load(fh)
+    with storage.transaction():
+        for username, info in users.items():
+            storage.upsert_user(dict(info, username=info.get('username', username)))
+    storage.set_meta('users_json_mtime', os.path.getmtime(path))
+    return len(users)
+
+
+def import_device_creds_json(storage, path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as fh:
+        creds = json.load(fh)
+    with storage.transaction():
+        for device, info in creds.items():
+            storage.save_device_creds(device, info.get('ssh_user'), info.get('ssh_password'))
+    return len(creds)
+
+
+def import_markdown_dir(storage, outputs_dir):
+    """Import session_N.md prompt/response pairs and aggregates.md entries into history.
+    A file whose mtime changed replaces the rows imported from it earlier; aggregates that the
+    web server already stored itself are skipped."""
+    if not os.path.isdir(outputs_dir):
+        return 0
+    count = 0
+    with storage.transaction():
+        for fname in sorted(os.listdir(outputs_dir)):
+            if not fname.endswith('.md'):
+                continue
+            path = os.path.join(outputs_dir, fname)
+            if storage.get_meta(f'imported:{fname}') == str(os.path.getmtime(path)):
+                continue
+            with open(path, 'r', encoding='utf-8', errors='ignore') as fh:
+                text = fh.read()
+            mtime = os.path.getmtime(path)
+            storage.write(SQL_DELETE_IMPORTED_HISTORY, (fname,))
+            if fname == 'aggregates.md':
+                stored = {(row[0] or '').strip() for row in storage.connection().execute(SQL_LIVE_AGGREGATES)}
+                for stamp, body in _AGG_RE.findall(text):
+                    if body.strip() in stored:
+                        continue
+                    ts = _parse_iso(stamp) or mtime
+                    storage.add_history('web', 'aggregate', response=body.strip(), ts=ts, import_path=fname)
+                    count += 1
+            else:
+                pairs = [(prompt.strip(), response.strip()) for prompt, response in _PAIR_RE.findall(text)]
+                count += storage.replace_history(fname, f'cli:{fname}', 'pair', pairs, ts=mtime)
+            storage.set_meta(f'imported:{fname}', mtime)
+    return count
+
+
+def import_memory_json(storage, path):
+    if not os.path.exists(path) or storage.load_memory():
+        return 0
+    with open(path, 'r', encoding='utf-8') as fh:
+        data = json.load(fh)
+    storage.save_memory([m for m in data if isinstance(m, dict)])
+    return len(data)
+
+
+def import_legacy(storage, web_dir=None, outputs_dir=None, memory_path=None):
+    """Import every legacy file that exists; returns a per-source count."""
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    web_dir = web_dir or os.path.join(base, 'web')
+    outputs_dir = outputs_dir or os.path.join(base, 'outputs')
+    memory_path = memory_path or 'persistent_memory.json'
+    return {
+        'users': import_users_json(storage, os.path.join(web_dir, 'users.json')),
+        'device_creds': import_device_creds_json(storage, os.path.join(web_dir, 'device_creds.json')),
+        'history': import_markdown_dir(storage, outputs_dir),
+        'memory': import_memory_json(storage, memory_path),
+    }
+
+
+def _parse_iso(stamp):
+    from datetime import datetime, timezone
+    try:
+        return datetime.fromisoformat(stamp.strip()).replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+_default_storage = None
+_default_lock = threading.Lock()
+
+
+def get_storage(path=None):
+    """Return the process-wide Storage for DEFAULT_DB_PATH (created and migrated on first use)."""
+    global _default_storage
+    with _default_lock:
+        if _default_storage is None:
+            _default_storage = Storage(path)
+        return _default_storage
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Llamatrama SQLite storage tools")
+    parser.add_argument("command", choices=["import", "info"], help="import legacy JSON/markdown files, or show schema info")
+    parser.add_argument("--db", type=str, default=DEFAULT_DB_PATH, help="Database path")
+    parser.add_argument("--web-dir", type=str, help="Directory holding users.json and device_creds.json")
+    parser.add_argument("--outputs-dir", type=str, help="Directory holding session markdown files")
+    parser.add_argument("--memory", type=str, help="Path to persistent_memory.json")
+    args = parser.parse_args()
+    storage = Storage(args.db)
+    if args.command == "import":
+        print(json.dumps(import_legacy(storage, args.web_dir, args.outputs_dir, args.memory), indent=2))
+    else:
+        print(json.dumps({'path': storage.path, 'schema_version': storage.schema_version()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Multiplexed command streams over a single websocket.
+
+Every frame is a JSON object tagged with a stream id:
+  client -> server: {"type": "open", "stream": "s1", "device": "100.x.y.z", "cmd": "uptime"}
+                    {"type": "cancel", "stream": "s1"}
+  server -> client: {"type": "open", "stream": "s1"}
+                    {"type": "data", "stream": "s1", "data": "..."}
+                    {"type": "exit", "stream": "s1", "code": 0}
+                    {"type": "error", "stream": "s1", "error": "..."}
+
+StreamMux buffers output per stream and drains it with deficit round-robin, so one
+chatty stream (e.g. `journalctl -f`) cannot starve the other devices on the socket.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+
+class _Stream:
+    def __init__(self, stream_id):
+        self.id = stream_id
+        self.chunks = deque()
+        self.buffered = 0
+        self.deficit = 0
+        self.dropped = 0
+        self.exit_code = None
+        self.error = None
+        self.finished = False
+        self.cancelled = False
+
+
+class StreamMux:
+    """
+    Per-stream output buffers with fair draining.
+    quantum: bytes of credit each stream earns per scheduling round.
+    max_buffer: per-stream cap; the oldest chunks are dropped (and counted) beyond it.
+    """
+    def __init__(self, quantum=4096, max_buffer=256 * 1024, max_streams=64):
+        self.quantum = quantum
+        self.max_buffer = max_buffer
+        self.max_streams = max_streams
+        self.streams = OrderedDict()
+        self._pending = []
+        self.ready = asyncio.Event()
+
+    def open(self, stream_id):
+        if stream_id in self.streams:
+            raise ValueError(f"stream {stream_id} already open")
+        if len(self.streams) >= self.max_streams:
+            raise ValueError(f"too many open streams (max {self.max_streams})")
+        self.streams[stream_id] = _Stream(stream_id)
+        self._pending.append({"type": "open", "stream": stream_id})
+        self.ready.set()
+
+    def push(self, stream_id, data):
+        s = self.streams.get(stream_id)
+        if s is None or s.cancelled or not data:
+            return
+        s.chunks.append(data)
+        s.buffered += len(data)
+        while s.buffered > self.max_buffer and len(s.chunks) > 1:
+            old = s.chunks.popleft()
+            s.buffered -= len(old)
+            s.dropped += len(old)
+        self.ready.set()
+
+    def finish(self, stream_id, code=None, error=None):
+        s = self.streams.get(stream_id)
+        if s is None or s.finished:
+            return
+        s.finished = True
+        s.exit_code = code
+        s.error = error
+        self.ready.set()
+
+    def cancel(self, stream_id):
+        """Mark a stream cancelled: drop buffered output and report exit immediately."""
+        s = self.streams.get(stream_id)
+        if s is None:
+            return False
+        s.cancelled = True
+        s.chunks.clear()
+        s.buffered = 0
+        self.finish(stream_id, code=None, error="cancelled")
+        return True
+
+    def is_cancelled(self, stream_id):
+        s = self.streams.get(stream_id)
+        return s is None or s.cancelled
+
+    def next_frames(self):
+        """
+        Return the frames for one scheduling round. Each stream with buffered data earns
+        `quantum` bytes of credit and sends whole chunks while its credit allows.
+        Finished streams emit their exit/error frame once their buffer is empty.
+        """
+        frames = self._pending
+        self._pending = []
+        for sid in list(self.streams):
+            s = self.streams[sid]
+            if s.chunks:
+                s.deficit += self.quantum
+                parts = []
+                while s.chunks and len(s.chunks[0]) <= s.deficit:
+                    chunk = s.chunks.popleft()
+                    s.deficit -= len(chunk)
+                    s.buffered -= len(chunk)
+                    parts.append(chunk)
+                if not parts and s.chunks:
+                    # Oversized chunk: split it rather than stalling the stream
+                    chunk = s.chunks.popleft()
+                    head, tail = chunk[:s.deficit], chunk[s.deficit:]
+                    s.chunks.appendleft(tail)
+                    s.buffered -= len(head)
+                    s.deficit = 0
+                    parts.append(head)
+                if not s.chunks:
+                    s.deficit = 0
+                frames.append({"type": "data", "stream": sid, "data": "".join(parts)})
+            if s.finished and not s.chunks:
+                if s.error and s.error != "cancelled":
+                    frames.append({"type": "error", "stream": sid, "error": s.error})
+                frame = {"type": "exit", "stream": sid, "code": s.exit_code}
+                if s.dropped:
+                    frame["dropped"] = s.dropped
+                if s.cancelled:
+                    frame["cancelled"] = True
+                frames.append(frame)
+                del self.streams[sid]
+        if not self._has_work():
+            self.ready.clear()
+        return frames
+
+    def _has_work(self):
+        return bool(self._pending) or any(s.chunks or s.finished for s in self.streams.values())
+
+
+async def pump_channel(mux, stream_id, channel, poll=0.05, on_idle=None, idle_after=5.0):
+    """
+    Copy output from a paramiko-style channel (recv_ready/recv/exit_status_ready/recv_exit_status)
+    into the mux until the command exits or the stream is cancelled. on_idle() is called once the
+    channel has been quiet for idle_after seconds (e.g. to give back an admission slot).
+    """
+    last_output = time.monotonic()
+    try:
+        while True:
+            if mux.is_cancelled(stream_id):
+                break
+            got = False
+            while channel.recv_ready():
+                data = channel.recv(4096)
+                if not data:
+                    break
+                got = True
+                mux.push(stream_id, data.decode(errors="ignore"))
+            if channel.exit_status_ready() and not channel.recv_ready():
+                mux.finish(stream_id, code=channel.recv_exit_status())
+                break
+            if got:
+                last_output = time.monotonic()
+            else:
+                if on_idle and time.monotonic() - last_output >= idle_after:
+                    on_idle()
+                    on_idle = None
+                await asyncio.sleep(poll)
+    except Exception as e:
+        mux.finish(stream_id, error=str(e))
+    finally:
+        try:
+            channel.close()
+        except Exception:
+            pass
@@ -0,0 +1,364 @@
+"""
+Streaming telemetry: one long-lived channel per device feeding in-memory time series.
+
+Instead of a shell round trip per question ("how hot is it?"), each watched device runs a
+small sampler loop on one exec channel of the shared SSH pool. Every `interval` seconds it
+prints /proc/stat, /proc/meminfo, /proc/loadavg and the thermal zone; the server turns each
+block into a sample (CPU %, memory, load, °C) and appends it to a TimeSeries.
+
+TimeSeries keeps three resolutions in fixed-size array-backed ring buffers:
+1 s for the last hour, 1 min for the last day and 1 h for the last 30 days. Each
+coarser point is the mean of the samples in its bucket. Latest and range queries are
+answered from memory.
+
+    telemetry.start('100.64.0.2', lambda cmd: ssh_pool.open_exec(host, user, cmd, password=pw))
+    telemetry.latest('100.64.0.2')
+    telemetry.range('100.64.0.2', start=time.time() - 600)
+"""
+import bisect
+import math
+import threading
+import time
+from array import array
+
+FIELDS = ('cpu_percent', 'mem_used_percent', 'mem_available_bytes', 'load_1', 'load_5', 'load_15', 'temp_c')
+
+# (bucket seconds, points kept)
+LEVELS = ((1, 3600), (60, 1440), (3600, 720))
+
+_START, _END = '@@TS', '@@TE'
+
+
+def sampler_command(interval=1.0):
+    """Shell loop printing one marked block of raw counters per interval, until the channel closes."""
+    return (
+        f"while :; do echo {_START}; head -n1 /proc/stat; grep -e ^MemTotal: -e ^MemAvailable: /proc/meminfo; "
+        f"cat /proc/loadavg; cat /sys/class/thermal/thermal_zone0/temp 2>/dev/null; echo {_END}; sleep {interval:g}; done"
+    )
+
+
+class SampleParser:
+    """Incremental parser for sampler output; CPU % needs the previous /proc/stat reading, so it is stateful."""
+    def __init__(self):
+        self._buffer = ''
+        self._block = None
+        self._prev_cpu = None
+
+    def feed(self, text, now=None):
+        """Consume output text; returns the samples [(ts, {field: value})] completed by it."""
+        self._buffer += text
+        samples = []
+        *lines, self._buffer = self._buffer.split('\n')
+        for line in lines:
+            line = line.strip()
+            if line == _START:
+                self._block = []
+            elif line == _END and self._block is not None:
+                values = self._parse_block(self._block)
+                self._block = None
+                if values:
+                    samples.append((now if now is not None else time.time(), values))
+            elif self._block is not None:
+                self._block.append(line)
+        return samples
+
+    def _parse_block(self, lines):
+        values = dict.fromkeys(FIELDS, math.nan)
+        mem = {}
+        for line in lines:
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'cpu' and len(parts) >= 5:
+                ticks = [int(p) for p in parts[1:] if p.isdigit()]
+                idle = ticks[3] + (ticks[4] if len(ticks) > 4 else 0)
+                total = sum(ticks[:8])
+                if self._prev_cpu is not None and total > self._prev_cpu[0]:
+                    d_total, d_idle = total - self._prev_cpu[0], idle - self._prev_cpu[1]
+                    values['cpu_percent'] = round(100.0 * (d_total - d_idle) / d_total, 2)
+                self._prev_cpu = (total, idle)
+            elif parts[0] in ('MemTotal:', 'MemAvailable:') and len(parts) >= 2 and parts[1].isdigit():
+                mem[parts[0][:-1]] = int(parts[1]) * 1024
+            elif len(parts) >= 3 and '/' in line and all(_is_float(p) for p in parts[:3]):
+                values['load_1'], values['load_5'], values['load_15'] = (float(p) for p in parts[:3])
+            elif len(parts) == 1 and parts[0].lstrip('-').isdigit():
+                values['temp_c'] = int(parts[0]) / 1000.0
+        if 'MemAvailable' in mem:
+            values['mem_available_bytes'] = float(mem['MemAvailable'])
+            if mem.get('MemTotal'):
+                values['mem_used_percent'] = round(100.0 * (1 - mem['MemAvailable'] / mem['MemTotal']), 2)
+        return values if any(not math.isnan(v) for v in values.values()) else None
+
+
+def _is_float(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+class RingBuffer:
+    """Fixed-capacity columns of doubles (array('d')); oldest points are overwritten. NaN marks a missing value."""
+    def __init__(self, capacity, fields=FIELDS):
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self._ts = array('d', bytes(8 * capacity))
+        self._cols = {f: array('d', bytes(8 * capacity)) for f in self.fields}
+        self._next = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _index(self, i):
+        """Physical slot of the i-th oldest point."""
+        return (self._next - self.size + i) % self.capacity
+
+    def append(self, ts, values):
+        slot = self._next
+        self._ts[slot] = ts
+        for f in self.fields:
+            v = values.get(f)
+            self._cols[f][slot] = math.nan if v is None else v
+        self._next = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def ts_at(self, i):
+        return self._ts[self._index(i)]
+
+    def row(self, i):
+        slot = self._index(i)
+        return self._ts[slot], {f: _clean(self._cols[f][slot]) for f in self.fields}
+
+    def latest(self):
+        return self.row(self.size - 1) if self.size else None
+
+    def oldest_ts(self):
+        return self.ts_at(0) if self.size else None
+
+    def range(self, start=None, end=None, fields=None):
+        """Points with start <= ts <= end, oldest first: [(ts, {field: value})]."""
+        view = _TsView(self)
+        lo = bisect.bisect_left(view, start) if start is not None else 0
+        hi = bisect.bisect_right(view, end) if end is not None else self.size
+        names = tuple(fields) if fields else self.fields
+        out = []
+        for i in range(lo, hi):
+            slot = self._index(i)
+            out.append((self._ts[slot], {f: _clean(self._cols[f][slot]) for f in names}))
+        return out
+
+
+class _TsView:
+    """Timestamps in logical order, for bisect."""
+    def __init__(self, ring):
+        self.ring = ring
+
+    def __len__(self):
+        return self.ring.size
+
+    def __getitem__(self, i):
+        return self.ring.ts_at(i)
+
+
+def _clean(value):
+    return None if math.isnan(value) else value
+
+
+class TimeSeries:
+    """Multi-resolution series: each level averages samples into buckets of `step` seconds."""
+    def __init__(self, levels=LEVELS, fields=FIELDS):
+        self.fields = tuple(fields)
+        self.levels = [(step, RingBuffer(capacity, self.fields)) for step, capacity in levels]
+        self._acc = [None] * len(self.levels)  # per level: [bucket, sums, counts]
+        self.last = None
+        self._lock = threading.Lock()
+
+    def add(self, ts, values):
+        with self._lock:
+            self.last = (ts, {f: _clean(values.get(f, math.nan)) for f in self.fields})
+            for i, (step, ring) in enumerate(self.levels):
+                bucket = int(ts // step)
+                acc = self._acc[i]
+                if acc is not None and acc[0] != bucket:
+                    self._flush(i)
+                    acc = None
+                if acc is None:
+                    acc = self._acc[i] = [bucket, [0.0] * len(self.fields), [0] * len(self.fields)]
+                for j, f in enumerate(self.fields):
+                    v = values.get(f, math.nan)
+                    if v is not None and not math.isnan(v):
+                        acc[1][j] += v
+                        acc[2][j] += 1
+
+    def _flush(self, i):
+        bucket, sums, counts = self._acc[i]
+        step, ring = self.levels[i]
+        ring.append(bucket * step, {f: (sums[j] / counts[j] if counts[j] else math.nan) for j, f in enumerate(self.fields)})
+        self._acc[i] = None
+
+    def latest(self):
+        return self.last
+
+    def range(self, start=None, end=None, step=None, fields=None):
+        """
+        Points between start and end from one resolution. step picks a level explicitly; otherwise the
+        finest level that still holds data from `start` is used. Returns {'step', 'points'}.
+        """
+        with self._lock:
+            if step is not None:
+                candidates = [lvl for lvl in self.levels if lvl[0] == step] or [self.levels[0]]
+            else:
+                filled = [lvl for lvl in self.levels if len(lvl[1])]
+                candidates = [lvl for lvl in filled if start is None or lvl[1].oldest_ts() <= start]
+                if not candidates:
+                    # Nothing reaches back that far: use whichever level does best (the finest on ties)
+                    candidates = [min(filled, key=lambda lvl: lvl[1].oldest_ts())] if filled else [self.levels[0]]
+            chosen_step, ring = candidates[0]
+            return {'step': chosen_step, 'points': ring.range(start, end, fields)}
+
+
+class DeviceStream:
+    """Reader thread for one device: keeps a sampler channel open, reconnecting with backoff."""
+    def __init__(self, device, open_channel, interval, series, on_sample=None):
+        self.device = device
+        self.open_channel = open_channel
+        self.interval = interval
+        self.series = series
+        self.on_sample = on_sample
+        self.error = None
+        self.connected = False
+        self.samples = 0
+        self.started = time.time()
+        self._stop = threading.Event()
+        self._channel = None
+        self._thread = threading.Thread(target=self._run, name=f'telemetry-{device}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        channel = self._channel
+        if channel is not None:
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                self._stream()
+                failures = 0
+            except Exception as e:
+                self.error = str(e) or type(e).__name__
+                failures += 1
+            self.connected = False
+            if self._stop.wait(min(60.0, 2.0 ** min(failures, 6))):
+                break
+
+    def _stream(self):
+        from tools.health import health
+        health.check(self.device)
+        channel = self._channel = self.open_channel(sampler_command(self.interval))
+        parser = SampleParser()
+        try:
+            channel.settimeout(max(10.0, self.interval * 5))
+            self.connected = True
+            self.error = None
+            while not self._stop.is_set():
+                data = channel.recv(4096)
+                if not data:
+                    raise ConnectionError('telemetry channel closed')
+                for ts, values in parser.feed(data.decode(errors='ignore')):
+                    self.series.add(ts, values)
+                    self.samples += 1
+                    if self.on_sample:
+                        self.on_sample(self.device, ts, values)
+        finally:
+            self._channel = None
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+    def status(self):
+        return {'device': self.device, 'connected': self.connected, 'alive': self.alive, 'interval': self.interval,
+                'samples': self.samples, 'error': self.error, 'since': self.started}
+
+
+class TelemetryCollector:
+    """Per-device streams and their series. on_sample(device, ts, values) is called from reader threads."""
+    def __init__(self, interval=1.0, levels=LEVELS, on_sample=None):
+        self.interval = interval
+        self.levels = levels
+        self.on_sample = on_sample
+        self._streams = {}
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def series(self, device):
+        with self._lock:
+            s = self._series.get(device)
+            if s is None:
+                s = self._series[device] = TimeSeries(self.levels)
+            return s
+
+    def start(self, device, open_channel, interval=None):
+        """Start streaming from device (no-op if already running). open_channel(command) -> channel."""
+        device = str(device)
+        series = self.series(device)
+        with self._lock:
+            stream = self._streams.get(device)
+            if stream is not None and stream.alive:
+                return stream
+            stream = self._streams[device] = DeviceStream(device, open_channel, interval or self.interval, series,
+                                                          on_sample=self._emit)
+        stream.start()
+        return stream
+
+    def _emit(self, device, ts, values):
+        if self.on_sample:
+            try:
+                self.on_sample(device, ts, values)
+            except Exception:
+                pass
+
+    def stop(self, device):
+        with self._lock:
+            stream = self._streams.pop(str(device), None)
+        if stream:
+            stream.stop()
+        return stream is not None
+
+    def stop_all(self):
+        for device in list(self._streams):
+            self.stop(device)
+
+    def latest(self, device):
+        s = self._series.get(str(device))
+        last = s.latest() if s else None
+        return {'ts': last[0], **last[1]} if last else None
+
+    def range(self, device, start=None, end=None, step=None, fields=None):
+        s = self._series.get(str(device))
+        if s is None:
+            return {'step': step, 'points': []}
+        result = s.range(start, end, step, [f for f in fields if f in s.fields] if fields else None)
+        result['points'] = [{'ts': ts, **values} for ts, values in result['points']]
+        return result
+
+    def status(self):
+        with self._lock:
+            return [s.status() for s in self._streams.values()]
+
+
+# Process-wide collector used by the web server
+telemetry = TelemetryCollector()
@@ -0,0 +1,293 @@
+"""
+Request tracing and on-demand profiling.
+
+Spans nest through a contextvar, so a span opened in a FastAPI handler becomes the parent of
+spans opened further down (agent -> LLM stream -> SSH connect -> send_command), including
+work handed to asyncio.to_thread. When the root span closes, the whole tree is written to
+outputs/traces/ in the Chrome trace event format (load it in Perfetto or chrome://tracing).
+
+    from tools.tracing import tracer, traced
+    with tracer.span('ssh.send_command', host=host):
+        ...
+
+Tracing is off unless LLAMA_TRACING=1 or an admin enables it at runtime; disabled spans cost
+one attribute check. RequestProfiler profiles the next N requests with cProfile or a
+sampling profiler (collapsed stacks, loadable by speedscope / flamegraph.pl).
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+_OUTPUTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'outputs')
+_current = contextvars.ContextVar('llamatrama_span', default=None)
+
+
+class Span:
+    def __init__(self, trace, name, parent, attrs):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.id = trace.next_id()
+        self.tid = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+        self.events = []
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def event(self, name, **attrs):
+        """Record an instant event (e.g. a streamed chunk) inside this span."""
+        if len(self.events) < self.trace.max_events:
+            self.events.append((name, time.perf_counter(), threading.get_ident(), attrs))
+
+
+class Trace:
+    def __init__(self, name, max_events=256):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.wall_start = time.time()
+        self.perf_start = time.perf_counter()
+        self.max_events = max_events
+        self.spans = []
+        self._lock = threading.Lock()
+        self._ids = 0
+
+    def next_id(self):
+        with self._lock:
+            self._ids += 1
+            return self._ids
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def _us(self, perf):
+        return round((self.wall_start + (perf - self.perf_start)) * 1e6)
+
+    def to_chrome(self):
+        """Chrome trace event JSON: one complete ('X') event per span, instant ('i') events inside."""
+        pid = os.getpid()
+        events, threads = [], set()
+        with self._lock:
+            spans = list(self.spans)
+        for s in spans:
+            end = s.end if s.end is not None else time.perf_counter()
+            threads.add(s.tid)
+            args = dict(s.attrs, span_id=s.id, parent_id=s.parent.id if s.parent else None)
+            events.append({'name': s.name, 'cat': 'llamatrama', 'ph': 'X', 'pid': pid, 'tid': s.tid,
+                           'ts': self._us(s.start), 'dur': max(0, round((end - s.start) * 1e6)), 'args': args})
+            for name, at, tid, attrs in s.events:
+                threads.add(tid)
+                events.append({'name': name, 'cat': 'llamatrama', 'ph': 'i', 's': 't', 'pid': pid, 'tid': tid,
+                               'ts': self._us(at), 'args': attrs})
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for tid in threads:
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': names.get(tid, str(tid))}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'trace_id': self.id, 'name': self.name, 'started': self.wall_start}}
+
+
+class Tracer:
+    """
+    directory: where finished traces are written (one JSON file per root span).
+    keep: number of trace files retained; older ones are removed.
+    """
+    def __init__(self, directory=None, enabled=None, keep=200):
+        self.directory = directory or os.path.join(_OUTPUTS, 'traces')
+        self.enabled = os.getenv('LLAMA_TRACING', '0') == '1' if enabled is None else enabled
+        self.keep = keep
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Open a child of the current span, or a new trace root when there is none."""
+        parent = _current.get()
+        if parent is None and not self.enabled:
+            yield None
+            return
+        trace = parent.trace if parent is not None else Trace(name)
+        span = Span(trace, name, parent, attrs)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current.reset(token)
+            trace.add(span)
+            if parent is None:
+                try:
+                    self.save(trace)
+                except OSError:
+                    pass
+
+    def save(self, trace):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(trace.wall_start))
+        path = os.path.join(self.directory, f"{stamp}-{trace.id}.json")
+        with open(path, 'w', encoding='utf-8') as fh:
+            json.dump(trace.to_chrome(), fh, default=str)
+        self._prune()
+        return path
+
+    def _prune(self):
+        files = self.list()
+        for fname in files[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, fname))
+            except OSError:
+                pass
+
+    def list(self):
+        """Trace file names, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((f for f in os.listdir(self.directory) if f.endswith('.json')), reverse=True)
+
+    def path(self, fname):
+        if os.path.basename(fname) != fname or not fname.endswith('.json'):
+            raise ValueError('Invalid trace name')
+        return os.path.join(self.directory, fname)
+
+
+def current_span():
+    return _current.get()
+
+
+def traced(name=None):
+    """Decorator: run the function inside a span named `name` (default: its qualified name)."""
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled and _current.get() is None:
+                return fn(*args, **kwargs)
+            with tracer.span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# --- On-demand profiling ---
+class _StackSampler:
+    """Samples one thread's Python stack every `interval` seconds and counts collapsed stacks."""
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if parts:
+                key = ';'.join(reversed(parts))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.stacks.items(), key=lambda kv: -kv[1])) + "\n"
+
+
+class RequestProfiler:
+    """
+    arm(n, mode) profiles the next n requests, one at a time (the profilers are per-thread,
+    so overlapping requests on the event loop are skipped rather than mixed together).
+    mode 'cprofile' writes a .prof file (pstats / snakeviz); 'sampling' writes a .folded file.
+    """
+    MODES = ('cprofile', 'sampling')
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(_OUTPUTS, 'profiles')
+        self.remaining = 0
+        self.mode = 'cprofile'
+        self.armed_by = None
+        self._active = False
+        self._lock = threading.Lock()
+
+    def arm(self, count, mode='cprofile', by=None):
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {', '.join(self.MODES)}")
+        with self._lock:
+            self.remaining = max(0, int(count))
+            self.mode = mode
+            self.armed_by = by
+        return self.status()
+
+    def status(self):
+        return {'remaining': self.remaining, 'mode': self.mode, 'armed_by': self.armed_by, 'active': self._active}
+
+    def claim(self):
+        """Return the mode to profile the current request with, or None."""
+        with self._lock:
+            if self.remaining <= 0 or self._active:
+                return None
+            self.remaining -= 1
+            self._active = True
+            return self.mode
+
+    @contextlib.contextmanager
+    def profile(self, mode, label):
+        """Profile the enclosed block on the current thread; the result path is yielded in a dict."""
+        result = {}
+        try:
+            if mode == 'cprofile':
+                import cProfile
+                prof = cProfile.Profile()
+                prof.enable()
+                try:
+                    yield result
+                finally:
+                    prof.disable()
+                    result['path'] = self._target(label, '.prof')
+                    prof.dump_stats(result['path'])
+            else:
+                sampler = _StackSampler(threading.get_ident())
+                sampler.start()
+                try:
+                    yield result
+                finally:
+                    sampler.stop()
+                    result['path'] = self._target(label, '.folded')
+                    with open(result['path'], 'w', encoding='utf-8') as fh:
+                        fh.write(sampler.folded())
+        finally:
+            with self._lock:
+                self._active = False
+
+    def _target(self, label, suffix):
+        os.makedirs(self.directory, exist_ok=True)
+        safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in label).strip('_')[:60] or 'request'
+        return os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe}-{uuid.uuid4().hex[:6]}{suffix}")
+
+    def list(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((f for f in os.listdir(self.directory) if f.endswith(('.prof', '.folded'))), reverse=True)
+
+
+# Process-wide instances used by the web server and the agent
+tracer = Tracer()
+profiler = RequestProfiler()
@@ -0,0 +1,170 @@
+"""
+Watch mode: re-run a read-only command on an interval and stream only what changed.
+
+One Watch exists per (device, command), however many viewers it has. It runs the command on
+the pooled SSH transport every `interval` seconds, diffs the new output against the previous
+one line by line, and fans the changed hunks out to every viewer:
+
+    {'type': 'snapshot', 'version': 3, 'lines': [...]}            first frame, and after a resync
+    {'type': 'diff', 'version': 4, 'base': 3, 'hunks': [...]}      only when the output changed
+    {'type': 'error', 'version': 4, 'error': '...'}                the run failed; the watch keeps going
+
+A hunk {'start', 'end', 'lines'} replaces lines[start:end] of the base version; hunks are
+listed bottom-up, so applying them in order keeps earlier indexes valid (see apply_hunks).
+A viewer that falls too far behind gets a fresh snapshot instead of a backlog of diffs.
+"""
+import asyncio
+import difflib
+import time
+
+MIN_INTERVAL = 1.0
+
+
+def diff_lines(old, new):
+    """Hunks turning old into new (bottom-up order); [] when identical."""
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    hunks = [{'start': i1, 'end': i2, 'lines': new[j1:j2]}
+             for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+    return hunks[::-1]
+
+
+def apply_hunks(lines, hunks):
+    lines = list(lines)
+    for h in hunks:
+        lines[h['start']:h['end']] = h['lines']
+    return lines
+
+
+class Viewer:
+    """One subscriber's bounded frame queue; overflow switches it to resync (next frame is a snapshot)."""
+    def __init__(self, watch, maxsize=32):
+        self.watch = watch
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.resync = False
+
+    def offer(self, frame):
+        if self.resync:
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Drop the backlog; a snapshot is cheaper than replaying every diff
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.resync = True
+            self.queue.put_nowait({'type': 'resync'})
+
+    async def get(self, timeout=None):
+        frame = await asyncio.wait_for(self.queue.get(), timeout)
+        if frame.get('type') == 'resync':
+            self.resync = False
+            return self.watch.snapshot()
+        return frame
+
+    def close(self):
+        self.watch.hub.unsubscribe(self)
+
+
+class Watch:
+    """run(command) -> output text, called in a worker thread every interval seconds."""
+    def __init__(self, hub, device, command, run, interval):
+        self.hub = hub
+        self.device = device
+        self.command = command
+        self.run = run
+        self.interval = max(MIN_INTERVAL, interval)
+        self.viewers = set()
+        self.lines = []
+        self.version = 0
+        self.error = None
+        self.runs = 0
+        self.updated_at = None
+        self.bytes_full = 0
+        self.bytes_sent = 0
+        self.task = None
+
+    @property
+    def key(self):
+        return (self.device, self.command)
+
+    def snapshot(self):
+        return {'type': 'snapshot', 'device': self.device, 'command': self.command, 'version': self.version,
+                'lines': list(self.lines), 'interval': self.interval, 'error': self.error}
+
+    def _broadcast(self, frame):
+        for viewer in list(self.viewers):
+            viewer.offer(frame)
+
+    async def step(self):
+        """One run + diff + fan-out (the loop body; also handy for tests)."""
+        self.runs += 1
+        try:
+            output = await asyncio.to_thread(self.run, self.command)
+        except Exception as e:
+            message = str(e) or type(e).__name__
+            if message != self.error:
+                self.error = message
+                self._broadcast({'type': 'error', 'version': self.version, 'error': message})
+            return None
+        self.error = None
+        lines = str(output).splitlines()
+        hunks = diff_lines(self.lines, lines)
+        self.bytes_full += len(output) * max(1, len(self.viewers))
+        if not hunks and self.version:
+            return None
+        base, self.version = self.version, self.version + 1
+        self.lines = lines
+        self.updated_at = time.time()
+        frame = {'type': 'diff', 'version': self.version, 'base': base, 'hunks': hunks}
+        self.bytes_sent += sum(len(line) + 1 for h in hunks for line in h['lines']) * max(1, len(self.viewers))
+        self._broadcast(frame)
+        return frame
+
+    async def loop(self):
+        while self.viewers:
+            started = time.monotonic()
+            await self.step()
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def status(self):
+        return {'device': self.device, 'command': self.command, 'viewers': len(self.viewers), 'interval': self.interval,
+                'version': self.version, 'runs': self.runs, 'error': self.error, 'updated_at': self.updated_at,
+                'bytes_full': self.bytes_full, 'bytes_sent': self.bytes_sent}
+
+
+class WatchHub:
+    """Coalesces viewers of the same (device, command) onto one Watch; the watch stops with its last viewer."""
+    def __init__(self):
+        self.watches = {}
+
+    def subscribe(self, device, command, run, interval=5.0, maxsize=32):
+        """Join (or start) the watch for (device, command). The viewer's first frame is a snapshot once one exists."""
+        key = (str(device), command)
+        watch = self.watches.get(key)
+        if watch is None:
+            watch = self.watches[key] = Watch(self, str(device), command, run, interval)
+        else:
+            watch.interval = max(MIN_INTERVAL, min(watch.interval, interval))  # the most eager viewer wins
+        viewer = Viewer(watch, maxsize=maxsize)
+        watch.viewers.add(viewer)
+        if watch.version:
+            viewer.offer(watch.snapshot())
+        if watch.task is None or watch.task.done():
+            watch.task = asyncio.get_running_loop().create_task(watch.loop())
+        return viewer
+
+    def unsubscribe(self, viewer):
+        watch = viewer.watch
+        watch.viewers.discard(viewer)
+        if not watch.viewers:
+            if self.watches.get(watch.key) is watch:
+                del self.watches[watch.key]
+            if watch.task and not watch.task.done():
+                watch.task.cancel()
+
+    def status(self):
+        return [w.status() for w in self.watches.values()]
+
+
+# Process-wide hub used by the web server (lives on its event loop)
+watch_hub = WatchHub()
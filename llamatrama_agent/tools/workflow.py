@@ -0,0 +1,475 @@
+"""
+DAG workflows: steps (device commands, plugin tools, LLM calls) with explicit dependencies.
+
+A workflow is JSON:
+
+    {"name": "triage", "aggregate": {"prompt": "Is the fleet healthy?"},
+     "steps": [
+        {"id": "disk", "type": "command", "devices": ["100.64.0.2", "100.64.0.3"], "command": "df -h /"},
+        {"id": "temp", "type": "command", "device": "100.64.0.2", "command": "vcgencmd measure_temp", "retries": 2},
+        {"id": "explain", "type": "llm", "prompt": "Explain this disk usage: {{disk}}", "timeout": 90}]}
+
+- Steps whose dependencies are done run in parallel. `needs` lists dependencies explicitly;
+  referencing another step in a template ({{id}} for its output, {{id.field}} for any
+  result field, {{id.error}}) adds it implicitly. In a command, each value is inserted as
+  one shell-quoted word (so templates must not sit inside quotes).
+- `devices` fans a command step out into one child per device; the step's result maps
+  device -> output and it fails if any device failed (the outputs are kept).
+- retries / retry_delay (doubling) / timeout per step. A step that times out is abandoned and
+  counts as a failed attempt.
+- trigger: 'all_ok' (default) skips a step when a dependency failed; 'all_done' runs it anyway
+  with the failures among its inputs. Aggregate steps default to 'all_done'.
+- "aggregate": true (or {"prompt": ...}) appends a final reduce step over every leaf step,
+  which the web server runs through `aggregate_agents` with the real results.
+
+Run and step state live in the workflow_runs / workflow_steps tables. The worker running a
+workflow holds a lease it keeps renewing; after a crash, resume() (run at startup for runs
+whose lease lapsed) keeps finished steps and re-runs the rest.
+
+Step handlers are registered per type: handler(params, inputs, timeout) -> dict or str,
+where params is the step with templates rendered and inputs maps each dependency id to
+{type, status, result, error}.
+"""
+import json
+import re
+import shlex
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+TRIGGERS = ('all_ok', 'all_done')
+FINISHED = ('ok', 'failed', 'skipped', 'cancelled')
+_ID = re.compile(r'^[A-Za-z][A-Za-z0-9_-]{0,63}$')
+# Fields whose template values are shell-quoted when rendered, per step type
+SHELL_FIELDS = {'command': ('command',)}
+_REF = re.compile(r'\{\{\s*([A-Za-z][A-Za-z0-9_-]*)(?:\.([A-Za-z0-9_]+))?\s*\}\}')
+_STRUCTURAL = ('id', 'type', 'needs', 'retries', 'retry_delay', 'timeout', 'trigger', 'devices', 'parent')
+MAX_RESULT = 64 * 1024
+LEASE = 60.0
+AGGREGATE_ID = 'aggregate'
+
+
+class WorkflowError(ValueError):
+    """The workflow definition is invalid (unknown step type, bad reference, cycle...)."""
+
+
+# --- Definitions ---
+def _refs(value):
+    if isinstance(value, str):
+        return {m.group(1) for m in _REF.finditer(value)}
+    if isinstance(value, dict):
+        return set().union(*(_refs(v) for v in value.values())) if value else set()
+    if isinstance(value, list):
+        return set().union(*(_refs(v) for v in value)) if value else set()
+    return set()
+
+
+def _topological(steps):
+    """Step ids in dependency order; raises WorkflowError on a cycle."""
+    indegree = {s['id']: len(s['needs']) for s in steps}
+    dependents = {s['id']: [] for s in steps}
+    for s in steps:
+        for dep in s['needs']:
+            dependents[dep].append(s['id'])
+    ready = [i for i, n in indegree.items() if n == 0]
+    order = []
+    while ready:
+        step_id = ready.pop()
+        order.append(step_id)
+        for child in dependents[step_id]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+    if len(order) != len(steps):
+        raise WorkflowError(f"dependency cycle among: {', '.join(sorted(set(indegree) - set(order)))}")
+    return order
+
+
+def normalize_workflow(spec, types):
+    """
+    Validate a workflow against the registered step types and return it in canonical form:
+    needs resolved (explicit + template references), fan-out children added, the aggregate
+    step appended. Raises WorkflowError.
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get('steps'), list) or not spec['steps']:
+        raise WorkflowError("workflow needs a non-empty 'steps' list")
+    steps, seen = [], set()
+    for raw in spec['steps']:
+        if not isinstance(raw, dict):
+            raise WorkflowError("every step must be an object")
+        step = dict(raw)
+        step_id = str(step.get('id') or '')
+        if not _ID.match(step_id):
+            raise WorkflowError(f"bad step id {step_id!r}: letters, digits, _ and -, starting with a letter")
+        if step_id in seen:
+            raise WorkflowError(f"duplicate step id {step_id!r}")
+        seen.add(step_id)
+        if step.get('type') not in types:
+            raise WorkflowError(f"step {step_id}: unknown type {step.get('type')!r} (known: {', '.join(sorted(types))})")
+        needs = step.get('needs') or []
+        needs = [needs] if isinstance(needs, str) else list(needs)
+        body = {k: v for k, v in step.items() if k not in _STRUCTURAL}
+        step['needs'] = list(dict.fromkeys(needs + sorted(_refs(body))))
+        step['retries'] = max(0, int(step.get('retries', 0)))
+        step['retry_delay'] = max(0.0, float(step.get('retry_delay', 1.0)))
+        step['timeout'] = max(0.1, float(step.get('timeout', 60)))
+        step['trigger'] = step.get('trigger') or ('all_done' if step['type'] == 'aggregate' else 'all_ok')
+        if step['trigger'] not in TRIGGERS:
+            raise WorkflowError(f"step {step_id}: trigger must be one of {', '.join(TRIGGERS)}")
+        for field in SHELL_FIELDS.get(step['type'], ()):
+            text = step.get(field)
+            if isinstance(text, str) and any(_inside_quotes(text, m.start()) for m in _REF.finditer(text)):
+                raise WorkflowError(f"step {step_id}: templates in {field} are shell-quoted; do not put them inside quotes")
+        steps.append(step)
+    for step in steps:
+        missing = [d for d in step['needs'] if d not in seen]
+        if missing or step['id'] in step['needs']:
+            raise WorkflowError(f"step {step['id']}: unknown dependency {', '.join(missing) or step['id']}")
+
+    aggregate = spec.get('aggregate')
+    if aggregate:
+        if AGGREGATE_ID in seen:
+            raise WorkflowError(f"'aggregate' adds a step named {AGGREGATE_ID!r}; rename the existing one")
+        if 'aggregate' not in types:
+            raise WorkflowError("no aggregate step type is registered")
+        used = {d for s in steps for d in s['needs']}
+        leaves = [s['id'] for s in steps if s['id'] not in used]
+        extra = aggregate if isinstance(aggregate, dict) else {}
+        steps.append({**extra, 'id': AGGREGATE_ID, 'type': 'aggregate', 'needs': leaves, 'retries': int(extra.get('retries', 0)),
+                      'retry_delay': 1.0, 'timeout': float(extra.get('timeout', 120)), 'trigger': 'all_done'})
+    _topological(steps)
+
+    expanded = []
+    for step in steps:
+        devices = step.get('devices')
+        if not devices:
+            expanded.append(step)
+            continue
+        if isinstance(devices, str):
+            devices = [devices]
+        children = []
+        for device in dict.fromkeys(str(d) for d in devices):
+            child = {k: v for k, v in step.items() if k != 'devices'}
+            child.update(id=f"{step['id']}@{device}", device=device, parent=step['id'])
+            children.append(child)
+        expanded.extend(children)
+        expanded.append({'id': step['id'], 'type': 'gather', 'needs': [c['id'] for c in children], 'trigger': 'all_done',
+                         'retries': 0, 'retry_delay': 0.0, 'timeout': step['timeout'], 'of': step['type']})
+    return {'name': str(spec.get('name') or 'workflow'), 'steps': expanded}
+
+
+def from_course_plan(plan, device=None, prompt=''):
+    """A workflow from a /course-check plan: 'ssh:' actions become command steps, the rest LLM
+    steps; each step needs the previous one (the plan is ordered) and an aggregate step closes it."""
+    steps = []
+    for n, item in enumerate(plan, 1):
+        item = item if isinstance(item, dict) else {'prompt': str(item), 'action': ''}
+        action = str(item.get('action') or '').strip()
+        step = {'id': f'step{n}', 'needs': [f'step{n - 1}'] if n > 1 else []}
+        if action.startswith('ssh:'):
+            step.update(type='command', command=action[4:].strip(), **({'device': device} if device else {}))
+        else:
+            step.update(type='llm', prompt=str(item.get('prompt') or action))
+        steps.append(step)
+    return {'name': 'course', 'steps': steps, 'aggregate': {'prompt': prompt} if prompt else True}
+
+
+# --- Templates and results ---
+def _text(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def render(value, states, quote=None):
+    """Substitute {{id}} / {{id.field}} in strings (recursively) from finished step states.
+    quote (e.g. shlex.quote) is applied to every substituted value."""
+    if isinstance(value, dict):
+        return {k: render(v, states, quote) for k, v in value.items()}
+    if isinstance(value, list):
+        return [render(v, states, quote) for v in value]
+    if not isinstance(value, str):
+        return value
+
+    def sub(m):
+        state = states.get(m.group(1)) or {}
+        result = state.get('result') or {}
+        field = m.group(2)
+        if field in ('error', 'status'):
+            text = _text(state.get(field) or '')
+        elif field is None:
+            text = _text(result.get('output', result) if isinstance(result, dict) else result)
+        else:
+            text = _text(result.get(field, '') if isinstance(result, dict) else '')
+        return quote(text) if quote else text
+    return _REF.sub(sub, value)
+
+
+def _inside_quotes(text, index):
+    """True when text[index] sits inside a '...' or "..." string (as sh would parse it)."""
+    quote, i = None, 0
+    while i < index:
+        c = text[i]
+        if quote:
+            if c == quote:
+                quote = None
+            elif c == '\\' and quote == '"':
+                i += 1
+        elif c in '\'"':
+            quote = c
+        elif c == '\\':
+            i += 1
+        i += 1
+    return quote is not None
+
+
+def _normalize_result(value):
+    result = value if isinstance(value, dict) else {'output': '' if value is None else str(value)}
+    encoded = json.dumps(result, default=str)
+    if len(encoded) > MAX_RESULT and isinstance(result.get('output'), str):
+        result = dict(result, output=result['output'][-MAX_RESULT // 2:], truncated=True)
+    return result
+
+
+def reduce_inputs(inputs):
+    """One line per input step ('id (type) status: output'), the action list aggregate_agents expects."""
+    lines = []
+    for step_id, state in inputs.items():
+        result = state.get('result') or {}
+        if 'outputs' in result:
+            for device, output in result['outputs'].items():
+                lines.append(f"{step_id} on {device}: {str(output).strip()[:800]}")
+            for device, error in (result.get('errors') or {}).items():
+                lines.append(f"{step_id} on {device}: failed: {error}")
+            continue
+        where = f" on {result['device']}" if result.get('device') else ''
+        if state.get('status') == 'ok':
+            lines.append(f"{step_id} ({state.get('type')}){where}: {str(result.get('output', '')).strip()[:800]}")
+        else:
+            lines.append(f"{step_id} ({state.get('type')}){where}: {state.get('status')}: {state.get('error') or ''}")
+    return lines
+
+
+# --- Engine ---
+class WorkflowEngine:
+    """
+    Runs workflows on a shared thread pool, one driver thread per run. on_event(run_id, step_id,
+    status, detail) is told about every step transition (step_id None for the run itself).
+    """
+    def __init__(self, handlers=None, storage=None, owner=None, max_workers=32, on_event=None):
+        self.handlers = dict(handlers or {})
+        self._storage = storage
+        self.owner = owner
+        self.on_event = on_event
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='workflow-step')
+        self._drivers = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            from tools.storage import get_storage
+            self._storage = get_storage()
+        return self._storage
+
+    def _owner(self):
+        if self.owner is None:
+            from tools.shared_state import ORIGIN
+            self.owner = ORIGIN
+        return self.owner
+
+    def register(self, step_type, handler):
+        self.handlers[step_type] = handler
+
+    def types(self):
+        return set(self.handlers) | {'gather'}
+
+    # --- Public API ---
+    def start(self, spec, username=None):
+        """Validate and persist a workflow, then run it in the background. Returns the run id."""
+        workflow = normalize_workflow(spec, self.types() - {'gather'})
+        run_id = self.storage.create_workflow_run(workflow['name'], workflow, [s['id'] for s in workflow['steps']],
+                                                  created_by=username, owner=self._owner())
+        self._spawn(run_id)
+        return run_id
+
+    def resume(self, run_id):
+        """Continue an interrupted run if its lease is free; finished steps keep their results."""
+        with self._lock:
+            if run_id in self._drivers and self._drivers[run_id].is_alive():
+                return True
+        if not self.storage.claim_workflow_run(run_id, self._owner(), time.time() - LEASE):
+            return False
+        self._spawn(run_id)
+        return True
+
+    def resume_stale(self):
+        """Resume every running workflow whose owner stopped renewing its lease (e.g. after a crash)."""
+        return [run_id for run_id in self.storage.stale_workflow_runs(time.time() - LEASE) if self.resume(run_id)]
+
+    def cancel(self, run_id):
+        """Stop scheduling new steps; steps in flight finish but their dependents do not start."""
+        with self._lock:
+            if run_id not in self._drivers:
+                return False
+            self._cancelled.add(run_id)
+        return True
+
+    def wait(self, run_id, timeout=None):
+        with self._lock:
+            driver = self._drivers.get(run_id)
+        if driver:
+            driver.join(timeout)
+        return self.get(run_id)
+
+    def get(self, run_id):
+        run = self.storage.get_workflow_run(run_id)
+        if run is None:
+            return None
+        order = {s['id']: s for s in run['spec']['steps']}
+        run['steps'] = [{'id': step_id, 'type': order[step_id]['type'], 'needs': order[step_id]['needs'],
+                         **run['steps'].get(step_id, {'status': 'pending'})} for step_id in order]
+        return run
+
+    def list(self, status=None, since=None, until=None, limit=50):
+        return self.storage.list_workflow_runs(status, since, until, limit)
+
+    # --- Driver ---
+    def _spawn(self, run_id):
+        driver = threading.Thread(target=self._drive, args=(run_id,), name=f'workflow-{run_id}', daemon=True)
+        with self._lock:
+            self._drivers[run_id] = driver
+        driver.start()
+
+    def _emit(self, run_id, step_id, status, detail=None):
+        if self.on_event:
+            try:
+                self.on_event(run_id, step_id, status, detail or {})
+            except Exception:
+                pass
+
+    def _drive(self, run_id):
+        try:
+            self._run(run_id)
+        except Exception as e:
+            self.storage.finish_workflow_run(run_id, 'failed', {'error': str(e) or type(e).__name__})
+            self._emit(run_id, None, 'failed', {'error': str(e)})
+        finally:
+            with self._lock:
+                self._drivers.pop(run_id, None)
+                self._cancelled.discard(run_id)
+
+    def _run(self, run_id):
+        run = self.storage.get_workflow_run(run_id)
+        steps = {s['id']: s for s in run['spec']['steps']}
+        order = _topological(list(steps.values()))
+        states = {}
+        for step_id, step in steps.items():
+            state = dict(run['steps'].get(step_id) or {'status': 'pending', 'attempts': 0})
+            state['type'] = step.get('of', step['type'])
+            if state['status'] == 'running':  # interrupted mid-attempt: run it again
+                state['status'] = 'pending'
+            states[step_id] = state
+        running = {}  # future -> (step_id, deadline)
+        retry_at = {}
+        last_beat = time.monotonic()
+        self._emit(run_id, None, 'running', {'name': run['name']})
+
+        def save(step_id):
+            s = states[step_id]
+            self.storage.update_workflow_step(run_id, step_id, s['status'], s.get('attempts', 0), s.get('result'),
+                                              s.get('error'), s.get('started_at'), s.get('finished_at'))
+            self._emit(run_id, step_id, s['status'], {'attempts': s.get('attempts', 0), 'error': s.get('error')})
+
+        def finish(step_id, status, result=None, error=None):
+            s = states[step_id]
+            s.update(status=status, result=result, error=error, finished_at=time.time())
+            save(step_id)
+
+        while True:
+            cancelled = run_id in self._cancelled
+            now = time.monotonic()
+            for step_id in order:
+                step, s = steps[step_id], states[step_id]
+                if s['status'] != 'pending' or retry_at.get(step_id, now) > now:
+                    continue
+                deps = [states[d] for d in step['needs']]
+                if any(d['status'] not in FINISHED for d in deps):
+                    continue
+                retry_at.pop(step_id, None)
+                if cancelled:
+                    finish(step_id, 'cancelled')
+                elif step['trigger'] == 'all_ok' and any(d['status'] != 'ok' for d in deps):
+                    failed = [d for d in step['needs'] if states[d]['status'] != 'ok']
+                    finish(step_id, 'skipped', error=f"dependency did not succeed: {', '.join(failed)}")
+                elif step['type'] == 'gather':
+                    self._gather(step, states)
+                    save(step_id)
+                else:
+                    s.update(status='running', attempts=s.get('attempts', 0) + 1, error=None, started_at=time.time())
+                    save(step_id)
+                    inputs = {d: {k: states[d].get(k) for k in ('type', 'status', 'result', 'error')} for d in step['needs']}
+                    shell = SHELL_FIELDS.get(step['type'], ())
+                    params = {k: render(v, states, shlex.quote if k in shell else None)
+                              for k, v in step.items() if k not in _STRUCTURAL or k == 'id'}
+                    future = self._pool.submit(self.handlers[step['type']], params, inputs, step['timeout'])
+                    running[future] = (step_id, now + step['timeout'])
+
+            if not running and not retry_at:
+                break
+            wake = [d for _, d in running.values()] + list(retry_at.values())
+            timeout = max(0.0, min(min(wake) - time.monotonic(), 5.0)) if wake else 5.0
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED) if running else (set(), None)
+            if not running and timeout:
+                time.sleep(timeout)
+            now = time.monotonic()
+            for future in list(running):
+                step_id, deadline = running[future]
+                if future in done:
+                    del running[future]
+                    try:
+                        finish(step_id, 'ok', _normalize_result(future.result()))
+                        continue
+                    except Exception as e:
+                        error = str(e) or type(e).__name__
+                elif now >= deadline:
+                    del running[future]
+                    future.cancel()
+                    error = f"timed out after {steps[step_id]['timeout']:g}s"
+                else:
+                    continue
+                step, s = steps[step_id], states[step_id]
+                if s['attempts'] <= step['retries'] and run_id not in self._cancelled:
+                    s.update(status='pending', error=error)
+                    retry_at[step_id] = now + step['retry_delay'] * 2 ** (s['attempts'] - 1)
+                    save(step_id)
+                else:
+                    finish(step_id, 'failed', error=error)
+            if now - last_beat > LEASE / 4:
+                last_beat = now
+                self.storage.heartbeat_workflow_run(run_id, self._owner())
+
+        status = 'cancelled' if run_id in self._cancelled else (
+            'ok' if all(s['status'] == 'ok' for s in states.values()) else 'failed')
+        used = {d for step in steps.values() for d in step['needs']}
+        result = {step_id: states[step_id].get('result') for step_id in steps if step_id not in used}
+        self.storage.finish_workflow_run(run_id, status, result)
+        self._emit(run_id, None, status)
+
+    def _gather(self, step, states):
+        outputs, errors = {}, {}
+        for child_id in step['needs']:
+            child = states[child_id]
+            device = child_id.split('@', 1)[1]
+            if child['status'] == 'ok':
+                outputs[device] = (child.get('result') or {}).get('output', '')
+            else:
+                errors[device] = child.get('error') or child['status']
+        text = '\n'.join(f"[{device}]\n{output}" for device, output in outputs.items())
+        states[step['id']].update(status='failed' if errors else 'ok', finished_at=time.time(),
+                                  result=_normalize_result({'output': text, 'outputs': outputs, 'errors': errors}),
+                                  error=f"failed on: {', '.join(errors)}" if errors else None)
+
+
+workflows = WorkflowEngine()
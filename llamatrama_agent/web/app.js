@@ -13,6 +13,133 @@ async function handleError(error) {
     if (el) el.innerText = 'An error occurred. Please try again later.';
 }
 
+// Multiplexed command streams over one websocket (/ws/mux).
+// Usage: const mux = openMux(); mux.run('100.64.0.2', 'uptime', { onData, onExit });
+function openMux() {
+    const proto = location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const ws = new WebSocket(`${proto}//${location.host}/ws/mux`);
+    const handlers = {};
+    const queue = [];
+    let seq = 0;
+    ws.onopen = () => {
+        // Auth comes from the access_token cookie; the first frame is still required
+        ws.send(JSON.stringify({ token: window.token === true ? null : window.token }));
+        queue.splice(0).forEach(f => ws.send(JSON.stringify(f)));
+    };
+    ws.onmessage = (ev) => {
+        const frame = JSON.parse(ev.data);
+        const h = handlers[frame.stream];
+        if (!h) {
+            if (frame.type === 'error') console.error('[mux]', frame.error);
+            return;
+        }
+        if (frame.type === 'data' && h.onData) h.onData(frame.data);
+        if (frame.type === 'error' && h.onError) h.onError(frame.error);
+        if (frame.type === 'exit') {
+            if (h.onExit) h.onExit(frame.code, frame);
+            delete handlers[frame.stream];
+        }
+    };
+    function send(frame) {
+        if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify(frame));
+        else queue.push(frame);
+    }
+    return {
+        run(device, cmd, h = {}) {
+            const stream = `s${++seq}`;
+            handlers[stream] = h;
+            send({ type: 'open', stream, device, cmd });
+            return stream;
+        },
+        cancel(stream) { send({ type: 'cancel', stream }); },
+        close() { ws.close(); },
+    };
+}
+
+// Live updates over Server-Sent Events (/events) instead of re-polling endpoints
+let eventSource = null;
+
+function applyDeviceDelta(sel, delta) {
+    if (!sel) return;
+    (delta.offline || []).forEach(d => {
+        const opt = Array.from(sel.options).find(o => o.value === d.ip);
+        if (opt) opt.remove();
+    });
+    (delta.online || []).forEach(d => {
+        if (Array.from(sel.options).some(o => o.value === d.ip)) return;
+        const opt = document.createElement('option');
+        opt.value = d.ip;
+        opt.innerText = d.name || d.ip;
+        sel.appendChild(opt);
+    });
+}
+
+// Grey out devices whose circuit is open (server fails fast for them until a probe succeeds)
+function markDeviceHealth(opt, state, latencyMs) {
+    if (!opt) return;
+    const label = opt.dataset.label || opt.innerText;
+    opt.dataset.label = label;
+    if (state !== undefined) opt.dataset.health = state || '';
+    if (latencyMs !== undefined) opt.dataset.latency = latencyMs == null ? '' : Math.round(latencyMs);
+    opt.disabled = opt.dataset.health === 'open';
+    if (opt.disabled) opt.innerText = `${label} (unreachable)`;
+    else opt.innerText = opt.dataset.latency ? `${label} · ${opt.dataset.latency} ms` : label;
+}
+
+function subscribeEvents() {
+    if (eventSource) return eventSource;
+    eventSource = new EventSource('/events', { withCredentials: true });
+    const parse = (ev) => JSON.parse(ev.data).data;
+    eventSource.addEventListener('devices', (ev) => {
+        const delta = parse(ev);
+        applyDeviceDelta(document.getElementById('device-select'), delta);
+        applyDeviceDelta(document.getElementById('tailnet-device-select'), delta);
+    });
+    eventSource.addEventListener('device-health', (ev) => {
+        const h = parse(ev);
+        ['device-select', 'tailnet-device-select'].forEach(id => {
+            const sel = document.getElementById(id);
+            if (!sel) return;
+            markDeviceHealth(Array.from(sel.options).find(o => o.value === h.host), h.state);
+        });
+    });
+    eventSource.addEventListener('device-latency', (ev) => {
+        const table = parse(ev);
+        (table.hosts || []).forEach(row => {
+            ['device-select', 'tailnet-device-select'].forEach(id => {
+                const sel = document.getElementById(id);
+                if (!sel) return;
+                markDeviceHealth(Array.from(sel.options).find(o => o.value === row.host),
+                                 row.reachable ? undefined : 'open', row.reachable ? row.p50_ms : null);
+            });
+        });
+    });
+    eventSource.addEventListener('session-log', (ev) => {
+        const entry = parse(ev);
+        const logDiv = document.getElementById('session-log');
+        if (logDiv) {
+            logDiv.innerText += entry.append;
+            logDiv.scrollTop = logDiv.scrollHeight;
+        }
+    });
+    eventSource.addEventListener('job', (ev) => {
+        const job = parse(ev);
+        const statusPanel = document.getElementById('status-panel');
+        if (statusPanel) statusPanel.innerText = `Job ${job.kind}: ${job.state}${job.status ? ' (' + job.status + ')' : ''}`;
+    });
+    eventSource.addEventListener('command', (ev) => {
+        const cmd = parse(ev);
+        const sshOut = document.getElementById('ssh-output');
+        if (sshOut && !sshOut.innerText) sshOut.innerText = cmd.output || '';
+    });
+    return eventSource;
+}
+
+function unsubscribeEvents() {
+    if (eventSource) eventSource.close();
+    eventSource = null;
+}
+
 // Load devices
 async function loadDevices() {
     try {
@@ -25,6 +152,8 @@ async function loadDevices() {
                 const opt = document.createElement('option');
                 opt.value = d.ip || d;
                 opt.innerText = d.name || d.ip || d;
+                opt.dataset.label = opt.innerText;
+                markDeviceHealth(opt, d.health, d.latency_ms);
                 sel.appendChild(opt);
             });
         }
@@ -103,9 +232,10 @@ async function loadSessionLog() {
         function showDashboard() {
             if (loginPanel) loginPanel.style.display = 'none';
             if (dashboard) dashboard.style.display = '';
-            // load devices when dashboard shows
+            // load devices once when dashboard shows; later changes arrive over SSE
             loadDevices();
             loadTailnetDevices();
+            subscribeEvents();
         }
 
         function showLogin() {
@@ -245,6 +375,7 @@ async function loadSessionLog() {
                     await fetch('/logout', { method: 'POST', credentials: 'include' });
                 } catch (e) { console.error(e); }
                 window.token = null;
+                unsubscribeEvents();
                 showLogin();
             });
         }
@@ -354,7 +485,7 @@ async function loadSessionLog() {
             });
         }
 
-        // Load session log on dashboard show
+        // Load session log once on dashboard show; new entries are appended from SSE
         async function refreshSessionLog() {
             try {
                 const resp = await fetch('/session-log', { credentials: 'include' });
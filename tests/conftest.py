@@ -1,5 +1,8 @@
+import atexit
 import sys
 import os
+import shutil
+import tempfile
 # Ensure project root is on sys.path for tests
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if ROOT not in sys.path:
@@ -8,3 +11,7 @@ if ROOT not in sys.path:
 PKG_DIR = os.path.join(ROOT, 'llamatrama_agent')
 if os.path.isdir(PKG_DIR) and PKG_DIR not in sys.path:
     sys.path.insert(0, PKG_DIR)
+# Keep the suite out of the app's real database: tools.storage reads LLAMA_DB_PATH at import time
+_DB_DIR = tempfile.mkdtemp(prefix='llamatrama-test-')
+os.environ['LLAMA_DB_PATH'] = os.path.join(_DB_DIR, 'llamatrama.db')
+atexit.register(shutil.rmtree, _DB_DIR, True)
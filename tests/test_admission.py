@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from tools.admission import AdmissionController, AdmissionRejected, ConcurrencyLimiter, LocalBuckets
+
+
+def policies(**overrides):
+    base = {
+        'llm': {'user_rate': 0.001, 'user_burst': 2, 'concurrency': 1, 'max_queue': 1, 'max_wait': 0.2},
+        'ssh': {'user_rate': 100, 'user_burst': 100, 'device_rate': 100, 'device_burst': 100,
+                'concurrency': 1, 'max_queue': 1, 'max_wait': 0.2},
+        'exec': {'device_rate': 100, 'device_burst': 100, 'concurrency': 1, 'max_queue': 4, 'max_wait': 1.0},
+    }
+    for kind, values in overrides.items():
+        base[kind].update(values)
+    return base
+
+
+def test_user_bucket_rejects_with_retry_after():
+    ctl = AdmissionController(policies(), buckets=LocalBuckets())
+
+    async def run():
+        for _ in range(2):
+            async with ctl.admit('llm', user='alice'):
+                pass
+        with pytest.raises(AdmissionRejected) as info:
+            async with ctl.admit('llm', user='alice'):
+                pass
+        assert info.value.reason == 'rate_limited'
+        assert info.value.retry_after >= 1
+        # Other users have their own bucket
+        async with ctl.admit('llm', user='bob'):
+            pass
+    asyncio.run(run())
+
+
+def test_per_device_cap_queues_then_rejects_when_queue_full():
+    ctl = AdmissionController(policies(ssh={'max_wait': 1.0}), buckets=LocalBuckets())
+    order = []
+
+    async def job(name, hold, device='pi-1'):
+        async with ctl.admit('ssh', user=name, device=device):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def run():
+        first = asyncio.create_task(job('a', 0.1))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(job('b', 0))   # waits for a's slot
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as info:
+            await job('c', 0)                       # queue (depth 1) is full
+        assert info.value.reason == 'queue_full'
+        # A different device is not affected by pi-1's cap
+        await job('d', 0, device='pi-2')
+        await asyncio.gather(first, second)
+        assert ctl.limiter('ssh', 'pi-1').active == 0
+    asyncio.run(run())
+    assert order == ['a', 'd', 'b']
+
+
+def test_waiter_times_out_and_slot_is_not_leaked():
+    async def run():
+        limiter = ConcurrencyLimiter('x', limit=1, max_queue=2, max_wait=0.05)
+        await limiter.acquire()
+        with pytest.raises(AdmissionRejected) as info:
+            await limiter.acquire()
+        assert info.value.reason == 'timeout'
+        limiter.release()
+        assert limiter.active == 0 and limiter.queued == 0
+        await limiter.acquire()
+        assert limiter.active == 1
+    asyncio.run(run())
+
+
+def test_slot_released_early_lets_the_next_stream_in():
+    ctl = AdmissionController(policies(), buckets=LocalBuckets())
+
+    async def run():
+        slot = await ctl.acquire('exec', device='pi-1')
+        waiting = asyncio.create_task(ctl.acquire('exec', device='pi-1'))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        slot.release()  # e.g. the stream went idle
+        second = await asyncio.wait_for(waiting, 1)
+        slot.release()  # idempotent: the stream ending later does not free a second slot
+        assert ctl.limiter('exec', 'pi-1').active == 1
+        second.release()
+        assert ctl.limiter('exec', 'pi-1').active == 0
+    asyncio.run(run())
@@ -33,3 +33,14 @@ def test_sanitize_output_redacts_ips_and_macs():
     out = agent.sanitize_output(s)
     assert '[REDACTED_IP]' in out
     assert '[REDACTED_MAC]' in out
+
+
+def test_session_markdown_is_recorded_in_history(tmp_path, monkeypatch):
+    from tools.storage import get_storage
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'outputs').mkdir()
+    agent.save_session_markdown(7, [('ls', 'files'), ('df', 'disk')])
+    agent.save_session_markdown(7, [('uptime', 'up 3 days')])  # a restarted CLI overwrites session_7.md
+    assert (tmp_path / 'outputs' / 'session_7.md').read_text().startswith('### Prompt 1:\nuptime')
+    rows = get_storage().list_history(source='cli:session_7.md')
+    assert [(r['prompt'], r['response'], r['import_path']) for r in rows] == [('uptime', 'up 3 days', 'session_7.md')]
@@ -0,0 +1,82 @@
+import asyncio
+import struct
+
+import pytest
+
+from tools.camera import CameraHub, JpegSplitter, SyntheticChannel, snapshot, snapshot_command, stream_command, synthetic_jpeg
+
+
+def test_commands_prefer_modern_tools_and_keep_stderr_off_the_stream():
+    cmd = snapshot_command(640, 480, 80)
+    assert cmd.index('rpicam-still') < cmd.index('libcamera-still') < cmd.index('raspistill')
+    assert '-o - 2>/dev/null' in cmd and 'exit 127' in cmd
+    assert '--codec mjpeg' in stream_command(fps=15) and '-cd MJPEG' in stream_command()
+
+
+def test_splitter_handles_chunking_thumbnails_and_garbage():
+    frames = [synthetic_jpeg(16, 16, 144 + i, f'f{i}') for i in range(3)]
+    thumb = synthetic_jpeg(8, 8)
+    with_thumb = frames[0][:2] + b'\xff\xe1' + struct.pack('>H', len(thumb) + 2) + thumb + frames[0][2:]
+    data = b'noise' + with_thumb + frames[1] + b'\xff\xd8broken' + frames[2]
+    splitter = JpegSplitter()
+    out = []
+    for i in range(0, len(data), 5):
+        out += splitter.feed(data[i:i + 5])
+    assert out == [with_thumb, frames[1], frames[2]]
+    assert splitter.skipped > 0
+
+
+def test_snapshot_reads_one_jpeg_from_the_channel():
+    commands = []
+
+    def open_channel(cmd):
+        commands.append(cmd)
+        return SyntheticChannel(fps=1000, frames=1, chunk=100)
+
+    jpeg = snapshot(open_channel, width=320, height=240)
+    assert jpeg.startswith(b'\xff\xd8') and jpeg.endswith(b'\xff\xd9')
+    assert 'rpicam-still' in commands[0]
+    with pytest.raises(RuntimeError):
+        snapshot(lambda cmd: SyntheticChannel(frames=0))
+
+
+def test_viewers_share_one_capture_and_slow_viewers_skip_frames():
+    opened = []
+
+    def open_channel(cmd):
+        opened.append(SyntheticChannel(fps=100, width=32, height=32))
+        return opened[-1]
+
+    async def scenario():
+        hub = CameraHub()
+        fast = hub.subscribe('pi', open_channel)
+        slow = hub.subscribe('pi', open_channel)
+        assert fast.stream is slow.stream
+        seqs = [(await fast.next(timeout=5))[0] for _ in range(10)]
+        assert seqs == sorted(set(seqs))
+        await asyncio.sleep(0.3)  # the slow viewer has not asked for anything in a while
+        seq, jpeg, _ = await slow.next(timeout=5)
+        assert seq >= seqs[-1] and jpeg.endswith(b'\xff\xd9')
+        seq2, _, _ = await slow.next(timeout=5)
+        assert seq2 > seq
+        assert hub.latest('pi') is not None
+        fast.close()
+        slow.close()
+        assert hub.status() == [] and hub.latest('pi') is None
+
+    asyncio.run(scenario())
+    assert len(opened) == 1 and opened[0]._closed.is_set()
+
+
+def test_viewer_sees_end_of_capture():
+    async def scenario():
+        hub = CameraHub()
+        viewer = hub.subscribe('pi', lambda cmd: SyntheticChannel(fps=1000, frames=2))
+        got = []
+        with pytest.raises(ConnectionError):
+            while True:
+                got.append((await viewer.next(timeout=5))[0])
+        viewer.close()
+        return got
+
+    assert asyncio.run(scenario())[-1] == 2
@@ -0,0 +1,154 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+from tools.delta_sync import (DeltaSync, build_manifest, compute_delta, encode_ops, iter_delta, pack_plan, stream_plan,
+                              strong_checksum, weak_checksum)
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='the sync script targets POSIX devices')
+
+
+class ProcessChannel:
+    """Channel-like wrapper running the device script locally."""
+    def __init__(self, command):
+        self.proc = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def settimeout(self, timeout):
+        pass
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+
+    def shutdown_write(self):
+        self.proc.stdin.close()
+
+    def recv(self, n):
+        data = os.read(self.proc.stdout.fileno(), n)
+        if not data:
+            self.proc.wait()
+        return data
+
+
+def local_channel(device, cmd):
+    return ProcessChannel(cmd.replace('python3 -c', f'{sys.executable} -c', 1))
+
+
+def signatures(old, block):
+    chunks = [old[i:i + block] for i in range(0, len(old), block)]
+    return [[weak_checksum(c), strong_checksum(c)] for c in chunks]
+
+
+def rebuild(old, ops, block):
+    out = b''
+    for op in ops:
+        out += old[op[1] * block:(op[1] + op[2]) * block] if op[0] == 'C' else op[1]
+    return out
+
+
+def test_rolling_delta_finds_shifted_blocks():
+    rng = random.Random(7)
+    old = bytes(rng.getrandbits(8) for _ in range(50_000))
+    new = old[:10_000] + b'inserted line\n' + old[10_000:30_000] + old[31_000:] + b'appended'
+    block = 1024
+    ops = compute_delta(new, signatures(old, block), block, size=len(old), use_numpy=False)
+    assert rebuild(old, ops, block) == new
+    literal = sum(len(op[1]) for op in ops if op[0] == 'L')
+    assert literal < 4 * block
+    assert encode_ops(ops).endswith(b'E') and len(encode_ops(ops)) < len(new) // 5
+    assert compute_delta(b'short', signatures(old, block), block, use_numpy=False) == [('L', b'short')]
+
+
+def test_streamed_delta_matches_across_read_windows(tmp_path):
+    rng = random.Random(11)
+    old = bytes(rng.getrandbits(8) for _ in range(40_000))
+    new = b'head' + old[:15_000] + old[16_000:] + b'tail'
+    block = 512
+    path = tmp_path / 'new.bin'
+    path.write_bytes(new)
+    whole = compute_delta(new, signatures(old, block), block, size=len(old), use_numpy=False)
+    with open(path, 'rb') as f:
+        ops = list(iter_delta(f, signatures(old, block), block, len(old), use_numpy=False, window=3000))
+    assert rebuild(old, [('L', new[o[1]:o[1] + o[2]]) if o[0] == 'L' else o for o in ops], block) == new
+    assert sum(o[2] for o in ops if o[0] == 'L') == sum(len(o[1]) for o in whole if o[0] == 'L')
+    assert b''.join(stream_plan(str(path), pack_plan(ops))) == encode_ops(whole)
+
+
+def test_manifest_for_directories_and_single_files(tmp_path):
+    (tmp_path / 'src' / 'sub').mkdir(parents=True)
+    (tmp_path / 'src' / 'a.conf').write_text('a')
+    (tmp_path / 'src' / 'sub' / 'b.sh').write_text('b')
+    os.symlink(tmp_path / 'src' / 'a.conf', tmp_path / 'src' / 'link')
+    manifest = build_manifest(str(tmp_path / 'src'), '/etc/app/')
+    assert manifest['root'] == '/etc/app' and sorted(manifest['files']) == ['a.conf', 'sub/b.sh']
+    single = build_manifest(str(tmp_path / 'src' / 'a.conf'), '/etc/app.conf')
+    assert single['root'] == '/etc' and list(single['files']) == ['app.conf'] and single['single']
+
+
+def test_push_to_many_devices_shares_deltas_and_verifies(tmp_path):
+    rng = random.Random(1)
+    src = tmp_path / 'src'
+    (src / 'sub').mkdir(parents=True)
+    old_data = bytes(rng.getrandbits(8) for _ in range(200_000))
+    new_data = old_data[:100_000] + b'changed!' + old_data[100_008:]
+    (src / 'data.bin').write_bytes(new_data)
+    (src / 'sub' / 'run.sh').write_text('#!/bin/sh\necho hi\n')
+    os.chmod(src / 'sub' / 'run.sh', 0o755)
+    (src / 'same.txt').write_text('same\n')
+
+    devices = {}
+    for name in ('pi1', 'pi2', 'pi3'):
+        dest = tmp_path / name
+        dest.mkdir()
+        (dest / 'data.bin').write_bytes(old_data)
+        (dest / 'same.txt').write_text('same\n')
+        (dest / 'stale.tmp').write_text('old')
+        devices[name] = dest
+
+    syncer = DeltaSync(use_numpy=False)
+    results = {}
+    for name, dest in devices.items():
+        manifest = build_manifest(str(src), str(dest))
+        results[name] = syncer.push_device(manifest, lambda cmd: local_channel(name, cmd), delete=True)
+    for name, dest in devices.items():
+        result = results[name]
+        assert result['files'] == {'data.bin': 'updated', 'sub/run.sh': 'updated', 'same.txt': 'unchanged',
+                                   'stale.tmp': 'deleted'}, result
+        assert (dest / 'data.bin').read_bytes() == new_data
+        assert os.stat(dest / 'sub' / 'run.sh').st_mode & 0o777 == 0o755
+        assert not (dest / 'stale.tmp').exists()
+        assert result['matched'] > 150_000 and result['sent'] < 30_000
+    assert syncer.delta_computations == 1
+
+    again = syncer.push_device(build_manifest(str(src), str(devices['pi1'])), lambda cmd: local_channel('pi1', cmd))
+    assert again['unchanged'] == 3 and again['sent'] == 0
+
+
+def test_changed_device_file_is_retried_as_full_copy(tmp_path):
+    (tmp_path / 'new.txt').write_bytes(b'x' * 5000 + b'new tail')
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    (dest / 'f.txt').write_bytes(b'x' * 5000 + b'old tail')
+
+    def racing_channel(cmd):
+        if cmd.endswith(' apply'):
+            (dest / 'f.txt').write_bytes(b'y' * 5000)  # the device file changes after signing
+        return local_channel('pi', cmd)
+
+    result = DeltaSync().push_device(build_manifest(str(tmp_path / 'new.txt'), str(dest / 'f.txt')), racing_channel)
+    assert result['files'] == {'f.txt': 'updated'}
+    assert (dest / 'f.txt').read_bytes() == b'x' * 5000 + b'new tail'
+
+
+def test_push_reports_errors_per_device(tmp_path):
+    (tmp_path / 'a').write_text('a')
+
+    def channel(device, cmd):
+        if device == 'down':
+            raise ConnectionError('unreachable')
+        return local_channel(device, cmd)
+
+    results = DeltaSync().push(str(tmp_path / 'a'), str(tmp_path / 'out' / 'a'), ['ok', 'down'], channel)
+    assert results['ok']['files'] == {'a': 'updated'} and results['down'] == {'error': 'unreachable'}
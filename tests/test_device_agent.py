@@ -0,0 +1,145 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import wait
+
+import pytest
+
+from tools.device_agent import (AgentError, AgentUnavailable, attach, connect_tcp, install_command,
+                                launch_command, parse_probe, probe_command, runtime_source)
+from tools.device_agent_runtime import FrameReader, JsonCodec, frame
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='the agent targets POSIX devices')
+
+
+class ProcessChannel:
+    """Channel-like wrapper around a local shell command, standing in for an SSH exec channel."""
+    def __init__(self, command, env=None):
+        self.proc = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, n):
+        return os.read(self.proc.stdout.fileno(), n)
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+
+
+@pytest.fixture
+def home(tmp_path):
+    env = dict(os.environ, HOME=str(tmp_path), PATH=os.path.dirname(sys.executable) + os.pathsep + os.environ['PATH'])
+    out = subprocess.run(install_command(), shell=True, env=env, capture_output=True, text=True)
+    assert out.stdout.startswith('installed'), out.stderr
+    return tmp_path, env
+
+
+@pytest.fixture
+def client(home):
+    _, env = home
+    agent = attach(lambda cmd: ProcessChannel(cmd, env=env))
+    assert agent is not None
+    yield agent
+    agent.close()
+
+
+def test_codec_and_framing_round_trip_bytes():
+    codec = JsonCodec()
+    message = {'i': 1, 'r': {'data': b'\x00\xff binary', 'n': [1, 2]}}
+    body = codec.encode(message)
+    reader = FrameReader()
+    wire = frame(body) + frame(b'{}')
+    assert reader.feed(wire[:3]) == [] and reader.feed(wire[3:]) == [body, b'{}']
+    assert codec.decode(body) == message
+
+
+def test_install_probe_and_absent_agent(home, tmp_path):
+    root, env = home
+    (path,) = (root / '.llamatrama').iterdir()
+    assert path.read_bytes() == runtime_source()
+    probe = parse_probe(subprocess.run(probe_command(), shell=True, env=env, capture_output=True, text=True).stdout)
+    assert probe['installed'] and probe['python'][0].isdigit()
+    empty = dict(env, HOME=str(tmp_path / 'nowhere'))
+    assert attach(lambda cmd: ProcessChannel(cmd, env=empty)) is None
+    assert 'exec python3 -u' in launch_command()
+
+
+def test_exec_tracks_cwd_runs_concurrently_and_times_out(client, tmp_path):
+    assert client.ping()['protocol'] == 1
+    first = client.exec(f'cd {tmp_path} && echo hi && echo oops >&2; exit 3')
+    assert (first['code'], first['stdout'], first['stderr']) == (3, 'hi\n', 'oops\n')
+    assert client.exec('pwd', cwd=first['cwd'])['stdout'].strip() == str(tmp_path)
+    started = time.monotonic()
+    futures = [client.submit('exec', cmd=f'sleep 0.4; echo {i}') for i in range(4)]
+    wait(futures, timeout=10)
+    assert sorted(f.result()['stdout'].strip() for f in futures) == ['0', '1', '2', '3']
+    assert time.monotonic() - started < 1.5
+    slow = client.exec('echo started; sleep 1; echo done > marker', timeout=0.3, cwd=str(tmp_path))
+    assert slow['timed_out'] and slow['running'] and slow['code'] is None and slow['stdout'] == 'started\n'
+    time.sleep(1.2)
+    assert (tmp_path / 'marker').read_text() == 'done\n'  # a read timeout leaves the command running
+    killed = client.exec('sleep 5; touch never', timeout=2, kill_after=0.3, cwd=str(tmp_path))
+    assert killed['killed'] and not killed['running'] and killed['elapsed'] < 1.5
+    assert not (tmp_path / 'never').exists()
+
+
+def test_file_metrics_and_error_calls(client, tmp_path):
+    (tmp_path / 'files').mkdir()
+    target = str(tmp_path / 'files' / 'blob.bin')
+    payload = bytes(range(256)) * 100
+    assert client.write_file(target, payload)['written'] == len(payload)
+    client.write_file(target, b'tail', append=True)
+    assert client.read_file(target, chunk=1000) == payload + b'tail'
+    assert client.stat(target)['size'] == len(payload) + 4
+    assert [e['name'] for e in client.listdir(str(tmp_path / 'files'))] == ['blob.bin']
+    assert client.metrics()['cpus'] >= 1
+    with pytest.raises(AgentError, match='FileNotFoundError'):
+        client.stat(str(tmp_path / 'missing'))
+    with pytest.raises(AgentError, match='unknown method'):
+        client.call('format_disk')
+
+
+def test_tcp_listener_requires_the_token(tmp_path):
+    from tools.device_agent import RUNTIME_PATH
+    token = tmp_path / 'token'
+    token.write_text('s3cret\n')
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, RUNTIME_PATH, '--listen', f'127.0.0.1:{port}', '--token-file', str(token)])
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                assert time.time() < deadline
+                time.sleep(0.05)
+        with pytest.raises(AgentUnavailable, match='unauthorized'):
+            connect_tcp('127.0.0.1', port, 'wrong')
+        agent = connect_tcp('127.0.0.1', port, 's3cret')
+        assert agent.exec('echo over tcp')['stdout'] == 'over tcp\n'
+        agent.close()
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_pending_calls_fail_when_the_agent_goes_away(client):
+    future = client.submit('exec', cmd='sleep 5')
+    client.transport.proc.kill()
+    with pytest.raises(AgentUnavailable):
+        future.result(5)
+    assert not client.alive
+    with pytest.raises(AgentUnavailable):
+        client.ping()
@@ -0,0 +1,85 @@
+import pytest
+
+from tools.diagnostics import (FleetFrame, collect_fleet, parse_df, parse_free, parse_ps, parse_size,
+                               parse_temp, parse_uptime, parse_vitals, VITALS_COMMAND)
+
+DF = """pi@pi:~ $ df -h
+Filesystem      Size  Used Avail Use% Mounted on
+/dev/root        29G   13G   15G  48% /
+/dev/mmcblk0p1  255M   51M  205M  20% /boot
+"""
+FREE = """               total        used        free      shared  buff/cache   available
+Mem:           3.7Gi       412Mi       2.6Gi        33Mi       755Mi       3.3Gi
+Swap:           99Mi          0B        99Mi
+"""
+PS = """USER         PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND
+root           1  0.1  0.3  33600  9800 ?        Ss   Oct18   0:05 /sbin/init splash
+pi          4242 87.5  4.1 301000 160000 pts/0   R+   10:01   1:30 python3 train.py --epochs 10
+"""
+
+
+def test_sizes_and_df():
+    assert parse_size('3.7Gi') == round(3.7 * 1024 ** 3)
+    assert parse_size('0B') == 0 and parse_size('512M') == 512 * 1024 ** 2 and parse_size('n/a') is None
+    disks = parse_df(DF)
+    assert [d['mount'] for d in disks] == ['/', '/boot']
+    assert disks[0]['use_percent'] == 48.0 and disks[0]['size_bytes'] == 29 * 1024 ** 3
+
+
+def test_free_uptime_temp_ps():
+    memory = parse_free(FREE)
+    assert memory['mem']['available'] == round(3.3 * 1024 ** 3)
+    assert memory['swap']['used'] == 0 and memory['swap_used_percent'] == 0.0
+    assert 10 < memory['mem_used_percent'] < 11
+
+    up = parse_uptime(' 10:02:11 up 3 days,  4:05,  2 users,  load average: 0.15, 0.10, 0.05')
+    assert up == {'uptime_seconds': 3 * 86400 + 4 * 3600 + 5 * 60, 'users': 2, 'load_1': 0.15, 'load_5': 0.10, 'load_15': 0.05}
+    assert parse_uptime(' 10:02:11 up 5 min,  1 user,  load average: 1,50, 0,80, 0,20')['load_1'] == 1.5
+
+    assert parse_temp("temp=48.3'C") == {'temp_c': 48.3}
+    assert parse_temp('51540\n') == {'temp_c': 51.54}
+
+    procs = parse_ps(PS)
+    assert procs[1]['pid'] == 4242 and procs[1]['cpu_percent'] == 87.5
+    assert procs[1]['rss_bytes'] == 160000 * 1024 and procs[1]['command'] == 'python3 train.py --epochs 10'
+
+
+def record(temp, load, disk_use):
+    return {'temp_c': temp, 'load_5': load, 'disks': [{'mount': '/', 'use_percent': disk_use}], 'memory': {}}
+
+
+@pytest.mark.parametrize('use_numpy', [None, False])
+def test_fleet_frame_percentiles_top_and_alerts(use_numpy):
+    if use_numpy is None:
+        pytest.importorskip('numpy')
+    records = {f'pi-{i}': record(40 + i, i / 10, 50) for i in range(100)}
+    records['pi-7']['disks'][0]['use_percent'] = 95
+    records['pi-down'] = {'error': 'timeout'}
+    frame = FleetFrame(records, use_numpy=use_numpy)
+    assert len(frame) == 100 and frame.errors == {'pi-down': 'timeout'}
+
+    stats = frame.stats('temp_c')
+    assert stats['count'] == 100 and stats['min'] == 40 and stats['max'] == 139
+    assert stats['p50'] == 89.5 and stats['p90'] == pytest.approx(129.1)
+    assert frame.stats('swap_used_percent') == {'count': 0}
+
+    assert [d for d, _ in frame.top('temp_c', 3)] == ['pi-99', 'pi-98', 'pi-97']
+    alerts = frame.alerts({'temp_c': 137, 'disk_used_percent': 90})
+    assert [(a['device'], a['metric']) for a in alerts] == [
+        ('pi-99', 'temp_c'), ('pi-98', 'temp_c'), ('pi-97', 'temp_c'), ('pi-7', 'disk_used_percent')]
+    assert frame.summary()['backend'] == ('python' if use_numpy is False else 'numpy')
+
+
+def test_collect_fleet_parses_vitals_and_isolates_failures():
+    output = DF + '@@VITALS\n' + FREE + '@@VITALS\n up 1 day,  1 user,  load average: 2.00, 1.00, 0.50\n@@VITALS\ntemp=61.0\'C\n@@VITALS\n' + PS
+
+    def run(host, command):
+        assert command == VITALS_COMMAND
+        if host == 'bad':
+            raise OSError('refused')
+        return output
+
+    records = collect_fleet(['pi-1', 'bad', 'pi-1'], run)
+    assert set(records) == {'pi-1', 'bad'} and records['bad'] == {'error': 'refused'}
+    assert records['pi-1'] == parse_vitals(output)
+    assert records['pi-1']['temp_c'] == 61.0 and records['pi-1']['load_1'] == 2.0
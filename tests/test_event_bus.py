@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+from tools.event_bus import EventBus, FileTailer, format_sse
+
+
+def test_bus_delivers_topics_and_replays_after_last_event_id():
+    async def run():
+        bus = EventBus()
+        first = bus.publish('job', {'state': 'started'})
+        sub = bus.subscribe(topics=['job'])
+        bus.publish('devices', {'online': []})
+        bus.publish('job', {'state': 'finished'})
+        event = await sub.get(timeout=1)
+        assert event['data'] == {'state': 'finished'}
+        # A reconnecting client resumes after the id it last saw
+        resumed = bus.subscribe(last_event_id=first)
+        assert resumed.queue.qsize() == 2
+        sub.close()
+        resumed.close()
+        assert bus.subscriber_count() == 0
+    asyncio.run(run())
+
+
+def test_bus_publish_from_thread_and_overflow_drops_oldest():
+    async def run():
+        bus = EventBus()
+        sub = bus.subscribe(maxsize=2)
+        t = threading.Thread(target=lambda: [bus.publish('command', i) for i in range(5)])
+        t.start()
+        t.join()
+        await asyncio.sleep(0.05)
+        got = [(await sub.get(timeout=1))['data'] for _ in range(2)]
+        assert got == [3, 4]
+        assert sub.dropped == 3
+    asyncio.run(run())
+
+
+def test_format_sse_and_file_tailer_deltas(tmp_path):
+    text = format_sse({'id': 7, 'topic': 'job', 'ts': 1.0, 'data': {'a': 1}})
+    assert text.startswith('id: 7\nevent: job\ndata: ')
+    assert text.endswith('\n\n')
+
+    log = tmp_path / 'aggregates.md'
+    log.write_text('old\n')
+    tailer = FileTailer(str(tmp_path))
+    tailer.prime()
+    assert tailer.poll() == []
+    with open(log, 'a') as fh:
+        fh.write('new entry\n')
+    assert tailer.poll() == [('aggregates.md', 'new entry\n')]
@@ -0,0 +1,75 @@
+import base64
+import hashlib
+
+from tools.facts import FactsCache, build_script, parse_output
+from tools.storage import Storage
+
+DEVICE = {
+    'os': 'PRETTY_NAME="Raspbian GNU/Linux 12 (bookworm)"\nID=raspbian\n',
+    'kernel': 'Linux pi 6.1.21-v8+ aarch64',
+    'memory': 'MemTotal:        3884000 kB\nSwapTotal:        102396 kB',
+    'disks': 'Filesystem 1048576-blocks Mounted\n/dev/root 29000 /',
+    'disk_usage': 'Filesystem 1048576-blocks Used Available Capacity Mounted on\n/dev/root 29000 13050 14700 48% /',
+    'services': 'ssh.service loaded active running OpenBSD Secure Shell server\ntailscaled.service loaded active running Tailscale',
+    'tailscale': '100.64.0.2\nfd7a:115c:a1e0::2\n1.56.1',
+}
+
+
+def fake_device(state, transcript):
+    """Answers the collection script like the device would: hash every section, send bodies only when changed."""
+    def run(script):
+        transcript.append(script)
+        lines = ['$ ' + script[:40]]  # interactive shells echo the command
+        for name, text in state.items():
+            digest = hashlib.sha256(text.encode()).hexdigest()[:16]
+            if f"_f {name} '{digest}'" in script:
+                lines.append(f'@@FACT {name} {digest} same')
+            else:
+                lines.append(f'@@FACT {name} {digest} changed')
+                lines.append(base64.b64encode(text.encode()).decode())
+        return '\r\n'.join(lines) + '\r\npi@pi:~ $ '
+    return run
+
+
+def test_script_quotes_known_hashes():
+    script = build_script({'os': 'abc'}, sections=['os', 'kernel'])
+    assert "_f os 'abc' 'cat /etc/os-release'" in script
+    assert "_f kernel '-' 'uname -nsrm'" in script
+    assert "_f disk_usage '-' " in build_script({'disk_usage': 'abc'}, sections=['disk_usage'])
+    assert parse_output('@@FACT os 0123456789abcdef same\n') == {'os': ('0123456789abcdef', None)}
+
+
+def test_only_changed_sections_are_transferred(tmp_path):
+    cache = FactsCache(Storage(str(tmp_path / 'facts.db')))
+    state, transcript = dict(DEVICE), []
+    first = cache.refresh('pi', fake_device(state, transcript))
+    assert first['changed'] == sorted(set(DEVICE) - {'disk_usage'}) and first['volatile'] == ['disk_usage']
+    assert first['facts']['kernel']['release'] == '6.1.21-v8+'
+    assert first['facts']['memory']['mem_total_kb'] == 3884000
+    assert first['facts']['disks'] == [{'filesystem': '/dev/root', 'size_mb': 29000, 'mount': '/'}]
+    assert first['facts']['disk_usage']['/']['used_mb'] == 13050
+    assert first['facts']['services'] == ['ssh.service', 'tailscaled.service']
+    assert first['facts']['tailscale']['ips'][0] == '100.64.0.2'
+
+    state['kernel'] = 'Linux pi 6.6.20-v8+ aarch64'
+    state['disk_usage'] = state['disk_usage'].replace('13050 14700 48%', '13100 14650 48%')  # usage drifts...
+    second = cache.refresh('pi', fake_device(state, transcript))
+    assert second['changed'] == ['kernel'] and 'disks' in second['unchanged']  # ...but the disks section holds
+    assert len(second['unchanged']) == len(DEVICE) - 2
+    assert second['bytes'] < first['bytes'] * 0.6  # the volatile disk usage is re-sent every time
+    assert second['facts']['kernel']['release'] == '6.6.20-v8+'
+    assert second['facts']['disk_usage']['/']['used_mb'] == 13100
+
+    # Another process sees the same facts through storage
+    other = FactsCache(Storage(str(tmp_path / 'facts.db')))
+    assert other.get('pi')['kernel']['release'] == '6.6.20-v8+'
+    assert cache.refresh('pi', fake_device(state, transcript), force=True)['changed'] == sorted(set(DEVICE) - {'disk_usage'})
+
+
+def test_summary_for_prompts(tmp_path):
+    cache = FactsCache(Storage(str(tmp_path / 'facts.db')))
+    assert cache.summary('pi') == ''
+    cache.refresh('pi', fake_device(dict(DEVICE), []))
+    summary = cache.summary('pi')
+    assert 'Raspbian GNU/Linux 12' in summary and 'RAM 3.7 GiB' in summary and '/ 28.3 GiB (48% used)' in summary
+    assert 'tailscale 100.64.0.2 (1.56.1)' in summary and 'ssh, tailscaled' in summary
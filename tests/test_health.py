@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from tools.health import CLOSED, HALF_OPEN, OPEN, HealthTracker, HostUnavailable
+
+
+def test_circuit_opens_after_consecutive_failures_and_fails_fast():
+    changes = []
+    tracker = HealthTracker(failure_threshold=3, reset_timeout=60, probe=None, on_change=changes.append)
+    tracker.record_success('pi', 0.02)
+    for _ in range(2):
+        tracker.record_failure('pi', 'timed out')
+    tracker.check('pi')  # still closed below the threshold
+    tracker.record_failure('pi', 'timed out')
+    assert tracker.state('pi') == OPEN
+    with pytest.raises(HostUnavailable) as info:
+        tracker.before_connect('pi')
+    assert info.value.retry_after >= 59 and 'timed out' in str(info.value)
+    assert [c['state'] for c in changes] == [OPEN]
+    tracker.check('other-pi')  # unknown hosts are allowed
+
+
+def test_half_open_allows_one_trial_then_closes_or_reopens_with_backoff():
+    tracker = HealthTracker(failure_threshold=1, reset_timeout=0.01, probe=None)
+    tracker.record_failure('pi', 'refused')
+    time.sleep(0.02)
+    tracker.before_connect('pi')           # claims the trial
+    assert tracker.state('pi') == HALF_OPEN
+    with pytest.raises(HostUnavailable):
+        tracker.check('pi')                # a second caller waits for the trial
+    tracker.record_failure('pi', 'refused')
+    assert tracker.state('pi') == OPEN
+    time.sleep(0.03)                       # second trip backs off to 2x reset_timeout
+    tracker.before_connect('pi')
+    tracker.record_success('pi', 0.05)
+    assert tracker.state('pi') == CLOSED
+    assert tracker.snapshot()[0]['consecutive_failures'] == 0
+
+
+def test_background_probe_half_opens_and_tracks_ewma():
+    up = {'pi': False}
+
+    def probe(host):
+        if not up[host]:
+            raise OSError('unreachable')
+        return 0.01
+
+    tracker = HealthTracker(failure_threshold=1, reset_timeout=0.0, probe=probe, probe_interval=60)
+    tracker.record_success('pi', 0.03)
+    tracker.record_failure('pi', 'timeout')
+    assert tracker.probe_due() == []
+    assert tracker.state('pi') == OPEN
+    up['pi'] = True
+    time.sleep(0.01)
+    assert tracker.probe_due() == ['pi']
+    assert tracker.state('pi') == HALF_OPEN
+    # EWMA: 0.3 * 10ms + 0.7 * 30ms
+    assert tracker.snapshot()[0]['ewma_latency_ms'] == pytest.approx(24.0)
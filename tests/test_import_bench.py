@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from scripts.import_bench import BUDGET_FILE, check, parse_importtime
+
+SAMPLE = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        420 | encodings
+import time:      1500 |       2100 |     sqlite3.dbapi2
+import time:       600 |       2700 |   sqlite3
+"""
+
+# Third-party packages a module cannot import without; only their absence skips its budget check
+REQUIRES = {
+    'agent': ['dotenv'],
+    'web.main': ['fastapi', 'jose', 'dotenv'],
+}
+
+with open(BUDGET_FILE, 'r', encoding='utf-8') as fh:
+    BUDGETS = json.load(fh)
+
+
+def test_parse_importtime_reads_self_cumulative_and_depth():
+    rows = parse_importtime(SAMPLE)
+    assert rows[0] == ('_io', 120, 120, 1)
+    assert rows[2] == ('sqlite3.dbapi2', 1500, 2100, 2)
+    assert sum(r[1] for r in rows) == 2520
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_import_stays_within_budget(module):
+    # Wall-clock budgets are generous (CI noise); the "forbid" lists are the strict part
+    for package in REQUIRES.get(module, []):
+        pytest.importorskip(package)
+    problems = check(module, BUDGETS[module], scale=3.0)
+    assert problems == []
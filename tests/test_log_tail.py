@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import pytest
+
+from tools.log_tail import LogFilter, LogMerger, LogTailHub, file_command, journal_command, parse_journal
+
+
+def entry(ts, message, unit='nginx.service', priority=6, cursor='c'):
+    return json.dumps({'__REALTIME_TIMESTAMP': str(int(ts * 1e6)), 'MESSAGE': message, '_SYSTEMD_UNIT': unit,
+                       'PRIORITY': str(priority), '__CURSOR': cursor, '_HOSTNAME': 'pi'})
+
+
+def test_commands_push_filters_to_the_device_and_resume_from_cursor():
+    f = LogFilter(units=['nginx', 'ssh'], priority='warning', pattern="fail(ed)?")
+    cmd = journal_command(f, lines=20)
+    assert cmd.startswith('echo @@CLOCK $(date +%s.%N); journalctl -f -o json')
+    assert "-n 20 -u nginx -u ssh -p 4 --grep 'fail(ed)?'" in cmd
+    assert "--after-cursor 's=1;i=2'" in journal_command(cursor='s=1;i=2') and '-n' not in journal_command(cursor='x').split()
+    assert "tail -n 0 -F /var/log/syslog | grep --line-buffered -E 'a b'" in file_command('/var/log/syslog', 0, 'a b')
+    with pytest.raises(ValueError):
+        file_command('../etc/shadow')
+    with pytest.raises(ValueError):
+        LogFilter(units=['nginx; reboot'])
+    with pytest.raises(ValueError):
+        LogFilter(priority='loud')
+
+
+def test_parse_journal_and_filter_match():
+    record = parse_journal(entry(100.5, 'boom', priority=3))
+    assert record['ts'] == 100.5 and record['unit'] == 'nginx.service' and record['priority'] == 3
+    assert parse_journal(json.dumps({'MESSAGE': [104, 105, 255], '__REALTIME_TIMESTAMP': '1'}))['message'].startswith('hi')
+    assert parse_journal('-- No entries --') is None
+    assert LogFilter(units=['nginx'], priority='err', pattern='bo+m').match(record)
+    assert not LogFilter(priority='crit').match(record)
+    assert not LogFilter(units=['ssh']).match(record)
+    assert not LogFilter(pattern='^x').match(record)
+
+
+def test_merger_orders_by_watermark_and_holds_back_otherwise():
+    merger = LogMerger(['a', 'b'], hold=2.0)
+    for src, ts in [('a', 1.0), ('a', 3.0), ('b', 2.0)]:
+        merger.push({'source': src, 'aligned': ts})
+    # b has reached 2.0, so everything up to 2.0 is safe; 3.0 waits for b or the hold time
+    assert [r['aligned'] for r in merger.pop_ready(now=3.5)] == [1.0, 2.0]
+    assert merger.pop_ready(now=4.0) == []
+    assert [r['aligned'] for r in merger.pop_ready(now=5.0)] == [3.0]
+    merger.push({'source': 'b', 'aligned': 2.5})
+    late, = merger.pop_ready(now=10)
+    assert late['late'] and merger.late == 1
+
+
+def test_feed_merges_devices_with_clock_skew_replays_and_drops_when_behind():
+    hub = LogTailHub(start_readers=False)
+    feed = hub.open(['pi1', 'pi2'], lambda device, cmd: None, LogFilter(units=['nginx']), where='server', hold=0.5, max_buffer=3)
+    one, two = feed.readers
+    one.handle_line('@@CLOCK 1000.0', now=1000.0)
+    two.handle_line('@@CLOCK 900.0', now=1000.0)  # pi2's clock is 100 s behind
+    one.handle_line(entry(1001.0, 'pi1 first'), now=1001.0)
+    two.handle_line(entry(901.5, 'pi2 second'), now=1001.5)
+    two.handle_line(entry(901.6, 'pi2 ssh', unit='ssh.service'), now=1001.6)
+    one.handle_line(entry(1002.0, 'pi1 third'), now=1002.0)
+    records, dropped = feed.take(now=1003.0)
+    assert [r['message'] for r in records] == ['pi1 first', 'pi2 second', 'pi1 third'] and dropped == 0
+    assert records[1]['ts'] == 901.5 and records[1]['aligned'] == 1001.5
+
+    late = hub.open(['pi2'], lambda device, cmd: None, where='server')
+    assert late.readers[0] is two and [r['message'] for r in late.replay(10)] == ['pi2 second', 'pi2 ssh']
+
+    for i in range(5):
+        one.handle_line(entry(1010.0 + i, f'burst {i}'), now=1010.0 + i)
+    assert feed.saturated
+    records, dropped = feed.take(now=2000.0)
+    assert dropped == 2 and [r['message'] for r in records] == ['burst 2', 'burst 3', 'burst 4']
+
+    feed.close()
+    assert len(hub.status()) == 1 and two.feeds == {late}
+    late.close()
+    assert hub.status() == []
+
+
+def test_next_batch_returns_empty_after_timeout():
+    hub = LogTailHub(start_readers=False)
+    feed = hub.open(['pi'], lambda device, cmd: None)
+    assert asyncio.run(feed.next_batch(timeout=0.05, poll=0.01)) == {'records': [], 'dropped': 0}
+    feed.close()
+
+
+def test_late_joiner_gets_lines_from_before_it_joined_only_once():
+    hub = LogTailHub(start_readers=False)
+    first = hub.open(['pi'], lambda device, cmd: None, where='server', hold=0)
+    reader, = first.readers
+    reader.handle_line(entry(1.0, 'before'), now=1.0)
+    late = hub.open(['pi'], lambda device, cmd: None, where='server', hold=0)
+    reader.handle_line(entry(2.0, 'after'), now=2.0)  # arrives before the viewer asks for its replay
+    late.ingest(reader.history()[0])  # a stale delivery of a replayed line is ignored
+    assert [r['message'] for r in late.replay(10)] == ['before']
+    records, _ = late.take(now=10.0)
+    assert [r['message'] for r in records] == ['after']
+    first.close()
+    late.close()
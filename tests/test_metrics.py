@@ -0,0 +1,50 @@
+import pytest
+
+from tools.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_histogram_renders_cumulative_buckets_sum_and_count():
+    reg = Registry()
+    h = reg.register(Histogram('ssh_connect_seconds', 'SSH phases', ['host', 'stage'], buckets=(0.1, 1.0)))
+    child = h.labels(host='10.0.0.2', stage='tcp')
+    for v in (0.05, 0.5, 0.7, 3.0):
+        child.observe(v)
+    text = reg.render()
+    assert '# TYPE ssh_connect_seconds histogram' in text
+    assert 'ssh_connect_seconds_bucket{host="10.0.0.2",stage="tcp",le="0.1"} 1' in text
+    assert 'ssh_connect_seconds_bucket{host="10.0.0.2",stage="tcp",le="1"} 3' in text
+    assert 'ssh_connect_seconds_bucket{host="10.0.0.2",stage="tcp",le="+Inf"} 4' in text
+    assert 'ssh_connect_seconds_count{host="10.0.0.2",stage="tcp"} 4' in text
+    assert 'ssh_connect_seconds_sum{host="10.0.0.2",stage="tcp"} 4.25' in text
+
+
+def test_counter_gauge_labels_and_escaping():
+    reg = Registry()
+    c = reg.register(Counter('cache_requests_total', 'Cache lookups', ['cache', 'result']))
+    c.labels(cache='ssh_pool', result='hit').inc()
+    c.labels(cache='ssh_pool', result='hit').inc(2)
+    c.labels(cache='a"b', result='miss').inc()
+    g = reg.register(Gauge('in_flight', 'In flight'))
+    g.inc()
+    g.inc()
+    g.dec()
+    text = reg.render()
+    assert 'cache_requests_total{cache="ssh_pool",result="hit"} 3' in text
+    assert 'cache_requests_total{cache="a\\"b",result="miss"} 1' in text
+    assert 'in_flight 1' in text
+
+
+def test_register_returns_existing_and_rejects_kind_clash():
+    reg = Registry()
+    first = reg.register(Counter('x_total', 'x'))
+    assert reg.register(Counter('x_total', 'x')) is first
+    with pytest.raises(ValueError):
+        reg.register(Gauge('x_total', 'x'))
+
+
+def test_histogram_time_context_manager_records_once():
+    h = Histogram('op_seconds', 'op')
+    with h.time():
+        pass
+    child = h.labels()
+    assert child.count == 1 and child.sum >= 0
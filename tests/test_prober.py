@@ -0,0 +1,63 @@
+import asyncio
+import socket
+import time
+
+from tools.prober import LatencyTable, probe_all, probe_host
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def start_server(banner):
+    async def handle(reader, writer):
+        if banner:
+            writer.write(banner)
+            await writer.drain()
+        await asyncio.sleep(1)
+        writer.close()
+    server = await asyncio.start_server(handle, '0.0.0.0', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_probe_reads_banner_and_reports_refused():
+    async def run():
+        server, port = await start_server(b'debug line\r\nSSH-2.0-OpenSSH_9.2p1 Raspbian-2\r\n')
+        async with server:
+            ok = await probe_host('127.0.0.1', port=port, timeout=1)
+        refused = await probe_host('127.0.0.1', port=free_port(), timeout=1)
+        return ok, refused
+    ok, refused = asyncio.run(run())
+    assert ok['reachable'] and ok['banner'] == 'SSH-2.0-OpenSSH_9.2p1 Raspbian-2'
+    assert ok['tcp_ms'] is not None and ok['banner_ms'] >= ok['tcp_ms']
+    assert not refused['reachable'] and refused['error']
+
+
+def test_probe_all_runs_in_about_one_timeout():
+    async def run():
+        # Accepts connections but never sends a banner, so every probe hits the timeout
+        server, port = await start_server(b'')
+        async with server:
+            hosts = [f'127.0.0.{i}' for i in range(1, 31)]
+            start = time.perf_counter()
+            results = await probe_all(hosts, port=port, timeout=0.3)
+            return results, time.perf_counter() - start
+    results, elapsed = asyncio.run(run())
+    assert len(results) == 30
+    assert all(not r['reachable'] and 'timeout' in r['error'] for r in results)
+    assert elapsed < 1.5
+
+
+def test_latency_table_rolls_and_ranks():
+    table = LatencyTable(window=3)
+    now = time.time()
+    for ms in (50, 10, 12, 14):
+        table.update([{'host': 'slow', 'ts': now, 'reachable': True, 'banner_ms': ms * 5}])
+        table.update([{'host': 'fast', 'ts': now, 'reachable': True, 'banner_ms': ms}])
+    table.update([{'host': 'down', 'ts': now, 'reachable': False, 'banner_ms': None, 'error': 'timeout'}])
+    fast = table.row('fast')
+    assert fast['samples'] == 3 and fast['p50_ms'] == 12 and fast['success_rate'] == 1.0
+    assert [r['host'] for r in table.rows()] == ['fast', 'slow', 'down']
+    assert table.rank(['down', 'new', 'slow', 'fast']) == ['fast', 'slow', 'new', 'down']
@@ -0,0 +1,116 @@
+import json
+import os
+import time
+
+from tools.recording import RecordingStore, decode_frames
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def record(store, clock, seconds=60, step=0.5):
+    """A session printing one numbered line every `step` seconds."""
+    rec = store.open(user='alice', device='pi1', command='top')
+    rec.input('top\n')
+    for n in range(int(seconds / step)):
+        clock.now += step
+        rec.output(f'line {n:04d} load 0.{n % 10}\r\n')
+        if n % 4 == 3:
+            store.flush(only_due=True)
+    rec.close(exit=0)
+    store.flush()
+    return rec
+
+
+def test_round_trip_is_compact_and_finalized(tmp_path):
+    clock = Clock()
+    store = RecordingStore(str(tmp_path), block_seconds=5, keyframe_seconds=20, clock=clock)
+    rec = record(store, clock)
+    meta = store.get(rec.id)
+    assert meta['ended'] and not meta['active'] and meta['user'] == 'alice'
+    assert meta['duration_ms'] == 60_000 and meta['blocks'] >= 10
+    assert meta['stored_bytes'] < meta['raw_bytes']
+    frames = list(store.frames(rec.id))
+    assert frames[0] == (0, 'k', b'') and frames[1] == (0, 'i', b'top\n')
+    outputs = [f for f in frames if f[1] == 'o']
+    assert len(outputs) == 120 and outputs[-1] == (60_000, 'o', b'line 0119 load 0.9\r\n')
+    assert json.loads(frames[-1][2]) == {'exit': 0}
+    assert [m['id'] for m in store.list(user='alice')] == [rec.id] and store.list(device='other') == []
+
+
+def test_seek_decodes_only_blocks_from_the_target_time(tmp_path):
+    clock = Clock()
+    store = RecordingStore(str(tmp_path), block_seconds=5, keyframe_seconds=15, keyframe_bytes=512, clock=clock)
+    rec = record(store, clock)
+    index = store._index(rec.id)
+    assert len(index) >= 10 and 2 <= sum(entry[3] for entry in index) <= 5
+    store.blocks_decoded = 0
+    frames = list(store.frames(rec.id, start_ms=45_200, end_ms=47_000))
+    assert store.blocks_decoded <= 3
+    kind, context = frames[0][1], frames[0][2]
+    # The keyframe carries what the screen showed just before 45.2s
+    assert kind == 'k' and context.endswith(b'line 0089 load 0.9\r\n') and len(context) <= 512
+    assert [f[0] for f in frames[1:]] == [45_500, 46_000, 46_500]
+    tail = list(store.frames(rec.id, start_ms=59_900))
+    assert [f[1] for f in tail] == ['k', 'o', 'm']
+    cast = list(store.asciicast(rec.id, start_ms=30_000, end_ms=31_000))
+    assert json.loads(cast[0])['version'] == 2 and json.loads(cast[1])[0] == 0.0
+    assert json.loads(cast[-1]) == [1.0 - 0.5, 'o', 'line 0060 load 0.0\r\n']
+
+
+def test_torn_block_and_crashed_recording_are_recovered(tmp_path):
+    clock = Clock()
+    store = RecordingStore(str(tmp_path), block_seconds=5, clock=clock)
+    rec = store.open(user='bob', command='ls')
+    rec.output('hello\n')
+    store.flush()
+    with open(os.path.join(str(tmp_path), rec.id + '.rec'), 'ab') as fh:
+        fh.write(b'\x40\x00\x00\x00partial')  # crash mid-block: no index entry yet
+    meta_path = os.path.join(str(tmp_path), rec.id + '.json')
+    meta = json.load(open(meta_path))
+    json.dump(dict(meta, owner='gone-host:1'), open(meta_path, 'w'))
+
+    reopened = RecordingStore(str(tmp_path), clock=clock)
+    recovered = reopened.get(rec.id)
+    assert recovered['incomplete'] and recovered['ended']
+    assert [f[2] for f in reopened.frames(rec.id)] == [b'', b'hello\n']
+
+
+def test_retention_bounds_disk_usage_and_keeps_live_recordings(tmp_path):
+    clock = Clock()
+    store = RecordingStore(str(tmp_path), block_seconds=5, clock=clock, max_bytes=10 ** 9)
+    old = [record(store, clock, seconds=5) for _ in range(4)]
+    live = store.open(user='carol')
+    live.output(os.urandom(2000))
+    store.flush()
+    store.max_bytes = sum(store._size(r.id) for r in old[2:]) + store._size(live.id)
+    assert store.enforce_retention() == [old[0].id, old[1].id]
+    assert {m['id'] for m in store.list()} == {old[2].id, old[3].id, live.id}
+    meta = json.load(open(os.path.join(str(tmp_path), old[2].id + '.json')))
+    json.dump(dict(meta, ended=time.time() - 40 * 86400), open(os.path.join(str(tmp_path), old[2].id + '.json'), 'w'))
+    assert store.enforce_retention() == [old[2].id]
+
+
+def test_hot_path_never_blocks_on_a_stalled_writer(tmp_path):
+    clock = Clock()
+    store = RecordingStore(str(tmp_path), block_seconds=3600, block_bytes=10 ** 9, max_pending=1000, clock=clock)
+    rec = store.open()
+    started = time.perf_counter()
+    for _ in range(5000):
+        rec.output(b'x' * 100)
+    assert time.perf_counter() - started < 0.5
+    rec.output(b'y')  # still over budget: dropped
+    store.flush()
+    rec.close()
+    rec.output(b'z' * 10)  # after close: ignored
+    store.flush()
+    kinds = [(f[1], len(f[2])) for f in store.frames(rec.id)]
+    assert kinds[:11] == [('k', 0)] + [('o', 100)] * 10
+    assert not any(k == 'o' and n == 10 for k, n in kinds)
+    raw = open(os.path.join(str(tmp_path), rec.id + '.rec'), 'rb').read()
+    assert raw.startswith(b'LTR1') and decode_frames(b'') == []
@@ -0,0 +1,67 @@
+import time
+
+from tools.result_cache import ResultCache, classify, is_mutating
+
+
+def test_classes_pick_the_most_volatile_part():
+    assert classify('uname -a') == 'static'
+    assert classify('tailscale ip') == 'static'
+    assert classify('df -h') == 'slow'
+    assert classify('free -h') == 'volatile'
+    assert classify("uname -a && lsb_release -a && uptime || echo '[ERROR] Command failed'") == 'volatile'
+    assert classify('ls') is None  # depends on the shell's working directory
+    assert classify('sudo reboot') is None
+    assert not is_mutating('ls') and is_mutating('rm -f /tmp/x')
+
+
+def test_hits_carry_freshness_and_expire_by_class():
+    cache = ResultCache(ttls={'static': 60, 'slow': 60, 'volatile': 0.05})
+    runs = []
+
+    def run(cmd):
+        runs.append(cmd)
+        return f'out{len(runs)}'
+
+    first = cache.fetch('pi', 'uname -a', run)
+    assert first == 'out1' and first.fresh and first.ttl_class == 'static'
+    second = cache.fetch('pi', 'uname -a', run)
+    assert second == 'out1' and second.cached and second.age >= 0
+    assert cache.fetch('pi', 'uname -a', run, use_cache=False) == 'out2'  # bypass refreshes
+
+    cache.fetch('pi', 'free -h', run)
+    time.sleep(0.1)
+    assert cache.get('pi', 'free -h') is None
+    assert cache.get('pi', 'uname -a') == 'out2'
+
+
+def test_mutation_invalidates_only_that_device():
+    cache = ResultCache()
+    cache.put('pi', 'uname -a', 'Linux pi')
+    cache.put('pi-2', 'uname -a', 'Linux pi-2')
+    cache.put('pi', 'sudo apt-get upgrade -y', 'done')  # never stored
+    assert cache.stats()['entries'] == 2
+    cache.observe('pi', 'uptime')
+    assert cache.get('pi', 'uname -a') == 'Linux pi'
+    cache.observe('pi', 'sudo apt-get upgrade -y')
+    assert cache.get('pi', 'uname -a') is None
+    assert cache.get('pi-2', 'uname -a') == 'Linux pi-2'
+
+
+def test_read_racing_a_mutation_is_not_stored():
+    cache = ResultCache()
+    generation = cache.generation('pi')
+    cache.invalidate('pi')  # a mutating command ran while the read was in flight
+    assert cache.put('pi', 'df -h', 'before', generation) == 'before'
+    assert cache.get('pi', 'df -h') is None
+
+
+def test_local_invalidations_are_announced_and_remote_ones_are_not():
+    announced = []
+    cache = ResultCache()
+    cache.on_invalidate = announced.append
+    cache.put('pi', 'uname -a', 'Linux pi')
+    cache.observe('pi', 'sudo reboot')
+    cache.invalidate()
+    cache.put('pi-2', 'hostname', 'pi-2')
+    cache.invalidate('pi-2', notify=False)  # applied from another worker's event
+    assert announced == ['pi', None] and cache.get('pi-2', 'hostname') is None
@@ -0,0 +1,157 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from tools.scheduler import CronExpr, Scheduler, jitter_offset, normalize_spec, resolve_targets
+from tools.storage import Storage
+
+DEVICES = [{'name': 'pi-a', 'ip': '100.0.0.1', 'tags': ['tag:lab']},
+           {'name': 'pi-b', 'ip': '100.0.0.2', 'tags': ['tag:lab', 'tag:cam']},
+           {'name': 'pi-c', 'ip': '100.0.0.3'}]
+
+
+def ts(*args):
+    return datetime(*args).timestamp()
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def make_scheduler(tmp_path):
+    created = []
+
+    def make(run, now=ts(2026, 3, 2, 10, 0, 30), **kwargs):
+        clock = Clock(now)
+        sched = Scheduler(Storage(str(tmp_path / 'sched.db')), run=run, devices=lambda: DEVICES, clock=clock, **kwargs)
+        sched.clock_ref = clock
+        created.append(sched)
+        return sched
+    yield make
+    for sched in created:
+        sched.stop()
+
+
+def test_cron_next_after():
+    start = ts(2026, 3, 2, 10, 7, 30)  # a Monday
+    assert CronExpr('*/15 * * * *').next_after(start) == ts(2026, 3, 2, 10, 15)
+    assert CronExpr('0 9-17/4 * * mon-fri').next_after(start) == ts(2026, 3, 2, 13, 0)
+    assert CronExpr('30 2 * * 0').next_after(start) == ts(2026, 3, 8, 2, 30)
+    assert CronExpr('@monthly').next_after(start) == ts(2026, 4, 1)
+    # Both day fields restricted: either may match (the 13th, or any Friday)
+    assert CronExpr('0 0 13 * fri').next_after(start) == ts(2026, 3, 6)
+    assert CronExpr('0 0 29 feb *').next_after(start) == ts(2028, 2, 29)
+    for bad in ('* * *', '61 * * * *', '*/0 * * * *', '5-1 * * * *', '0 0 31 feb *'):
+        with pytest.raises(ValueError):
+            CronExpr(bad).next_after(start)
+
+
+def test_spec_validation_targets_and_jitter():
+    spec = normalize_spec({'name': 'disk', 'cron': '@hourly', 'command': 'df -h', 'targets': 'tag:lab'})
+    assert spec['targets'] == ['tag:lab'] and spec['concurrency'] == 8
+    with pytest.raises(ValueError, match='command'):
+        normalize_spec({'name': 'x', 'cron': '@hourly'})
+    with pytest.raises(ValueError, match='unknown'):
+        normalize_spec({'name': 'x', 'cron': '@hourly', 'command': 'ls', 'colour': 'red'})
+    assert resolve_targets(['tag:lab'], DEVICES) == ['100.0.0.1', '100.0.0.2']
+    assert resolve_targets(['pi-c', '100.0.0.1', '10.9.9.9'], DEVICES) == ['100.0.0.3', '100.0.0.1', '10.9.9.9']
+    assert len(resolve_targets(['*'], DEVICES)) == 3
+    offsets = [jitter_offset(1, 1000, f'pi-{i}', 30) for i in range(50)]
+    assert all(0 <= o < 30 for o in offsets) and max(offsets) - min(offsets) > 20
+    assert jitter_offset(1, 1000, 'pi-1', 30) == offsets[1] != jitter_offset(1, 1060, 'pi-1', 30)
+
+
+def test_due_run_spreads_devices_caps_concurrency_and_records_history(make_scheduler):
+    lock, active, peak, starts = threading.Lock(), [0], [0], {}
+
+    def run(device, command, timeout):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            starts[device] = time.monotonic()
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        if device == '100.0.0.3':
+            raise ConnectionError('unreachable')
+        return 0, f'{command} on {device}'
+
+    events = []
+    sched = make_scheduler(run, on_run=events.append)
+    schedule = sched.add({'name': 'uptime', 'cron': '*/5 * * * *', 'command': 'uptime', 'jitter': 0.3, 'concurrency': 2})
+    assert schedule['next_run'] == ts(2026, 3, 2, 10, 5)
+    assert sched.tick() == {}
+    sched.clock_ref.now = ts(2026, 3, 2, 10, 5, 2)
+    fired = sched.tick()
+    summary = fired[schedule['id']].result(10)
+    assert (summary['status'], summary['devices'], summary['failed']) == ('partial', 3, 1)
+    assert events == [summary] and peak[0] <= 2
+    assert sched.get(schedule['id'])['next_run'] == ts(2026, 3, 2, 10, 10)
+
+    (run_row,) = sched.history(schedule['id'])
+    results = run_row['detail']['results']
+    assert results['100.0.0.1']['output'] == 'uptime on 100.0.0.1' and results['100.0.0.3']['error'] == 'unreachable'
+    order = sorted(starts, key=starts.get)
+    assert order == sorted(results, key=lambda h: results[h]['delay'])
+    assert sched.history(status='partial')[0]['id'] == run_row['id']
+
+
+def test_overlapping_run_is_skipped_and_history_is_bounded(make_scheduler):
+    release = threading.Event()
+    sched = make_scheduler(lambda device, command, timeout: (release.wait(5), (0, 'done'))[1])
+    schedule = sched.add({'name': 'slow', 'cron': '* * * * *', 'command': 'sleep 100', 'targets': ['pi-a'], 'keep': 3})
+    sched.clock_ref.now = schedule['next_run']
+    first = sched.tick()[schedule['id']]
+    assert sched.get(schedule['id'])['running']
+    sched.clock_ref.now += 60
+    assert sched.tick() == {schedule['id']: 'skipped'}
+    release.set()
+    first.result(10)
+    for _ in range(4):
+        sched.clock_ref.now += 60
+        sched.tick()[schedule['id']].result(10)
+    history = sched.history(schedule['id'])
+    assert len(history) == 3 and all(r['status'] == 'ok' for r in history)
+    assert sched.run_now(schedule['id']).result(10)['status'] == 'ok'
+
+
+def test_misfire_policies(make_scheduler):
+    calls = []
+    sched = make_scheduler(lambda device, command, timeout: (calls.append(command), (0, ''))[1])
+    skip = sched.add({'name': 'skip', 'cron': '*/10 * * * *', 'command': 'a', 'targets': ['pi-a']})
+    once = sched.add({'name': 'once', 'cron': '*/10 * * * *', 'command': 'b', 'targets': ['pi-a'], 'misfire': 'run_once'})
+    sched.clock_ref.now = ts(2026, 3, 2, 10, 45)  # down since 10:10: slots 10:10..10:40 lost
+    fired = sched.tick()
+    assert fired[skip['id']] == 'missed'
+    assert fired[once['id']].result(10)['due_at'] == ts(2026, 3, 2, 10, 40)
+    assert calls == ['b']
+    missed = sched.history(skip['id'])[0]
+    assert missed['status'] == 'missed' and missed['detail']['missed'] == 4
+    assert sched.get(skip['id'])['next_run'] == ts(2026, 3, 2, 10, 50)
+
+
+def test_slot_claimed_by_another_worker_does_not_run(make_scheduler):
+    sched = make_scheduler(lambda *a: pytest.fail('should not run'), claim=lambda key, ttl: False)
+    schedule = sched.add({'name': 'x', 'cron': '* * * * *', 'command': 'ls'})
+    sched.clock_ref.now = schedule['next_run']
+    assert sched.tick() == {schedule['id']: 'claimed'}
+    assert sched.history() == [] and sched.get(schedule['id'])['next_run'] > schedule['next_run']
+
+
+def test_diagnostics_schedule_summarises_fleet(make_scheduler):
+    output = ('Filesystem Size Used Avail Use% Mounted on\n/dev/root 29G 12G 16G 43% /\n@@VITALS\n@@VITALS\n'
+              ' up 3 days,  2:11,  1 user,  load average: 0.50, 0.40, 0.30\n@@VITALS\ntemp=51.0\'C\n@@VITALS\n')
+    sched = make_scheduler(lambda device, command, timeout: (0, output))
+    schedule = sched.add({'name': 'vitals', 'cron': '@hourly', 'kind': 'diagnostics', 'targets': ['tag:lab']})
+    result = sched.run_now(schedule['id']).result(10)
+    assert result['status'] == 'ok' and result['devices'] == 2
+    detail = sched.history(schedule['id'])[0]['detail']
+    assert detail['results']['100.0.0.2']['record']['temp_c'] == 51.0
+    assert detail['summary']['devices'] == 2
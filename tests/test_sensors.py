@@ -0,0 +1,100 @@
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+
+import pytest
+
+from tools.sensors import FrameReader, SensorSession, channel_names, decode_samples, sampler_command
+
+
+class ProcessChannel:
+    """Channel-like wrapper running the sampler locally."""
+    def __init__(self, command):
+        self.proc = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def recv(self, n):
+        return os.read(self.proc.stdout.fileno(), n)
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def close(self):
+        self.proc.kill()
+        self.proc.wait()
+
+
+def fake_gpio(root, pins):
+    top = root / 'sys' / 'class' / 'gpio'
+    (top / 'gpiochip0').mkdir(parents=True)
+    (top / 'gpiochip0' / 'label').write_text('pinctrl-bcm2711\n')
+    (top / 'export').write_text('')
+    for pin, value in pins.items():
+        (top / f'gpio{pin}').mkdir()
+        (top / f'gpio{pin}' / 'value').write_text(value)
+        (top / f'gpio{pin}' / 'direction').write_text('in')
+    return top
+
+
+def test_command_validation_and_channel_names():
+    assert channel_names([17], [(1, 0x48, 0x00, 2)]) == ['gpio17', 'i2c1_0x48_0x00']
+    cmd = sampler_command([17], [(1, 0x48, 0, 2)], rate=200)
+    assert cmd.startswith('python3 -u -c ') and '"batch": 20' in cmd
+    for kwargs in ({}, {'gpio': [99]}, {'gpio': [1], 'rate': 10000}, {'i2c': [(1, 0x90, 0)]}):
+        with pytest.raises(ValueError):
+            sampler_command(**kwargs)
+
+
+def test_frame_reader_reassembles_split_frames():
+    payload = struct.pack('<HH', 2, 1) + struct.pack('<df', 1.5, 1.0) + struct.pack('<df', 2.5, 0.0)
+    data = b'S' + struct.pack('<I', len(payload)) + payload + b'A' + struct.pack('<I', 2) + b'{}'
+    reader = FrameReader()
+    assert reader.feed(data[:7]) == []
+    frames = reader.feed(data[7:])
+    assert [kind for kind, _ in frames] == ['S', 'A']
+    assert decode_samples(frames[0][1]) == [(1.5, (1.0,)), (2.5, (0.0,))]
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='sampler uses select() on stdin')
+def test_sampler_streams_batches_and_applies_writes(tmp_path):
+    top = fake_gpio(tmp_path, {17: '1\n', 22: '0\n'})
+
+    def open_channel(_command):
+        return ProcessChannel(sampler_command([17], [(1, 0x48, 0, 1)], rate=200, batch=10,
+                                              root=str(tmp_path), python=sys.executable))
+
+    session = SensorSession('pi', open_channel, gpio=[17], i2c=[(1, 0x48, 0, 1)], rate=200).start()
+    try:
+        deadline = time.time() + 10
+        while session.samples < 50 and time.time() < deadline:
+            time.sleep(0.05)
+        assert session.samples >= 50 and session.batches >= 5
+        window = session.window(max_points=10)
+        assert len(window['ts']) <= 10 and set(window['gpio17']) == {1.0}
+        assert window['i2c1_0x48_0x00'][0] is None  # no /dev/i2c-1 here: NaN, reported once
+        assert 'i2c1_0x48_0x00' in session.errors
+
+        ack = session.write(gpio=[(22, 1)])
+        assert ack['ok'] and (top / 'gpio22' / 'value').read_text().startswith('1')
+        assert (top / 'gpio22' / 'direction').read_text() == 'out'
+        assert session.write(gpio=[(40, 1)])['ok'] is False  # not exported in the fake sysfs
+    finally:
+        session.stop()
+    assert json.loads(json.dumps(session.status()))['channels'] == ['gpio17', 'i2c1_0x48_0x00']
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='sampler uses select() on stdin')
+def test_sampler_answers_every_request_that_arrives_in_one_read(tmp_path):
+    fake_gpio(tmp_path, {22: '0\n'})
+    channel = ProcessChannel(sampler_command([22], [], rate=5, batch=100, root=str(tmp_path), python=sys.executable))
+    try:
+        channel.sendall(b''.join(json.dumps({'id': i, 'gpio': [[22, i % 2]]}).encode() + b'\n' for i in range(3)))
+        reader, acks, deadline = FrameReader(), [], time.time() + 2
+        while len(acks) < 3 and time.time() < deadline:
+            acks += [json.loads(p)['id'] for kind, p in reader.feed(channel.recv(4096)) if kind == 'A']
+        assert acks == [0, 1, 2]
+    finally:
+        channel.close()
@@ -0,0 +1,49 @@
+import os
+
+from tools.session_log import SessionEventLog
+
+
+def test_append_and_paginate_across_segments(tmp_path):
+    log = SessionEventLog(str(tmp_path), max_segment_bytes=200)
+    for i in range(10):
+        log.append('prompt', text=f'prompt {i}')
+    assert log.cursor == 10
+    assert len([f for f in os.listdir(tmp_path) if f.endswith('.jsonl')]) > 1
+
+    page, nxt = log.read(since=0, limit=4)
+    assert [r['seq'] for r in page] == [1, 2, 3, 4]
+    page, nxt = log.read(since=nxt, limit=4)
+    assert [r['text'] for r in page] == ['prompt 4', 'prompt 5', 'prompt 6', 'prompt 7']
+    page, nxt = log.read(since=nxt, limit=4)
+    assert [r['seq'] for r in page] == [9, 10]
+    assert log.read(since=nxt) == ([], 10)
+
+
+def test_large_outputs_become_blob_references(tmp_path):
+    log = SessionEventLog(str(tmp_path), inline_limit=10)
+    log.append('ssh_output', command='ps aux', output='x' * 50, duration_ms=12)
+    rec = log.read()[0][0]
+    assert 'output' not in rec and rec['output_bytes'] == 50
+    assert log.read_blob(rec['output_ref']) == 'x' * 50
+    assert 'blob' in log.export_markdown()
+
+
+def test_recovery_drops_torn_trailing_record(tmp_path):
+    log = SessionEventLog(str(tmp_path))
+    log.append('prompt', text='a')
+    log.append('prompt', text='b')
+    seg = [f for f in os.listdir(tmp_path) if f.endswith('.jsonl')][0]
+    with open(tmp_path / seg, 'ab') as fh:
+        fh.write(b'{"seq": 3, "type": "pro')
+    reopened = SessionEventLog(str(tmp_path))
+    assert reopened.cursor == 2
+    assert reopened.append('prompt', text='c') == 3
+    assert [r['text'] for r in reopened.read()[0]] == ['a', 'b', 'c']
+
+
+def test_type_filter(tmp_path):
+    log = SessionEventLog(str(tmp_path))
+    log.append('prompt', text='hi')
+    log.append('planned_command', command='uptime')
+    recs, nxt = log.read(types=['planned_command'])
+    assert [r['command'] for r in recs] == ['uptime'] and nxt == 2
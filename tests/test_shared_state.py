@@ -0,0 +1,64 @@
+import threading
+
+from tools.storage import Storage
+from tools.shared_state import SharedState, ChangeWatcher, ChangeForwarder
+
+
+def test_kv_swap_and_ttl(tmp_path):
+    state = SharedState(Storage(str(tmp_path / 's.db')), origin='w1')
+    assert state.swap('devices:snapshot', {'a': 1}) is None
+    assert state.swap('devices:snapshot', {'b': 2}) == {'a': 1}
+    assert state.set_if_absent('start', 10) == 10
+    assert state.set_if_absent('start', 20) == 10
+    state.set('gone', 'x', ttl=-1)
+    assert state.get('gone') is None
+
+
+def test_token_bucket_shared_between_workers(tmp_path):
+    db = str(tmp_path / 's.db')
+    w1 = SharedState(Storage(db), origin='w1')
+    w2 = SharedState(Storage(db), origin='w2')
+    assert w1.take_token('user:alice', rate=0.001, capacity=2) == (True, 0.0)
+    assert w2.take_token('user:alice', rate=0.001, capacity=2)[0]
+    allowed, retry_after = w1.take_token('user:alice', rate=0.001, capacity=2)
+    assert not allowed and retry_after > 0
+
+
+def test_registry_prunes_stale_entries(tmp_path):
+    state = SharedState(Storage(str(tmp_path / 's.db')), origin='w1')
+    state.register('worker', 'w1', {'started': 1.0})
+    state.storage.write("UPDATE registry SET last_seen = 0 WHERE name = 'w1'")
+    state.register('worker', 'w2')
+    assert [e['name'] for e in state.entries('worker', ttl=30)] == ['w2']
+
+
+def test_watcher_delivers_only_foreign_changes(tmp_path):
+    db = str(tmp_path / 's.db')
+    w1 = SharedState(Storage(db), origin='w1')
+    w2 = SharedState(Storage(db), origin='w2')
+    got = []
+    watcher = ChangeWatcher(w1, lambda topic, payload, origin: got.append((topic, payload, origin)))
+    watcher.last_id = w1.last_change_id()
+    w1.notify('job', {'state': 'mine'})
+    w2.notify('job', {'state': 'theirs'})
+    # Poll from a different thread, as the real watcher does
+    t = threading.Thread(target=watcher.poll_once)
+    t.start()
+    t.join()
+    assert got == [('job', {'state': 'theirs'}, 'w2')]
+
+
+def test_forwarder_batches_events_off_the_caller_thread(tmp_path):
+    db = str(tmp_path / 's.db')
+    w1 = SharedState(Storage(db), origin='w1')
+    w2 = SharedState(Storage(db), origin='w2')
+    got = []
+    watcher = ChangeWatcher(w2, lambda topic, payload, origin: got.append(payload['n']))
+    watcher.last_id = w2.last_change_id()
+    forwarder = ChangeForwarder(w1, max_batch=50)
+    for n in range(120):
+        forwarder.put('job', {'n': n})
+    forwarder.stop()
+    assert forwarder.batches < 120
+    watcher.poll_once()
+    assert got == list(range(120))
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from tools.speculative import SpeculativeCache, is_read_only
+
+
+@pytest.mark.parametrize('cmd', [
+    'df -h', 'free -m', 'uptime', 'ls -la /var/log', 'cat /proc/cpuinfo', 'tail -n 50 /var/log/syslog',
+    'systemctl status ssh --no-pager', 'vcgencmd measure_temp', 'hostname -I', 'ip addr show',
+    'ip -br -4 addr', 'ip -j route show', 'tailscale status --json --peers', 'tailscale ip -4',
+])
+def test_read_only_commands_are_allowed(cmd):
+    assert is_read_only(cmd)
+
+
+@pytest.mark.parametrize('cmd', [
+    'rm -rf /tmp/x', 'sudo df -h', 'df -h; reboot', 'cat /proc/cpuinfo | head', 'ls > /tmp/out',
+    'cat $(echo /etc/shadow)', 'cat /etc/shadow', 'cat /var/log/../../etc/shadow', 'cat relative.txt',
+    'tail -f /var/log/syslog', 'tail -Fn 10 /var/log/syslog', 'free -s 1', 'hostname newname',
+    'systemctl restart ssh', 'ls /tmp/*', 'cat /proc/kmsg', 'FOO=1 uptime', '', 'ip link set eth0 down',
+    'ip -b addr', 'ip -batch addr', 'ip -force -batch addr', 'ip -n other addr', 'tailscale status --web',
+    'tailscale status --browser=false --web', 'tailscale ip --1',
+])
+def test_mutating_or_unknown_commands_are_refused(cmd):
+    assert not is_read_only(cmd)
+
+
+def test_never_runs_refused_commands():
+    calls = []
+    cache = SpeculativeCache()
+    assert not cache.start('pi', 'reboot', calls.append)
+    time.sleep(0.05)
+    assert calls == []
+    assert cache.take('pi', 'reboot') is None
+
+
+def test_take_waits_for_run_in_flight_and_consumes():
+    release = threading.Event()
+    runs = []
+
+    def run(cmd):
+        runs.append(cmd)
+        release.wait(2)
+        return f'out:{cmd}'
+
+    cache = SpeculativeCache()
+    assert cache.start('pi', 'uptime', run)
+    assert cache.start('pi', 'uptime', run)  # deduplicated
+    assert cache.take('pi-2', 'uptime') is None  # keyed by device
+
+    async def approve():
+        task = asyncio.ensure_future(cache.take_async('pi', 'uptime', timeout=2))
+        await asyncio.sleep(0.05)
+        assert not task.done()  # waiting, not blocking the loop
+        release.set()
+        return await task
+
+    assert asyncio.run(approve()) == 'out:uptime'
+    assert runs == ['uptime']
+    assert cache.take('pi', 'uptime') is None
+
+
+def test_expired_failed_and_invalidated_results_miss():
+    cache = SpeculativeCache(ttl=0.05)
+    cache.start('pi', 'uptime', lambda cmd: 'up')
+    time.sleep(0.1)
+    assert cache.take('pi', 'uptime') is None
+
+    def fail(cmd):
+        raise PermissionError('denied')
+
+    cache = SpeculativeCache()
+    cache.start('pi', 'cat /var/log/auth.log', fail)
+    assert cache.take('pi', 'cat /var/log/auth.log', timeout=1) is None
+
+    cache.start('pi', 'df -h', lambda cmd: 'disk')
+    cache.start('pi-2', 'df -h', lambda cmd: 'disk2')
+    cache.invalidate('pi')
+    assert cache.take('pi', 'df -h') is None
+    assert cache.take('pi-2', 'df -h', timeout=1) == 'disk2'
@@ -0,0 +1,92 @@
+import json
+import os
+import sqlite3
+
+from tools.storage import Storage, UserMapping, import_legacy, import_markdown_dir, MIGRATIONS
+
+
+def test_schema_is_migrated_in_wal_mode(tmp_path):
+    db = tmp_path / 'test.db'
+    storage = Storage(str(db))
+    assert storage.schema_version() == len(MIGRATIONS)
+    assert storage.connection().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    # Reopening doesn't re-run migrations
+    assert Storage(str(db)).schema_version() == len(MIGRATIONS)
+    plan = sqlite3.connect(str(db)).execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM jobs WHERE device = ? ORDER BY started_at DESC", ('pi',)).fetchall()
+    assert any('idx_jobs_device_time' in str(row) for row in plan)
+
+
+def test_users_jobs_and_audit(tmp_path):
+    storage = Storage(str(tmp_path / 'test.db'))
+    users = UserMapping(storage)
+    users['alice'] = {'full_name': 'Alice', 'hashed_password': 'x', 'disabled': False}
+    assert 'alice' in users and users.get('alice')['full_name'] == 'Alice'
+    assert storage.set_password('alice', 'y') and users['alice']['hashed_password'] == 'y'
+    assert users.get('nobody') is None
+
+    job = storage.start_job('course-run', command='uptime', device='pi1', username='alice')
+    storage.start_job('course-run', command='df -h', device='pi2', username='alice')
+    storage.finish_job(job, status='ok', output='up 3 days')
+    jobs = storage.list_jobs(device='pi1')
+    assert [j['command'] for j in jobs] == ['uptime'] and jobs[0]['status'] == 'ok'
+    assert len(storage.list_jobs(username='alice')) == 2
+
+    storage.audit('login', username='alice', detail={'ip': '1.2.3.4'})
+    assert storage.list_audit(username='alice')[0]['action'] == 'login'
+
+
+def test_import_legacy_files(tmp_path):
+    web = tmp_path / 'web'
+    out = tmp_path / 'outputs'
+    web.mkdir()
+    out.mkdir()
+    (web / 'users.json').write_text(json.dumps({'admin': {'username': 'admin', 'hashed_password': 'h', 'disabled': False}}))
+    (web / 'device_creds.json').write_text(json.dumps({'100.64.0.2': {'ssh_user': 'pi', 'ssh_password': 'pw'}}))
+    (out / 'session_1.md').write_text('### Prompt 1:\nls\n\n### Response 1:\nfiles\n\n### Prompt 2:\ndf\n\n### Response 2:\ndisk\n\n')
+    (out / 'aggregates.md').write_text('### Aggregate (2025-01-01T00:00:00):\nall good\n\n')
+    memory = tmp_path / 'persistent_memory.json'
+    memory.write_text(json.dumps([{'role': 'system', 'content': 'hi'}]))
+
+    storage = Storage(str(tmp_path / 'test.db'))
+    counts = import_legacy(storage, str(web), str(out), str(memory))
+    assert counts == {'users': 1, 'device_creds': 1, 'history': 3, 'memory': 1}
+    assert storage.get_device_creds('100.64.0.2') == {'ssh_user': 'pi', 'ssh_password': 'pw'}
+    assert {h['kind'] for h in storage.list_history()} == {'pair', 'aggregate'}
+    # Unchanged markdown files are not imported twice
+    assert import_legacy(storage, str(web), str(out), str(memory))['history'] == 0
+    # A changed file replaces what was imported from it instead of adding to it
+    (out / 'session_1.md').write_text('### Prompt 1:\nls\n\n### Response 1:\nmore files\n\n')
+    os.utime(out / 'session_1.md', (1, 1))
+    assert import_legacy(storage, str(web), str(out), str(memory))['history'] == 1
+    assert [h['response'] for h in storage.list_history(source='cli:session_1.md')] == ['more files']
+    assert len(storage.list_history()) == 2
+
+    storage.save_memory([{'role': 'system', 'content': 'hi'}, {'role': 'user', 'content': 'more'}])
+    assert [m['content'] for m in storage.load_memory()] == ['hi', 'more']
+
+
+def test_aggregates_stored_live_are_not_imported_again(tmp_path):
+    out = tmp_path / 'outputs'
+    out.mkdir()
+    (out / 'aggregates.md').write_text('### Aggregate (2025-01-01T00:00:00):\nold\n\n### Aggregate (2025-01-02T00:00:00):\nR1\n\n')
+    storage = Storage(str(tmp_path / 'test.db'))
+    storage.add_history('web', 'aggregate', prompt='p', response='R1\n')
+    assert import_markdown_dir(storage, str(out)) == 1
+    assert sorted(h['response'] for h in storage.list_history(source='web')) == ['R1\n', 'old']
+
+
+def test_migration_drops_duplicated_aggregates(tmp_path):
+    db = str(tmp_path / 'test.db')
+    conn = sqlite3.connect(db)
+    for number, script in enumerate(MIGRATIONS[:5], start=1):
+        conn.executescript(script)
+        conn.execute(f'PRAGMA user_version = {number}')
+    conn.executemany("INSERT INTO history (ts, source, kind, prompt, response) VALUES (?, ?, ?, ?, ?)",
+                     [(1, 'web', 'aggregate', 'p', 'R1\n'), (2, 'web', 'aggregate', None, 'R1'), (3, 'cli:session_1.md', 'pair', 'ls', 'x')])
+    conn.commit()
+    conn.close()
+    storage = Storage(db)
+    rows = storage.list_history()
+    assert sorted((h['source'], h['prompt'], h['import_path']) for h in rows) == [
+        ('cli:session_1.md', 'ls', 'session_1.md'), ('web', 'p', None)]
@@ -0,0 +1,128 @@
+import asyncio
+
+from tools.stream_mux import StreamMux, pump_channel
+from tools.ssh_pool import SSHTransportPool
+
+
+def test_mux_drains_streams_fairly():
+    async def run():
+        mux = StreamMux(quantum=10)
+        mux.open('a')
+        mux.open('b')
+        for _ in range(5):
+            mux.push('a', 'x' * 10)
+        mux.push('b', 'y' * 10)
+        first = mux.next_frames()
+        # open acks come first, then one quantum from each stream in the same round
+        assert [f['type'] for f in first] == ['open', 'open', 'data', 'data']
+        assert first[2] == {'type': 'data', 'stream': 'a', 'data': 'x' * 10}
+        assert first[3] == {'type': 'data', 'stream': 'b', 'data': 'y' * 10}
+    asyncio.run(run())
+
+
+def test_mux_cancel_emits_exit_and_drops_output():
+    async def run():
+        mux = StreamMux()
+        mux.open('s1')
+        mux.next_frames()
+        mux.push('s1', 'data')
+        assert mux.cancel('s1')
+        frames = mux.next_frames()
+        assert frames == [{'type': 'exit', 'stream': 's1', 'code': None, 'cancelled': True}]
+        assert 's1' not in mux.streams
+    asyncio.run(run())
+
+
+class FakeChannel:
+    def __init__(self, chunks, code=0):
+        self.chunks = list(chunks)
+        self.code = code
+        self.closed = False
+
+    def recv_ready(self):
+        return bool(self.chunks)
+
+    def recv(self, n):
+        return self.chunks.pop(0)
+
+    def exit_status_ready(self):
+        return not self.chunks
+
+    def recv_exit_status(self):
+        return self.code
+
+    def close(self):
+        self.closed = True
+
+
+def test_pump_channel_reports_output_and_exit_code():
+    async def run():
+        mux = StreamMux()
+        mux.open('s')
+        ch = FakeChannel([b'hello ', b'world'], code=3)
+        await pump_channel(mux, 's', ch, poll=0)
+        frames = mux.next_frames()
+        assert {'type': 'data', 'stream': 's', 'data': 'hello world'} in frames
+        assert frames[-1] == {'type': 'exit', 'stream': 's', 'code': 3}
+        assert ch.closed
+    asyncio.run(run())
+
+
+class QuietChannel(FakeChannel):
+    """Prints once, then stays open without output until told to exit."""
+    def __init__(self):
+        super().__init__([b'tailing'])
+        self.done = False
+
+    def exit_status_ready(self):
+        return self.done
+
+
+def test_pump_channel_reports_idle_once():
+    async def run():
+        mux = StreamMux()
+        mux.open('s')
+        ch = QuietChannel()
+        idle = []
+        pump = asyncio.create_task(pump_channel(mux, 's', ch, poll=0.01, on_idle=lambda: idle.append(1), idle_after=0.05))
+        await asyncio.sleep(0.2)
+        assert idle == [1] and not pump.done()
+        ch.done = True
+        await asyncio.wait_for(pump, 1)
+        assert idle == [1]
+    asyncio.run(run())
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+
+class FakeClient:
+    def __init__(self):
+        self.transport = FakeTransport()
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.transport.active = False
+
+
+def test_pool_reuses_live_clients_and_reconnects_dead_ones():
+    made = []
+
+    def connect(host, user, password=None, key_path=None, timeout=10):
+        made.append(host)
+        return FakeClient()
+
+    pool = SSHTransportPool(connect=connect)
+    a = pool.get_client('pi1', 'pi')
+    assert pool.get_client('pi1', 'pi') is a
+    a.close()
+    b = pool.get_client('pi1', 'pi')
+    assert b is not a
+    assert made == ['pi1', 'pi1']
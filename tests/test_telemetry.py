@@ -0,0 +1,88 @@
+import queue
+import time
+
+from tools.telemetry import RingBuffer, SampleParser, TelemetryCollector, TimeSeries
+
+
+def block(busy, idle, avail_kb=1000000, temp='48312'):
+    return (f"@@TS\ncpu  {busy} 0 0 {idle} 0 0 0 0 0 0\nMemTotal:        4000000 kB\nMemAvailable:    {avail_kb} kB\n"
+            f"0.50 0.40 0.30 1/200 999\n{temp}\n@@TE\n")
+
+
+def test_parser_computes_cpu_from_deltas_and_handles_split_chunks():
+    parser = SampleParser()
+    first = parser.feed(block(100, 900), now=1.0)
+    assert first[0][1]['cpu_percent'] != first[0][1]['cpu_percent']  # NaN until a previous reading exists
+    text = block(150, 950, avail_kb=3000000)
+    assert parser.feed(text[:30], now=2.0) == []
+    (ts, values), = parser.feed(text[30:], now=2.0)
+    assert ts == 2.0 and values['cpu_percent'] == 50.0
+    assert values['mem_used_percent'] == 25.0 and values['mem_available_bytes'] == 3000000 * 1024
+    assert (values['load_1'], values['load_15'], values['temp_c']) == (0.5, 0.3, 48.312)
+
+
+def test_ring_buffer_wraps_and_answers_ranges():
+    ring = RingBuffer(4, fields=('v',))
+    for t in range(10):
+        ring.append(float(t), {'v': t * 10})
+    assert len(ring) == 4 and ring.oldest_ts() == 6.0
+    assert ring.latest() == (9.0, {'v': 90.0})
+    assert [ts for ts, _ in ring.range(7, 8)] == [7.0, 8.0]
+    ring.append(10.0, {})
+    assert ring.latest() == (10.0, {'v': None})
+
+
+def test_downsampling_levels_average_buckets():
+    series = TimeSeries(levels=((1, 100), (10, 10)), fields=('v',))
+    for t in range(25):
+        series.add(1000.0 + t, {'v': float(t)})
+    fine = series.range(start=1000, step=1)
+    assert fine['step'] == 1 and len(fine['points']) == 24  # the current second is still open
+    coarse = series.range(step=10)
+    assert [(ts, p['v']) for ts, p in coarse['points']] == [(1000.0, 4.5), (1010.0, 14.5)]
+    assert series.latest() == (1024.0, {'v': 24.0})
+    # Automatic choice: the finest level that reaches back to `start`
+    assert series.range(start=1005)['step'] == 1
+
+
+class FakeChannel:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, n):
+        try:
+            return self.chunks.get(timeout=2)
+        except queue.Empty:
+            return b''
+
+    def close(self):
+        self.closed = True
+
+
+def test_collector_streams_samples_from_one_channel():
+    chunks = queue.Queue()
+    opened = []
+
+    def open_channel(command):
+        assert '/proc/loadavg' in command and 'sleep 0.5' in command
+        opened.append(FakeChannel(chunks))
+        return opened[-1]
+
+    seen = []
+    collector = TelemetryCollector(on_sample=lambda device, ts, values: seen.append(device))
+    collector.start('pi', open_channel, interval=0.5)
+    collector.start('pi', open_channel)  # already running
+    for i in range(3):
+        chunks.put(block(100 + i * 50, 900 + i * 50).encode())
+    deadline = time.time() + 2
+    while len(seen) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert seen == ['pi'] * 3 and len(opened) == 1
+    assert collector.latest('pi')['cpu_percent'] == 50.0
+    assert collector.status()[0]['samples'] == 3
+    assert collector.stop('pi') and opened[0].closed
+    assert collector.range('unknown') == {'step': None, 'points': []}
@@ -0,0 +1,76 @@
+import asyncio
+import json
+import os
+import pstats
+
+from tools.tracing import RequestProfiler, Tracer, current_span
+
+
+def test_disabled_tracer_records_nothing(tmp_path):
+    tracer = Tracer(str(tmp_path), enabled=False)
+    with tracer.span('root') as span:
+        assert span is None
+        assert current_span() is None
+    assert tracer.list() == []
+
+
+def test_nested_spans_written_as_chrome_trace(tmp_path):
+    tracer = Tracer(str(tmp_path), enabled=True)
+
+    def send_command():
+        with tracer.span('ssh.send_command', host='pi'):
+            pass
+
+    async def handler():
+        with tracer.span('POST /chat') as root:
+            with tracer.span('llm.stream', model='m') as llm:
+                llm.event('llm.chunk', n=1)
+            # Spans opened in worker threads still attach to the request's tree
+            await asyncio.to_thread(send_command)
+            root.set(status=200)
+
+    asyncio.run(handler())
+    [name] = tracer.list()
+    with open(os.path.join(str(tmp_path), name)) as fh:
+        data = json.load(fh)
+    spans = {e['name']: e for e in data['traceEvents'] if e['ph'] == 'X'}
+    assert spans['POST /chat']['args']['status'] == 200
+    assert spans['llm.stream']['args']['parent_id'] == spans['POST /chat']['args']['span_id']
+    assert spans['ssh.send_command']['args']['parent_id'] == spans['POST /chat']['args']['span_id']
+    assert spans['llm.stream']['dur'] <= spans['POST /chat']['dur']
+    assert any(e['ph'] == 'i' and e['name'] == 'llm.chunk' for e in data['traceEvents'])
+
+
+def test_error_recorded_and_retention(tmp_path):
+    tracer = Tracer(str(tmp_path), enabled=True, keep=2)
+    for i in range(4):
+        try:
+            with tracer.span(f'req{i}'):
+                raise RuntimeError('boom')
+        except RuntimeError:
+            pass
+    files = tracer.list()
+    assert len(files) == 2
+    with open(os.path.join(str(tmp_path), files[0])) as fh:
+        event = json.load(fh)['traceEvents'][0]
+    assert event['args']['error'] == 'RuntimeError: boom'
+
+
+def test_profiler_profiles_only_armed_requests(tmp_path):
+    profiler = RequestProfiler(str(tmp_path))
+    assert profiler.claim() is None
+    profiler.arm(1, 'cprofile', by='admin')
+    mode = profiler.claim()
+    assert mode == 'cprofile'
+    # Only one profile at a time, and the armed count is used up
+    assert profiler.claim() is None
+    with profiler.profile(mode, 'GET-/devices') as result:
+        sum(range(10000))
+    assert profiler.claim() is None
+    assert pstats.Stats(result['path']).total_calls > 0
+
+    profiler.arm(1, 'sampling')
+    with profiler.profile(profiler.claim(), 'GET-/status') as result:
+        sum(i * i for i in range(300000))
+    assert result['path'].endswith('.folded')
+    assert len(profiler.list()) == 2
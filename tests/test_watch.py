@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from tools.speculative import is_read_only_pipeline
+from tools.watch import WatchHub, apply_hunks, diff_lines
+
+
+@pytest.mark.parametrize('cmd', ['df -h', 'ps aux | grep python | head -n 5', 'cat /proc/loadavg | wc -l',
+                                 'systemctl status nginx | tail -n 20', 'ps aux | grep -i -e ssh -m 3 | sort -k2 -rn',
+                                 'ps aux | head -5 | uniq -c | grep --color=always sshd'])
+def test_pipeline_policy_accepts_read_only_filters(cmd):
+    assert is_read_only_pipeline(cmd)
+
+
+@pytest.mark.parametrize('cmd', ['ps aux | sh', 'df || reboot', 'ps | sort -o /etc/passwd', 'ps | grep -f /etc/shadow',
+                                 'tail -f /var/log/syslog | grep x', 'rm -rf / | head',
+                                 'ps aux | sort -S1 --compress-program=reboot', 'ps | sort -T /tmp', 'ps | uniq 1 2',
+                                 'ps | wc --files0-from=/etc/list', 'ps | head -n', 'ps | grep x /etc/shadow',
+                                 'ps | grep -e x /etc/shadow', 'ps | tail --pid=1', 'ps | sort --output=/tmp/x'])
+def test_pipeline_policy_refuses_everything_else(cmd):
+    assert not is_read_only_pipeline(cmd)
+
+
+def test_hunks_rebuild_the_new_output():
+    old = ['a', 'b', 'c', 'd', 'e']
+    new = ['a', 'B', 'c', 'e', 'f', 'g']
+    hunks = diff_lines(old, new)
+    assert apply_hunks(old, hunks) == new
+    assert diff_lines(new, new) == []
+    assert apply_hunks([], diff_lines([], new)) == new
+
+
+def test_viewers_share_one_run_and_receive_only_changes():
+    outputs = iter(['load 1\nup 5\n', 'load 1\nup 5\n', 'load 2\nup 5\n'])
+    calls = []
+
+    def run(cmd):
+        calls.append(cmd)
+        return next(outputs)
+
+    async def scenario():
+        hub = WatchHub()
+        first = hub.subscribe('pi', 'uptime', run, interval=60)
+        second = hub.subscribe('pi', 'uptime', run, interval=60)
+        watch = first.watch
+        watch.task.cancel()  # drive the steps by hand
+        assert second.watch is watch and len(hub.watches) == 1
+        await watch.step()
+        frame = await first.get(timeout=1)
+        assert frame['version'] == 1 and apply_hunks([], frame['hunks']) == ['load 1', 'up 5']
+        assert await watch.step() is None  # unchanged output sends nothing
+        await watch.step()
+        frame = await second.get(timeout=1)
+        frame = await second.get(timeout=1)
+        assert frame['base'] == 1 and frame['hunks'] == [{'start': 0, 'end': 1, 'lines': ['load 2']}]
+        late = hub.subscribe('pi', 'uptime', run, interval=60)
+        watch.task.cancel()  # subscribing restarted the (cancelled) loop
+        snap = await late.get(timeout=1)
+        assert snap['type'] == 'snapshot' and snap['lines'] == ['load 2', 'up 5']
+        for viewer in (first, second, late):
+            viewer.close()
+        assert hub.watches == {}
+        return watch
+
+    watch = asyncio.run(scenario())
+    assert calls == ['uptime'] * 3 and watch.runs == 3
+
+
+def test_slow_viewer_is_resynced_with_a_snapshot_and_errors_are_reported_once():
+    state = {'n': 0}
+
+    def run(cmd):
+        state['n'] += 1
+        if state['n'] == 5:
+            raise ConnectionError('host down')
+        return f"tick {state['n']}"
+
+    async def scenario():
+        hub = WatchHub()
+        viewer = hub.subscribe('pi', 'date', run, interval=60, maxsize=2)
+        viewer.watch.task.cancel()
+        for _ in range(4):
+            await viewer.watch.step()
+        frame = await viewer.get(timeout=1)
+        assert frame['type'] == 'snapshot' and frame['lines'] == ['tick 4']
+        await viewer.watch.step()
+        await viewer.watch.step()
+        assert (await viewer.get(timeout=1))['error'] == 'host down'
+        assert (await viewer.get(timeout=1))['hunks'] == [{'start': 0, 'end': 1, 'lines': ['tick 6']}]
+        viewer.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,160 @@
+import threading
+import time
+
+import pytest
+
+from tools.storage import Storage
+from tools.workflow import WorkflowEngine, WorkflowError, from_course_plan, normalize_workflow, reduce_inputs
+
+
+def command(params, inputs, timeout):
+    if 'sleep' in params:
+        time.sleep(params['sleep'])
+    if params.get('device') == 'bad':
+        raise ConnectionError('unreachable')
+    return {'output': f"{params['command']} @ {params.get('device', 'local')}", 'device': params.get('device')}
+
+
+def llm(params, inputs, timeout):
+    return f"LLM: {params['prompt']}"
+
+
+def aggregate(params, inputs, timeout):
+    return '\n'.join(reduce_inputs(inputs))
+
+
+@pytest.fixture
+def engine(tmp_path):
+    events = []
+    eng = WorkflowEngine({'command': command, 'llm': llm, 'aggregate': aggregate}, Storage(str(tmp_path / 'wf.db')),
+                         owner='test', on_event=lambda *e: events.append(e))
+    eng.events = events
+    return eng
+
+
+def run(engine, spec):
+    run_id = engine.start(spec)
+    return engine.wait(run_id, timeout=10)
+
+
+def steps_by_id(result):
+    return {s['id']: s for s in result['steps']}
+
+
+def test_validation_rejects_bad_graphs():
+    types = {'command', 'llm', 'aggregate'}
+    with pytest.raises(WorkflowError, match='cycle'):
+        normalize_workflow({'steps': [{'id': 'a', 'type': 'llm', 'prompt': '{{b}}'}, {'id': 'b', 'type': 'llm', 'needs': 'a'}]}, types)
+    with pytest.raises(WorkflowError, match='unknown dependency'):
+        normalize_workflow({'steps': [{'id': 'a', 'type': 'llm', 'prompt': '{{nope.output}}'}]}, types)
+    with pytest.raises(WorkflowError, match='unknown type'):
+        normalize_workflow({'steps': [{'id': 'a', 'type': 'rm'}]}, types)
+    with pytest.raises(WorkflowError, match='duplicate'):
+        normalize_workflow({'steps': [{'id': 'a', 'type': 'llm'}, {'id': 'a', 'type': 'llm'}]}, types)
+    spec = normalize_workflow({'steps': [{'id': 'a', 'type': 'command', 'devices': ['p1', 'p2'], 'command': 'ls'},
+                                         {'id': 'b', 'type': 'llm', 'prompt': '{{a}}'}], 'aggregate': True}, types)
+    ids = {s['id']: s for s in spec['steps']}
+    assert ids['a']['type'] == 'gather' and ids['a']['needs'] == ['a@p1', 'a@p2']
+    assert ids['b']['needs'] == ['a'] and ids['aggregate']['needs'] == ['b']
+
+
+def test_independent_branches_run_in_parallel_and_feed_later_steps(engine):
+    started = time.monotonic()
+    result = run(engine, {'name': 'triage', 'steps': [
+        {'id': 'disk', 'type': 'command', 'device': 'pi1', 'command': 'df', 'sleep': 0.4},
+        {'id': 'temp', 'type': 'command', 'device': 'pi2', 'command': 'vcgencmd', 'sleep': 0.4},
+        {'id': 'explain', 'type': 'llm', 'prompt': 'disk={{disk}} temp-host={{temp.device}}'}],
+        'aggregate': {'prompt': 'healthy?'}})
+    assert time.monotonic() - started < 0.75
+    assert result['status'] == 'ok'
+    steps = steps_by_id(result)
+    assert steps['explain']['result']['output'] == 'LLM: disk=df @ pi1 temp-host=pi2'
+    assert steps['aggregate']['result']['output'] == 'explain (llm): LLM: disk=df @ pi1 temp-host=pi2'
+    assert result['result'] == {'aggregate': steps['aggregate']['result']}
+    assert (result['id'], None, 'ok', {}) in engine.events
+
+
+def test_retries_timeouts_and_failure_propagation(engine):
+    calls = []
+
+    def flaky(params, inputs, timeout):
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise RuntimeError('try again')
+        return 'finally'
+
+    engine.register('flaky', flaky)
+    result = run(engine, {'steps': [
+        {'id': 'flaky', 'type': 'flaky', 'retries': 2, 'retry_delay': 0.05},
+        {'id': 'slow', 'type': 'command', 'command': 'hang', 'sleep': 2, 'timeout': 0.2},
+        {'id': 'after', 'type': 'llm', 'prompt': '{{slow}}'}], 'aggregate': True})
+    steps = steps_by_id(result)
+    assert steps['flaky']['status'] == 'ok' and steps['flaky']['attempts'] == 3
+    assert calls[2] - calls[1] >= 0.09  # backoff doubles
+    assert steps['slow']['status'] == 'failed' and 'timed out' in steps['slow']['error']
+    assert steps['after']['status'] == 'skipped'
+    assert steps['aggregate']['status'] == 'ok' and 'after (llm): skipped' in steps['aggregate']['result']['output']
+    assert result['status'] == 'failed'
+
+
+def test_fan_out_across_devices_keeps_partial_results(engine):
+    result = run(engine, {'steps': [
+        {'id': 'up', 'type': 'command', 'devices': ['pi1', 'bad', 'pi2'], 'command': 'uptime'},
+        {'id': 'report', 'type': 'aggregate', 'needs': ['up']}]})
+    steps = steps_by_id(result)
+    assert steps['up']['status'] == 'failed' and steps['up']['error'] == 'failed on: bad'
+    assert steps['up']['result']['outputs'] == {'pi1': 'uptime @ pi1', 'pi2': 'uptime @ pi2'}
+    assert steps['report']['result']['output'].splitlines() == [
+        'up on pi1: uptime @ pi1', 'up on pi2: uptime @ pi2', 'up on bad: failed: unreachable']
+
+
+def test_interrupted_run_resumes_without_repeating_finished_steps(engine):
+    spec = normalize_workflow({'name': 'resume', 'steps': [
+        {'id': 'a', 'type': 'command', 'command': 'expensive'},
+        {'id': 'b', 'type': 'llm', 'prompt': 'saw {{a}}'},
+        {'id': 'c', 'type': 'llm', 'prompt': '{{b}}!'}]}, {'command', 'llm'})
+    storage = engine.storage
+    run_id = storage.create_workflow_run('resume', spec, ['a', 'b', 'c'], owner='crashed-worker')
+    storage.update_workflow_step(run_id, 'a', 'ok', 1, {'output': 'cached'})
+    storage.update_workflow_step(run_id, 'b', 'running', 1)
+    storage.write("UPDATE workflow_runs SET heartbeat = 0 WHERE id = ?", (run_id,))
+    engine.register('command', lambda *a: pytest.fail('finished step re-ran'))
+
+    assert engine.resume_stale() == [run_id]
+    result = engine.wait(run_id, timeout=10)
+    steps = steps_by_id(result)
+    assert result['status'] == 'ok' and steps['c']['result']['output'] == 'LLM: LLM: saw cached!'
+    assert steps['b']['attempts'] == 2
+    assert engine.resume_stale() == []
+
+
+def test_cancel_stops_pending_steps(engine):
+    gate = threading.Event()
+    engine.register('block', lambda *a: gate.wait(5) and 'done')
+    run_id = engine.start({'steps': [{'id': 'a', 'type': 'block'}, {'id': 'b', 'type': 'llm', 'prompt': '{{a}}'}]})
+    assert engine.cancel(run_id)
+    gate.set()
+    result = engine.wait(run_id, timeout=10)
+    assert result['status'] == 'cancelled' and steps_by_id(result)['b']['status'] == 'cancelled'
+
+
+def test_course_plan_becomes_a_chain_with_a_reduce_step():
+    plan = [{'prompt': 'check disk', 'action': 'ssh: df -h'}, {'prompt': 'explain it', 'action': ''}]
+    spec = normalize_workflow(from_course_plan(plan, device='pi1', prompt='ok?'), {'command', 'llm', 'aggregate'})
+    steps = {s['id']: s for s in spec['steps']}
+    assert steps['step1']['command'] == 'df -h' and steps['step1']['device'] == 'pi1'
+    assert steps['step2']['type'] == 'llm' and steps['step2']['needs'] == ['step1']
+    assert steps['aggregate']['needs'] == ['step2'] and steps['aggregate']['prompt'] == 'ok?'
+
+
+def test_templates_in_commands_are_shell_quoted(engine):
+    engine.register('emit', lambda *a: 'x; reboot $(id)')
+    result = run(engine, {'steps': [{'id': 'a', 'type': 'emit'},
+                                    {'id': 'b', 'type': 'command', 'command': 'echo {{a}}'},
+                                    {'id': 'c', 'type': 'llm', 'prompt': 'saw {{a}}'}]})
+    steps = steps_by_id(result)
+    assert steps['b']['result']['output'] == "echo 'x; reboot $(id)' @ local"
+    assert steps['c']['result']['output'] == 'LLM: saw x; reboot $(id)'
+    with pytest.raises(WorkflowError, match='inside quotes'):
+        normalize_workflow({'steps': [{'id': 'a', 'type': 'llm'},
+                                      {'id': 'b', 'type': 'command', 'command': 'echo "{{a}}"'}]}, {'command', 'llm'})